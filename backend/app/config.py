@@ -19,7 +19,152 @@ CORS_ORIGINS = [
     if origin.strip()
 ]
 
+# Credit reservations (see app/credits.py) still ``reserved`` this many seconds
+# after the call, e.g. because settling them failed, are settled by a sweep
+# run every ``CREDIT_SWEEP_INTERVAL`` seconds.
+CREDIT_RESERVATION_TTL = float(os.getenv("CREDIT_RESERVATION_TTL", "3600"))
+CREDIT_SWEEP_INTERVAL = float(os.getenv("CREDIT_SWEEP_INTERVAL", "600"))
+
 # Sentry is opt-in: if SENTRY_DSN isn't set, sentry_sdk.init() is skipped entirely.
 SENTRY_DSN = os.getenv("SENTRY_DSN")
 SENTRY_ENVIRONMENT = os.getenv("SENTRY_ENVIRONMENT", "production")
 SENTRY_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0.1"))
+
+# Cost guard for agent-generated SQL (see app/sql_guard.py). Costs are in
+# Postgres planner units, rows are the planner's estimate for the top node.
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "100000"))
+SQL_GUARD_MAX_ROWS = float(os.getenv("SQL_GUARD_MAX_ROWS", "10000"))
+SQL_GUARD_ROW_LIMIT = int(os.getenv("SQL_GUARD_ROW_LIMIT", "100"))
+SQL_GUARD_EXPLAIN_TIMEOUT_MS = int(os.getenv("SQL_GUARD_EXPLAIN_TIMEOUT_MS", "2000"))
+
+# Agent SQL workload recorder (see app/workload.py): ring buffer capacity and
+# how many pending entries trigger a background flush to ``agent_query``.
+WORKLOAD_BUFFER_SIZE = int(os.getenv("WORKLOAD_BUFFER_SIZE", "10000"))
+WORKLOAD_FLUSH_SIZE = int(os.getenv("WORKLOAD_FLUSH_SIZE", "100"))
+
+# Agent usage accounting (see app/usage.py): same buffering as the workload
+# recorder, flushed to ``agent_usage`` and the daily rollups.
+USAGE_BUFFER_SIZE = int(os.getenv("USAGE_BUFFER_SIZE", "10000"))
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", "50"))
+
+# Agent call resilience (see app/resilience.py). Delays are in seconds.
+AGENT_RETRY_ATTEMPTS = int(os.getenv("AGENT_RETRY_ATTEMPTS", "3"))
+AGENT_RETRY_BASE_DELAY = float(os.getenv("AGENT_RETRY_BASE_DELAY", "0.5"))
+AGENT_RETRY_MAX_DELAY = float(os.getenv("AGENT_RETRY_MAX_DELAY", "4"))
+INGEST_RETRY_ATTEMPTS = int(os.getenv("INGEST_RETRY_ATTEMPTS", "5"))
+INGEST_RETRY_BASE_DELAY = float(os.getenv("INGEST_RETRY_BASE_DELAY", "5"))
+INGEST_RETRY_MAX_DELAY = float(os.getenv("INGEST_RETRY_MAX_DELAY", "80"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_CAPACITY = float(os.getenv("RETRY_BUDGET_CAPACITY", "10"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+# Seconds before a hedged duplicate request goes to the first fallback model;
+# 0 disables hedging (fallbacks are then only tried after a failure).
+AGENT_HEDGE_DELAY = float(os.getenv("AGENT_HEDGE_DELAY", "0"))
+
+# Batch score enrichment (see app/enrichment.py): scores completed in parallel
+# per job, max scores per job, and finished jobs kept for progress polling.
+ENRICH_BATCH_CONCURRENCY = int(os.getenv("ENRICH_BATCH_CONCURRENCY", "4"))
+ENRICH_BATCH_MAX_ITEMS = int(os.getenv("ENRICH_BATCH_MAX_ITEMS", "500"))
+ENRICH_BATCH_KEEP_JOBS = int(os.getenv("ENRICH_BATCH_KEEP_JOBS", "100"))
+
+# Shared enrichment cache: entries older than the TTL are refreshed by the
+# agent; fuzzy title matches need at least this difflib ratio.
+ENRICH_CACHE_TTL_DAYS = float(os.getenv("ENRICH_CACHE_TTL_DAYS", "180"))
+ENRICH_CACHE_MATCH_RATIO = float(os.getenv("ENRICH_CACHE_MATCH_RATIO", "0.9"))
+
+# "Pieces like this one" index: directory of its memory-mapped segments,
+# hashed feature buckets, segments kept before they are merged, and postings
+# of a work's rarest features read to gather neighbour candidates.
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "database/similarity")
+SIMILARITY_FEATURES = int(os.getenv("SIMILARITY_FEATURES", str(2**20)))
+SIMILARITY_MAX_SEGMENTS = int(os.getenv("SIMILARITY_MAX_SEGMENTS", "8"))
+SIMILARITY_POSTINGS_BUDGET = int(os.getenv("SIMILARITY_POSTINGS_BUDGET", "200000"))
+
+# "What to play next" recommender (see app/recommend.py): days after which a
+# score counts as half rested, days of plays that count as recent for the
+# variety term, and difficulty levels above the user's average to aim for.
+RECOMMEND_REST_DAYS = float(os.getenv("RECOMMEND_REST_DAYS", "7"))
+RECOMMEND_RECENT_DAYS = float(os.getenv("RECOMMEND_RECENT_DAYS", "14"))
+RECOMMEND_STRETCH = float(os.getenv("RECOMMEND_STRETCH", "0.5"))
+
+# Single flight (see app/singleflight.py): seconds an execution shared by
+# identical concurrent agent calls / catalogue queries may take.
+SINGLEFLIGHT_AGENT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_AGENT_TIMEOUT", "120"))
+SINGLEFLIGHT_QUERY_TIMEOUT = float(os.getenv("SINGLEFLIGHT_QUERY_TIMEOUT", "30"))
+
+# Agent scheduler (see app/scheduler.py): agent calls run at once per model,
+# calls allowed to wait per model and per user before 503s, and finished
+# background agent jobs kept for polling.
+SCHEDULER_MODEL_CONCURRENCY = int(os.getenv("SCHEDULER_MODEL_CONCURRENCY", "8"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+SCHEDULER_MAX_USER_QUEUE = int(os.getenv("SCHEDULER_MAX_USER_QUEUE", "3"))
+AGENT_JOBS_KEEP = int(os.getenv("AGENT_JOBS_KEEP", "200"))
+
+# IMSLP catalogue crawl (see app/imslp.py): worklist API, workers of the fetch
+# / completion-agent stages, works queued between stages, and works upserted
+# per transaction.
+IMSLP_API_URL = os.getenv("IMSLP_API_URL", "https://imslp.org/imslpscripts/API.ISCR.php")
+IMSLP_FETCH_CONCURRENCY = int(os.getenv("IMSLP_FETCH_CONCURRENCY", "4"))
+IMSLP_ENRICH_CONCURRENCY = int(os.getenv("IMSLP_ENRICH_CONCURRENCY", "4"))
+IMSLP_QUEUE_SIZE = int(os.getenv("IMSLP_QUEUE_SIZE", "50"))
+IMSLP_WRITE_BATCH = int(os.getenv("IMSLP_WRITE_BATCH", "100"))
+
+# Batched completion of the crawled IMSLP works (see app/imslp.py): works per
+# agent request, estimated prompt tokens per request, and times the works an
+# answer left out or got wrong are asked again.
+IMSLP_ENRICH_BATCH_SIZE = int(os.getenv("IMSLP_ENRICH_BATCH_SIZE", "20"))
+IMSLP_ENRICH_BATCH_TOKENS = int(os.getenv("IMSLP_ENRICH_BATCH_TOKENS", "8000"))
+IMSLP_ENRICH_RETRIES = int(os.getenv("IMSLP_ENRICH_RETRIES", "2"))
+# Share of a work's fields (see app/imslp_normalize.py) read from its IMSLP
+# metadata under which the completion agent is asked for the rest. The
+# default lets a work miss one field (often its key, which many works don't
+# have): scripts/bench_imslp_normalize.py sends 7 of its 30 works to the
+# agent instead of 19 when every field is required.
+IMSLP_COMPLETENESS_THRESHOLD = float(os.getenv("IMSLP_COMPLETENESS_THRESHOLD", "0.85"))
+
+# Process pool parsing the IMSLP pages off the event loop (see app/imslp.py):
+# worker processes, and work pages shipped to a worker at once.
+IMSLP_PARSE_PROCESSES = int(os.getenv("IMSLP_PARSE_PROCESSES", "2"))
+IMSLP_PARSE_CHUNK = int(os.getenv("IMSLP_PARSE_CHUNK", "20"))
+
+# On-disk cache of the IMSLP crawl's responses (see app/http_cache.py): on or
+# off, its directory, and megabytes of bodies kept before evicting.
+IMSLP_CACHE = os.getenv("IMSLP_CACHE", "true").lower() == "true"
+IMSLP_CACHE_DIR = os.getenv("IMSLP_CACHE_DIR", "database/imslp_cache")
+IMSLP_CACHE_MAX_MB = int(os.getenv("IMSLP_CACHE_MAX_MB", "2048"))
+
+# Incremental IMSLP sync (see app/imslp.py): UTC time ("HH:MM") it runs every
+# night, unset for none, and worklist pages it reads at most.
+IMSLP_SYNC_AT = os.getenv("IMSLP_SYNC_AT", "")
+IMSLP_SYNC_PAGES = int(os.getenv("IMSLP_SYNC_PAGES", "50"))
+
+# Shared IMSLP crawl state (see app/crawl_state.py): seconds a worker's lease
+# on the crawl lasts without renewal, and seconds between its checkpoints.
+IMSLP_LEASE_SECONDS = float(os.getenv("IMSLP_LEASE_SECONDS", "60"))
+IMSLP_CHECKPOINT_INTERVAL = float(os.getenv("IMSLP_CHECKPOINT_INTERVAL", "5"))
+
+# Adaptive pace of the requests to IMSLP (see app/politeness.py), per host:
+# requests/s to start at and its bounds, requests sent at once after a pause,
+# requests/s added per fast response and the factor applied on a 429/5xx or
+# timeout, seconds over which a response isn't fast, longest Retry-After
+# honoured, and times a request backed off from is sent again.
+IMSLP_RATE = float(os.getenv("IMSLP_RATE", "1"))
+IMSLP_RATE_MIN = float(os.getenv("IMSLP_RATE_MIN", "0.1"))
+IMSLP_RATE_MAX = float(os.getenv("IMSLP_RATE_MAX", "10"))
+IMSLP_RATE_BURST = int(os.getenv("IMSLP_RATE_BURST", "4"))
+IMSLP_RATE_INCREASE = float(os.getenv("IMSLP_RATE_INCREASE", "0.05"))
+IMSLP_RATE_DECREASE = float(os.getenv("IMSLP_RATE_DECREASE", "0.5"))
+IMSLP_RATE_SLOW_SECONDS = float(os.getenv("IMSLP_RATE_SLOW_SECONDS", "2"))
+IMSLP_RETRY_AFTER_MAX = float(os.getenv("IMSLP_RETRY_AFTER_MAX", "300"))
+IMSLP_HTTP_RETRIES = int(os.getenv("IMSLP_HTTP_RETRIES", "3"))
+
+# Shared IMSLP HTTP client (see app/imslp.py): HTTP/2, open and idle kept-alive
+# connections, seconds to connect and to get a response, and landing pages
+# resolved at once when listing a work's PDFs.
+IMSLP_HTTP2 = os.getenv("IMSLP_HTTP2", "true").lower() == "true"
+IMSLP_HTTP_MAX_CONNECTIONS = int(os.getenv("IMSLP_HTTP_MAX_CONNECTIONS", "20"))
+IMSLP_HTTP_KEEPALIVE = int(os.getenv("IMSLP_HTTP_KEEPALIVE", "10"))
+IMSLP_HTTP_CONNECT_TIMEOUT = float(os.getenv("IMSLP_HTTP_CONNECT_TIMEOUT", "10"))
+IMSLP_HTTP_TIMEOUT = float(os.getenv("IMSLP_HTTP_TIMEOUT", "60"))
+IMSLP_PDF_CONCURRENCY = int(os.getenv("IMSLP_PDF_CONCURRENCY", "8"))
@@ -0,0 +1,100 @@
+"""Crawl state shared by every backend worker.
+
+A crawl's progress lives in its ``crawl_state`` row rather than in the
+memory of the worker running it, so that any uvicorn worker can report it
+or take a cancel, and a crawl interrupted by a deploy or a crash can be
+resumed from its last checkpoint.
+
+Only the holder of the row's lease runs the crawl. Taking it is one
+conditional ``UPDATE`` (the lease is free, expired or already ours), so of
+two workers starting a crawl at once only one gets it. The holder renews
+the lease with each checkpoint; if it dies, the lease runs out after
+``IMSLP_LEASE_SECONDS`` and the crawl reads as ``interrupted``.
+"""
+
+import os
+import socket
+import time
+
+from sqlalchemy import or_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config
+from app.db import async_engine
+from shared.crawl import CrawlState
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+ACTIVE = ("starting", "processing", "cancelling")
+
+
+async def acquire(name: str, **values) -> bool:
+    """Take ``name``'s lease unless another live worker holds it, and set ``values``."""
+    now = time.time()
+    async with AsyncSession(async_engine) as session:
+        await session.exec(insert(CrawlState).values(name=name).on_conflict_do_nothing())
+        taken = await session.exec(
+            update(CrawlState)
+            .where(
+                col(CrawlState.name) == name,
+                or_(
+                    col(CrawlState.lease_owner).is_(None),
+                    col(CrawlState.lease_owner) == WORKER_ID,
+                    col(CrawlState.lease_expires) < now,
+                ),
+            )
+            .values(lease_owner=WORKER_ID, lease_expires=now + config.IMSLP_LEASE_SECONDS, **values)
+            .returning(col(CrawlState.name))
+        )
+        acquired = taken.first() is not None
+        await session.commit()
+    return acquired
+
+
+async def renew(name: str, **values) -> bool | None:
+    """Set ``values`` and extend our lease; the cancel flag, or None if the lease was lost."""
+    now = time.time()
+    async with AsyncSession(async_engine) as session:
+        renewed = await session.exec(
+            update(CrawlState)
+            .where(col(CrawlState.name) == name, col(CrawlState.lease_owner) == WORKER_ID)
+            .values(lease_expires=now + config.IMSLP_LEASE_SECONDS, **values)
+            .returning(col(CrawlState.cancel_requested))
+        )
+        row = renewed.first()
+        await session.commit()
+    return None if row is None else row[0]
+
+
+async def release(name: str, **values) -> None:
+    """Set ``values`` and give our lease up."""
+    async with AsyncSession(async_engine) as session:
+        await session.exec(
+            update(CrawlState)
+            .where(col(CrawlState.name) == name, col(CrawlState.lease_owner) == WORKER_ID)
+            .values(lease_owner=None, lease_expires=0.0, **values)
+        )
+        await session.commit()
+
+
+async def request_cancel(name: str) -> None:
+    """Ask the worker running ``name`` to stop, at its next checkpoint."""
+    async with AsyncSession(async_engine) as session:
+        await session.exec(
+            update(CrawlState)
+            .where(col(CrawlState.name) == name, col(CrawlState.status).in_(ACTIVE))
+            .values(cancel_requested=True, status="cancelling")
+        )
+        await session.commit()
+
+
+async def read(name: str) -> CrawlState:
+    """The state of ``name``; a crawl whose lease ran out reads as ``interrupted``."""
+    async with AsyncSession(async_engine) as session:
+        state = (
+            await session.exec(select(CrawlState).where(col(CrawlState.name) == name))
+        ).first() or CrawlState(name=name)
+    if state.status in ACTIVE and state.lease_expires < time.time():
+        state.status = "interrupted"
+    return state
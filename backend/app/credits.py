@@ -1,17 +1,44 @@
-"""Atomic credit accounting for agent endpoints."""
+"""Atomic credit accounting for agent endpoints.
 
+Every agent call reserves one credit before running and records why in the
+``credit_ledger`` table. The reservation is a single round trip: on
+PostgreSQL one statement whose CTE debits the user (``UPDATE ... WHERE
+credits > 0 RETURNING credits``) and inserts the ``reserved`` ledger row
+from what it returned; SQLite, which has no data-modifying CTEs, runs the
+same two statements in one transaction. Afterwards the reservation is
+``settled`` or, if the call failed, ``released`` and the credit given back
+(again one statement on PostgreSQL).
+
+The reservation is committed before the agent runs and settled in a second
+commit after it, so that no transaction is held open for the length of an
+agent call. The price is a window between the two: a reservation left
+``reserved``, because settling it failed or the worker died mid-call, keeps
+its credit debited until :func:`sweep` settles it, once older than
+``CREDIT_RESERVATION_TTL``.
+
+The user's remaining credits are returned in the ``X-Credits-Remaining``
+header so the frontend doesn't have to refetch ``/user``.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
+from datetime import UTC, datetime, timedelta
 from logging import getLogger
 
-from fastapi import HTTPException
-from sqlalchemy import update
+from fastapi import HTTPException, Response
+from sqlalchemy import func, insert, literal, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import config
+from app.db import async_engine
+from shared.credits import CreditLedger
 from shared.user import User
 
 logger = getLogger(__name__)
 
+CREDITS_HEADER = "X-Credits-Remaining"
+
 
 def _out_of_credits_detail() -> str:
     return (
@@ -20,33 +47,153 @@ def _out_of_credits_detail() -> str:
     )
 
 
+def _is_postgres(session: AsyncSession) -> bool:
+    return session.bind.dialect.name == "postgresql"
+
+
+async def reserve(session: AsyncSession, user_id: int, endpoint: str) -> tuple[int, int] | None:
+    """Debit one credit and record the reservation; ``(entry id, balance)`` or None."""
+    debit = (
+        update(User).where(User.id == user_id, User.credits > 0).values(credits=User.credits - 1)
+    )
+    if _is_postgres(session):
+        debited = debit.returning(User.id, User.credits).cte("debit")
+        statement = (
+            insert(CreditLedger)
+            .from_select(
+                ["user_id", "delta", "balance", "reason", "endpoint", "status", "created_at"],
+                select(
+                    debited.c.id,
+                    literal(-1),
+                    debited.c.credits,
+                    literal("agent"),
+                    literal(endpoint),
+                    literal("reserved"),
+                    func.now(),
+                ),
+            )
+            .returning(CreditLedger.id, CreditLedger.balance)
+        )
+        row = (await session.exec(statement)).first()
+        await session.commit()
+        return None if row is None else (row[0], row[1])
+
+    row = (await session.exec(debit.returning(User.credits))).first()
+    if row is None:
+        return None
+    entry = CreditLedger(
+        user_id=user_id,
+        delta=-1,
+        balance=row[0],
+        reason="agent",
+        endpoint=endpoint,
+        status="reserved",
+    )
+    session.add(entry)
+    await session.flush()
+    reservation = (entry.id, entry.balance)
+    await session.commit()
+    return reservation
+
+
+async def settle(session: AsyncSession, entry_id: int) -> None:
+    """Mark a reservation as spent."""
+    await session.exec(
+        update(CreditLedger).where(CreditLedger.id == entry_id).values(status="settled")
+    )
+    await session.commit()
+
+
+async def release(session: AsyncSession, entry_id: int) -> int | None:
+    """Give a reservation's credit back; the user's new balance."""
+    released = (
+        update(CreditLedger)
+        .where(CreditLedger.id == entry_id, CreditLedger.status == "reserved")
+        .values(status="released")
+        .returning(CreditLedger.user_id, CreditLedger.delta)
+    )
+    if _is_postgres(session):
+        cte = released.cte("released")
+        statement = (
+            update(User)
+            .where(User.id == cte.c.user_id)
+            .values(credits=User.credits - cte.c.delta)
+            .returning(User.credits)
+        )
+    else:
+        row = (await session.exec(released)).first()
+        if row is None:
+            return None
+        statement = (
+            update(User)
+            .where(User.id == row[0])
+            .values(credits=User.credits - row[1])
+            .returning(User.credits)
+        )
+    balance = (await session.exec(statement)).scalar()
+    await session.commit()
+    return balance
+
+
+async def sweep(session: AsyncSession) -> int:
+    """Settle the reservations older than ``CREDIT_RESERVATION_TTL``; how many."""
+    cutoff = datetime.now(UTC) - timedelta(seconds=config.CREDIT_RESERVATION_TTL)
+    swept = (
+        await session.exec(
+            update(CreditLedger)
+            .where(CreditLedger.status == "reserved", CreditLedger.created_at < cutoff)
+            .values(status="settled")
+            .returning(CreditLedger.id)
+        )
+    ).all()
+    await session.commit()
+    return len(swept)
+
+
+async def sweep_forever() -> None:
+    """Run :func:`sweep` every ``CREDIT_SWEEP_INTERVAL`` seconds, for the app's lifetime."""
+    while True:
+        await asyncio.sleep(config.CREDIT_SWEEP_INTERVAL)
+        try:
+            async with AsyncSession(async_engine) as session:
+                swept = await sweep(session)
+        except Exception:
+            logger.exception("sweeping stale credit reservations failed")
+            continue
+        if swept:
+            logger.warning("settled %s stale credit reservations", swept)
+
+
 @asynccontextmanager
-async def consume_credit(user_id: int, session: AsyncSession):
+async def consume_credit(
+    user_id: int, session: AsyncSession, response: Response | None = None, endpoint: str = ""
+) -> AsyncIterator[None]:
     """
-    Atomically debit one credit from the user; refund on exception.
+    Reserve one credit for the body; settle it on success, release it on exception.
 
-    Uses a conditional UPDATE (credits > 0) so the check-and-debit is a
-    single SQL statement, preventing the read-modify-write race of the
-    previous implementation. On any exception raised inside the ``async
-    with`` body, the credit is refunded in a separate transaction.
+    The check-and-debit is a single conditional UPDATE (credits > 0), so
+    concurrent calls can't spend the same credit twice. When ``response`` is
+    given, the remaining credits are set in its ``X-Credits-Remaining`` header.
     """
-    debit = await session.execute(
-        update(User)
-        .where(User.id == user_id, User.credits > 0)  # type: ignore[arg-type]
-        .values(credits=User.credits - 1)
-    )
-    if debit.rowcount == 0:  # type: ignore[attr-defined]
-        raise HTTPException(status_code=403, detail=_out_of_credits_detail())
-    await session.commit()
+    reservation = await reserve(session, user_id, endpoint)
+    if reservation is None:
+        raise HTTPException(
+            status_code=403, detail=_out_of_credits_detail(), headers={CREDITS_HEADER: "0"}
+        )
+    entry_id, balance = reservation
 
     try:
         yield
     except Exception:
         try:
-            await session.execute(
-                update(User).where(User.id == user_id).values(credits=User.credits + 1)
-            )
-            await session.commit()
+            await release(session, entry_id)
         except Exception:
             logger.exception("failed to refund credit for user %s", user_id)
         raise
+    try:
+        await settle(session, entry_id)
+    except Exception:
+        # the call succeeded and the credit is debited; sweep settles it later
+        logger.exception("failed to settle credit reservation %s", entry_id)
+    if response is not None:
+        response.headers[CREDITS_HEADER] = str(balance)
@@ -0,0 +1,489 @@
+"""Batch score enrichment.
+
+``POST /complete_score/batch`` takes a list of the user's score ids and runs
+the complete agent over them in the background, at most
+``ENRICH_BATCH_CONCURRENCY`` at a time. Each score is handled like a single
+``/complete_score`` call: one credit is debited through ``consume_credit``
+and refunded if the agent fails. Unlike ``/complete_score``, the enriched
+fields are written straight back to the ``score`` row.
+
+``GET /complete_score/batch/{job_id}`` reports progress and the results of
+the scores processed so far. Jobs are kept in memory, like the IMSLP scraper
+state (single uvicorn worker); only the last ``ENRICH_BATCH_KEEP_JOBS``
+finished jobs are kept.
+
+Both ``/complete_score`` and the batch go through a cross-user cache first:
+the enrichment of a work is public knowledge, so the agent output is stored
+in ``enrichment_cache`` keyed by normalized composer and title. A fresh hit
+(younger than ``ENRICH_CACHE_TTL_DAYS``) is merged into the user's score
+without calling the agent or debiting a credit. Titles match fuzzily
+(``difflib`` ratio >= ``ENRICH_CACHE_MATCH_RATIO``) but catalogue numbers
+must be identical, so "Op. 9 No. 1" never answers for "Op. 9 No. 2". Admins
+can list and purge entries under ``/admin/enrichment_cache``.
+
+On a cache miss the local ``imslp`` catalogue comes next: the work is looked
+up by ``imslp_id``, else by composer and title with the same matching rules,
+and the facts it holds (year, key, instrumentation...) fill the fields the
+user left at their defaults. The agent is then asked only for the fields
+still missing, with the known facts in a slimmer prompt; when nothing is
+missing it is not called and no credit is debited.
+"""
+
+import asyncio
+import difflib
+import json
+import logging
+import re
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Annotated, Any
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config, scheduler, usage
+from app.agent import get_agent_models, run_complete_agent
+from app.credits import consume_credit
+from app.db import async_engine, get_async_session
+from app.rate_limit import limiter
+from app.users import get_admin_user, get_current_user
+from shared.enrichment import EnrichmentCache
+from shared.scores import IMSLP, Score, ScoreUpdate
+from shared.user import User
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/complete_score", tags=["enrichment"])
+cache_router = APIRouter(prefix="/admin/enrichment_cache", tags=["admin"])
+
+# Score fields filled in by the complete agent. Title and composer stay as the
+# user entered them; file, ownership and play count are never touched.
+ENRICHED_FIELDS = (
+    "year",
+    "period",
+    "genre",
+    "form",
+    "style",
+    "key",
+    "instrumentation",
+    "short_description",
+    "short_description_fr",
+    "long_description",
+    "long_description_fr",
+    "youtube_url",
+    "difficulty",
+    "notable_interpreters",
+)
+# The subset the ``imslp`` catalogue knows about.
+CATALOGUE_FIELDS = ("year", "period", "genre", "form", "style", "key", "instrumentation")
+FINISHED = {"completed", "cancelled", "out_of_credits"}
+
+_NON_WORD_RE = re.compile(r"[^\w\s]|_")
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def _fold(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_NON_WORD_RE.sub(" ", text.lower()).split())
+
+
+def title_key(title: str) -> str:
+    """Normalized title: "Nocturne Op.9, No.2" -> "nocturne op 9 no 2"."""
+    return _fold(title)
+
+
+def composer_key(composer: str) -> str:
+    """Normalized composer, word order ignored ("Chopin, Frédéric" == "Frédéric Chopin")."""
+    return " ".join(sorted(_fold(composer).split()))
+
+
+def is_fresh(entry: EnrichmentCache) -> bool:
+    """Whether ``entry`` is younger than ``ENRICH_CACHE_TTL_DAYS``."""
+    updated_at = entry.updated_at
+    if updated_at.tzinfo is None:  # SQLite hands back naive datetimes
+        updated_at = updated_at.replace(tzinfo=UTC)
+    return datetime.now(UTC) - updated_at < timedelta(days=config.ENRICH_CACHE_TTL_DAYS)
+
+
+def best_match[T](title: str, candidates: Iterable[tuple[str, T]]) -> T | None:
+    """Candidate whose title key is closest to ``title``'s, catalogue numbers equal.
+
+    ``candidates`` are ``(title_key, item)`` pairs; the ratio must reach
+    ``ENRICH_CACHE_MATCH_RATIO``.
+    """
+    wanted = title_key(title)
+    numbers = _NUMBER_RE.findall(wanted)
+    best, best_ratio = None, config.ENRICH_CACHE_MATCH_RATIO
+    for key, item in candidates:
+        if _NUMBER_RE.findall(key) != numbers:
+            continue
+        ratio = difflib.SequenceMatcher(None, wanted, key).ratio()
+        if ratio >= best_ratio:
+            best, best_ratio = item, ratio
+    return best
+
+
+async def find_entry(session: AsyncSession, title: str, composer: str) -> EnrichmentCache | None:
+    """Best cache entry for the work, fresh or not, or None."""
+    candidates = (
+        await session.exec(
+            select(EnrichmentCache).where(EnrichmentCache.composer_key == composer_key(composer))
+        )
+    ).all()
+    return best_match(title, ((entry.title_key, entry) for entry in candidates))
+
+
+def _is_default(score: Score, name: str) -> bool:
+    return getattr(score, name) == Score.model_fields[name].default
+
+
+async def use_entry(session: AsyncSession, score: Score, entry: EnrichmentCache) -> Score:
+    """Merge cached fields into ``score`` (fields the user already set win)."""
+    cached = ScoreUpdate.model_validate_json(entry.fields).model_dump(exclude_unset=True)
+    entry.hits += 1
+    session.add(entry)
+    await session.commit()  # expires entry with the app's sessions
+    updates = {
+        name: value
+        for name, value in cached.items()
+        if name in ENRICHED_FIELDS and _is_default(score, name)
+    }
+    return Score(**{**score.model_dump(), **updates})
+
+
+async def remember(
+    session: AsyncSession,
+    score: Score,
+    completed: Score,
+    model: str,
+    entry: EnrichmentCache | None = None,
+    missing: list[str] | None = None,
+) -> None:
+    """Store the agent output for ``score``'s work, refreshing ``entry`` if given.
+
+    ``score`` is the user's own score. With ``missing`` (the agent was only
+    asked for those, after ``prefill``) only the fields the user left at
+    their defaults are stored, i.e. what the catalogue and the agent found:
+    what one user typed is never served to another. Without it the agent
+    only had the title and composer, so all its output is stored.
+    """
+    if entry is None:
+        entry = EnrichmentCache(
+            work_key=f"{composer_key(score.composer)}|{title_key(score.title)}",
+            composer_key=composer_key(score.composer),
+            title_key=title_key(score.title),
+            title=score.title,
+            composer=score.composer,
+        )
+    learned = {name for name in ENRICHED_FIELDS if missing is None or _is_default(score, name)}
+    entry.fields = completed.model_dump_json(include=learned)
+    entry.model = model
+    entry.updated_at = datetime.now(UTC)
+    session.add(entry)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # another request cached the same work meanwhile; keep theirs
+        await session.rollback()
+
+
+def _words(text: str) -> list[str]:
+    """Lower-cased words of ``text``, accents kept (for SQL ``LIKE`` prefilters)."""
+    return [word for word in _NON_WORD_RE.sub(" ", text.lower()).split() if not word.isdigit()]
+
+
+async def find_work(session: AsyncSession, score: Score) -> IMSLP | None:
+    """The ``imslp`` catalogue entry for ``score``, by ``imslp_id`` or by name."""
+    if score.imslp_id is not None:
+        work = await session.get(IMSLP, score.imslp_id)
+        if work is not None:
+            return work
+    composer_words, title_words = _words(score.composer), _words(score.title)
+    if not composer_words or not title_words:
+        return None
+    # narrow down in SQL on the longest words, then match on the normalized keys
+    query = select(IMSLP).where(
+        col(IMSLP.composer).ilike(f"%{max(composer_words, key=len)}%"),
+        col(IMSLP.title).ilike(f"%{max(title_words, key=len)}%"),
+    )
+    wanted = set(composer_key(score.composer).split())
+    candidates = [
+        work
+        for work in (await session.exec(query)).all()
+        if wanted <= set(composer_key(work.composer).split())
+    ]
+    return best_match(score.title, ((title_key(work.title), work) for work in candidates))
+
+
+def _catalogue_value(work: IMSLP, name: str) -> Any:
+    """``work``'s value for ``name`` as a Score field, None if unknown or unparsable."""
+    try:
+        value = getattr(ScoreUpdate.model_validate({name: getattr(work, name)}), name)
+    except ValidationError:
+        return None
+    return None if value in ("", Score.model_fields[name].default) else value
+
+
+async def prefill(session: AsyncSession, score: Score) -> tuple[Score, list[str] | None]:
+    """Fill ``score`` from the ``imslp`` catalogue before calling the agent.
+
+    Returns the filled score and the enriched fields still at their defaults,
+    or None for the fields when the work is not in the catalogue (the agent
+    then gets the full prompt).
+    """
+    work = await find_work(session, score)
+    if work is None:
+        return score, None
+    updates = {
+        name: value
+        for name in CATALOGUE_FIELDS
+        if _is_default(score, name) and (value := _catalogue_value(work, name)) is not None
+    }
+    if score.imslp_id is None:
+        updates["imslp_id"] = work.id
+    filled = Score(**{**score.model_dump(), **updates})
+    return filled, [name for name in ENRICHED_FIELDS if _is_default(filled, name)]
+
+
+class BatchRequest(BaseModel):
+    """Body for POST /complete_score/batch."""
+
+    score_ids: list[int]
+
+
+@dataclass
+class BatchJob:
+    """Progress and per-score results of one batch enrichment."""
+
+    id: str
+    user_id: int
+    score_ids: list[int]
+    status: str = "queued"
+    cancel_requested: bool = False
+    out_of_credits: bool = False
+    results: dict[int, dict] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+
+    def snapshot(self) -> dict:
+        """JSON-able progress report, results in submission order."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.score_ids),
+            "processed": len(self.results),
+            "counts": dict(Counter(r["status"] for r in self.results.values())),
+            "results": [self.results[i] for i in self.score_ids if i in self.results],
+        }
+
+
+jobs: OrderedDict[str, BatchJob] = OrderedDict()
+
+
+def _prune_jobs() -> None:
+    """Forget the oldest finished jobs beyond ``ENRICH_BATCH_KEEP_JOBS``."""
+    finished = [job_id for job_id, job in jobs.items() if job.status in FINISHED]
+    for job_id in finished[: max(0, len(jobs) - config.ENRICH_BATCH_KEEP_JOBS)]:
+        del jobs[job_id]
+
+
+async def enrich_score(job: BatchJob, score_id: int, model: str, fallbacks: list[str]) -> None:
+    """Complete one score of ``job``, debiting (and on failure refunding) a credit."""
+    if job.cancel_requested:
+        job.results[score_id] = {"score_id": score_id, "status": "cancelled"}
+        return
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        score = (
+            await session.exec(
+                select(Score).where(Score.id == score_id, Score.user_id == job.user_id)
+            )
+        ).first()
+        if score is None:
+            job.results[score_id] = {"score_id": score_id, "status": "not_found"}
+            return
+        original = Score.model_validate(score.model_dump())
+        entry = await find_entry(session, score.title, score.composer)
+        if entry is not None and is_fresh(entry):
+            completed = await use_entry(session, original, entry)
+            for name in ENRICHED_FIELDS:
+                setattr(score, name, getattr(completed, name))
+            session.add(score)
+            await session.commit()
+            job.results[score_id] = {
+                "score_id": score_id,
+                "status": "cached",
+                "score": score.model_dump(mode="json"),
+            }
+            return
+        filled, missing = await prefill(session, original)
+        if missing == []:
+            for name in ENRICHED_FIELDS:
+                setattr(score, name, getattr(filled, name))
+            score.imslp_id = filled.imslp_id
+            session.add(score)
+            await session.commit()
+            job.results[score_id] = {
+                "score_id": score_id,
+                "status": "catalogue",
+                "score": score.model_dump(mode="json"),
+            }
+            return
+        try:
+            async with (
+                consume_credit(job.user_id, session, endpoint="/complete_score/batch"),
+                scheduler.slot(model, job.user_id, bounded=False),
+            ):
+                completed = await run_complete_agent(
+                    filled, model, fallbacks, strict=True, fields=missing
+                )
+                for name in ENRICHED_FIELDS:
+                    setattr(score, name, getattr(completed, name))
+                score.imslp_id = filled.imslp_id
+                session.add(score)
+                await session.commit()
+                await remember(session, original, completed, model, entry, missing)
+        except HTTPException as e:
+            job.out_of_credits = job.cancel_requested = True
+            job.results[score_id] = {
+                "score_id": score_id,
+                "status": "no_credits",
+                "error": e.detail,
+            }
+        except Exception as e:
+            logger.warning("batch %s: enriching score %s failed: %s", job.id, score_id, e)
+            job.results[score_id] = {"score_id": score_id, "status": "failed", "error": str(e)}
+        else:
+            job.results[score_id] = {
+                "score_id": score_id,
+                "status": "done",
+                "score": score.model_dump(mode="json"),
+            }
+
+
+async def run_job(job: BatchJob, model: str, fallbacks: list[str]) -> None:
+    """Enrich every score of ``job`` with bounded concurrency."""
+    job.status = "running"
+    usage.bind("/complete_score/batch", job.user_id)
+    semaphore = asyncio.Semaphore(config.ENRICH_BATCH_CONCURRENCY)
+
+    async def worker(score_id: int) -> None:
+        async with semaphore:
+            await enrich_score(job, score_id, model, fallbacks)
+
+    await asyncio.gather(*(worker(score_id) for score_id in job.score_ids))
+    if job.out_of_credits:
+        job.status = "out_of_credits"
+    elif job.cancel_requested:
+        job.status = "cancelled"
+    else:
+        job.status = "completed"
+
+
+def _get_job(job_id: str, user: User) -> BatchJob:
+    job = jobs.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@router.post("/batch")
+@limiter.limit(config.AGENT_RATE_LIMIT)
+async def start_batch(
+    request: Request,
+    body: BatchRequest,
+    background_tasks: BackgroundTasks,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Enqueue a batch enrichment of the user's scores."""
+    score_ids = list(dict.fromkeys(body.score_ids))
+    if not score_ids:
+        raise HTTPException(status_code=400, detail="No score ids given")
+    if len(score_ids) > config.ENRICH_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {config.ENRICH_BATCH_MAX_ITEMS} scores per batch",
+        )
+    model, fallbacks = await get_agent_models(session, "complete")
+
+    assert current_user.id is not None
+    job = BatchJob(id=uuid.uuid4().hex, user_id=current_user.id, score_ids=score_ids)
+    jobs[job.id] = job
+    _prune_jobs()
+    background_tasks.add_task(run_job, job, model, fallbacks)
+    return job.snapshot()
+
+
+@router.get("/batch/{job_id}")
+def get_batch(job_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    """Progress and partial results of a batch enrichment."""
+    return _get_job(job_id, current_user).snapshot()
+
+
+@router.post("/batch/{job_id}/cancel")
+def cancel_batch(job_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    """Stop a batch after the scores currently in flight."""
+    job = _get_job(job_id, current_user)
+    if job.status not in FINISHED:
+        job.cancel_requested = True
+    return job.snapshot()
+
+
+@cache_router.get("", dependencies=[Depends(get_admin_user)])
+async def list_cache(
+    q: str = "",
+    limit: int = 50,
+    offset: int = 0,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Cached enrichments, most recently refreshed first."""
+    query = select(EnrichmentCache)
+    if q:
+        query = query.where(col(EnrichmentCache.work_key).contains(_fold(q)))
+    entries = (
+        await session.exec(
+            query.order_by(col(EnrichmentCache.updated_at).desc()).offset(offset).limit(limit)
+        )
+    ).all()
+    return [
+        {
+            **entry.model_dump(exclude={"fields"}),
+            "fields": json.loads(entry.fields),
+            "stale": not is_fresh(entry),
+        }
+        for entry in entries
+    ]
+
+
+@cache_router.delete("/{entry_id}", dependencies=[Depends(get_admin_user)])
+async def delete_cache_entry(entry_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Drop one cached enrichment."""
+    entry = await session.get(EnrichmentCache, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    await session.delete(entry)
+    await session.commit()
+    return {"deleted": 1}
+
+
+@cache_router.delete("", dependencies=[Depends(get_admin_user)])
+async def purge_cache(stale_only: bool = False, session: AsyncSession = Depends(get_async_session)):
+    """Drop all cached enrichments, or only the stale ones."""
+    entries = (await session.exec(select(EnrichmentCache))).all()
+    deleted = 0
+    for entry in entries:
+        if stale_only and is_fresh(entry):
+            continue
+        await session.delete(entry)
+        deleted += 1
+    await session.commit()
+    return {"deleted": deleted}
@@ -0,0 +1,236 @@
+"""On-disk cache of the IMSLP crawl's HTTP responses.
+
+Every worklist page and work page the crawl downloads is kept in
+``IMSLP_CACHE_DIR``: bodies are content-addressed files (named by their
+SHA-256, so identical pages are stored once) and a small SQLite index maps
+each URL to its body, ``ETag`` and ``Last-Modified``. A cached URL is
+fetched again with ``If-None-Match`` / ``If-Modified-Since``, and a ``304``
+serves the stored body, so a re-crawl only downloads the pages that changed.
+
+The cache holds at most ``IMSLP_CACHE_MAX_MB``: past that, the least
+recently used URLs are evicted, along with the bodies no other URL uses.
+
+With ``cache_only`` nothing goes to the network and a URL not in the cache
+raises :class:`CacheMissError`; the crawl uses it to rebuild the catalogue
+from the pages of a previous crawl (``/imslp/start/{pages}?cache_only=true``).
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import httpx
+from fastapi import APIRouter, Depends
+
+from app import config, politeness
+from app.users import get_admin_user
+
+router = APIRouter(prefix="/imslp", tags=["imslp"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+"""
+
+
+class CacheMissError(LookupError):
+    """A URL asked for from the cache only isn't in it."""
+
+
+@dataclass
+class Entry:
+    """A cached response."""
+
+    url: str
+    content: bytes
+    content_type: str | None
+    etag: str | None
+    last_modified: str | None
+
+    def validators(self) -> dict[str, str]:
+        """Headers of a conditional request for this response."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def response(self) -> httpx.Response:
+        """The cached response, as if it was just downloaded."""
+        headers = {"content-type": self.content_type} if self.content_type else {}
+        return httpx.Response(
+            200, content=self.content, headers=headers, request=httpx.Request("GET", self.url)
+        )
+
+
+class HttpCache:
+    """Size-bounded LRU cache of response bodies, keyed by URL."""
+
+    def __init__(self, path: str, max_bytes: int | None = None):
+        self.path = path
+        self.max_bytes = config.IMSLP_CACHE_MAX_MB * 2**20 if max_bytes is None else max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.downloaded = 0
+        self._db: sqlite3.Connection | None = None
+        self._size = 0  # bytes of the bodies on disk
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.join(self.path, "bodies"), exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), check_same_thread=False)
+            db.executescript(_SCHEMA)
+            self._size = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM"
+                " (SELECT MAX(size) AS size FROM entries GROUP BY digest)"
+            ).fetchone()[0]
+            self._db = db
+        return self._db
+
+    def _body_path(self, digest: str) -> str:
+        return os.path.join(self.path, "bodies", digest[:2], digest)
+
+    def get(self, url: str) -> Entry | None:
+        """The cached response of ``url``, marked as just used."""
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT digest, content_type, etag, last_modified FROM entries WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._body_path(row[0]), "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:  # removed by hand
+                db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                db.commit()
+                return None
+            db.execute("UPDATE entries SET used_at = ? WHERE url = ?", (time.time(), url))
+            db.commit()
+        return Entry(url, content, *row[1:])
+
+    def put(self, url: str, response: httpx.Response) -> None:
+        """Store ``response``'s body and validators for ``url``, evicting as needed."""
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._body_path(digest)
+        with self._lock:
+            db = self._connect()
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+                self._size += len(content)
+            previous = db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    digest,
+                    len(content),
+                    response.headers.get("content-type"),
+                    response.headers.get("etag"),
+                    response.headers.get("last-modified"),
+                    time.time(),
+                ),
+            )
+            if previous is not None and previous[0] != digest:
+                self._drop_unused(db, previous[0])
+            self._evict(db)
+            db.commit()
+
+    def revalidated_by(self, entry: Entry, response: httpx.Response) -> None:
+        """Take the validators a ``304`` for ``entry`` came with."""
+        entry.etag = response.headers.get("etag", entry.etag)
+        entry.last_modified = response.headers.get("last-modified", entry.last_modified)
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "UPDATE entries SET etag = ?, last_modified = ? WHERE url = ?",
+                (entry.etag, entry.last_modified, entry.url),
+            )
+            db.commit()
+
+    def _drop_unused(self, db: sqlite3.Connection, digest: str) -> None:
+        """Delete the body ``digest`` unless another URL still uses it."""
+        if db.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone():
+            return
+        path = self._body_path(digest)
+        try:
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        """Remove the least recently used URLs until the bodies fit in ``max_bytes``."""
+        oldest = "SELECT url, digest FROM entries ORDER BY used_at LIMIT 1"
+        while self._size > self.max_bytes and (row := db.execute(oldest).fetchone()):
+            db.execute("DELETE FROM entries WHERE url = ?", (row[0],))
+            self._drop_unused(db, row[1])
+
+    def stats(self) -> dict:
+        """Cached URLs, bytes on disk and how requests were served."""
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "downloaded": self.downloaded,
+        }
+
+
+cache = HttpCache(config.IMSLP_CACHE_DIR)
+
+
+async def get(client: httpx.AsyncClient, url: str, cache_only: bool = False):
+    """GET ``url`` with ``client``, through the cache.
+
+    Without ``IMSLP_CACHE`` the request goes straight to ``client``. Either
+    way it is sent at the pace of ``app.politeness``.
+    """
+    if not config.IMSLP_CACHE and not cache_only:
+        return await politeness.send(client.get, url)
+    entry = await asyncio.to_thread(cache.get, url)
+    if cache_only:
+        if entry is None:
+            raise CacheMissError(url)
+        cache.hits += 1
+        return entry.response()
+    response = await politeness.send(client.get, url, headers=entry.validators() if entry else {})
+    if entry is not None and response.status_code == 304:
+        cache.revalidated += 1
+        await asyncio.to_thread(cache.revalidated_by, entry, response)
+        return entry.response()
+    cache.downloaded += 1
+    if response.status_code == 200:
+        await asyncio.to_thread(cache.put, url, response)
+    return response
+
+
+@router.get("/cache/stats", dependencies=[Depends(get_admin_user)])
+def cache_stats():
+    """Size of the crawl's response cache and how it served requests."""
+    return cache.stats()
@@ -3,203 +3,803 @@
 import asyncio
 import json
 import logging
-import os
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import UTC, datetime, timedelta
 
 import httpx
-import requests
-from bs4 import BeautifulSoup
-from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy import update
 from sqlalchemy.dialects.postgresql import insert
-from sqlmodel import Session, func, select, text
-
-from app.agent import run_imslp_complete_agent
-from app.db import engine, get_session
+from sqlmodel import Session, col, func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config, crawl_state, http_cache, politeness, similarity, singleflight
+from app.agent import (
+    get_agent_models,
+    run_imslp_batch_complete_agent,
+    run_imslp_complete_agent,
+)
+from app.db import async_engine, get_session
+from app.imslp_normalize import completeness, normalize
+from app.imslp_parser import parse_download_ids, parse_work_page, parse_works
 from app.users import get_admin_user
+from shared.crawl import CrawlState
 from shared.scores import IMSLP
-from shared.settings import Setting
 
 logger = logging.getLogger(__name__)
 
-# Module-level state shared by the /imslp/start, /imslp/progress, and
-# /imslp/cancel endpoints. This only works correctly when the backend runs
-# with a single uvicorn worker (see Dockerfile.backend) — each worker would
-# otherwise see its own copy. If we ever need to scale out, move this to a
-# DB row (e.g. on the Setting table) or Redis.
-progress_tracker = {"status": "idle", "page": 0, "cancel_requested": False}
+# Progress of the crawl run by this worker, which its stages read. Other
+# workers, and /imslp/progress, see it through the crawl's shared state (see
+# app/crawl_state.py), checkpointed from here.
+progress_tracker = {
+    "status": "idle",
+    "page": 0,
+    "total": 0,
+    "written": 0,
+    "last_id": None,
+    "cancel_requested": False,
+}
+CRAWL = "imslp"
+PAGE_SIZE = 1000  # works per worklist page
 router = APIRouter(prefix="/imslp", tags=["imslp"])
+stats_flight = singleflight.group("imslp_stats")
+by_ids_flight = singleflight.group("imslp_scores_by_ids")
+_client: httpx.AsyncClient | None = None
+_pool: "ParsePool | None" = None
+# Bind parameters allowed in one statement by asyncpg (and SQLite >= 3.32).
+MAX_BIND_PARAMS = 32766
+CHARS_PER_TOKEN = 4  # to estimate the prompt tokens of a work
+
+
+def http_client() -> httpx.AsyncClient:
+    """The HTTP client of every IMSLP request, created on first use.
+
+    Sharing it keeps connections to imslp.org alive (over HTTP/2 when
+    ``IMSLP_HTTP2``) across the many requests of a crawl instead of paying a
+    TCP and TLS handshake for each. It carries the disclaimer cookie IMSLP
+    asks for before serving files, and the app's lifespan closes it. Its
+    requests are sent at the pace of ``app.politeness``.
+    """
+    global _client  # noqa: PLW0603
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=config.IMSLP_HTTP2,
+            limits=httpx.Limits(
+                max_connections=config.IMSLP_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.IMSLP_HTTP_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(
+                config.IMSLP_HTTP_TIMEOUT, connect=config.IMSLP_HTTP_CONNECT_TIMEOUT
+            ),
+            cookies={"imslpdisclaimeraccepted": "yes"},
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_http_client():
+    """Close the shared IMSLP client and its connections."""
+    global _client  # noqa: PLW0603
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class ParsePool:
+    """Worker processes parsing IMSLP pages, and how busy they are.
+
+    Parsing is CPU-bound: on the event loop, or in a thread holding the GIL,
+    it slows down every API request while a crawl runs. The pool has
+    ``IMSLP_PARSE_PROCESSES`` workers; the crawl keeps at most one chunk of
+    pages in flight per worker, so the pool's queue stays short.
+    """
+
+    def __init__(self, processes: int):
+        self.processes = max(processes, 1)
+        self.executor = self._executor()
+        self.reset()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # spawn: forking the server's process would copy its threads and sockets
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+
+    def reset(self) -> None:
+        """Start counting utilisation afresh (at the start of a crawl)."""
+        self.started = time.monotonic()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.tasks = 0
+
+    async def run(self, fn, *args):
+        """``fn(*args)`` in a worker process."""
+        self.busy += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (e.g. out of memory): the next tasks get a new pool
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._executor()
+            raise
+        finally:
+            self.busy -= 1
+            self.busy_seconds += time.monotonic() - start
+            self.tasks += 1
+
+    def stats(self) -> dict:
+        """Workers, tasks and the share of the workers' time spent parsing."""
+        elapsed = time.monotonic() - self.started
+        utilisation = self.busy_seconds / (elapsed * self.processes) if elapsed else 0.0
+        return {
+            "processes": self.processes,
+            "busy": self.busy,
+            "tasks": self.tasks,
+            "utilisation": round(min(utilisation, 1.0), 3),
+        }
+
+
+def parse_pool() -> ParsePool:
+    """The pool parsing IMSLP pages, created on first use."""
+    global _pool  # noqa: PLW0603
+    if _pool is None:
+        _pool = ParsePool(config.IMSLP_PARSE_PROCESSES)
+    return _pool
+
+
+def close_parse_pool():
+    """Stop the parse pool's worker processes."""
+    global _pool  # noqa: PLW0603
+    if _pool is not None:
+        _pool.executor.shutdown(cancel_futures=True)
+        _pool = None
 
 
 def get_metadata(response, bypass=False) -> dict:
     """return a dictionary of metadata from the page"""
     if bypass:
         return {}
-    soup = BeautifulSoup(response.text, "html.parser")
-    gen_info = soup.find("span", id="General_Information")
-    if gen_info is None:
-        return {}
-
-    table = gen_info.find_next("table")
-    if table is None:
-        return {}
-
-    data = {}
-    for row in table.find_all("tr"):
-        header = row.find("th")
-        value = row.find("td")
-        if header and value:
-            key = header.get_text(" ", strip=True)
-            val = value.get_text(" ", strip=True)
-            data[key] = val
-    return data
+    return parse_work_page(response.text).metadata
 
 
-def get_pdfs(response):
+async def get_pdfs(response):
     """return a list of pdf urls"""
-    soup = BeautifulSoup(response.text, "html.parser")
-    links = soup.find_all("a", href=True)
-    pdf_landing_pages = [link["href"] for link in links if "Special:ImagefromIndex" in link["href"]]
-
-    session = requests.Session()
-    cookies = {"imslpdisclaimeraccepted": "yes"}
-    pdf_urls = []
-    for pdf_landing_page in pdf_landing_pages:
-        response = session.get(str(pdf_landing_page), cookies=cookies, allow_redirects=True)
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        links = soup.find_all("span", id="sm_dl_wait")
-        if links:
-            pdf_urls += [link["data-id"] for link in links]
-        # try redirect
-        else:
-            response = session.head(str(pdf_landing_page), cookies=cookies, allow_redirects=True)
-            pdf_url = response.url
-            if pdf_url.endswith("pdf"):
-                pdf_urls.append(pdf_url)
-            else:
-                print(pdf_url)
-    print(pdf_urls)
-    return pdf_urls
-
-
-async def get_page(start):
-    """Get a page of works from IMSLP."""
-    url = (
-        "https://imslp.org/imslpscripts/API.ISCR.php?account=worklist/"
-        f"disclaimer=accepted/sort=id/type=2/start={start}"
+    pool = parse_pool()
+    pdf_landing_pages = (await pool.run(parse_work_page, response.text)).pdf_landing_pages
+    client = http_client()
+    semaphore = asyncio.Semaphore(config.IMSLP_PDF_CONCURRENCY)
+
+    async def resolve(pdf_landing_page):
+        async with semaphore:
+            response = await politeness.send(client.get, pdf_landing_page)
+            pdf_urls = await pool.run(parse_download_ids, response.text)
+            if pdf_urls:
+                return pdf_urls
+            # try redirect
+            response = await politeness.send(client.head, pdf_landing_page)
+        pdf_url = str(response.url)
+        if pdf_url.endswith("pdf"):
+            return [pdf_url]
+        logger.warning("No pdf behind %s (redirected to %s)", pdf_landing_page, pdf_url)
+        return []
+
+    resolved = await asyncio.gather(*(resolve(page) for page in pdf_landing_pages))
+    return [pdf_url for pdf_urls in resolved for pdf_url in pdf_urls]
+
+
+def _page_url(start):
+    return (
+        f"{config.IMSLP_API_URL}?account=worklist/disclaimer=accepted/sort=id/type=2/start={start}"
     )
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, timeout=60)
+
+
+async def get_page(start, cache_only=False):
+    """Get a page of works from IMSLP; none past the cached ones if ``cache_only``."""
+    try:
+        response = await http_cache.get(http_client(), _page_url(start), cache_only)
+    except http_cache.CacheMissError:
+        return {}
     data = response.json()
     data.pop("metadata")
     return data
 
 
-async def fix_entry(entry, session):
-    """Fix missing values in the entry using an agent."""
+def _prompt(entry):
+    """What the completion agent is told about ``entry``."""
+    return entry.model_dump_json(exclude={"metadata_hash"})
 
-    setting = await asyncio.to_thread(session.get, Setting, "model_imslp_complete")
-    model = setting.value if setting else os.getenv("MODEL", "test")
 
+async def complete_entry(entry, model, fallbacks):
+    """Fill in the entry's missing values with the completion agent."""
     try:
-        output = await run_imslp_complete_agent(entry.model_dump_json(), model)
-        for key, value in output.model_dump().items():
+        output = await run_imslp_complete_agent(_prompt(entry), model, fallbacks)
+        # fields the model left out keep their parsed value, not ScoreBase's default
+        for key, value in output.model_dump(exclude_unset=True).items():
             setattr(entry, key, value)
     except Exception as e:
         logger.error("Failed to fix entry: %s", e)
+    return entry
+
+
+def pack(prompts, budget, size):
+    """Split ``(id, prompt)`` pairs into requests of ``size`` works and ``budget`` tokens at most.
+
+    Tokens are estimated from the prompts' length; a work over the budget on
+    its own gets a request of its own.
+    """
+    requests, request, tokens = [], {}, 0
+    for i, prompt in prompts:
+        cost = len(prompt) // CHARS_PER_TOKEN + 1
+        if request and (tokens + cost > budget or len(request) >= size):
+            requests.append(request)
+            request, tokens = {}, 0
+        request[i] = prompt
+        tokens += cost
+    if request:
+        requests.append(request)
+    return requests
+
+
+async def complete_entries(entries, model, fallbacks):
+    """Fill in the entries' missing values, many entries per completion request.
+
+    Entries are packed (see :func:`pack`) into requests of
+    ``IMSLP_ENRICH_BATCH_SIZE`` works and ``IMSLP_ENRICH_BATCH_TOKENS``
+    estimated prompt tokens. The works of a failed request, and those its
+    answer left out or got wrong, are asked again in the next round, up to
+    ``IMSLP_ENRICH_RETRIES`` times; as with :func:`complete_entry`, a work
+    that still fails is kept as parsed.
+    """
+    by_id = {entry.id: entry for entry in entries}
+    pending = {i: _prompt(entry) for i, entry in by_id.items()}
+    for _ in range(config.IMSLP_ENRICH_RETRIES + 1):
+        requests = pack(
+            pending.items(), config.IMSLP_ENRICH_BATCH_TOKENS, config.IMSLP_ENRICH_BATCH_SIZE
+        )
+        for request in requests:
+            try:
+                completed = await run_imslp_batch_complete_agent(request, model, fallbacks)
+            except Exception as e:
+                logger.error("Failed to fix %s entries: %s", len(request), e)
+                continue
+            for i, output in completed.items():
+                for key, value in output.model_dump(exclude_unset=True, exclude_none=True).items():
+                    setattr(by_id[i], key, value)
+                del pending[i]
+    if pending:
+        logger.error("Gave up fixing IMSLP works %s", sorted(pending))
+    return entries
+
+
+def needs_completion(entry):
+    """Whether the rules read too little of the entry's metadata to go without the agent.
+
+    See ``app.imslp_normalize``: entries under ``IMSLP_COMPLETENESS_THRESHOLD``
+    are completed by the agent, the others are written as normalized.
+    """
+    fields = normalize(json.loads(entry.score_metadata or "{}"))
+    return completeness(fields) < config.IMSLP_COMPLETENESS_THRESHOLD
 
 
-async def add_entry(i, item, session, overwrite=False):
-    """Add an entry to the database."""
-    entry_exists = await asyncio.to_thread(session.get, IMSLP, int(i))
-    if not overwrite and entry_exists:
-        return
+async def fix_entry(entry, session):
+    """Fix missing values in the entry using an agent."""
+    await complete_entry(entry, *await get_agent_models(session, "imslp_complete"))
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(item["permlink"], timeout=60)
-    metadata = get_metadata(response)
-    entry = IMSLP(
-        id=int(i),
-        title=metadata.get("Work Title", item["intvals"]["worktitle"]),
-        composer=metadata.get("Composer", item["intvals"]["composer"]),
-        permlink=item["permlink"],
-        instrumentation=metadata.get("Instrumentation", ""),
-        style=metadata.get("Piece Style", ""),
-        period=metadata.get("Composer Time Period Comp. Period", ""),
-        year=metadata.get("Year/Date of Composition Y/D of Comp.", ""),
-        key=metadata.get("Key", ""),
-        score_metadata=json.dumps(metadata),
-    )
-    await fix_entry(entry, session)
-    stmt = insert(IMSLP).values(entry.model_dump())
-    update_columns = {
-        col.name: stmt.excluded[col.name]
-        for col in IMSLP.metadata.tables["imslp"].columns
-        if col.name != "id"
+
+async def fetch_entry(i, item, cache_only=False):
+    """Fetch the work page of a worklist item, from the response cache only if ``cache_only``."""
+    response = await http_cache.get(http_client(), item["permlink"], cache_only)
+    return i, item, response
+
+
+async def parse_entries(fetched):
+    """IMSLP rows of fetched ``(id, item, response)``, parsed in one pool task.
+
+    A work whose page can't be parsed is logged and left out.
+    """
+    chunk = [(i, item, response.text) for i, item, response in fetched]
+    entries = []
+    parsed = await parse_pool().run(parse_works, chunk)
+    for (i, *_), fields in zip(chunk, parsed, strict=True):
+        if isinstance(fields, Exception):
+            logger.error("IMSLP parse failed for work %s", i, exc_info=fields)
+        else:
+            entries.append(IMSLP(**fields))
+    return entries
+
+
+async def write_entries(entries, session):
+    """Upsert entries with multi-row statements and commit them together."""
+    rows = list({entry.id: entry.model_dump() for entry in entries}.values())
+    columns = IMSLP.metadata.tables["imslp"].columns
+    per_statement = max(MAX_BIND_PARAMS // len(columns), 1)
+    for offset in range(0, len(rows), per_statement):
+        stmt = insert(IMSLP).values(rows[offset : offset + per_statement])
+        update_columns = {col.name: stmt.excluded[col.name] for col in columns if col.name != "id"}
+        await session.exec(stmt.on_conflict_do_update(index_elements=["id"], set_=update_columns))
+    await session.commit()
+
+
+async def existing_ids(ids, session):
+    """The ids among ``ids`` already in the catalogue, in one query."""
+    return set((await session.exec(select(IMSLP.id).where(col(IMSLP.id).in_(ids)))).all())
+
+
+async def metadata_hashes(ids, session):
+    """The stored metadata hash of each work of ``ids`` in the catalogue, in one query."""
+    rows = await session.exec(select(IMSLP.id, IMSLP.metadata_hash).where(col(IMSLP.id).in_(ids)))
+    return dict(rows.all())
+
+
+async def add_entry(i, item, session, overwrite=False):
+    """Add an entry to the database; returns whether it was written."""
+    if not overwrite and await existing_ids([int(i)], session):
+        return False
+
+    entries = await parse_entries([await fetch_entry(i, item)])
+    if not entries:
+        return False
+    entry = entries[0]
+    if needs_completion(entry):
+        await fix_entry(entry, session)
+    await write_entries([entry], session)
+    return True
+
+
+async def index_entries(entries):
+    """Add freshly written entries to the similarity index."""
+    if entries:
+        await asyncio.to_thread(similarity.index.add, entries)
+
+
+async def _next_batch(queue, size):
+    """The next item of ``queue`` and those already waiting behind it, up to ``size``."""
+    batch = [await queue.get()]
+    while len(batch) < size and not queue.empty():
+        batch.append(queue.get_nowait())
+    return batch
+
+
+class Checkpoint:
+    """The first worklist page with works still going through the crawl.
+
+    A resumed crawl starts there: every work of the pages before it was
+    written, or failed and was skipped as a running crawl skips it. The
+    works a cancel drops stay pending, so their page is read again.
+    """
+
+    def __init__(self, page):
+        self.read = page  # the first page not queued in full
+        self.pages = {}  # page of each work in the pipeline
+        self.pending = Counter()
+
+    def add(self, work_id, page):
+        """``work_id`` of ``page`` goes into the pipeline."""
+        self.pages[work_id] = page
+        self.pending[page] += 1
+
+    def settle(self, work_ids):
+        """``work_ids`` are through the pipeline, written or failed."""
+        for work_id in work_ids:
+            page = self.pages.pop(work_id)
+            self.pending[page] -= 1
+            if not self.pending[page]:
+                del self.pending[page]
+
+    @property
+    def page(self):
+        """The page a resumed crawl should start from."""
+        return min(self.pending, default=self.read)
+
+
+def _stage(name, inbox, outbox, work, concurrency, settle):
+    """Workers passing ``work(*item)`` from ``inbox`` to ``outbox``.
+
+    Items start with their work's id. Once a cancel is requested the items
+    left in ``inbox`` are dropped; a failed item is logged, dropped so it
+    doesn't stop the crawl, and its id passed to ``settle``.
+    """
+
+    async def worker():
+        while True:
+            item = await inbox.get()
+            try:
+                if not progress_tracker["cancel_requested"]:
+                    await outbox.put(await work(*item))
+            except Exception:
+                logger.exception("IMSLP %s failed for work %s", name, item[0])
+                settle([item[0]])
+            finally:
+                inbox.task_done()
+
+    return [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+
+
+def _batch_stage(name, inbox, outbox, work, size, concurrency, settle):
+    """Workers passing the items of ``work(batch)`` from ``inbox`` to ``outbox``.
+
+    A batch is the next item of ``inbox`` and those already waiting behind
+    it, up to ``size``. As in :func:`_stage`, items start with their work's
+    id and are dropped after a cancel; the ids of a batch's items that
+    ``work`` leaves out, or of all its items if it fails, go to ``settle``.
+    """
+
+    async def worker():
+        while True:
+            batch = await _next_batch(inbox, size)
+            forwarded = set()
+            try:
+                if not progress_tracker["cancel_requested"]:
+                    for item in await work(batch):
+                        await outbox.put(item)
+                        forwarded.add(item[0])
+                    settle(i for i, *_ in batch if i not in forwarded)
+            except Exception:
+                logger.exception("IMSLP %s of %s works failed", name, len(batch))
+                settle(i for i, *_ in batch if i not in forwarded)
+            finally:
+                for _ in batch:
+                    inbox.task_done()
+
+    return [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+
+
+async def get_works(resumed=None, cache_only=False, enrich=True, sync_from=None):
+    """Get all works from IMSLP, from the checkpoint of the ``resumed`` crawl state.
+
+    The crawl is a pipeline of asyncio stages: worklist pages are read one at a
+    time, then every new work goes through its page fetch, parse, completion
+    agent and a batched write. Each stage has its own number of workers and
+    hands over through a bounded queue, so a slow stage (usually the agent)
+    holds back the ones before it instead of piling up work in memory. Pages
+    are parsed in the :class:`ParsePool`, in chunks of those fetched so far,
+    and those of the works parsed so far that the rules couldn't complete (see
+    :func:`needs_completion`) go to the agent together (see
+    :func:`complete_entries`).
+
+    The crawl holds the lease of its shared state (see ``app.crawl_state``)
+    and checkpoints there after each worklist page and every
+    ``IMSLP_CHECKPOINT_INTERVAL`` seconds, which also picks up a cancel
+    requested on another worker.
+
+    Pages come through the response cache (see ``app.http_cache``). With
+    ``cache_only`` the catalogue is rebuilt from the cached pages alone:
+    nothing is downloaded and every cached work is written again, with the
+    completion agent unless ``enrich`` is off.
+
+    An incremental sync (see :func:`start_sync`) starts at page ``sync_from``
+    and fetches the works already in the catalogue again too: those whose
+    metadata hash didn't change are dropped after the parse, so only new and
+    edited works go through the agent and get written.
+    """
+    first_page = resumed.checkpoint if resumed else sync_from or 0
+    stored = {}  # metadata hash of the known works a sync fetches again
+    unchanged = 0
+    normalized = 0  # works complete without the agent
+    checkpoint = Checkpoint(first_page)
+    counters = {
+        "page": first_page,
+        "written": resumed.written if resumed else 0,
+        "last_id": resumed.last_id if resumed else None,
     }
-    stmt = stmt.on_conflict_do_update(index_elements=["id"], set_=update_columns)
-    await asyncio.to_thread(session.exec, stmt)
-    await asyncio.to_thread(session.commit)
-
-
-async def get_works():
-    """Get all works from IMSLP."""
-    progress_tracker["status"] = "processing"
-    with Session(engine) as session:
-        for i in range(0, progress_tracker["total"]):
-            progress_tracker["page"] = i
-            start = int(i * 1000)
-            await asyncio.sleep(10)  # don't fetch too fast to reduce LLM cost
-            data = await get_page(start)
-
-            # last page, we stop
-            if not data:
-                break
-
-            # add entries
-            for item_id, item in data.items():
-                item_id = int(item_id) + start
-                await add_entry(item_id, item, session)
-
-                # cancelled by user
+    if not await crawl_state.acquire(
+        CRAWL,
+        status="processing",
+        total=progress_tracker["total"],
+        checkpoint=first_page,
+        cancel_requested=progress_tracker["cancel_requested"],
+        **counters,
+    ):
+        logger.warning("The IMSLP crawl is running on another worker")
+        return
+    progress_tracker.update(status="processing", **counters)
+
+    def state(**values):
+        return {
+            "checkpoint": checkpoint.page,
+            **{key: progress_tracker[key] for key in ("page", "written", "last_id")},
+            **values,
+        }
+
+    async def save():
+        values = state(status=progress_tracker["status"])
+        if progress_tracker["cancel_requested"]:
+            values["cancel_requested"] = True
+        try:
+            cancel_requested = await crawl_state.renew(CRAWL, **values)
+        except Exception:
+            logger.exception("IMSLP checkpoint failed")
+            return
+        if cancel_requested is None:
+            logger.error("The IMSLP crawl's lease was taken over, stopping")
+            progress_tracker["cancel_requested"] = True
+        elif cancel_requested and not progress_tracker["cancel_requested"]:
+            progress_tracker.update(cancel_requested=True, status="cancelling")
+
+    stopped = asyncio.Event()
+
+    async def heartbeat():
+        # stopped rather than cancelled, which could leave a checkpoint's
+        # transaction open while the state is released
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), config.IMSLP_CHECKPOINT_INTERVAL)
+            except TimeoutError:
+                await save()
+
+    pool = parse_pool()
+    pool.reset()
+    size = config.IMSLP_QUEUE_SIZE
+    todo, fetched, parsed, completed = (asyncio.Queue(maxsize=size) for _ in range(4))
+    status = "failed"
+
+    # the writer has its own session: an AsyncSession can't run two statements
+    # at once, and the pages only need a short-lived one
+    async with AsyncSession(async_engine, expire_on_commit=False) as writer:
+        models = None  # the agent settings, read once the first works come in
+
+        async def parse(chunk):
+            nonlocal unchanged
+            entries = []
+            for entry in await parse_entries(chunk):
+                if stored.pop(entry.id, None) == entry.metadata_hash:
+                    unchanged += 1
+                else:
+                    entries.append((entry.id, entry))
+            return entries
+
+        async def complete(batch):
+            nonlocal normalized
+            entries = [entry for _, entry in batch]
+            incomplete = [entry for entry in entries if needs_completion(entry)]
+            normalized += len(entries) - len(incomplete)
+            if enrich and incomplete:
+                await complete_entries(incomplete, *models)
+            return [(entry.id, entry) for entry in entries]
+
+        async def fetch(i, item):
+            return await fetch_entry(i, item, cache_only)
+
+        async def write():
+            while True:
+                batch = await _next_batch(completed, config.IMSLP_WRITE_BATCH)
+                entries = [entry for _, entry in batch]
+                try:
+                    await write_entries(entries, writer)
+                    await index_entries(entries)
+                    progress_tracker["written"] += len(batch)
+                    progress_tracker["last_id"] = max(
+                        progress_tracker["last_id"] or 0, *(i for i, _ in batch)
+                    )
+                except Exception:
+                    logger.exception("IMSLP write of %s works failed", len(batch))
+                    await writer.rollback()
+                finally:
+                    checkpoint.settle(i for i, _ in batch)
+                    for _ in batch:
+                        completed.task_done()
+
+        settle = checkpoint.settle
+        fetch_workers = config.IMSLP_FETCH_CONCURRENCY
+        enrich_workers = config.IMSLP_ENRICH_CONCURRENCY
+        chunk, batch = config.IMSLP_PARSE_CHUNK, config.IMSLP_ENRICH_BATCH_SIZE
+        stages = [
+            (todo, _stage("fetch", todo, fetched, fetch, fetch_workers, settle)),
+            (fetched, _batch_stage("parse", fetched, parsed, parse, chunk, pool.processes, settle)),
+            (
+                parsed,
+                _batch_stage("enrich", parsed, completed, complete, batch, enrich_workers, settle),
+            ),
+            (completed, [asyncio.create_task(write())]),
+        ]
+        checkpointing = asyncio.create_task(heartbeat())
+        try:
+            for i in range(first_page, progress_tracker["total"]):
                 if progress_tracker["cancel_requested"]:
-                    progress_tracker["status"] = "cancelled"
-                    return
-
-    progress_tracker["status"] = "completed"
+                    break
+                progress_tracker["page"] = i
+                start = i * PAGE_SIZE
+                data = await get_page(start, cache_only)
+
+                # last page, we stop
+                if not data:
+                    break
+
+                items = {int(item_id) + start: item for item_id, item in data.items()}
+                async with AsyncSession(async_engine) as reader:
+                    if models is None and enrich:
+                        models = await get_agent_models(reader, "imslp_complete")
+                    # a rebuild from the cache writes the stored works again, a
+                    # sync those it finds edited
+                    if sync_from is not None:
+                        stored.update(await metadata_hashes(list(items), reader))
+                    known = (
+                        set()
+                        if cache_only or sync_from is not None
+                        else await existing_ids(list(items), reader)
+                    )
+                for item_id, item in items.items():
+                    if progress_tracker["cancel_requested"]:
+                        break
+                    if item_id not in known:
+                        checkpoint.add(item_id, i)
+                        await todo.put((item_id, item))
+                else:
+                    checkpoint.read = i + 1
+                await save()
+
+            # let every stage finish what it was handed, in order
+            for queue, _ in stages:
+                await queue.join()
+            status = "cancelled" if progress_tracker["cancel_requested"] else "completed"
+        except asyncio.CancelledError:
+            status = "interrupted"  # e.g. the server shutting down
+            raise
+        finally:
+            stopped.set()
+            workers = [worker for _, stage_workers in stages for worker in stage_workers]
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(checkpointing, *workers, return_exceptions=True)
+            progress_tracker["status"] = status
+            await crawl_state.release(CRAWL, **state(status=status))
+            logger.info(
+                "IMSLP %s %s: %s works written, %s unchanged, %s complete without the agent",
+                "sync" if sync_from is not None else "crawl",
+                status,
+                progress_tracker["written"] - counters["written"],
+                unchanged,
+                normalized,
+            )
 
 
 @router.post("/start/{max_pages}", dependencies=[Depends(get_admin_user)])
-def update_imslp_database(max_pages: int, background_tasks: BackgroundTasks):
-    """Update the Imslp database."""
-    progress_tracker["cancel_requested"] = False
-    background_tasks.add_task(get_works)
-    progress_tracker["page"] = 0
-    progress_tracker["status"] = "starting"
-    progress_tracker["total"] = max_pages
-    return {"message": "Task started successfully!"}
+async def update_imslp_database(
+    max_pages: int,
+    background_tasks: BackgroundTasks,
+    resume: bool = False,
+    cache_only: bool = False,
+    enrich: bool = True,
+):
+    """Update the Imslp database, from the last checkpoint if ``resume``.
+
+    ``cache_only`` rebuilds it from the cached IMSLP pages without any
+    download, and without the completion agent if ``enrich`` is off.
+    """
+    resumed = await crawl_state.read(CRAWL) if resume else None
+    first_page = resumed.checkpoint if resumed else 0
+    await start_crawl(max_pages, first_page, resumed)
+    background_tasks.add_task(get_works, resumed, cache_only, enrich)
+    return {"message": "Task started successfully!", "page": first_page}
+
+
+async def start_crawl(total, first_page=0, resumed=None):
+    """Take the crawl's lease for pages ``first_page`` to ``total``; a 409 if it's running."""
+    if progress_tracker["status"] in crawl_state.ACTIVE or not await crawl_state.acquire(
+        CRAWL,
+        status="starting",
+        page=first_page,
+        total=total,
+        checkpoint=first_page,
+        written=resumed.written if resumed else 0,
+        last_id=resumed.last_id if resumed else None,
+        cancel_requested=False,
+    ):
+        raise HTTPException(status_code=409, detail="An IMSLP update is already running")
+    progress_tracker.update(status="starting", page=first_page, total=total, cancel_requested=False)
+
+
+async def start_sync(pages, from_page=None):
+    """Take the crawl's lease for an incremental sync; the page it starts from.
+
+    The worklist is sorted by id, so new works are on the page of the
+    highest known id and after it: the sync starts there unless
+    ``from_page`` says otherwise (e.g. 0 to look for edits in the whole
+    catalogue, which only downloads the pages that changed thanks to the
+    response cache), and reads at most ``pages`` pages.
+    """
+    if from_page is None:
+        async with AsyncSession(async_engine) as session:
+            last_id = (await session.exec(select(func.max(IMSLP.id)))).one()
+        from_page = (last_id or 0) // PAGE_SIZE
+    await start_crawl(from_page + pages, from_page)
+    return from_page
+
+
+@router.post("/sync", dependencies=[Depends(get_admin_user)])
+async def sync_imslp_database(
+    background_tasks: BackgroundTasks, pages: int | None = None, from_page: int | None = None
+):
+    """Add the new IMSLP works and update the edited ones (see :func:`start_sync`)."""
+    first_page = await start_sync(pages or config.IMSLP_SYNC_PAGES, from_page)
+    background_tasks.add_task(get_works, sync_from=first_page)
+    return {"message": "Sync started successfully!", "page": first_page}
+
+
+def seconds_until(at, now):
+    """Seconds from ``now`` to the next ``at`` ("HH:MM", UTC)."""
+    hour, minute = map(int, at.split(":"))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run <= now:
+        run += timedelta(days=1)
+    return (run - now).total_seconds()
+
+
+async def sync_nightly():
+    """Run the incremental sync every day at ``IMSLP_SYNC_AT``, for the app's lifetime.
+
+    Every worker runs this loop; the crawl's lease lets one of them sync.
+    """
+    while True:
+        await asyncio.sleep(seconds_until(config.IMSLP_SYNC_AT, datetime.now(UTC)))
+        try:
+            first_page = await start_sync(config.IMSLP_SYNC_PAGES)
+        except HTTPException:
+            logger.info("IMSLP sync skipped, a crawl is running")
+            continue
+        try:
+            await get_works(sync_from=first_page)
+        except Exception:
+            logger.exception("IMSLP sync failed")
 
 
 @router.post("/progress", dependencies=[Depends(get_admin_user)])
-def get_progress():
-    """Get the progress of the IMSLP update"""
-    return progress_tracker
+async def get_progress():
+    """Get the progress of the IMSLP update, how busy its parse pool is, and the
+    pace of this worker's requests to IMSLP"""
+    state = await crawl_state.read(CRAWL)
+    progress = state.model_dump(exclude={"name", "lease_expires"})
+    # the pool is the crawl's on the worker running it only
+    running_here = state.lease_owner == crawl_state.WORKER_ID
+    progress["parse_pool"] = parse_pool().stats() if running_here else None
+    progress["politeness"] = politeness.stats()
+    return progress
 
 
 @router.post("/cancel", dependencies=[Depends(get_admin_user)])
-def cancel():
-    """Cancel the IMSLP update"""
-    progress_tracker["cancel_requested"] = True
-    progress_tracker["status"] = "cancelling"
+async def cancel():
+    """Cancel the IMSLP update, on whichever worker runs it"""
+    await crawl_state.request_cancel(CRAWL)
+    if progress_tracker["status"] in crawl_state.ACTIVE:
+        progress_tracker["cancel_requested"] = True
+        progress_tracker["status"] = "cancelling"
+
+
+async def _coalesced(flight, key, query):
+    """Run ``await query(session)`` once for all concurrent callers with ``key``.
+
+    The query gets a session of its own rather than the leader's request
+    session, which is closed if the leader disconnects while followers still
+    wait; the rows come back detached from it.
+    """
+
+    async def run():
+        async with AsyncSession(async_engine) as session:
+            return await query(session)
+
+    try:
+        return await flight.do(key, run, config.SINGLEFLIGHT_QUERY_TIMEOUT)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail="Catalogue query timed out") from e
 
 
 @router.get("/stats", dependencies=[Depends(get_admin_user)])
-def get_imslp_stats(session: Session = Depends(get_session)):
+async def get_imslp_stats():
     """Get IMSLP stats"""
 
-    return {
-        "total_works": session.exec(select(func.count()).select_from(IMSLP)).one(),
-        "total_composers": session.exec(select(func.count(func.distinct(IMSLP.composer)))).one(),
-    }
+    async def query(session):
+        return {
+            "total_works": (await session.exec(select(func.count()).select_from(IMSLP))).one(),
+            "total_composers": (
+                await session.exec(select(func.count(func.distinct(IMSLP.composer))))
+            ).one(),
+        }
+
+    return await _coalesced(stats_flight, None, query)
 
 
 @router.post("/empty", dependencies=[Depends(get_admin_user)])
@@ -209,11 +809,20 @@ def empty(session: Session = Depends(get_session)):
         session.execute(text("TRUNCATE TABLE imslp RESTART IDENTITY CASCADE;"))  # pragma: no cover
     else:
         session.execute(text("DELETE FROM imslp;"))
+    # a resumed crawl would skip the pages before the checkpoint
+    session.execute(
+        update(CrawlState).where(col(CrawlState.name) == CRAWL).values(checkpoint=0, last_id=None)
+    )
     session.commit()
+    similarity.index.reset()
 
 
 @router.get("/scores_by_ids")
-def get_by_ids(score_ids: str, session: Session = Depends(get_session)):
+async def get_by_ids(score_ids: str):
     """Get scores by ids."""
+    ids = tuple(sorted(set(json.loads(score_ids))))
+
+    async def query(session):
+        return (await session.exec(select(IMSLP).where(col(IMSLP.id).in_(ids)))).all()
 
-    return session.exec(select(IMSLP).where(IMSLP.id.in_(json.loads(score_ids)))).all()
+    return await _coalesced(by_ids_flight, ids, query)
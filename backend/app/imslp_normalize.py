@@ -0,0 +1,285 @@
+"""Deterministic clean-up of a work's IMSLP metadata into typed columns.
+
+The "General Information" table of a work page is free text: the date of
+composition reads "1804–08" or "ca.1720", the period is IMSLP's label
+("Early 20th century") rather than a :class:`Period`, keys are spelled
+"B♭ major" or "b-flat minor". :func:`normalize` reads what it can of these
+with rules alone and leaves out what it can't; :func:`completeness` is the
+share of :data:`COMPLETENESS_FIELDS` it could read, which the crawl uses to
+only ask the completion agent about the works it couldn't complete.
+
+It runs in the parse pool's workers (see ``app.imslp_parser``).
+"""
+
+import re
+import unicodedata
+from typing import Any
+
+from shared.scores import Period
+
+# The columns a complete work has.
+COMPLETENESS_FIELDS = (
+    "title",
+    "composer",
+    "year",
+    "period",
+    "genre",
+    "form",
+    "key",
+    "instrumentation",
+    "style",
+)
+MIN_YEAR, MAX_YEAR = 800, 2030
+
+_YEAR_RE = re.compile(r"(?<!\d)(\d{3,4})(?!\d)")
+_CENTURY_RE = re.compile(r"(\d{1,2})(?:st|nd|rd|th)\s+century", re.IGNORECASE)
+_MODES = "major|minor|dorian|phrygian|lydian|mixolydian|aeolian|ionian|locrian"
+_KEY_RE = re.compile(
+    rf"\b([A-Ga-g])(?:(-?\s?flat|♭|b)|(-?\s?sharp|♯|#))?\s*\b({_MODES})\b", re.IGNORECASE
+)
+# IMSLP's period labels, most specific first
+_PERIODS = (
+    ("medieval", Period.Medieval),
+    ("renaissance", Period.Renaissance),
+    ("baroque", Period.Baroque),
+    ("neoclassic", Period.Modernist),
+    ("classical", Period.Classical),
+    ("romantic", Period.Romantic),
+    ("21st century", Period.Postmodernist),
+    ("contemporary", Period.Postmodernist),
+    ("postmodern", Period.Postmodernist),
+    ("20th century", Period.Modernist),
+    ("modern", Period.Modernist),
+)
+# Periods by the year a work was composed, when IMSLP gives no label.
+_PERIOD_ENDS = (
+    (1400, Period.Medieval),
+    (1600, Period.Renaissance),
+    (1750, Period.Baroque),
+    (1820, Period.Classical),
+    (1910, Period.Romantic),
+    (1975, Period.Modernist),
+)
+# Genre categories that say what a work is for or about rather than what it is.
+_NOT_GENRES = ("for ", "scores ", "pages ", "works ", "arrangements", "contents", "language")
+_PLURALS = (
+    ("ies", "y"),
+    ("sses", "ss"),
+    ("ches", "ch"),
+    ("shes", "sh"),
+    ("zes", "z"),
+    ("ss", "ss"),
+    ("s", ""),
+)
+_INSTRUMENTS = {
+    "pf": "piano",
+    "pianoforte": "piano",
+    "vn": "violin",
+    "vln": "violin",
+    "vla": "viola",
+    "vc": "cello",
+    "violoncello": "cello",
+    "db": "double bass",
+    "kb": "keyboard",
+    "org": "organ",
+    "orch": "orchestra",
+}
+_WORD_RE = re.compile(r"[A-Za-z]+\.?")
+
+
+def _plurals(word: str) -> tuple[str, str]:
+    if word.endswith("y"):
+        return word, word[:-1] + "ies"
+    if word.endswith(("ch", "sh", "ss", "z", "s")):
+        return word, word + "es"
+    return word, word + "s"
+
+
+# Forms a title names, singular or plural ("Piano Sonata No.11", "Waltzes, Op.39").
+_FORM_NAMES = (
+    "Allemande",
+    "Bagatelle",
+    "Ballade",
+    "Barcarolle",
+    "Berceuse",
+    "Bolero",
+    "Canon",
+    "Cantata",
+    "Canzona",
+    "Caprice",
+    "Chaconne",
+    "Chorale",
+    "Concerto",
+    "Courante",
+    "Divertimento",
+    "Etude",
+    "Fantasia",
+    "Fantasy",
+    "Fugue",
+    "Gavotte",
+    "Gigue",
+    "Gymnopedie",
+    "Gnossienne",
+    "Hymn",
+    "Impromptu",
+    "Intermezzo",
+    "Invention",
+    "Lied",
+    "Madrigal",
+    "March",
+    "Mass",
+    "Mazurka",
+    "Minuet",
+    "Motet",
+    "Nocturne",
+    "Octet",
+    "Opera",
+    "Oratorio",
+    "Overture",
+    "Partita",
+    "Passacaglia",
+    "Pavane",
+    "Polonaise",
+    "Prelude",
+    "Quartet",
+    "Quintet",
+    "Requiem",
+    "Rhapsody",
+    "Rondo",
+    "Sarabande",
+    "Scherzo",
+    "Serenade",
+    "Sextet",
+    "Sonata",
+    "Sonatina",
+    "Song",
+    "Study",
+    "Suite",
+    "Symphony",
+    "Toccata",
+    "Trio",
+    "Variation",
+    "Waltz",
+)
+_FORMS = {word: form for form in _FORM_NAMES for word in _plurals(form.lower())} | {
+    "lieder": "Lied"
+}
+_TITLE_WORD_RE = re.compile(r"[^\W\d_]+")
+# A genre's qualifier, left plural ("Songs without words").
+_QUALIFIER_RE = re.compile(r"\s+(?:with|without|of|on|in)\s")
+
+
+def _clean(text: str | None) -> str:
+    return " ".join((text or "").split())
+
+
+def parse_year(text: str | None) -> int | None:
+    """The first year of a date ("1804–08" -> 1804), or the middle of its century."""
+    text = _clean(text)
+    for match in _YEAR_RE.finditer(text):
+        year = int(match.group(1))
+        if MIN_YEAR <= year <= MAX_YEAR:
+            return year
+    if century := _CENTURY_RE.search(text):
+        return (int(century.group(1)) - 1) * 100 + 50
+    return None
+
+
+def parse_period(label: str | None) -> Period | None:
+    """The :class:`Period` of one of IMSLP's period labels."""
+    label = _clean(label).lower()
+    for name, period in _PERIODS:
+        if name in label:
+            return period
+    return None
+
+
+def period_of_year(year: int) -> Period:
+    """The period a work composed in ``year`` belongs to."""
+    for end, period in _PERIOD_ENDS:
+        if year < end:
+            return period
+    return Period.Postmodernist
+
+
+def canonical_key(text: str | None) -> str | None:
+    """Keys spelled "C minor", "B-flat major", "F-sharp minor", "D dorian", comma-separated."""
+    keys = []
+    for note, flat, sharp, mode in _KEY_RE.findall(_clean(text)):
+        accidental = "-flat" if flat else "-sharp" if sharp else ""
+        key = f"{note.upper()}{accidental} {mode.lower()}"
+        if key not in keys:
+            keys.append(key)
+    return ", ".join(keys) or None
+
+
+def canonical_instrumentation(text: str | None) -> str | None:
+    """Whitespace collapsed, abbreviations spelled out, capitalized."""
+    text = _WORD_RE.sub(
+        lambda m: _INSTRUMENTS.get(m.group().rstrip(".").lower(), m.group()), _clean(text)
+    )
+    return text[:1].upper() + text[1:] if text else None
+
+
+def genre_of(categories: str | None) -> str | None:
+    """The genre of IMSLP's genre categories ("Symphonies; For orchestra" -> "Symphony")."""
+    for category in _clean(categories).split(";"):
+        category = category.strip()
+        if not category or any(word in category.lower() for word in _NOT_GENRES):
+            continue
+        head = _QUALIFIER_RE.split(category, maxsplit=1)[0]
+        rest = category[len(head) :]
+        for plural, singular in _PLURALS:
+            if head.endswith(plural) and len(head) >= len(plural) + 2:
+                return head[: -len(plural)] + singular + rest
+        return category
+    return None
+
+
+def form_of(title: str | None) -> str | None:
+    """The form a title names ("Cello Suite No.1" -> "Suite", "Etudes, Op.10" -> "Etude").
+
+    Of adjacent form words the last one is the form ("Trio Sonata" -> "Sonata").
+    """
+    text = (title or "").lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    form = None
+    for word in _TITLE_WORD_RE.findall(text):
+        found = _FORMS.get(word)
+        if found:
+            form = found
+        elif form:
+            break
+    return form
+
+
+def normalize(metadata: dict[str, str]) -> dict[str, Any]:
+    """Column values read from a work's metadata block; those it can't read are left out."""
+    year = parse_year(metadata.get("Year/Date of Composition Y/D of Comp."))
+    style = _clean(metadata.get("Piece Style"))
+    style_period = parse_period(style)
+    period = (
+        parse_period(metadata.get("Composer Time Period Comp. Period"))
+        or style_period
+        or (period_of_year(year) if year is not None else None)
+    )
+    title = _clean(metadata.get("Work Title"))
+    fields = {
+        "title": title,
+        "composer": _clean(metadata.get("Composer")),
+        "year": year,
+        "period": period,
+        "genre": genre_of(metadata.get("Genre Categories")),
+        "form": form_of(title),
+        "key": canonical_key(metadata.get("Key")),
+        "instrumentation": canonical_instrumentation(metadata.get("Instrumentation")),
+        "style": style_period.value if style_period else style,
+    }
+    return {name: value for name, value in fields.items() if value}
+
+
+def completeness(fields: dict[str, Any]) -> float:
+    """Share of :data:`COMPLETENESS_FIELDS` among normalized ``fields``."""
+    return sum(name in fields for name in COMPLETENESS_FIELDS) / len(COMPLETENESS_FIELDS)
@@ -0,0 +1,115 @@
+"""Extraction of the data the crawl needs from IMSLP pages.
+
+A work page is parsed once, with lxml's C parser, for both the "General
+Information" table (the work's metadata) and the links to its files'
+download landing pages. The output matches what BeautifulSoup's
+``html.parser`` gave for the same pages (``tests/data/imslp`` holds saved
+pages and their expected output): cell texts are their text nodes, stripped
+and joined by spaces, leaving out comments and ``script``/``style`` content.
+
+The crawl runs :func:`parse_works` in worker processes (see ``app.imslp``),
+so this module only imports what parsing needs. The metadata is turned into
+typed columns by ``app.imslp_normalize``.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+import lxml.html
+from lxml import etree
+
+from app.imslp_normalize import normalize
+
+LANDING_PAGE_MARKER = "Special:ImagefromIndex"
+
+_general_information = etree.XPath("(//span[@id='General_Information'])[1]")
+# the first table inside or after the heading, in document order
+_next_table = etree.XPath("(descendant::table | following::table)[1]")
+_texts = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template)]")
+_landing_pages = etree.XPath(f"//a[contains(@href, '{LANDING_PAGE_MARKER}')]/@href")
+_download_ids = etree.XPath("//span[@id='sm_dl_wait']/@data-id")
+# lxml refuses str input with an XML encoding declaration, so pages are given as UTF-8
+_parser = lxml.html.HTMLParser(encoding="utf-8")
+
+
+@dataclass
+class WorkPage:
+    """What the crawl reads from a work page."""
+
+    metadata: dict[str, str] = field(default_factory=dict)
+    pdf_landing_pages: list[str] = field(default_factory=list)
+
+
+def _document(html: str) -> etree._Element | None:
+    try:
+        return lxml.html.document_fromstring(html.encode("utf-8"), parser=_parser)
+    except etree.ParserError:  # nothing but whitespace or comments
+        return None
+
+
+def _text(element: etree._Element) -> str:
+    return " ".join(text for text in (str(t).strip() for t in _texts(element)) if text)
+
+
+def _metadata(root: etree._Element) -> dict[str, str]:
+    headings = _general_information(root)
+    tables = _next_table(headings[0]) if headings else []
+    metadata = {}
+    for row in tables[0].iter("tr") if tables else ():
+        header = row.find(".//th")
+        value = row.find(".//td")
+        if header is not None and value is not None:
+            metadata[_text(header)] = _text(value)
+    return metadata
+
+
+def parse_work_page(html: str) -> WorkPage:
+    """Metadata and download landing pages of a work page, in one parse."""
+    root = _document(html)
+    if root is None:
+        return WorkPage()
+    return WorkPage(
+        metadata=_metadata(root),
+        pdf_landing_pages=[str(href) for href in _landing_pages(root)],
+    )
+
+
+def parse_download_ids(html: str) -> list[str]:
+    """File URLs announced by a download landing page."""
+    root = _document(html)
+    return [] if root is None else [str(url) for url in _download_ids(root)]
+
+
+def metadata_hash(metadata: dict[str, str]) -> str:
+    """Digest of a work's metadata block, which changes when the work is edited."""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+
+def work_fields(i: int, item: dict, html: str) -> dict:
+    """Column values of the IMSLP row of worklist item ``item`` and its work page."""
+    metadata = parse_work_page(html).metadata
+    return {
+        "id": int(i),
+        "title": item["intvals"]["worktitle"],
+        "composer": item["intvals"]["composer"],
+        "permlink": item["permlink"],
+        **normalize(metadata),
+        "score_metadata": json.dumps(metadata),
+        "metadata_hash": metadata_hash(metadata),
+    }
+
+
+def parse_works(chunk: list[tuple[int, dict, str]]) -> list[dict | Exception]:
+    """:func:`work_fields` of each ``(id, item, html)``, or the error it raised.
+
+    One call handles a whole chunk of the crawl's pages, and a page that
+    fails doesn't lose the others of its chunk.
+    """
+    results: list[dict | Exception] = []
+    for i, item, html in chunk:
+        try:
+            results.append(work_fields(i, item, html))
+        except Exception as e:
+            results.append(e)
+    return results
@@ -1,16 +1,27 @@
 """Backend main entry point."""
 
+import asyncio
 import json
 import logging
 import os
 import uuid
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
+from datetime import UTC, datetime
 from logging import getLogger
 from typing import Annotated
 
 import sentry_sdk
-from fastapi import Depends, FastAPI, File, HTTPException, Request, UploadFile
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
@@ -20,9 +31,28 @@ from sqlalchemy import text
 from sqlmodel import Session, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app import config, imslp, users
-from app.agent import Deps, run_agent, run_complete_agent, run_imslp_agent
-from app.credits import consume_credit
+from app import (
+    config,
+    credits,
+    enrichment,
+    http_cache,
+    imslp,
+    recommend,
+    scheduler,
+    similarity,
+    singleflight,
+    usage,
+    users,
+    workload,
+)
+from app.agent import (
+    Deps,
+    get_agent_models,
+    run_agent,
+    run_complete_agent,
+    run_imslp_agent,
+)
+from app.credits import CREDITS_HEADER, consume_credit
 from app.db import get_async_session, get_session
 from app.file_helper import file_helper
 from app.rate_limit import limiter
@@ -61,9 +91,18 @@ class MainAgentRequest(ChatRequest):
 
 
 class ModelsUpdate(BaseModel):
-    """Body for POST /admin/model."""
+    """Body for POST /admin/model.
+
+    ``fallbacks`` maps an agent kind to the ordered list of models to try
+    when its main model is unavailable; an empty list clears the chain.
+    """
+
+    models: dict[str, str] = {}
+    fallbacks: dict[str, list[str]] = {}
 
-    models: dict[str, str]
+
+AGENT_KINDS = ("main", "imslp", "complete", "imslp_complete")
+imslp_agent_flight = singleflight.group("imslp_agent")
 
 
 def configure_logging() -> None:
@@ -86,12 +125,22 @@ async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:  # pragma: no cove
     migrations on a fresh volume.
     """
     configure_logging()
+    sync = asyncio.create_task(imslp.sync_nightly()) if config.IMSLP_SYNC_AT else None
+    sweep = asyncio.create_task(credits.sweep_forever())
     yield
+    if sync is not None:
+        sync.cancel()
+    sweep.cancel()
+    await workload.recorder.flush()
+    await usage.recorder.flush()
+    await imslp.close_http_client()
+    imslp.close_parse_pool()
 
 
 app = FastAPI(lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)  # type: ignore
+app.add_exception_handler(scheduler.QueueFullError, scheduler.queue_full_handler)
 
 app.add_middleware(
     CORSMiddleware,
@@ -99,10 +148,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CREDITS_HEADER],
 )
 
 app.include_router(users.router, tags=["users"])
 app.include_router(imslp.router, tags=["imslp"])
+app.include_router(similarity.router, tags=["imslp"])
+app.include_router(http_cache.router, tags=["imslp"])
+app.include_router(recommend.router, tags=["scores"])
+app.include_router(enrichment.router, tags=["enrichment"])
+app.include_router(enrichment.cache_router, tags=["admin"])
+app.include_router(workload.router, tags=["admin"])
+app.include_router(usage.router, tags=["admin"])
+app.include_router(singleflight.router, tags=["admin"])
+app.include_router(scheduler.router, tags=["agent"])
+app.include_router(scheduler.admin_router, tags=["admin"])
 
 
 @app.get("/health")
@@ -135,17 +195,39 @@ async def complete_score(
     request: Request,
     score: Score,
     current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     session: AsyncSession = Depends(get_async_session),
 ):
     """Complete a score."""
-    setting = await session.get(Setting, "model_complete")
-    model = setting.value if setting else os.getenv("MODEL", "test")
-
-    async with consume_credit(current_user.id, session):
-        try:
-            return await run_complete_agent(score, model)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e)) from e
+    model, fallbacks = await get_agent_models(session, "complete")
+    usage.bind("/complete_score", current_user.id)
+
+    async def run(session: AsyncSession):
+        entry = await enrichment.find_entry(session, score.title, score.composer)
+        if entry is not None and enrichment.is_fresh(entry):
+            return await enrichment.use_entry(session, score, entry)
+        filled, missing = await enrichment.prefill(session, score)
+        if missing == []:  # the catalogue knew everything
+            return filled
+
+        async with (
+            consume_credit(current_user.id, session, response, "/complete_score"),
+            scheduler.slot(model, current_user.id),
+        ):
+            try:
+                completed = await run_complete_agent(filled, model, fallbacks, fields=missing)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e)) from e
+            # on agent errors run_complete_agent hands back the input unchanged
+            if completed is not filled:
+                await enrichment.remember(session, score, completed, model, entry, missing)
+            return completed
+
+    return await scheduler.dispatch(
+        run, session, "/complete_score", current_user.id, model, background_tasks, background
+    )
 
 
 @app.put("/scores/{score_id}")
@@ -199,6 +281,7 @@ def add_play(
     ).first()
     if score is not None:
         score.number_of_plays += 1
+        score.last_played = datetime.now(UTC)
         session.commit()
         session.refresh(score)
     return score
@@ -219,19 +302,42 @@ async def run_imslp_agent_api(
     request: Request,
     body: ChatRequest,
     current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     session: AsyncSession = Depends(get_async_session),
 ):
     """Run the imslp agent."""
-    setting = await session.get(Setting, "model_imslp")
-    model = setting.value if setting else os.getenv("MODEL", "test")
+    model, fallbacks = await get_agent_models(session, "imslp")
+    usage.bind("/imslp_agent", current_user.id)
 
-    async with consume_credit(current_user.id, session):
-        try:
+    # the answer doesn't depend on the caller: identical concurrent prompts
+    # share one run, but every caller is charged (and refunded) on their own
+    key = (body.prompt, json.dumps(body.message_history), model, tuple(fallbacks))
+
+    async def call():
+        async with scheduler.slot(model, current_user.id):
             return await run_imslp_agent(
-                body.prompt, message_history=body.message_history, model=model
+                body.prompt,
+                message_history=body.message_history,
+                model=model,
+                fallbacks=fallbacks,
             )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e)) from e
+
+    async def run(session: AsyncSession):
+        async with consume_credit(current_user.id, session, response, "/imslp_agent"):
+            try:
+                return await imslp_agent_flight.do(key, call, config.SINGLEFLIGHT_AGENT_TIMEOUT)
+            except scheduler.QueueFullError:
+                raise
+            except TimeoutError as e:
+                raise HTTPException(status_code=504, detail="The agent took too long") from e
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e)) from e
+
+    return await scheduler.dispatch(
+        run, session, "/imslp_agent", current_user.id, model, background_tasks, background
+    )
 
 
 @app.post("/agent")
@@ -240,48 +346,55 @@ async def run_main_agent(
     request: Request,
     body: MainAgentRequest,
     current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     session: AsyncSession = Depends(get_async_session),
 ):
     """Run the agent."""
-    setting = await session.get(Setting, "model_main")
-    model = setting.value if setting else os.getenv("MODEL", "test")
-
-    async with consume_credit(current_user.id, session):
-        try:
-            return await run_agent(
-                body.prompt,
-                message_history=body.message_history,
-                deps=Deps(user=current_user, scores=Scores(**json.loads(body.deps))),
-                model=model,
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e)) from e
+    model, fallbacks = await get_agent_models(session, "main")
+    usage.bind("/agent", current_user.id)
+
+    async def run(session: AsyncSession):
+        async with (
+            consume_credit(current_user.id, session, response, "/agent"),
+            scheduler.slot(model, current_user.id),
+        ):
+            try:
+                return await run_agent(
+                    body.prompt,
+                    message_history=body.message_history,
+                    deps=Deps(user=current_user, scores=Scores(**json.loads(body.deps))),
+                    model=model,
+                    fallbacks=fallbacks,
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e)) from e
+
+    return await scheduler.dispatch(
+        run, session, "/agent", current_user.id, model, background_tasks, background
+    )
 
 
 @app.get("/admin/model", dependencies=[Depends(get_admin_user)])
 def get_active_model(session: Session = Depends(get_session)):
-    """Get the currently active agent models."""
-    main_setting = session.get(Setting, "model_main")
-    imslp_setting = session.get(Setting, "model_imslp")
-    complete_setting = session.get(Setting, "model_complete")
-    imslp_complete_setting = session.get(Setting, "model_imslp_complete")
-
-    models = {
-        "main": (main_setting.value if main_setting else os.getenv("MODEL", "test")),
-        "imslp": (imslp_setting.value if imslp_setting else os.getenv("MODEL", "test")),
-        "complete": (complete_setting.value if complete_setting else os.getenv("MODEL", "test")),
-        "imslp_complete": (
-            imslp_complete_setting.value if imslp_complete_setting else os.getenv("MODEL", "test")
-        ),
-    }
-    return {"models": models}
+    """Get the currently active agent models and their fallback chains."""
+    models = {}
+    fallbacks = {}
+    for kind in AGENT_KINDS:
+        setting = session.get(Setting, f"model_{kind}")
+        fallback = session.get(Setting, f"fallback_{kind}")
+        models[kind] = setting.value if setting else os.getenv("MODEL", "test")
+        fallbacks[kind] = json.loads(fallback.value) if fallback else []
+    return {"models": models, "fallbacks": fallbacks}
 
 
 @app.post("/admin/model", dependencies=[Depends(get_admin_user)])
 def set_active_model(body: ModelsUpdate, session: Session = Depends(get_session)):
-    """Set the currently active agent models."""
-    for key, val in body.models.items():
-        setting_key = f"model_{key}"
+    """Set the currently active agent models and fallback chains."""
+    values = {f"model_{key}": val for key, val in body.models.items()}
+    values |= {f"fallback_{key}": json.dumps(val) for key, val in body.fallbacks.items()}
+    for setting_key, val in values.items():
         setting = session.get(Setting, setting_key)
         if setting:
             setting.value = val
@@ -289,7 +402,7 @@ def set_active_model(body: ModelsUpdate, session: Session = Depends(get_session)
             setting = Setting(key=setting_key, value=val)
         session.add(setting)
     session.commit()
-    return {"message": "Models updated", "models": body.models}
+    return {"message": "Models updated", "models": body.models, "fallbacks": body.fallbacks}
 
 
 def get_pdf_user(token: str = "", session: Session = Depends(get_session)):  # pragma: no cover
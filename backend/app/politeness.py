@@ -0,0 +1,168 @@
+"""Adaptive rate limiting of the requests sent to IMSLP.
+
+Every request to IMSLP (worklist pages and work pages through
+``app.http_cache``, PDF landing pages in ``imslp.get_pdfs``) goes through
+:func:`send`, which waits for a token of its host's :class:`HostLimiter`
+first. A limiter is a token bucket (``IMSLP_RATE_BURST`` tokens) refilled at
+a rate it adapts to how the host answers, additive increase / multiplicative
+decrease:
+
+* a 2xx/3xx answered within ``IMSLP_RATE_SLOW_SECONDS`` raises the rate by
+  ``IMSLP_RATE_INCREASE`` requests per second, up to ``IMSLP_RATE_MAX``;
+* a 429, a 5xx or a timeout multiplies it by ``IMSLP_RATE_DECREASE``, down to
+  ``IMSLP_RATE_MIN``, empties the bucket, and, if the response has a
+  ``Retry-After``, holds every request to the host until then. The request is
+  then sent again, up to ``IMSLP_HTTP_RETRIES`` times.
+
+A burst of failures that concurrent requests see together only decreases the
+rate once. Limiters are process-local, like the breakers of
+``app.resilience``; :func:`stats` shows this worker's in ``/imslp/progress``.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean "slow down".
+BACKOFF_STATUS = {429, 500, 502, 503, 504}
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """Seconds the ``Retry-After`` header of ``response`` asks to wait, if any."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """Token bucket of one host, refilled at an AIMD-controlled rate."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.rate = config.IMSLP_RATE
+        self.tokens = float(config.IMSLP_RATE_BURST)
+        self.blocked_until = 0.0  # monotonic time before which nothing is sent
+        self.backoffs = 0
+        self.last_status: int | None = None
+        self._updated = time.monotonic()
+        self._decreased_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        # nothing accrues while the host asked us to hold off
+        elapsed = now - max(self._updated, self.blocked_until)
+        if elapsed > 0:
+            self.tokens = min(config.IMSLP_RATE_BURST, self.tokens + elapsed * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait for a token; waiters are served in turn."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(
+                    max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.0)
+                )
+
+    def record(self, response: httpx.Response | None, elapsed: float) -> bool:
+        """Adapt the rate to a response (``None`` for a timeout); whether to back off."""
+        status = None if response is None else response.status_code
+        self.last_status = status
+        if status is not None and status not in BACKOFF_STATUS:
+            if elapsed < config.IMSLP_RATE_SLOW_SECONDS:
+                self.rate = min(config.IMSLP_RATE_MAX, self.rate + config.IMSLP_RATE_INCREASE)
+            return False
+        now = time.monotonic()
+        self.backoffs += 1
+        self.tokens = 0.0
+        # the failures of requests already in flight belong to the same burst
+        if now - self._decreased_at >= 1 / self.rate:
+            self.rate = max(config.IMSLP_RATE_MIN, self.rate * config.IMSLP_RATE_DECREASE)
+            self._decreased_at = now
+        delay = retry_after(response) if response is not None else None
+        if delay is not None:
+            delay = min(delay, config.IMSLP_RETRY_AFTER_MAX)
+            self.blocked_until = max(self.blocked_until, now + delay)
+        logger.warning(
+            "IMSLP host %s answered %s, slowing down to %.2f requests/s",
+            self.host,
+            status or "with a timeout",
+            self.rate,
+        )
+        return True
+
+    def stats(self) -> dict:
+        """Current rate, tokens and backoff of the host."""
+        return {
+            "rate": round(self.rate, 3),
+            "tokens": round(self.tokens, 3),
+            "backoff_seconds": round(max(self.blocked_until - time.monotonic(), 0.0), 3),
+            "backoffs": self.backoffs,
+            "last_status": self.last_status,
+        }
+
+
+_limiters: dict[str, HostLimiter] = {}
+
+
+def get_limiter(host: str) -> HostLimiter:
+    """The limiter of ``host``, created on first use."""
+    if host not in _limiters:
+        _limiters[host] = HostLimiter(host)
+    return _limiters[host]
+
+
+def reset() -> None:
+    """Forget every host's rate and backoff."""
+    _limiters.clear()
+
+
+def stats() -> dict:
+    """Rate and backoff of every host this worker sent requests to."""
+    return {host: limiter.stats() for host, limiter in _limiters.items()}
+
+
+async def send(
+    method: Callable[..., Awaitable[httpx.Response]], url: str, **kwargs
+) -> httpx.Response:
+    """``method(url, **kwargs)`` (e.g. ``client.get``) at the pace its host allows.
+
+    A response to back off from is sent again after the backoff, up to
+    ``IMSLP_HTTP_RETRIES`` times; the last one is returned (or its timeout
+    raised).
+    """
+    limiter = get_limiter(httpx.URL(url).host)
+    for attempt in range(config.IMSLP_HTTP_RETRIES + 1):
+        await limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = await method(url, **kwargs)
+        except httpx.TimeoutException:
+            limiter.record(None, time.monotonic() - start)
+            if attempt == config.IMSLP_HTTP_RETRIES:
+                raise
+            continue
+        if not limiter.record(response, time.monotonic() - start):
+            break
+    return response
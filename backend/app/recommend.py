@@ -0,0 +1,145 @@
+"""Deterministic "what to play next" recommendations.
+
+Ranks a user's library without a model call. Every score gets four terms in
+[0, 1], computed for the whole library at once with NumPy:
+
+* ``rest``: time since it was last played, half rested after
+  ``RECOMMEND_REST_DAYS``; a score never played is fully rested;
+* ``plays``: ``1 / (1 + log1p(number_of_plays))``, favouring the neglected;
+* ``level``: a Gaussian of the distance between its difficulty and the
+  user's level (the play-weighted mean difficulty of what they played, plus
+  ``RECOMMEND_STRETCH``);
+* ``variety``: one minus the share of the last ``RECOMMEND_RECENT_DAYS``
+  plays that went to its composer and to its period.
+
+The ranking is their weighted sum, spread across composers: a composer's
+n-th score in the ranking is discounted by ``COMPOSER_DECAY ** n``.
+
+``GET /scores/recommendations`` serves it, and the main agent gets it as
+its ``recommend_scores`` tool so it doesn't read the whole library.
+"""
+
+from datetime import UTC, datetime
+from typing import Annotated
+
+import numpy as np
+from fastapi import APIRouter, Depends
+from sqlmodel import Session, select
+
+from app import config
+from app.db import get_session
+from app.users import get_current_user
+from shared.scores import Difficulty, Period, Score
+from shared.user import User
+
+router = APIRouter(prefix="/scores", tags=["scores"])
+
+TERMS = ("rest", "plays", "level", "variety")
+WEIGHTS = np.array([0.35, 0.2, 0.3, 0.15])
+COMPOSER_DECAY = 0.7
+MAX_K = 50
+LEVELS = {difficulty: level for level, difficulty in enumerate(Difficulty)}
+# Terms at least this high are given as reasons for a recommendation.
+REASON_THRESHOLD = 0.7
+REASONS = {
+    "rest": "not played recently",
+    "plays": "rarely played",
+    "level": "matches your level",
+    "variety": "a change of composer or period",
+}
+
+
+def _days_since(scores: list[Score], now: datetime) -> np.ndarray:
+    """Days since each score was last played; ``inf`` when never."""
+    days = np.full(len(scores), np.inf)
+    for i, score in enumerate(scores):
+        if score.last_played is not None:
+            last = score.last_played
+            if last.tzinfo is None:  # SQLite hands back naive datetimes
+                last = last.replace(tzinfo=UTC)
+            days[i] = max((now - last).total_seconds() / 86400, 0)
+    return days
+
+
+def _codes(values: list[str]) -> np.ndarray:
+    """Dense integer codes of ``values``, equal values sharing a code."""
+    return np.unique(np.array(values, dtype=str), return_inverse=True)[1]
+
+
+def _recent_share(values: list[str], recent: np.ndarray) -> np.ndarray:
+    """Share of the recent plays that went to each score's ``values`` group."""
+    codes = _codes(values)
+    counts = np.bincount(codes, weights=recent.astype(float))
+    return counts[codes] / max(recent.sum(), 1)
+
+
+def terms(scores: list[Score], now: datetime | None = None) -> np.ndarray:
+    """``(len(scores), len(TERMS))`` array of the ranking terms."""
+    now = now or datetime.now(UTC)
+    plays = np.array([score.number_of_plays for score in scores], dtype=float)
+    levels = np.array([LEVELS[Difficulty(score.difficulty)] for score in scores], dtype=float)
+    days = _days_since(scores, now)
+
+    rest = 1 - 0.5 ** (days / config.RECOMMEND_REST_DAYS)
+    if plays.any():
+        target = np.average(levels, weights=plays) + config.RECOMMEND_STRETCH
+    else:
+        target = float(np.median(levels))
+    level = np.exp(-0.5 * (levels - target) ** 2)
+    recent = days <= config.RECOMMEND_RECENT_DAYS
+    composers = [score.composer.strip().lower() for score in scores]
+    periods = [Period(score.period).value for score in scores]
+    variety = 1 - 0.5 * (_recent_share(composers, recent) + _recent_share(periods, recent))
+    return np.column_stack([rest, 1 / (1 + np.log1p(plays)), level, variety])
+
+
+def recommend(
+    scores: list[Score], k: int = 10, now: datetime | None = None
+) -> list[tuple[Score, float, dict[str, float]]]:
+    """The ``k`` best scores to play next, with their value and terms."""
+    if not scores:
+        return []
+    values = terms(scores, now)
+    totals = values @ WEIGHTS
+    order = np.argsort(-totals, kind="stable")
+    # how many of the same composer's scores rank above each one
+    composers = _codes([score.composer.strip().lower() for score in scores])[order]
+    by_composer = np.argsort(composers, kind="stable")
+    grouped = composers[by_composer]
+    nth = np.empty(len(order), dtype=int)
+    nth[by_composer] = np.arange(len(order)) - np.searchsorted(grouped, grouped)
+    spread = np.empty(len(order))
+    spread[order] = totals[order] * COMPOSER_DECAY**nth
+    best = np.argsort(-spread, kind="stable")[:k]
+    return [
+        (
+            scores[i],
+            round(float(spread[i]), 4),
+            dict(zip(TERMS, values[i].round(4).tolist(), strict=True)),
+        )
+        for i in best.tolist()
+    ]
+
+
+def reasons(term_values: dict[str, float]) -> list[str]:
+    """Human-readable reasons for a recommendation's terms."""
+    return [REASONS[name] for name, value in term_values.items() if value >= REASON_THRESHOLD]
+
+
+@router.get("/recommendations")
+def get_recommendations(
+    current_user: Annotated[User, Depends(get_current_user)],
+    k: int = 10,
+    session: Session = Depends(get_session),
+):
+    """The ``k`` scores of the user's library to play next, best first."""
+    scores = list(session.exec(select(Score).where(Score.user_id == current_user.id)))
+    return [
+        {
+            **score.model_dump(),
+            "recommendation": value,
+            "terms": term_values,
+            "reasons": reasons(term_values),
+        }
+        for score, value, term_values in recommend(scores, min(max(k, 1), MAX_K))
+    ]
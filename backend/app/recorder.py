@@ -0,0 +1,82 @@
+"""Bounded in-memory buffer of rows, flushed to the database in batches.
+
+Recorders on the request path (the agent SQL workload, LLM usage) must not
+wait on the database: they append to a ring buffer and a background task
+writes the pending rows once ``flush_size`` of them have accumulated. If
+flushing falls behind, the ring buffer drops the oldest entries rather than
+growing without bound. A batch whose write fails goes back to the front of
+the buffer for the next flush; whatever no longer fits is counted in
+``dropped`` like any other overflow.
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+from sqlalchemy.orm import make_transient
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import async_engine
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedRecorder[T: SQLModel]:
+    """Bounded in-memory buffer of ``T`` rows, flushed in one transaction per batch."""
+
+    label = "records"  # what the rows are, for the logs
+
+    def __init__(self, capacity: int, flush_size: int):
+        self.buffer: deque[T] = deque(maxlen=capacity)
+        self.flush_size = flush_size
+        self.dropped = 0
+        self._flush_task: asyncio.Task | None = None
+
+    def _append(self, row: T) -> None:
+        """Buffer one row; schedule a flush once ``flush_size`` rows are pending."""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_size and self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._background_flush())
+
+    async def _background_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("failed to flush %s", self.label)
+        finally:
+            self._flush_task = None
+
+    async def flush(self, session: AsyncSession | None = None) -> int:
+        """Write all buffered rows in one transaction; return how many were written.
+
+        If the write fails, the batch is put back and the error re-raised.
+        """
+        batch = [self.buffer.popleft() for _ in range(len(self.buffer))]
+        if not batch:
+            return 0
+        try:
+            if session is None:
+                async with AsyncSession(async_engine) as own_session:
+                    await self._write(own_session, batch)
+            else:
+                await self._write(session, batch)
+        except BaseException:
+            self._requeue(batch)
+            raise
+        return len(batch)
+
+    def _requeue(self, batch: list[T]) -> None:
+        """Put a failed batch back ahead of the rows recorded since."""
+        room = (self.buffer.maxlen or 0) - len(self.buffer)
+        lost = max(len(batch) - room, 0)
+        self.dropped += lost
+        for row in batch:
+            make_transient(row)  # a failed flush leaves it bound to the dead transaction
+        self.buffer.extendleft(reversed(batch[lost:]))
+
+    async def _write(self, session: AsyncSession, batch: list[T]) -> None:
+        session.add_all(batch)
+        await session.commit()
@@ -0,0 +1,369 @@
+"""Async retries, backoff and circuit breaking for LLM agent calls.
+
+All four agents run their model calls through :func:`call_with_retries`:
+
+* failed calls are retried with exponential backoff and full jitter, using
+  ``asyncio.sleep`` so the event loop keeps serving requests meanwhile;
+* retries are capped by a per-agent :class:`RetryBudget`, so a provider
+  outage can't turn every request into ``attempts`` requests;
+* each model has a :class:`CircuitBreaker` that opens after repeated 429/503
+  responses. While it is open, calls fail immediately with
+  :class:`CircuitOpenError` (a ``ModelHTTPError``), which
+  ``agent._response_for_http_error`` turns into a user-facing message instead
+  of making the user wait out the timeout.
+
+On top of that, :func:`call_with_fallback` walks an ordered chain of models
+(configured per agent kind via ``/admin/model``) when the current one is
+unavailable, and can hedge: if the primary hasn't answered after
+``AGENT_HEDGE_DELAY`` seconds, the same request goes to the next model and
+whichever returns a valid output first wins; the other is cancelled.
+
+Breakers and budgets are process-local, like the rest of the in-memory state
+in this backend (single uvicorn worker).
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, replace
+from functools import partial
+
+from pydantic_ai.exceptions import ModelAPIError, ModelHTTPError
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Statuses that mean "the provider is overloaded": these trip the breaker.
+BREAKER_STATUS = {429, 503}
+
+
+@dataclass
+class RetryPolicy:
+    """How many times, and how patiently, to retry a call."""
+
+    attempts: int
+    base_delay: float
+    max_delay: float
+    retry_unknown: bool = False  # also retry exceptions that aren't model API errors
+
+
+def interactive_policy() -> RetryPolicy:
+    """Policy for user-facing agents: a few quick retries."""
+    return RetryPolicy(
+        attempts=config.AGENT_RETRY_ATTEMPTS,
+        base_delay=config.AGENT_RETRY_BASE_DELAY,
+        max_delay=config.AGENT_RETRY_MAX_DELAY,
+    )
+
+
+def ingest_policy() -> RetryPolicy:
+    """Policy for the IMSLP ingest fixer: patient, retries anything but 4xx."""
+    return RetryPolicy(
+        attempts=config.INGEST_RETRY_ATTEMPTS,
+        base_delay=config.INGEST_RETRY_BASE_DELAY,
+        max_delay=config.INGEST_RETRY_MAX_DELAY,
+        retry_unknown=True,
+    )
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry number."""
+    cap = min(policy.max_delay, policy.base_delay * 2**attempt)
+    return random.uniform(0, cap)
+
+
+def _describe(err: Exception) -> str:
+    """Short label for log lines (provider error bodies can be huge)."""
+    if isinstance(err, ModelHTTPError):
+        return f"HTTP {err.status_code}"
+    return type(err).__name__
+
+
+def is_retryable(err: Exception, policy: RetryPolicy) -> bool:
+    """Whether ``err`` is worth another attempt under ``policy``."""
+    if isinstance(err, CircuitOpenError):
+        return False
+    if isinstance(err, ModelHTTPError):
+        return err.status_code in RETRYABLE_STATUS
+    if isinstance(err, ModelAPIError):
+        return True
+    return policy.retry_unknown
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of first attempts.
+
+    Every first attempt deposits ``ratio`` tokens (up to ``capacity``) and every
+    retry spends one, so sustained failure settles at ``ratio`` retries per call.
+    """
+
+    def __init__(self, ratio: float, capacity: float):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def on_request(self) -> None:
+        """Credit the budget for a first attempt."""
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one retry token if available."""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitOpenError(ModelHTTPError):
+    """Raised without calling the provider while a model's breaker is open."""
+
+    def __init__(self, status_code: int, model_name: str, retry_after: float):
+        super().__init__(status_code, model_name, body={"retry_after": retry_after})
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        return self.__class__, (self.status_code, self.model_name, self.retry_after)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker tripped by consecutive 429/503s.
+
+    Consecutive means with no other outcome in between: a success or any
+    other error (a 400, a 500, a bad output...) shows the provider isn't
+    overloaded and resets the count.
+    """
+
+    def __init__(self, model_name: str, failure_threshold: int, cooldown: float):
+        self.model_name = model_name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_status = 503
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` if calls to this model should be short-circuited."""
+        if self.state == "closed":
+            return
+        remaining = self.opened_at + self.cooldown - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        raise CircuitOpenError(self.last_status, self.model_name, max(remaining, 0.0))
+
+    def record_success(self) -> None:
+        """A call went through: close the breaker."""
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_cancelled(self) -> None:
+        """A call was cancelled: a probe's outcome is unknown, so re-open the breaker."""
+        if self._probe_in_flight:
+            self._probe_in_flight = False
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def record_failure(self, err: Exception) -> None:
+        """Count overload responses; open the breaker past the threshold."""
+        self._probe_in_flight = False
+        if not isinstance(err, ModelHTTPError) or err.status_code not in BREAKER_STATUS:
+            self.failures = 0
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            return
+        self.failures += 1
+        self.last_status = err.status_code
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(
+                    "circuit breaker for model %s opened after status %s",
+                    self.model_name,
+                    err.status_code,
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_budgets: dict[str, RetryBudget] = {}
+
+
+def get_breaker(model_name: str) -> CircuitBreaker:
+    """The breaker for ``model_name``, created on first use."""
+    if model_name not in _breakers:
+        _breakers[model_name] = CircuitBreaker(
+            model_name, config.BREAKER_FAILURE_THRESHOLD, config.BREAKER_COOLDOWN
+        )
+    return _breakers[model_name]
+
+
+def get_budget(kind: str) -> RetryBudget:
+    """The retry budget for agent ``kind``, created on first use."""
+    if kind not in _budgets:
+        _budgets[kind] = RetryBudget(config.RETRY_BUDGET_RATIO, config.RETRY_BUDGET_CAPACITY)
+    return _budgets[kind]
+
+
+def reset() -> None:
+    """Forget all breaker and budget state."""
+    _breakers.clear()
+    _budgets.clear()
+
+
+async def call_with_retries[T](
+    kind: str,
+    model_name: str,
+    call: Callable[[], Awaitable[T]],
+    policy: RetryPolicy | None = None,
+) -> T:
+    """Run ``call`` under ``model_name``'s breaker, retrying per ``policy``."""
+    policy = policy or interactive_policy()
+    breaker = get_breaker(model_name)
+    budget = get_budget(kind)
+    budget.on_request()
+
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # hedge losers, timeouts, client disconnects: don't leave a probe hanging
+            breaker.record_cancelled()
+            raise
+        except Exception as e:
+            breaker.record_failure(e)
+            attempt += 1
+            if (
+                attempt >= policy.attempts
+                or not is_retryable(e, policy)
+                or breaker.state == "open"
+                or not budget.try_spend()
+            ):
+                raise
+            delay = backoff_delay(attempt - 1, policy)
+            logger.warning(
+                "%s agent call to %s failed (%s), retrying in %.2f s (attempt %s / %s)",
+                kind,
+                model_name,
+                _describe(e),
+                delay,
+                attempt,
+                policy.attempts,
+            )
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def can_fall_back(err: Exception) -> bool:
+    """Whether another model might succeed where this one failed."""
+    if isinstance(err, ModelHTTPError):
+        return err.status_code in RETRYABLE_STATUS
+    return isinstance(err, ModelAPIError)
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    """Retrieve a cancelled loser's outcome so asyncio doesn't log it as lost."""
+    if not task.cancelled():
+        task.exception()
+
+
+async def _hedged[T](
+    kind: str,
+    primary: str,
+    secondary: str,
+    call: Callable[[str], Awaitable[T]],
+    policy: RetryPolicy,
+    delay: float,
+) -> T:
+    """Race ``primary`` against ``secondary``, started ``delay`` seconds later."""
+    tasks = [asyncio.create_task(call_with_retries(kind, primary, lambda: call(primary), policy))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done and tasks[0].exception() is None:
+            return tasks[0].result()
+        if done and not can_fall_back(tasks[0].exception()):  # type: ignore[arg-type]
+            raise tasks[0].exception()  # type: ignore[misc]
+        logger.info("%s agent: hedging %s with %s", kind, primary, secondary)
+        tasks.append(
+            asyncio.create_task(call_with_retries(kind, secondary, lambda: call(secondary), policy))
+        )
+        pending = {t for t in tasks if not t.done()}
+        error: BaseException | None = tasks[0].exception() if tasks[0].done() else None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error  # type: ignore[misc]
+    finally:
+        for task in tasks:
+            task.cancel()
+            task.add_done_callback(_discard_result)
+
+
+async def call_with_fallback[T](
+    kind: str,
+    models: list[str],
+    call: Callable[[str], Awaitable[T]],
+    policy: RetryPolicy | None = None,
+) -> T:
+    """Run ``call(model)`` over the ``models`` chain until one succeeds.
+
+    Models before the last one get a single attempt, so an overloaded
+    provider is abandoned right away instead of being retried; the last model
+    gets the full ``policy``. With ``AGENT_HEDGE_DELAY`` > 0 the first two
+    models are raced (see :func:`_hedged`).
+    """
+    policy = policy or interactive_policy()
+    chain = list(dict.fromkeys(m for m in models if m))
+    single = replace(policy, attempts=1)
+
+    start = 0
+    if config.AGENT_HEDGE_DELAY > 0 and len(chain) >= 2:
+        last_pair = len(chain) == 2
+        try:
+            return await _hedged(
+                kind,
+                chain[0],
+                chain[1],
+                call,
+                policy if last_pair else single,
+                config.AGENT_HEDGE_DELAY,
+            )
+        except Exception as e:
+            if last_pair or not can_fall_back(e):
+                raise
+        start = 2
+
+    for i in range(start, len(chain)):
+        model = chain[i]
+        is_last = i == len(chain) - 1
+        try:
+            return await call_with_retries(
+                kind, model, partial(call, model), policy if is_last else single
+            )
+        except Exception as e:
+            if is_last or not can_fall_back(e):
+                raise
+            logger.warning(
+                "%s agent: %s unavailable (%s), falling back to %s",
+                kind,
+                model,
+                _describe(e),
+                chain[i + 1],
+            )
+    raise AssertionError("unreachable: empty model chain")  # pragma: no cover
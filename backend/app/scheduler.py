@@ -0,0 +1,301 @@
+"""Fair, bounded scheduling of agent runs.
+
+Every agent run (``/agent``, ``/imslp_agent``, ``/complete_score`` and the
+batch enrichment) takes a slot in the lane of its model first. A lane runs at
+most ``SCHEDULER_MODEL_CONCURRENCY`` calls at a time; the others wait in one
+FIFO queue per user, and a freed slot goes to the next user in round-robin
+order, so a user with many queued calls (e.g. a batch) doesn't hold the
+others back.
+
+Queues are bounded: past ``SCHEDULER_MAX_QUEUE`` waiting calls in a lane, or
+``SCHEDULER_MAX_USER_QUEUE`` for one user, a call fails at once with
+:class:`QueueFullError`, served as a 503 whose ``Retry-After`` estimates when
+the queue will have drained from the recent run times. The batch enrichment
+bypasses the bounds: it has its own concurrency limit and would rather wait.
+
+The agent endpoints also take ``?background=true``: the call is then queued
+as an :class:`AgentJob` and its id returned at once, to be polled with
+``GET /agent/jobs/{job_id}``. A job is admitted with the same bounds and
+counts in its lane's queue from then on, until it runs or ends without an
+agent call; once admitted it waits in its lane as long as needed. Jobs are
+kept in memory, like the rest of the backend's state (single uvicorn
+worker); only the last ``AGENT_JOBS_KEEP`` finished jobs are kept.
+
+``GET /admin/scheduler`` reports, per lane, the running and queued calls and
+the queue wait times.
+"""
+
+import asyncio
+import logging
+import math
+import statistics
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Annotated, Any
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config
+from app.db import async_engine
+from app.users import get_admin_user, get_current_user
+from shared.user import User
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/agent/jobs", tags=["agent"])
+admin_router = APIRouter(prefix="/admin/scheduler", tags=["admin"])
+
+# Run time assumed for the Retry-After estimate before any run finished.
+DEFAULT_RUN_SECONDS = 10.0
+SAMPLES = 1000
+FINISHED = ("done", "failed")
+
+
+class QueueFullError(Exception):
+    """The lane's queue (or the user's share of it) is full."""
+
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"too many queued calls for {model}")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Lane:
+    """Slots and per-user queues of one model."""
+
+    running: int = 0
+    waiting: OrderedDict[int | None, deque[asyncio.Future[None]]] = field(
+        default_factory=OrderedDict
+    )
+    # background jobs admitted per user, not yet waiting for a slot
+    reserved: Counter[int | None] = field(default_factory=Counter)
+    admitted: int = 0
+    rejected: int = 0
+    max_depth: int = 0
+    waits: deque[float] = field(default_factory=lambda: deque(maxlen=SAMPLES))
+    runs: deque[float] = field(default_factory=lambda: deque(maxlen=SAMPLES))
+
+    @property
+    def depth(self) -> int:
+        """Calls waiting for a slot, admitted background jobs included."""
+        return sum(len(queue) for queue in self.waiting.values()) + self.reserved.total()
+
+    def user_depth(self, user_id: int | None) -> int:
+        """Calls of ``user_id`` waiting for a slot, admitted background jobs included."""
+        return len(self.waiting.get(user_id, ())) + self.reserved[user_id]
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained."""
+        run = statistics.fmean(self.runs) if self.runs else DEFAULT_RUN_SECONDS
+        slots = max(config.SCHEDULER_MODEL_CONCURRENCY, 1)
+        return max(1, math.ceil(run * (self.depth + 1) / slots))
+
+    def stats(self) -> dict[str, Any]:
+        """Counters and wait-time quantiles (seconds) of this lane."""
+        waits = sorted(self.waits)
+        return {
+            "running": self.running,
+            "queued": self.depth,
+            "users_waiting": len(self.waiting),
+            "max_depth": self.max_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_p50": round(waits[len(waits) // 2], 3) if waits else 0,
+            "wait_p95": round(waits[int(len(waits) * 0.95)], 3) if waits else 0,
+            "wait_max": round(waits[-1], 3) if waits else 0,
+        }
+
+
+@dataclass
+class AgentJob:
+    """An agent call run in the background, polled by its owner."""
+
+    id: str
+    user_id: int | None
+    endpoint: str
+    status: str = "queued"
+    result: Any = None
+    error: dict | None = None
+    created_at: float = field(default_factory=time.time)
+    lane: str | None = None  # model whose queue counts the job until it queues or ends
+
+    def snapshot(self) -> dict:
+        """JSON-able status report."""
+        return {
+            "job_id": self.id,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+lanes: dict[str, Lane] = {}
+jobs: OrderedDict[str, AgentJob] = OrderedDict()
+_current_job: ContextVar[AgentJob | None] = ContextVar("agent_job", default=None)
+
+
+def _lane(model: str) -> Lane:
+    if model not in lanes:
+        lanes[model] = Lane()
+    return lanes[model]
+
+
+def check(model: str, user_id: int | None) -> None:
+    """Raise :class:`QueueFullError` if a new call would overflow the queues."""
+    lane = _lane(model)
+    if lane.running < config.SCHEDULER_MODEL_CONCURRENCY and not lane.depth:
+        return
+    if (
+        lane.depth >= config.SCHEDULER_MAX_QUEUE
+        or lane.user_depth(user_id) >= config.SCHEDULER_MAX_USER_QUEUE
+    ):
+        lane.rejected += 1
+        raise QueueFullError(model, lane.retry_after())
+
+
+def _release(job: AgentJob) -> None:
+    """Stop counting ``job`` in the queue it was admitted to."""
+    if job.lane is None:
+        return
+    lane = _lane(job.lane)
+    lane.reserved[job.user_id] -= 1
+    if not lane.reserved[job.user_id]:
+        del lane.reserved[job.user_id]
+    job.lane = None
+
+
+def _dispatch(lane: Lane) -> None:
+    """Hand free slots to the waiting users in turn."""
+    while lane.waiting and lane.running < config.SCHEDULER_MODEL_CONCURRENCY:
+        user_id, queue = next(iter(lane.waiting.items()))
+        waiter = queue.popleft()
+        if queue:
+            lane.waiting.move_to_end(user_id)
+        else:
+            del lane.waiting[user_id]
+        if not waiter.done():
+            waiter.set_result(None)
+            lane.running += 1
+
+
+@asynccontextmanager
+async def slot(model: str, user_id: int | None, bounded: bool = True) -> AsyncIterator[None]:
+    """Hold one of ``model``'s slots, queued fairly behind other users."""
+    lane = _lane(model)
+    job = _current_job.get()
+    if job is None:
+        if bounded:
+            check(model, user_id)
+    else:  # admitted on submission; from here on it is counted as a waiter
+        _release(job)
+    queued_at = time.monotonic()
+    if lane.running < config.SCHEDULER_MODEL_CONCURRENCY and not lane.waiting:
+        lane.running += 1
+    else:
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiting.setdefault(user_id, deque()).append(waiter)
+        lane.max_depth = max(lane.max_depth, lane.depth)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # granted, then cancelled
+                lane.running -= 1
+                _dispatch(lane)
+            elif waiter in lane.waiting.get(user_id, ()):
+                lane.waiting[user_id].remove(waiter)
+                if not lane.waiting[user_id]:
+                    del lane.waiting[user_id]
+            raise
+    started = time.monotonic()
+    lane.admitted += 1
+    lane.waits.append(started - queued_at)
+    if job is not None:
+        job.status = "running"
+    try:
+        yield
+    finally:
+        lane.runs.append(time.monotonic() - started)
+        lane.running -= 1
+        _dispatch(lane)
+
+
+def queue_full_handler(_request: Request, exc: Exception) -> JSONResponse:
+    """Serve :class:`QueueFullError` as a 503 with ``Retry-After``."""
+    assert isinstance(exc, QueueFullError)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The agents are busy, please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _prune_jobs() -> None:
+    """Forget the oldest finished jobs beyond ``AGENT_JOBS_KEEP``."""
+    finished = [job_id for job_id, job in jobs.items() if job.status in FINISHED]
+    for job_id in finished[: max(0, len(jobs) - config.AGENT_JOBS_KEEP)]:
+        del jobs[job_id]
+
+
+async def run_job(job: AgentJob, run: Callable[[AsyncSession], Awaitable[Any]]) -> None:
+    """Run ``job`` with its own DB session and record the outcome."""
+    token = _current_job.set(job)
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        try:
+            job.result = jsonable_encoder(await run(session))
+        except HTTPException as e:
+            job.status = "failed"
+            job.error = {"status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.exception("agent job %s failed", job.id)
+            job.status = "failed"
+            job.error = {"status_code": 500, "detail": str(e)}
+        else:
+            job.status = "done"
+        finally:
+            _release(job)
+            _current_job.reset(token)
+
+
+async def dispatch(
+    run: Callable[[AsyncSession], Awaitable[Any]],
+    session: AsyncSession,
+    endpoint: str,
+    user_id: int | None,
+    model: str,
+    background_tasks: BackgroundTasks,
+    background: bool,
+) -> Any:
+    """Run the endpoint body ``run`` now, or queue it as a job when ``background``."""
+    if not background:
+        return await run(session)
+    check(model, user_id)
+    job = AgentJob(id=uuid.uuid4().hex, user_id=user_id, endpoint=endpoint, lane=model)
+    _lane(model).reserved[user_id] += 1
+    jobs[job.id] = job
+    _prune_jobs()
+    background_tasks.add_task(run_job, job, run)
+    return job.snapshot()
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    """Status, and once done the response, of a background agent call."""
+    job = jobs.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Agent job not found")
+    return job.snapshot()
+
+
+@admin_router.get("", dependencies=[Depends(get_admin_user)])
+def scheduler_report():
+    """Slots, queues and wait times of each model's lane."""
+    return {model: lane.stats() for model, lane in sorted(lanes.items())}
@@ -0,0 +1,425 @@
+"""Local "pieces like this one" index over the IMSLP catalogue.
+
+Every work becomes a sparse vector of hashed features: the words of its
+title, composer, instrumentation, style, key and period (prefixed by the
+field name) plus character trigrams of the title, hashed into
+``SIMILARITY_FEATURES`` buckets. Document vectors are L2-normalized term
+counts; queries are weighted by idf squared, so neighbours are ranked by a
+TF-IDF cosine and adding works only changes the document frequencies, never
+the stored vectors.
+
+The index lives in ``SIMILARITY_INDEX_DIR`` as immutable segments of NumPy
+arrays forming an inverted index (sorted feature ids, posting offsets,
+posting rows and weights). Arrays are opened with ``mmap_mode="r"`` so
+every worker shares one copy through the page cache; the document
+frequencies are summed from the segments' posting counts when the index is
+opened, so adding a segment never rewrites them. The IMSLP ingest appends a
+segment per page; a work indexed again masks its older copy, and past
+``SIMILARITY_MAX_SEGMENTS`` segments are merged into one.
+``manifest.json`` lists the live segments and readers reopen the index when
+it changes.
+
+``GET /imslp/{id}/similar`` scores only the postings of the work's own
+features (``np.bincount`` per segment), so a query stays in the
+milliseconds for catalogues of several hundred thousand works.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import unicodedata
+import zlib
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any
+
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlmodel import Session, col, func, select
+
+from app import config
+from app.db import engine, get_session
+from app.users import get_admin_user
+from shared.scores import IMSLP
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/imslp", tags=["imslp"])
+
+FIELDS = ("title", "composer", "instrumentation", "style", "key", "period")
+# Title trigrams catch "Nocturne" / "Nocturnes" but are many; damp them.
+TRIGRAM_WEIGHT = 0.3
+ARRAYS = ("ids", "features", "offsets", "rows", "weights")
+MAX_K = 100
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def _words(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return _WORD_RE.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode()) % config.SIMILARITY_FEATURES
+
+
+def features(work: Any) -> dict[int, float]:
+    """L2-normalized hashed feature counts of ``work`` (an IMSLP row or alike)."""
+    counts: dict[int, float] = defaultdict(float)
+    for name in FIELDS:
+        value = getattr(work, name, "")
+        value = value.value if isinstance(value, Enum) else value
+        for word in _words(str(value or "")):
+            counts[_bucket(f"{name}:{word}")] += 1
+    title = f" {' '.join(_words(work.title))} "
+    for i in range(len(title) - 2):
+        counts[_bucket(f"#{title[i : i + 3]}")] += TRIGRAM_WEIGHT
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    return {f: c / norm for f, c in counts.items()} if norm else {}
+
+
+@dataclass
+class Segment:
+    """One immutable slice of the index: an inverted index over its works."""
+
+    name: str
+    ids: np.ndarray  # work id per row
+    features: np.ndarray  # sorted feature ids with postings
+    offsets: np.ndarray  # postings of features[i] are offsets[i]:offsets[i + 1]
+    rows: np.ndarray
+    weights: np.ndarray
+    live: np.ndarray = field(default_factory=lambda: np.ones(0, dtype=bool))  # not superseded
+
+
+def build_segment(name: str, works: Iterable[Any]) -> Segment:
+    """Vectorize ``works`` into an in-memory segment."""
+    ids, vectors = [], []
+    for work in works:
+        ids.append(work.id)
+        vectors.append(features(work))
+    sizes = [len(v) for v in vectors]
+    nnz = sum(sizes)
+    feats = np.fromiter((f for v in vectors for f in v), dtype=np.int64, count=nnz)
+    weights = np.fromiter((w for v in vectors for w in v.values()), dtype=np.float32, count=nnz)
+    rows = np.repeat(np.arange(len(vectors), dtype=np.int32), sizes)
+    order = np.argsort(feats, kind="stable")
+    feats = feats[order]
+    unique, starts = np.unique(feats, return_index=True)
+    return Segment(
+        name=name,
+        ids=np.asarray(ids, dtype=np.int64),
+        features=unique,
+        offsets=np.append(starts, nnz).astype(np.int64),
+        rows=rows[order],
+        weights=weights[order],
+    )
+
+
+class SimilarityIndex:
+    """Segmented, memory-mapped TF-IDF index; safe to share between workers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments: list[Segment] = []
+        self.df = np.zeros(0, dtype=np.int32)
+        self.docs = 0
+        self._stamp: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0, "segments": []}
+
+    def refresh(self) -> None:
+        """Reopen the index if another writer (or worker) changed the manifest."""
+        try:
+            stat = os.stat(self._manifest_path)
+            stamp: tuple[int, int] | None = (stat.st_ino, stat.st_mtime_ns)  # replaced, not edited
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp and (stamp is not None or not self.segments):
+            return
+        try:
+            self._open(self._read_manifest())
+        except FileNotFoundError:  # a merge removed segments meanwhile
+            self._open(self._read_manifest())
+        self._stamp = stamp
+
+    def _open(self, manifest: dict) -> None:
+        segments = []
+        for name in manifest["segments"]:
+            arrays = {
+                key: np.load(os.path.join(self.path, name, f"{key}.npy"), mmap_mode="r")
+                for key in ARRAYS
+            }
+            segments.append(Segment(name=name, **arrays))
+        self._set_live(segments)
+        self.df = self._document_frequencies(segments)
+        self.segments = segments
+        self.docs = sum(int(s.live.sum()) for s in segments)
+
+    @staticmethod
+    def _set_live(segments: list[Segment]) -> None:
+        """Mask rows whose work was indexed again in a later segment."""
+        seen = np.zeros(0, dtype=np.int64)
+        for segment in reversed(segments):
+            segment.live = ~np.isin(segment.ids, seen)
+            seen = np.concatenate([seen, np.asarray(segment.ids)])
+
+    @staticmethod
+    def _document_frequencies(segments: list[Segment]) -> np.ndarray:
+        """Postings per feature over ``segments``; superseded rows count until merged."""
+        df = np.zeros(config.SIMILARITY_FEATURES if segments else 0, dtype=np.int32)
+        for segment in segments:
+            df[segment.features] += np.diff(segment.offsets).astype(np.int32)
+        return df
+
+    def _write(self, segments: list[Segment], stale: list[str]) -> None:
+        """Persist new segments, then swap the manifest in atomically."""
+        manifest = self._read_manifest()
+        version = manifest["version"] + 1
+        names = [s.name for s in segments]
+        for segment in segments:
+            target = os.path.join(self.path, segment.name)
+            if segment.name in manifest["segments"]:
+                continue
+            shutil.rmtree(target, ignore_errors=True)  # left over by an interrupted write
+            tmp = f"{target}.tmp"
+            os.makedirs(tmp, exist_ok=True)
+            for key in ARRAYS:
+                np.save(os.path.join(tmp, f"{key}.npy"), getattr(segment, key))
+            os.replace(tmp, target)
+        tmp = f"{self._manifest_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "segments": names}, f)
+        os.replace(tmp, self._manifest_path)
+        # open mappings in other workers survive the unlink
+        for name in stale:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self._stamp = None
+        self.refresh()
+
+    def add(self, works: Iterable[Any]) -> int:
+        """Index ``works`` as a new segment; returns how many were added."""
+        with self._lock:
+            self.refresh()
+            version = self._read_manifest()["version"] + 1
+            segment = build_segment(f"seg-{version:08d}", works)
+            if not len(segment.ids):
+                return 0
+            os.makedirs(self.path, exist_ok=True)
+            self._write([*self.segments, segment], stale=[])
+            self._merge(self._merge_start())
+            return len(segment.ids)
+
+    def _merge_start(self) -> int:
+        """First segment of the tail to merge so sizes stay roughly geometric.
+
+        A segment is merged with the newer ones once it is no bigger than
+        they are together (binary-counter style: O(log n) segments, each work
+        rewritten O(log n) times), and the tail always grows to keep at most
+        ``SIMILARITY_MAX_SEGMENTS`` segments.
+        """
+        sizes = [len(s.ids) for s in self.segments]
+        start = len(sizes) - 1
+        while start > 0 and sizes[start - 1] <= sum(sizes[start:]):
+            start -= 1
+        return min(start, config.SIMILARITY_MAX_SEGMENTS - 1)
+
+    def compact(self) -> None:
+        """Merge all segments into one, dropping superseded rows."""
+        with self._lock:
+            self.refresh()
+            self._merge(0)
+
+    def _merge(self, start: int) -> None:
+        """Merge ``segments[start:]`` into one, dropping their superseded rows."""
+        tail = self.segments[start:]
+        if len(tail) < 2:
+            return
+        ids, feats, rows, weights = [], [], [], []
+        row_offset = 0
+        for segment in tail:
+            new_rows = np.cumsum(segment.live) - 1 + row_offset
+            posting_rows = np.asarray(segment.rows)
+            keep = segment.live[posting_rows]
+            feats.append(np.repeat(np.asarray(segment.features), np.diff(segment.offsets))[keep])
+            rows.append(new_rows[posting_rows][keep])
+            weights.append(np.asarray(segment.weights)[keep])
+            ids.append(np.asarray(segment.ids)[segment.live])
+            row_offset += int(segment.live.sum())
+        all_feats = np.concatenate(feats)
+        order = np.argsort(all_feats, kind="stable")
+        unique, starts = np.unique(all_feats[order], return_index=True)
+        merged = Segment(
+            name=f"seg-{self._read_manifest()['version'] + 1:08d}",
+            ids=np.concatenate(ids),
+            features=unique,
+            offsets=np.append(starts, len(all_feats)).astype(np.int64),
+            rows=np.concatenate(rows).astype(np.int32)[order],
+            weights=np.concatenate(weights)[order],
+        )
+        self._write([*self.segments[:start], merged], stale=[s.name for s in tail])
+
+    def reset(self) -> None:
+        """Drop every segment (e.g. after the IMSLP table was emptied)."""
+        with self._lock:
+            self.refresh()
+            if self.segments:
+                os.makedirs(self.path, exist_ok=True)
+                self._write([], [s.name for s in self.segments])
+
+    def similar(self, work: Any, k: int = 10, budget: int | None = None) -> list[tuple[int, float]]:
+        """``(work_id, similarity)`` of the ``k`` works closest to ``work``.
+
+        Candidates are gathered from the postings of the work's rarest
+        features, up to ``budget`` postings (``SIMILARITY_POSTINGS_BUDGET``);
+        the best of them are then scored exactly on the remaining, common
+        features by binary search in their (row-sorted) postings. Similarity
+        is relative to the work itself (1.0 for an identical one).
+        """
+        self.refresh()
+        query = features(work)
+        if not query or not self.docs:
+            return []
+        qf = np.fromiter(query, dtype=np.int64, count=len(query))
+        tf = np.fromiter(query.values(), dtype=np.float32, count=len(query))
+        df = np.asarray(self.df[qf])
+        idf = np.log((1 + self.docs) / (1 + df)) + 1
+        qw = tf * idf * idf
+        self_score = float(tf @ qw)
+        budget = config.SIMILARITY_POSTINGS_BUDGET if budget is None else budget
+        by_rarity = np.argsort(df, kind="stable")
+        postings = np.cumsum(df[by_rarity])
+        shortlist = max(20 * k, 200)
+        # spend the budget, but read enough postings to fill the shortlist
+        cutoff = max(
+            np.searchsorted(postings, budget, "right"),
+            np.searchsorted(postings, shortlist, "left") + 1,
+        )
+        rare = np.zeros(len(qf), dtype=bool)
+        rare[by_rarity[:cutoff]] = True
+
+        results: list[tuple[int, float]] = []
+        for segment in self.segments:
+            results += self._search_segment(segment, work.id, qf, qw, rare, k, shortlist)
+        return [(i, score / self_score) for i, score in sorted(results, key=lambda r: -r[1])[:k]]
+
+    @staticmethod
+    def _search_segment(
+        segment: Segment,
+        work_id: int,
+        qf: np.ndarray,
+        qw: np.ndarray,
+        rare: np.ndarray,
+        k: int,
+        shortlist: int,
+    ) -> list[tuple[int, float]]:
+        n = len(segment.features)
+        if not n:
+            return []
+        pos = np.minimum(np.searchsorted(segment.features, qf), n - 1)
+        hit = segment.features[pos] == qf
+        starts, ends = segment.offsets[pos], segment.offsets[pos + 1]
+
+        # candidates: accumulate the rare features' postings
+        scores = np.zeros(len(segment.ids))
+        postings = [
+            (segment.rows[s:e], segment.weights[s:e] * w)
+            for s, e, w in zip(starts[hit & rare], ends[hit & rare], qw[hit & rare], strict=True)
+        ]
+        if postings:
+            rows, weights = zip(*postings, strict=True)
+            scores = np.bincount(
+                np.concatenate(rows), weights=np.concatenate(weights), minlength=len(segment.ids)
+            )
+        scores[~segment.live] = 0
+        scores[np.asarray(segment.ids) == work_id] = 0
+        if len(scores) > shortlist:
+            candidates = np.argpartition(-scores, shortlist)[:shortlist]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = np.sort(candidates[scores[candidates] > 0])
+        if not len(candidates):
+            return []
+
+        # exact scores: add the common features found in each candidate
+        exact = scores[candidates]
+        for s, e, w in zip(starts[hit & ~rare], ends[hit & ~rare], qw[hit & ~rare], strict=True):
+            posting_rows = segment.rows[s:e]
+            at = np.minimum(np.searchsorted(posting_rows, candidates), e - s - 1)
+            found = posting_rows[at] == candidates
+            exact[found] += segment.weights[s + at[found]] * w
+        top = np.argsort(-exact, kind="stable")[:k]
+        return [(int(segment.ids[candidates[i]]), float(exact[i])) for i in top]
+
+
+index = SimilarityIndex(config.SIMILARITY_INDEX_DIR)
+
+
+def rebuild(batch_size: int = 10000) -> int:
+    """Re-index the whole ``imslp`` table, ``batch_size`` works per segment."""
+    index.reset()
+    total = 0
+    with Session(engine) as session:
+        last_id = -1
+        while True:
+            query = select(IMSLP).where(col(IMSLP.id) > last_id).order_by(col(IMSLP.id))
+            works = session.exec(query.limit(batch_size)).all()
+            if not works:
+                break
+            total += index.add(works)
+            last_id = works[-1].id
+    index.compact()
+    logger.info("similarity index rebuilt with %d works", total)
+    return total
+
+
+@router.get("/{work_id}/similar")
+def get_similar(work_id: int, k: int = 10, session: Session = Depends(get_session)):
+    """The ``k`` catalogue works most similar to ``work_id``."""
+    work = session.get(IMSLP, work_id)
+    if work is None:
+        raise HTTPException(status_code=404, detail="Work not found")
+    neighbours = index.similar(work, min(max(k, 1), MAX_K))
+    works = {
+        w.id: w
+        for w in session.exec(select(IMSLP).where(col(IMSLP.id).in_([i for i, _ in neighbours])))
+    }
+    return [
+        {**works[i].model_dump(), "similarity": round(score, 4)}
+        for i, score in neighbours
+        if i in works
+    ]
+
+
+@router.post("/similarity/rebuild", dependencies=[Depends(get_admin_user)])
+def rebuild_similarity(background_tasks: BackgroundTasks):
+    """Rebuild the similarity index from the whole catalogue in the background."""
+    background_tasks.add_task(rebuild)
+    return {"message": "Rebuild started"}
+
+
+@router.get("/similarity/stats", dependencies=[Depends(get_admin_user)])
+def similarity_stats(session: Session = Depends(get_session)):
+    """Indexed works and segments, against the catalogue size."""
+    index.refresh()
+    return {
+        "indexed_works": index.docs,
+        "segments": len(index.segments),
+        "catalogue_works": session.exec(select(func.count()).select_from(IMSLP)).one(),
+    }
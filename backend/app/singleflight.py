@@ -0,0 +1,95 @@
+"""Coalescing of identical concurrent calls ("single flight").
+
+A :class:`SingleFlight` group runs one execution per key at a time: callers
+arriving while a call with the same key is in flight wait for it and get its
+result (or its exception) instead of starting their own. Once the call
+finishes the key is forgotten, so nothing is cached past the execution.
+
+The execution runs in its own task, shielded from the callers: a client
+that disconnects doesn't cancel the call the others are waiting on. The
+``timeout`` given by the caller that starts an execution bounds it; when it
+expires every waiter gets ``TimeoutError`` and the key is free again.
+
+Only the work is shared. Each endpoint still authenticates, rate-limits and
+debits (or refunds) its own caller around ``do``.
+
+``GET /admin/singleflight`` reports, per group, the calls made, the
+executions they needed, how many calls were collapsed into another's
+execution and how many executions timed out. Groups are process-local like
+the rest of the in-memory state in this backend (single uvicorn worker).
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from app.users import get_admin_user
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin/singleflight", tags=["admin"])
+
+groups: dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    """Collapses concurrent calls sharing a key into one execution."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight: dict[Hashable, asyncio.Task[Any]] = {}
+        self.calls = 0
+        self.executions = 0
+        self.timeouts = 0
+
+    async def do[T](
+        self, key: Hashable, call: Callable[[], Awaitable[T]], timeout: float | None = None
+    ) -> T:
+        """Await ``call()``, or the execution already in flight for ``key``."""
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(self._execute(key, call, timeout))
+            # nobody may be left to retrieve the exception if every caller left
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.in_flight[key] = task
+        return await asyncio.shield(task)
+
+    async def _execute[T](
+        self, key: Hashable, call: Callable[[], Awaitable[T]], timeout: float | None
+    ) -> T:
+        try:
+            return await asyncio.wait_for(call(), timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            logger.warning("%s call timed out after %ss", self.name, timeout)
+            raise
+        finally:
+            del self.in_flight[key]
+
+    def stats(self) -> dict[str, int]:
+        """Counters of this group."""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "collapsed": self.calls - self.executions,
+            "timeouts": self.timeouts,
+            "in_flight": len(self.in_flight),
+        }
+
+
+def group(name: str) -> SingleFlight:
+    """The group called ``name``, created on first use."""
+    if name not in groups:
+        groups[name] = SingleFlight(name)
+    return groups[name]
+
+
+@router.get("", dependencies=[Depends(get_admin_user)])
+def singleflight_report():
+    """Calls, executions and collapsed calls of each group."""
+    return {name: flight.stats() for name, flight in sorted(groups.items())}
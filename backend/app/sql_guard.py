@@ -0,0 +1,201 @@
+"""EXPLAIN-based cost guard for agent-generated SQL.
+
+The imslp and main agents send model-written SQL to the postgres MCP server.
+Before a query is forwarded, we ask the planner for an estimate with
+``EXPLAIN (FORMAT JSON)`` (never ``ANALYZE``, so nothing is executed) and:
+
+* reject plans whose total cost exceeds ``SQL_GUARD_MAX_COST`` with a
+  ``ModelRetry`` carrying a structured "query too expensive" payload, so the
+  model narrows the query and tries again;
+* rewrite plain ``SELECT``s returning more than ``SQL_GUARD_MAX_ROWS`` rows
+  by wrapping them in an outer ``LIMIT`` (and tell the model its rows were
+  capped), and reject other statements that wide, which can't be wrapped;
+* allow everything else unchanged.
+
+Every decision is logged with the estimate so the thresholds can be tuned,
+and every guarded statement is handed to the workload recorder.
+
+The guard only runs against Postgres; on other dialects (SQLite dev loop,
+tests) and when EXPLAIN itself fails, queries pass through untouched and the
+MCP server's restricted mode stays the line of defense. Failing open on
+Postgres is logged as a warning.
+"""
+
+import json
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from pydantic_ai import RunContext
+from pydantic_ai.exceptions import ModelRetry
+from pydantic_ai.mcp import CallToolFunc, ToolResult
+
+from app import config, workload
+from app.db import async_engine
+
+logger = logging.getLogger(__name__)
+
+# SQL-running tools exposed by crystaldba/postgres-mcp and the reference
+# postgres MCP server; both take the statement in a ``sql`` argument.
+GUARDED_TOOLS = {"execute_sql", "query"}
+# A single SELECT, which can be wrapped as a subquery; WITH (possibly around
+# DML), several statements, etc. can't.
+_PLAIN_SELECT_RE = re.compile(r"\(*\s*select\b", re.IGNORECASE)
+
+
+@dataclass
+class PlanEstimate:
+    """Planner estimate for the top node of a query plan."""
+
+    total_cost: float
+    plan_rows: float
+    node_type: str
+
+
+@dataclass
+class GuardDecision:
+    """Outcome of checking one query against the thresholds."""
+
+    action: str  # "allow", "rewrite" or "reject"
+    sql: str
+    estimate: PlanEstimate | None
+    reason: str = ""
+
+    def error_payload(self) -> str:
+        """Structured error returned to the model when the query is rejected."""
+        assert self.estimate is not None
+        return json.dumps(
+            {
+                "error": "query_too_expensive",
+                "reason": self.reason,
+                "estimated_cost": self.estimate.total_cost,
+                "estimated_rows": self.estimate.plan_rows,
+                "max_cost": config.SQL_GUARD_MAX_COST,
+                "max_rows": config.SQL_GUARD_MAX_ROWS,
+                "hint": (
+                    "Narrow the query: filter on selective columns, avoid leading-wildcard "
+                    "LIKE patterns and cross joins, and add a LIMIT."
+                ),
+            }
+        )
+
+
+def _clean(sql: str) -> str:
+    """Strip whitespace and trailing semicolons so the query can be wrapped."""
+    return sql.strip().rstrip(";").strip()
+
+
+def _is_plain_select(sql: str) -> bool:
+    return _PLAIN_SELECT_RE.match(sql) is not None and ";" not in sql
+
+
+def parse_plan(raw: Any) -> PlanEstimate:
+    """Extract the top-node estimate from ``EXPLAIN (FORMAT JSON)`` output."""
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    plan = raw[0]["Plan"]
+    return PlanEstimate(
+        total_cost=float(plan["Total Cost"]),
+        plan_rows=float(plan["Plan Rows"]),
+        node_type=str(plan["Node Type"]),
+    )
+
+
+async def explain(sql: str) -> PlanEstimate | None:
+    """Return the planner estimate for ``sql``, or None when unavailable."""
+    if async_engine.dialect.name != "postgresql":
+        return None
+    try:
+        async with async_engine.connect() as conn:
+            await conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+            await conn.exec_driver_sql(
+                f"SET LOCAL statement_timeout = {int(config.SQL_GUARD_EXPLAIN_TIMEOUT_MS)}"
+            )
+            result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+            raw = result.scalar_one()
+            await conn.rollback()
+        return parse_plan(raw)
+    except Exception:
+        logger.warning("sql guard: EXPLAIN failed, letting query through", exc_info=True)
+        return None
+
+
+def decide(sql: str, estimate: PlanEstimate | None) -> GuardDecision:
+    """Apply the configured thresholds to a plan estimate."""
+    if estimate is None:
+        return GuardDecision("allow", sql, None, "no plan")
+    if estimate.total_cost > config.SQL_GUARD_MAX_COST:
+        return GuardDecision("reject", sql, estimate, "estimated cost above threshold")
+    if estimate.plan_rows > config.SQL_GUARD_MAX_ROWS:
+        if not _is_plain_select(sql):
+            return GuardDecision(
+                "reject", sql, estimate, "estimated rows above threshold, not a plain SELECT"
+            )
+        # the newline ends a trailing ``--`` comment before the closing parenthesis
+        limited = f"SELECT * FROM (\n{sql}\n) AS guarded LIMIT {config.SQL_GUARD_ROW_LIMIT}"
+        return GuardDecision("rewrite", limited, estimate, "estimated rows above threshold")
+    return GuardDecision("allow", sql, estimate)
+
+
+async def check_query(sql: str) -> GuardDecision:
+    """Explain ``sql``, decide what to do with it and log the decision."""
+    sql = _clean(sql)
+    estimate = await explain(sql)
+    decision = decide(sql, estimate)
+    failed_open = estimate is None and async_engine.dialect.name == "postgresql"
+    logger.log(
+        logging.WARNING if failed_open else logging.INFO,
+        "sql guard decision=%s reason=%r cost=%s rows=%s node=%s sql=%r",
+        decision.action,
+        decision.reason,
+        estimate.total_cost if estimate else None,
+        estimate.plan_rows if estimate else None,
+        estimate.node_type if estimate else None,
+        sql,
+    )
+    return decision
+
+
+def _capped(result: ToolResult, estimate: PlanEstimate) -> dict[str, Any]:
+    """``result`` of a rewritten query, with a note that its rows were capped."""
+    return {
+        "rows": result,
+        "note": (
+            f"Only the first {config.SQL_GUARD_ROW_LIMIT} rows were returned (SQL guard limit);"
+            f" the query was estimated to return {estimate.plan_rows:.0f} rows. Filter or"
+            " aggregate it to see the rest."
+        ),
+    }
+
+
+async def guard_tool_call(
+    ctx: RunContext[Any], call_tool: CallToolFunc, name: str, tool_args: dict[str, Any]
+) -> ToolResult:
+    """``process_tool_call`` hook for the postgres MCP server."""
+    sql = tool_args.get("sql") if name in GUARDED_TOOLS else None
+    if not isinstance(sql, str):
+        return await call_tool(name, tool_args, None)
+
+    decision = await check_query(sql)
+    if decision.action == "reject":
+        workload.recorder.record(decision.sql, 0.0, None, decision.action, decision.estimate)
+        raise ModelRetry(decision.error_payload())
+
+    start = time.perf_counter()
+    try:
+        result = await call_tool(name, {**tool_args, "sql": decision.sql}, None)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    workload.recorder.record(
+        decision.sql,
+        elapsed_ms,
+        workload.row_count(result),
+        decision.action,
+        decision.estimate,
+    )
+    if decision.action == "rewrite":
+        assert decision.estimate is not None
+        return _capped(result, decision.estimate)
+    return result
@@ -0,0 +1,223 @@
+"""Per-call LLM usage and latency accounting.
+
+Every model call made by the agents goes through :func:`track`, which times
+it and captures ``res.usage()`` (requests, input/output tokens, tool calls)
+together with the model name and the endpoint / user bound to the current
+request by :func:`bind`. Records are buffered in memory (see
+``app.recorder``) and flushed in batches to ``agent_usage``; each flush also
+folds the batch into the ``agent_usage_daily`` rollups (per day, model and
+endpoint, with a fixed-bucket latency histogram).
+
+``GET /admin/usage`` reads only the rollups, so the report stays cheap no
+matter how many raw rows accumulate.
+"""
+
+import bisect
+import json
+import time
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from datetime import UTC, date, datetime, timedelta
+
+from fastapi import APIRouter, Depends
+from pydantic_ai.usage import RunUsage
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config
+from app.db import get_async_session
+from app.recorder import BufferedRecorder
+from app.users import get_admin_user
+from shared.usage import AgentUsage, AgentUsageDaily
+
+router = APIRouter(prefix="/admin/usage", tags=["admin"])
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000)
+# Columns of ``agent_usage_daily`` a flush adds its calls' totals to.
+ROLLUP_COUNTERS = ("calls", "errors", "input_tokens", "output_tokens", "tool_calls", "total_ms")
+
+# (endpoint, user_id) of the request being served; agents called outside a
+# request (e.g. the IMSLP ingest) are recorded under their agent kind.
+_call_context: ContextVar[tuple[str, int | None] | None] = ContextVar(
+    "usage_call_context", default=None
+)
+
+
+def bind(endpoint: str, user_id: int | None) -> None:
+    """Attribute agent calls made while serving this request to ``endpoint`` / ``user_id``."""
+    _call_context.set((endpoint, user_id))
+
+
+def bucket_index(latency_ms: float) -> int:
+    """Index of the histogram bucket holding ``latency_ms``."""
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def percentile(histogram: list[int], q: float) -> float | None:
+    """Approximate ``q``-th percentile (0-1) from bucket counts.
+
+    Interpolates linearly inside the bucket; the open last bucket reports its
+    lower bound.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            low = LATENCY_BUCKETS_MS[i - 1] if i else 0
+            if i >= len(LATENCY_BUCKETS_MS):
+                return float(low)
+            return low + (LATENCY_BUCKETS_MS[i] - low) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BUCKETS_MS[-1])  # pragma: no cover
+
+
+def _merge_histograms(a: list[int], b: list[int]) -> list[int]:
+    size = max(len(a), len(b))
+    return [(a[i] if i < len(a) else 0) + (b[i] if i < len(b) else 0) for i in range(size)]
+
+
+class UsageRecorder(BufferedRecorder[AgentUsage]):
+    """Bounded in-memory buffer of agent calls, flushed to ``agent_usage``."""
+
+    label = "agent usage"
+
+    def record(
+        self,
+        kind: str,
+        model: str,
+        latency_ms: float,
+        run_usage: RunUsage | None = None,
+        status: str = "ok",
+    ) -> None:
+        """Buffer one call; schedule a flush once ``flush_size`` entries are pending."""
+        endpoint, user_id = _call_context.get() or (kind, None)
+        run_usage = run_usage or RunUsage()
+        self._append(
+            AgentUsage(
+                kind=kind,
+                endpoint=endpoint,
+                model=model,
+                user_id=user_id,
+                status=status,
+                latency_ms=latency_ms,
+                requests=run_usage.requests,
+                input_tokens=run_usage.input_tokens,
+                output_tokens=run_usage.output_tokens,
+                tool_calls=run_usage.tool_calls,
+            )
+        )
+
+    async def _write(self, session: AsyncSession, batch: list[AgentUsage]) -> None:
+        """Insert the calls and fold them into their daily rollups, in one transaction."""
+        groups: dict[tuple[date, str, str], dict] = {}
+        histograms: dict[tuple[date, str, str], list[int]] = {}
+        for call in batch:
+            key = (call.created_at.astimezone(UTC).date(), call.model, call.endpoint)
+            if key not in groups:
+                groups[key] = dict.fromkeys(ROLLUP_COUNTERS, 0)
+                histograms[key] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            counters = groups[key]
+            counters["calls"] += 1
+            counters["errors"] += call.status != "ok"
+            counters["input_tokens"] += call.input_tokens
+            counters["output_tokens"] += call.output_tokens
+            counters["tool_calls"] += call.tool_calls
+            counters["total_ms"] += call.latency_ms
+            histograms[key][bucket_index(call.latency_ms)] += 1
+
+        session.add_all(batch)
+        daily = AgentUsageDaily.__table__.c  # type: ignore[attr-defined]
+        for (day, model, endpoint), counters in groups.items():
+            # the upsert adds to the counters in the database, and holds the
+            # row until the commit, so merging the histogram after it loses
+            # nothing to a concurrent flush
+            stmt = insert(AgentUsageDaily).values(
+                day=day, model=model, endpoint=endpoint, latency_histogram="[]", **counters
+            )
+            await session.exec(
+                stmt.on_conflict_do_update(
+                    index_elements=["day", "model", "endpoint"],
+                    set_={name: daily[name] + stmt.excluded[name] for name in ROLLUP_COUNTERS},
+                )
+            )
+            row = (daily.day == day) & (daily.model == model) & (daily.endpoint == endpoint)
+            stored = (await session.exec(select(daily.latency_histogram).where(row))).one()
+            histogram = _merge_histograms(json.loads(stored), histograms[(day, model, endpoint)])
+            await session.exec(
+                update(AgentUsageDaily).where(row).values(latency_histogram=json.dumps(histogram))
+            )
+        await session.commit()
+
+
+recorder = UsageRecorder(config.USAGE_BUFFER_SIZE, config.USAGE_FLUSH_SIZE)
+
+
+async def track[T](kind: str, model: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Run one agent call, recording its wall time and ``usage()`` (errors too)."""
+    start = time.perf_counter()
+    try:
+        result = await call()
+    except Exception:
+        recorder.record(kind, model, (time.perf_counter() - start) * 1000, status="error")
+        raise
+    run_usage = getattr(result, "usage", None)
+    run_usage = run_usage() if callable(run_usage) else None
+    recorder.record(
+        kind,
+        model,
+        (time.perf_counter() - start) * 1000,
+        run_usage if isinstance(run_usage, RunUsage) else None,
+    )
+    return result
+
+
+@router.get("", dependencies=[Depends(get_admin_user)])
+async def usage_report(
+    days: int = 7,
+    model: str | None = None,
+    endpoint: str | None = None,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Latency percentiles and token totals per model / endpoint / day."""
+    await recorder.flush(session)
+    since = datetime.now(UTC).date() - timedelta(days=days - 1)
+    query = select(AgentUsageDaily).where(AgentUsageDaily.day >= since)
+    if model:
+        query = query.where(AgentUsageDaily.model == model)
+    if endpoint:
+        query = query.where(AgentUsageDaily.endpoint == endpoint)
+    rollups = (
+        await session.exec(
+            query.order_by(
+                AgentUsageDaily.day.desc(),  # type: ignore[attr-defined]
+                AgentUsageDaily.model,
+                AgentUsageDaily.endpoint,
+            )
+        )
+    ).all()
+
+    rows = []
+    for rollup in rollups:
+        histogram = json.loads(rollup.latency_histogram)
+        rows.append(
+            {
+                "day": rollup.day.isoformat(),
+                "model": rollup.model,
+                "endpoint": rollup.endpoint,
+                "calls": rollup.calls,
+                "errors": rollup.errors,
+                "input_tokens": rollup.input_tokens,
+                "output_tokens": rollup.output_tokens,
+                "tool_calls": rollup.tool_calls,
+                "mean_ms": rollup.total_ms / rollup.calls if rollup.calls else None,
+                "p50_ms": percentile(histogram, 0.5),
+                "p95_ms": percentile(histogram, 0.95),
+            }
+        )
+    return {"rows": rows, "buffered": len(recorder.buffer), "dropped": recorder.dropped}
@@ -11,10 +11,11 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError
 from pwdlib import PasswordHash
 from pydantic import BaseModel
-from sqlmodel import Session, func, select
+from sqlmodel import Session, col, func, select
 
 from app.db import get_session
 from app.rate_limit import limiter
+from shared.credits import CreditLedger
 from shared.scores import Score
 from shared.user import User
 
@@ -287,6 +288,14 @@ def refill_user_credits(
     if not user_to_update:
         raise HTTPException(status_code=404, detail="User not found")
 
+    session.add(
+        CreditLedger(
+            user_id=user_id,
+            delta=user_to_update.max_credits - user_to_update.credits,
+            balance=user_to_update.max_credits,
+            reason="refill",
+        )
+    )
     user_to_update.credits = user_to_update.max_credits
     session.add(user_to_update)
     session.commit()
@@ -294,6 +303,27 @@ def refill_user_credits(
     return user_to_update
 
 
+@router.get("/users/{user_id}/credit_ledger")
+def get_credit_ledger(
+    user_id: int,
+    current_user: Annotated[User | None, Depends(get_admin_user)],
+    limit: int = 100,
+    session: Session = Depends(get_session),
+):
+    """Latest credit movements of a user, newest first (admin only)."""
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have permission to perform this action.",
+        )
+    return session.exec(
+        select(CreditLedger)
+        .where(CreditLedger.user_id == user_id)
+        .order_by(col(CreditLedger.id).desc())
+        .limit(limit)
+    ).all()
+
+
 @router.delete("/user")
 def delete_account(
     current_user: Annotated[User, Depends(get_current_user)],
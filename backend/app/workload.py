@@ -0,0 +1,334 @@
+"""Workload recorder and index advisor for agent-generated SQL.
+
+Every statement the agents send through the postgres MCP server is recorded
+(see ``sql_guard.guard_tool_call``) into an in-memory ring buffer, which is
+flushed in batches to the ``agent_query`` table (see ``app.recorder``).
+
+``GET /admin/workload`` reports the top fingerprints by total time and
+suggests indexes for predicate columns that aren't indexed yet. The module is
+also a CLI for replaying the recorded workload against another database::
+
+    python -m app.workload replay --target-url postgresql://localhost/app -o before.json
+    # ... apply a migration / create an index ...
+    python -m app.workload replay --target-url postgresql://localhost/app -o after.json
+    python -m app.workload compare before.json after.json
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import re
+import statistics
+import sys
+import time
+from typing import Any
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import create_engine, func, inspect
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import config
+from app.db import DATABASE_URL, get_async_session
+from app.recorder import BufferedRecorder
+from app.users import get_admin_user
+from shared.workload import AgentQuery
+
+router = APIRouter(prefix="/admin/workload", tags=["admin"])
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+(?:public\.)?\"?(\w+)\"?(?:\s+(?:as\s+)?(\w+))?", re.I)
+_PREDICATE_RE = re.compile(
+    r"\b(?:where|and|or|on)\s+(?:lower\(\s*)?(?:(\w+)\.)?(\w+)\s*\)?\s*"
+    r"(=|<>|!=|<=|>=|<|>|not\s+like|like|not\s+ilike|ilike|in|between|is)\s*('[^']*')?",
+    re.I,
+)
+_SQL_KEYWORDS = {"where", "and", "or", "on", "not", "select", "join", "inner", "left", "right"}
+
+
+def normalize(sql: str) -> str:
+    """Replace literals with ``?`` and collapse whitespace so similar queries match."""
+    out = _STRING_RE.sub("?", sql.strip().rstrip(";"))
+    out = _NUMBER_RE.sub("?", out)
+    out = _IN_LIST_RE.sub("(?)", out)
+    return _SPACE_RE.sub(" ", out).strip().lower()
+
+
+def fingerprint(sql: str) -> str:
+    """Stable short hash of the normalized statement."""
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+def row_count(result: Any) -> int | None:
+    """Best-effort row count from an MCP tool result.
+
+    postgres-mcp returns rows as the ``str()`` of a list of dicts, other
+    servers return JSON; anything we can't parse into a list is ``None``.
+    """
+    if isinstance(result, list):
+        return len(result)
+    if not isinstance(result, str):
+        return None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            parsed = parse(result)
+        except Exception:
+            continue
+        if isinstance(parsed, list):
+            return len(parsed)
+    return None
+
+
+class WorkloadRecorder(BufferedRecorder[AgentQuery]):
+    """Bounded in-memory buffer of agent queries, flushed to ``agent_query``."""
+
+    label = "agent query workload"
+
+    def record(
+        self,
+        sql: str,
+        latency_ms: float,
+        rows: int | None,
+        decision: str = "allow",
+        estimate: Any = None,
+    ) -> None:
+        """Buffer one query; schedule a flush once ``flush_size`` entries are pending."""
+        self._append(
+            AgentQuery(
+                fingerprint=fingerprint(sql),
+                normalized=normalize(sql),
+                sql=sql,
+                decision=decision,
+                latency_ms=latency_ms,
+                row_count=rows,
+                plan_node=estimate.node_type if estimate else "",
+                plan_cost=estimate.total_cost if estimate else None,
+                plan_rows=estimate.plan_rows if estimate else None,
+            )
+        )
+
+
+recorder = WorkloadRecorder(config.WORKLOAD_BUFFER_SIZE, config.WORKLOAD_FLUSH_SIZE)
+
+
+def predicate_columns(sql: str) -> set[tuple[str, str, str]]:
+    """Return ``(table, column, kind)`` for predicates in ``sql``.
+
+    ``kind`` is ``"trgm"`` for ``LIKE``/``ILIKE`` with a leading wildcard (only
+    a trigram index helps) and ``"btree"`` otherwise. Columns are resolved to
+    tables through aliases; unqualified columns go to the first table.
+    """
+    tables = _TABLE_RE.findall(sql)
+    if not tables:
+        return set()
+    aliases = {table.lower(): table.lower() for table, _ in tables}
+    for table, alias in tables:
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+    default_table = tables[0][0].lower()
+
+    found = set()
+    for qualifier, column, operator, literal in _PREDICATE_RE.findall(sql):
+        if column.lower() in _SQL_KEYWORDS:
+            continue
+        table = aliases.get(qualifier.lower(), default_table) if qualifier else default_table
+        operator = operator.lower()
+        leading_wildcard = literal.startswith("'%")
+        kind = "trgm" if "like" in operator and leading_wildcard else "btree"
+        found.add((table, column.lower(), kind))
+    return found
+
+
+def _existing_indexes(sync_conn) -> dict[str, set[str]]:
+    """Leading column of every existing index (and primary key) per known table."""
+    inspector = inspect(sync_conn)
+    indexed: dict[str, set[str]] = {}
+    for table in SQLModel.metadata.tables:
+        if not inspector.has_table(table):
+            continue
+        columns = set(inspector.get_pk_constraint(table).get("constrained_columns") or [])
+        for index in inspector.get_indexes(table):
+            if index["column_names"] and index["column_names"][0]:
+                columns.add(index["column_names"][0])
+        indexed[table] = columns
+    return indexed
+
+
+def suggest_indexes(samples: list[str], indexed: dict[str, set[str]]) -> list[dict]:
+    """Suggest ``CREATE INDEX`` statements for unindexed predicate columns."""
+    suggestions: dict[tuple[str, str, str], dict] = {}
+    for sql in samples:
+        for table, column, kind in predicate_columns(sql):
+            known = SQLModel.metadata.tables.get(table)
+            if known is None or column not in known.columns:
+                continue
+            if kind == "btree" and column in indexed.get(table, set()):
+                continue
+            key = (table, column, kind)
+            if key in suggestions:
+                suggestions[key]["queries"] += 1
+                continue
+            if kind == "trgm":
+                statement = (
+                    f"CREATE INDEX CONCURRENTLY ix_{table}_{column}_trgm "
+                    f"ON {table} USING gin ({column} gin_trgm_ops)"
+                )
+            else:
+                statement = f"CREATE INDEX CONCURRENTLY ix_{table}_{column} ON {table} ({column})"
+            suggestions[key] = {
+                "table": table,
+                "column": column,
+                "kind": kind,
+                "statement": statement,
+                "queries": 1,
+            }
+    return sorted(suggestions.values(), key=lambda s: -s["queries"])
+
+
+@router.get("", dependencies=[Depends(get_admin_user)])
+async def workload_report(
+    limit: int = 20,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Top query fingerprints by total time, plus index suggestions."""
+    await recorder.flush(session)
+    total_ms = func.sum(AgentQuery.latency_ms)
+    rows = (
+        await session.exec(
+            select(  # type: ignore[call-overload]
+                AgentQuery.fingerprint,
+                func.count(),
+                total_ms,
+                func.avg(AgentQuery.latency_ms),
+                func.max(AgentQuery.latency_ms),
+                func.avg(AgentQuery.row_count),
+                func.max(AgentQuery.normalized),
+                func.max(AgentQuery.sql),
+            )
+            .group_by(AgentQuery.fingerprint)
+            .order_by(total_ms.desc())
+            .limit(limit)
+        )
+    ).all()
+    top = [
+        {
+            "fingerprint": fp,
+            "calls": calls,
+            "total_ms": total,
+            "mean_ms": mean,
+            "max_ms": worst,
+            "mean_rows": mean_rows,
+            "normalized": normalized,
+            "sample": sample,
+        }
+        for fp, calls, total, mean, worst, mean_rows, normalized, sample in rows
+    ]
+    indexed = await (await session.connection()).run_sync(_existing_indexes)
+    return {
+        "top": top,
+        "suggested_indexes": suggest_indexes([t["sample"] for t in top], indexed),
+        "buffered": len(recorder.buffer),
+        "dropped": recorder.dropped,
+    }
+
+
+def replay(source_url: str, target_url: str, limit: int, repeat: int) -> dict[str, dict]:
+    """Run each recorded fingerprint's sample query against ``target_url``.
+
+    Each query runs ``repeat`` times in a rolled-back transaction; the median
+    wall time per fingerprint is returned.
+    """
+    source = create_engine(source_url)
+    with source.connect() as conn:
+        samples = conn.execute(
+            select(AgentQuery.fingerprint, func.max(AgentQuery.sql))  # type: ignore[call-overload]
+            .where(AgentQuery.decision != "reject")
+            .group_by(AgentQuery.fingerprint)
+            .order_by(func.sum(AgentQuery.latency_ms).desc())
+            .limit(limit)
+        ).all()
+    source.dispose()
+
+    target = create_engine(target_url)
+    timings: dict[str, dict] = {}
+    with target.connect() as conn:
+        for fp, sql in samples:
+            runs = []
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    conn.exec_driver_sql(sql).fetchall()
+                    runs.append((time.perf_counter() - start) * 1000)
+                    conn.rollback()
+            except Exception as e:
+                conn.rollback()
+                timings[fp] = {"sql": sql, "error": str(e)}
+                continue
+            timings[fp] = {"sql": sql, "median_ms": statistics.median(runs)}
+    target.dispose()
+    return timings
+
+
+def compare(before: dict[str, dict], after: dict[str, dict]) -> list[dict]:
+    """Per-fingerprint timing deltas between two replay runs, worst regression first."""
+    rows = []
+    for fp, old in before.items():
+        new = after.get(fp)
+        if new is None or "median_ms" not in old or "median_ms" not in new:
+            continue
+        rows.append(
+            {
+                "fingerprint": fp,
+                "before_ms": old["median_ms"],
+                "after_ms": new["median_ms"],
+                "delta_ms": new["median_ms"] - old["median_ms"],
+                "sql": old["sql"],
+            }
+        )
+    return sorted(rows, key=lambda r: -r["delta_ms"])
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point for ``python -m app.workload``."""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.workload", description="Replay recorded agent SQL."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    replay_cmd = sub.add_parser("replay", help="replay recorded queries and time them")
+    replay_cmd.add_argument("--source-url", default=DATABASE_URL)
+    replay_cmd.add_argument("--target-url", required=True)
+    replay_cmd.add_argument("--limit", type=int, default=50)
+    replay_cmd.add_argument("--repeat", type=int, default=3)
+    replay_cmd.add_argument("-o", "--output", required=True)
+
+    compare_cmd = sub.add_parser("compare", help="compare two replay outputs")
+    compare_cmd.add_argument("before")
+    compare_cmd.add_argument("after")
+
+    args = parser.parse_args(argv)
+    if args.command == "replay":
+        timings = replay(args.source_url, args.target_url, args.limit, args.repeat)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(timings, f, indent=2)
+        print(f"replayed {len(timings)} fingerprints -> {args.output}")
+        return 0
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    for row in compare(before, after):
+        print(
+            f"{row['fingerprint']}  {row['before_ms']:9.2f} ms -> {row['after_ms']:9.2f} ms "
+            f"({row['delta_ms']:+.2f})  {row['sql'][:80]}"
+        )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
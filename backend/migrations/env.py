@@ -41,6 +41,11 @@ if config.config_file_name is not None:
 import shared.user
 import shared.scores
 import shared.settings
+import shared.workload
+import shared.usage
+import shared.enrichment
+import shared.credits
+import shared.crawl
 
 target_metadata = SQLModel.metadata
 
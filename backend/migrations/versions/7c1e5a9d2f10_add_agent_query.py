@@ -0,0 +1,45 @@
+"""add agent_query workload table
+
+Revision ID: 7c1e5a9d2f10
+Revises: 4a6222a48c48
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "7c1e5a9d2f10"
+down_revision: Union[str, Sequence[str], None] = "4a6222a48c48"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "agent_query",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("fingerprint", AutoString(), nullable=False),
+        sa.Column("normalized", AutoString(), nullable=False, server_default=""),
+        sa.Column("sql", AutoString(), nullable=False, server_default=""),
+        sa.Column("decision", AutoString(), nullable=False, server_default="allow"),
+        sa.Column("latency_ms", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("row_count", sa.Integer(), nullable=True),
+        sa.Column("plan_node", AutoString(), nullable=False, server_default=""),
+        sa.Column("plan_cost", sa.Float(), nullable=True),
+        sa.Column("plan_rows", sa.Float(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_agent_query_fingerprint", "agent_query", ["fingerprint"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_agent_query_fingerprint", table_name="agent_query")
+    op.drop_table("agent_query")
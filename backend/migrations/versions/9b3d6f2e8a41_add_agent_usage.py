@@ -0,0 +1,63 @@
+"""add agent_usage and agent_usage_daily tables
+
+Revision ID: 9b3d6f2e8a41
+Revises: 7c1e5a9d2f10
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "9b3d6f2e8a41"
+down_revision: Union[str, Sequence[str], None] = "7c1e5a9d2f10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "agent_usage",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("kind", AutoString(), nullable=False, server_default=""),
+        sa.Column("endpoint", AutoString(), nullable=False, server_default=""),
+        sa.Column("model", AutoString(), nullable=False, server_default=""),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("status", AutoString(), nullable=False, server_default="ok"),
+        sa.Column("latency_ms", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("requests", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("input_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("output_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("tool_calls", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_agent_usage_user_id", "agent_usage", ["user_id"])
+    op.create_index("ix_agent_usage_created_at", "agent_usage", ["created_at"])
+    op.create_table(
+        "agent_usage_daily",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("model", AutoString(), nullable=False),
+        sa.Column("endpoint", AutoString(), nullable=False),
+        sa.Column("calls", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("errors", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("input_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("output_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("tool_calls", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("total_ms", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("latency_histogram", AutoString(), nullable=False, server_default="[]"),
+        sa.PrimaryKeyConstraint("day", "model", "endpoint"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("agent_usage_daily")
+    op.drop_index("ix_agent_usage_created_at", table_name="agent_usage")
+    op.drop_index("ix_agent_usage_user_id", table_name="agent_usage")
+    op.drop_table("agent_usage")
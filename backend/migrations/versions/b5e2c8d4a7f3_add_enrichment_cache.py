@@ -0,0 +1,45 @@
+"""add enrichment_cache table
+
+Revision ID: b5e2c8d4a7f3
+Revises: 9b3d6f2e8a41
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "b5e2c8d4a7f3"
+down_revision: Union[str, Sequence[str], None] = "9b3d6f2e8a41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "enrichment_cache",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("work_key", AutoString(), nullable=False),
+        sa.Column("composer_key", AutoString(), nullable=False),
+        sa.Column("title_key", AutoString(), nullable=False, server_default=""),
+        sa.Column("title", AutoString(), nullable=False, server_default=""),
+        sa.Column("composer", AutoString(), nullable=False, server_default=""),
+        sa.Column("fields", AutoString(), nullable=False, server_default="{}"),
+        sa.Column("model", AutoString(), nullable=False, server_default=""),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("work_key"),
+    )
+    op.create_index("ix_enrichment_cache_composer_key", "enrichment_cache", ["composer_key"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_enrichment_cache_composer_key", table_name="enrichment_cache")
+    op.drop_table("enrichment_cache")
@@ -0,0 +1,28 @@
+"""add last_played to score
+
+Revision ID: c7f4a1e9d2b6
+Revises: b5e2c8d4a7f3
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c7f4a1e9d2b6"
+down_revision: Union[str, Sequence[str], None] = "b5e2c8d4a7f3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("score", sa.Column("last_played", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("score", "last_played")
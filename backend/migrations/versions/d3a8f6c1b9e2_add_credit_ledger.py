@@ -0,0 +1,42 @@
+"""add credit_ledger table
+
+Revision ID: d3a8f6c1b9e2
+Revises: c7f4a1e9d2b6
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "d3a8f6c1b9e2"
+down_revision: Union[str, Sequence[str], None] = "c7f4a1e9d2b6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "credit_ledger",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("delta", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("balance", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("reason", AutoString(), nullable=False, server_default=""),
+        sa.Column("endpoint", AutoString(), nullable=False, server_default=""),
+        sa.Column("status", AutoString(), nullable=False, server_default="settled"),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_credit_ledger_user_id", "credit_ledger", ["user_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_credit_ledger_user_id", table_name="credit_ledger")
+    op.drop_table("credit_ledger")
@@ -0,0 +1,42 @@
+"""add crawl_state table
+
+Revision ID: e8c4b2d7a5f1
+Revises: d3a8f6c1b9e2
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "e8c4b2d7a5f1"
+down_revision: Union[str, Sequence[str], None] = "d3a8f6c1b9e2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "crawl_state",
+        sa.Column("name", AutoString(), nullable=False),
+        sa.Column("status", AutoString(), nullable=False, server_default="idle"),
+        sa.Column("page", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("checkpoint", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_id", sa.Integer(), nullable=True),
+        sa.Column("written", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cancel_requested", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("lease_owner", AutoString(), nullable=True),
+        sa.Column("lease_expires", sa.Float(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("crawl_state")
@@ -0,0 +1,31 @@
+"""add metadata_hash to imslp
+
+Revision ID: f2d9a6c3e1b8
+Revises: e8c4b2d7a5f1
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlmodel.sql.sqltypes import AutoString
+
+# revision identifiers, used by Alembic.
+revision: str = "f2d9a6c3e1b8"
+down_revision: Union[str, Sequence[str], None] = "e8c4b2d7a5f1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "imslp", sa.Column("metadata_hash", AutoString(), nullable=False, server_default="")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("imslp", "metadata_hash")
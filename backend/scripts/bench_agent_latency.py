@@ -0,0 +1,95 @@
+"""Tail-latency benchmark for agent model fallback and hedging.
+
+Runs ``run_imslp_agent`` against stand-in models (pydantic-ai ``FunctionModel``)
+with injected latency and 503 errors, and reports p50/p95/p99 for:
+
+* ``single``: primary model only (retries with backoff);
+* ``fallback``: primary, then the backup model on failure;
+* ``hedge``: fallback plus a hedged request after ``--hedge-delay`` seconds.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_agent_latency.py --requests 200 --error-rate 0.1
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.toolsets import FunctionToolset
+
+from app import agent, config, resilience
+
+
+def stand_in(name: str, median: float, tail: float, tail_rate: float, error_rate: float):
+    """A model answering after ``median`` s (``tail`` s for ``tail_rate`` of calls)."""
+
+    async def respond(_messages, info: AgentInfo) -> ModelResponse:
+        await asyncio.sleep(tail if random.random() < tail_rate else median)
+        if random.random() < error_rate:
+            raise ModelHTTPError(503, name)
+        tool = info.output_tools[0].name
+        return ModelResponse(
+            parts=[ToolCallPart(tool, {"response": f"from {name}", "score_ids": []})]
+        )
+
+    return FunctionModel(respond, model_name=name)
+
+
+async def run(mode: str, args: argparse.Namespace) -> list[float]:
+    """Latencies (ms) of ``args.requests`` concurrent-ish requests in ``mode``."""
+    resilience.reset()
+    config.AGENT_HEDGE_DELAY = args.hedge_delay if mode == "hedge" else 0
+    fallbacks = [] if mode == "single" else ["backup"]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.run_imslp_agent("prompt", model="primary", fallbacks=fallbacks)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    await asyncio.sleep(0.1)  # let cancelled hedges unwind before the loop closes
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--hedge-delay", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.ERROR)
+
+    models = {
+        "primary": stand_in("primary", 0.05, 1.0, args.tail_rate, args.error_rate),
+        "backup": stand_in("backup", 0.08, 1.0, args.tail_rate, args.error_rate / 2),
+    }
+    # No MCP server in the benchmark: the stand-ins answer without SQL tools.
+    agent.postgres_server = FunctionToolset()  # type: ignore[assignment]
+    original = agent.get_imslp_agent
+    agent.get_imslp_agent = lambda model: original(models[model])  # type: ignore[assignment]
+    # Keep the breaker out of the way so every request exercises the chain.
+    config.BREAKER_FAILURE_THRESHOLD = 10**9
+
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for mode in ("single", "fallback", "hedge"):
+        latencies = asyncio.run(run(mode, args))
+        q = statistics.quantiles(latencies, n=100)
+        print(f"{mode:<10}{q[49]:>10.1f}{q[94]:>10.1f}{q[98]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
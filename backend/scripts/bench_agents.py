@@ -0,0 +1,334 @@
+"""Offline end-to-end benchmark of the agent endpoints.
+
+Drives ``/agent``, ``/imslp_agent`` and ``/complete_score`` through the ASGI
+app (``httpx.ASGITransport``, no network) with stand-in models and a local
+stand-in MCP server, so only our own overhead around the LLM is measured:
+
+* ``request``: FastAPI dependency solving and body validation;
+* ``deps``: building ``Deps`` / ``Scores`` from the ``/agent`` body;
+* ``history``: ``_parse_history``;
+* ``tools``: function tools and MCP tool calls (guard + stdio round trip);
+* ``agent``: the whole agent run, tools and stand-in model included;
+* ``serialize``: FastAPI response serialization;
+* ``total``: end to end, as seen by the client.
+
+The models are pydantic-ai ``FunctionModel``s answering instantly: the main
+agent calls ``get_score_info``, the imslp agent sends one ``execute_sql`` to
+the stand-in MCP server (a FastMCP stdio server over a SQLite copy of the
+``imslp`` table), the complete agent answers directly. Each scenario is run
+with a synthetic library (``--libraries``) and message history
+(``--histories``) of varying size, then once more under ``tracemalloc`` for
+peak allocations.
+
+``--save`` writes the results as a baseline; ``--baseline`` compares against
+one and exits with status 1 if any scenario's p50 or peak memory grew by more
+than ``--threshold``. Run from ``backend/``::
+
+    uv run python scripts/bench_agents.py --save bench-baseline.json
+    uv run python scripts/bench_agents.py --baseline bench-baseline.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+STAGES = ("request", "deps", "history", "tools", "agent", "serialize")
+
+# Stage timings (ms) of the request being measured; requests run one at a time.
+_stage_ms: dict[str, float] = defaultdict(float)
+
+
+def timed(stage: str, func):
+    """Wrap ``func`` (sync or async) so its wall time is added to ``stage``."""
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _stage_ms[stage] += (time.perf_counter() - start) * 1000
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _stage_ms[stage] += (time.perf_counter() - start) * 1000
+
+    return wrapper
+
+
+def serve_mcp(db_path: str) -> None:
+    """Stand-in for the postgres MCP server: ``execute_sql`` over a SQLite file."""
+    from mcp.server.fastmcp import FastMCP  # noqa: PLC0415
+
+    server = FastMCP("bench-postgres", log_level="WARNING")
+
+    @server.tool()
+    def execute_sql(sql: str) -> str:
+        """Run a read-only query and return the rows like postgres-mcp does."""
+        with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+            conn.row_factory = sqlite3.Row
+            return str([dict(row) for row in conn.execute(sql).fetchall()])
+
+    server.run("stdio")
+
+
+def synthetic_history(size: int) -> list[dict]:
+    """``size`` alternating user / model messages, as the frontend sends them back."""
+    from pydantic_ai.messages import (  # noqa: PLC0415
+        ModelMessage,
+        ModelMessagesTypeAdapter,
+        ModelRequest,
+        ModelResponse,
+        TextPart,
+        UserPromptPart,
+    )
+
+    messages: list[ModelMessage] = []
+    for i in range(size):
+        if i % 2:
+            messages.append(ModelResponse(parts=[TextPart(f"Try score {i}, a sonata.")]))
+        else:
+            messages.append(ModelRequest(parts=[UserPromptPart(f"Something like {i}?")]))
+    return ModelMessagesTypeAdapter.dump_python(messages, mode="json")
+
+
+def synthetic_library(size: int) -> dict:
+    """``Scores`` JSON for the ``/agent`` ``deps`` field."""
+    return {
+        "scores": [
+            {
+                "id": i,
+                "title": f"Sonata No. {i}",
+                "composer": ("Bach", "Chopin", "Liszt", "Ravel")[i % 4],
+                "year": 1700 + i % 250,
+                "short_description": "A piece. " * 10,
+                "user_id": 1,
+            }
+            for i in range(size)
+        ]
+    }
+
+
+def stand_in_models():
+    """FunctionModels for the three agents, keyed by the model name we configure."""
+    from pydantic_ai.messages import ModelResponse, ToolCallPart, ToolReturnPart  # noqa: PLC0415
+    from pydantic_ai.models.function import AgentInfo, FunctionModel  # noqa: PLC0415
+
+    def answered(messages) -> bool:
+        return any(isinstance(part, ToolReturnPart) for part in messages[-1].parts)
+
+    def output(info: AgentInfo, args: dict) -> ModelResponse:
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, args)])
+
+    def main(messages, info: AgentInfo) -> ModelResponse:
+        if not answered(messages):
+            return ModelResponse(parts=[ToolCallPart("get_score_info", {})])
+        return output(info, {"response": "Try this one.", "score_id": 1, "score_ids": []})
+
+    def imslp(messages, info: AgentInfo) -> ModelResponse:
+        if not answered(messages):
+            sql = "SELECT id, title FROM imslp WHERE composer = 'Bach' LIMIT 100"
+            return ModelResponse(parts=[ToolCallPart("execute_sql", {"sql": sql})])
+        return output(info, {"response": "Found some.", "score_ids": [1, 2, 3]})
+
+    def complete(_messages, info: AgentInfo) -> ModelResponse:
+        return output(info, {"title": "Sonata", "composer": "Bach", "year": 1720})
+
+    return {
+        "bench-main": FunctionModel(main, model_name="bench-main"),
+        "bench-imslp": FunctionModel(imslp, model_name="bench-imslp"),
+        "bench-complete": FunctionModel(complete, model_name="bench-complete"),
+    }
+
+
+def setup_app(db_path: str):
+    """Import the app against a fresh SQLite DB and patch in stand-ins and timers."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import fastapi.routing  # noqa: PLC0415
+    from pydantic_ai.mcp import MCPServerStdio  # noqa: PLC0415
+    from sqlmodel import Session, SQLModel  # noqa: PLC0415
+
+    from app import agent, db, main, usage  # noqa: PLC0415
+    from app.rate_limit import limiter  # noqa: PLC0415
+    from app.sql_guard import guard_tool_call  # noqa: PLC0415
+    from app.users import get_current_user  # noqa: PLC0415
+    from shared.scores import IMSLP  # noqa: PLC0415
+    from shared.user import User  # noqa: PLC0415
+
+    SQLModel.metadata.create_all(db.engine)
+    with Session(db.engine) as session:
+        user = User(username="bench", credits=10**9, max_credits=10**9)
+        session.add(user)
+        composers = ("Bach", "Chopin", "Liszt", "Ravel")
+        session.add_all(
+            IMSLP(title=f"Piece {i}", composer=composers[i % 4], permlink=f"p{i}")
+            for i in range(2000)
+        )
+        session.commit()
+        session.refresh(user)
+    main.app.dependency_overrides[get_current_user] = lambda: user
+    limiter.enabled = False
+    usage.recorder.flush_size = 10**9  # keep the usage recorder out of the timings
+
+    models = stand_in_models()
+
+    async def get_agent_models(_session, kind):
+        return {"imslp": "bench-imslp", "complete": "bench-complete"}.get(kind, "bench-main"), []
+
+    main.get_agent_models = get_agent_models
+    for name in ("get_main_agent", "get_imslp_agent", "get_complete_agent"):
+        builder = getattr(agent, name)
+        setattr(agent, name, functools.partial(lambda b, m: b(models[m]), builder))
+    agent.get_score_info = timed("tools", agent.get_score_info)
+    agent.postgres_server = MCPServerStdio(  # type: ignore[assignment]
+        sys.executable,
+        [__file__, "mcp-server", db_path],
+        process_tool_call=timed("tools", guard_tool_call),
+        max_retries=3,
+    )
+    agent._parse_history = timed("history", agent._parse_history)
+    agent.call_with_fallback = timed("agent", agent.call_with_fallback)
+    main.Deps = timed("deps", main.Deps)  # type: ignore[misc]
+    main.Scores = timed("deps", main.Scores)  # type: ignore[misc]
+    fastapi.routing.solve_dependencies = timed("request", fastapi.routing.solve_dependencies)
+    fastapi.routing.serialize_response = timed("serialize", fastapi.routing.serialize_response)
+    return main.app, agent.postgres_server
+
+
+def scenarios(libraries: list[int], histories: list[int]):
+    """``(name, path, body)`` for every endpoint / size combination."""
+    for history in histories:
+        messages = synthetic_history(history)
+        for library in libraries:
+            body = {
+                "prompt": "Something by Bach?",
+                "message_history": messages,
+                "deps": json.dumps(synthetic_library(library)),
+            }
+            yield f"agent lib={library} hist={history}", "/agent", body
+        body = {"prompt": "Bach fugues", "message_history": messages}
+        yield f"imslp_agent hist={history}", "/imslp_agent", body
+    yield "complete_score", "/complete_score", {"title": "Sonata", "composer": "Bach"}
+
+
+async def run_scenario(client, path: str, body: dict, iterations: int, warmup: int) -> dict:
+    """Timings per stage and peak allocations for one scenario."""
+    for _ in range(warmup):
+        (await client.post(path, json=body)).raise_for_status()
+
+    totals: list[float] = []
+    stages: dict[str, list[float]] = defaultdict(list)
+    for _ in range(iterations):
+        _stage_ms.clear()
+        start = time.perf_counter()
+        (await client.post(path, json=body)).raise_for_status()
+        totals.append((time.perf_counter() - start) * 1000)
+        for stage in STAGES:
+            stages[stage].append(_stage_ms[stage])
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(max(1, iterations // 5)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        (await client.post(path, json=body)).raise_for_status()
+        peaks.append((tracemalloc.get_traced_memory()[1] - base) / 1024)
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(totals, n=20)
+    return {
+        "total_p50_ms": statistics.median(totals),
+        "total_p95_ms": quantiles[18],
+        **{f"{stage}_ms": statistics.mean(stages[stage]) for stage in STAGES},
+        "peak_kib": statistics.median(peaks),
+    }
+
+
+async def run(args: argparse.Namespace, db_path: str) -> dict[str, dict]:
+    """Run every scenario and print a table of the results."""
+    import httpx  # noqa: PLC0415
+
+    app, mcp_server = setup_app(db_path)
+    results = {}
+    header = f"{'scenario':<28}{'p50':>8}{'p95':>8}" + "".join(f"{s:>10}" for s in STAGES)
+    print(header + f"{'peak KiB':>10}")
+    transport = httpx.ASGITransport(app=app)
+    async with mcp_server, httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        for name, path, body in scenarios(args.libraries, args.histories):
+            r = await run_scenario(c, path, body, args.iterations, args.warmup)
+            results[name] = r
+            stages = "".join(f"{r[f'{s}_ms']:>10.2f}" for s in STAGES)
+            print(
+                f"{name:<28}{r['total_p50_ms']:>8.2f}{r['total_p95_ms']:>8.2f}{stages}"
+                f"{r['peak_kib']:>10.0f}"
+            )
+    return results
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Scenarios whose p50 or peak memory exceed the baseline by more than ``threshold``."""
+    failures = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in ("total_p50_ms", "peak_kib"):
+            if current[metric] > before[metric] * (1 + threshold):
+                failures.append(
+                    f"{name}: {metric} {before[metric]:.2f} -> {current[metric]:.2f} "
+                    f"(+{current[metric] / before[metric] - 1:.0%})"
+                )
+    return failures
+
+
+def main() -> int:
+    if len(sys.argv) == 3 and sys.argv[1] == "mcp-server":
+        serve_mcp(sys.argv[2])
+        return 0
+
+    def sizes(value: str) -> list[int]:
+        return [int(v) for v in value.split(",")]
+
+    parser = argparse.ArgumentParser(description="Offline agent endpoint benchmark.")
+    parser.add_argument("--libraries", type=sizes, default=[10, 100, 1000])
+    parser.add_argument("--histories", type=sizes, default=[0, 20, 200])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--save", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = asyncio.run(run(args, os.path.join(tmp, "bench.db")))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = regressions(results, json.load(f), args.threshold)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
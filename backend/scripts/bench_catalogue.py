@@ -0,0 +1,191 @@
+"""Savings of catalogue-first score completion on a sample library.
+
+Completes a synthetic library twice, the enrichment cache left out:
+
+* ``agent``: every score goes to the complete agent with the full prompt
+  (the behaviour before the catalogue stage);
+* ``catalogue``: ``enrichment.prefill`` fills what the ``imslp`` table knows,
+  then the agent is asked only for the fields still missing (or not at all).
+
+The library mixes works present in the catalogue (``--in-catalogue``, titles
+formatted differently from IMSLP's) and scores whose descriptions were
+already written (``--described``). The stand-in model behaves like the real
+agent under the two prompts: it runs one web search before answering when it
+must find facts (year, key, instrumentation...) and answers directly when it
+only writes descriptions. Model requests and searches sleep
+``--model-latency`` / ``--search-latency`` seconds. Token counts are
+pydantic-ai's ``FunctionModel`` estimates.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_catalogue.py --library 200 --in-catalogue 0.7
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+COMPOSERS = ("Bach, Johann Sebastian", "Chopin, Frédéric", "Dvořák, Antonín", "Ravel, Maurice")
+FORMS = ("Sonata", "Nocturne", "Prelude", "Etude", "Fugue", "Waltz")
+
+
+def sample_value(name: str):
+    """A plausible answer for Score field ``name``."""
+    return {"year": 1840, "period": "Romantic", "difficulty": "advanced"}.get(name, f"{name} text")
+
+
+def stand_in_model(model_latency: float):
+    """FunctionModel that searches first whenever it is asked for catalogue facts."""
+    from pydantic_ai.messages import ModelResponse, ToolCallPart, ToolReturnPart  # noqa: PLC0415
+    from pydantic_ai.models.function import AgentInfo, FunctionModel  # noqa: PLC0415
+
+    from app.enrichment import CATALOGUE_FIELDS  # noqa: PLC0415
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        await asyncio.sleep(model_latency)
+        tool = info.output_tools[0]
+        wanted = set(tool.parameters_json_schema["properties"]) - {"title", "composer"}
+        searched = any(isinstance(part, ToolReturnPart) for part in messages[-1].parts)
+        if not searched and wanted & set(CATALOGUE_FIELDS):
+            return ModelResponse(parts=[ToolCallPart("duckduckgo_search", {"query": "piece"})])
+        args = {name: sample_value(name) for name in wanted}
+        return ModelResponse(parts=[ToolCallPart(tool.name, {"title": "", "composer": "", **args})])
+
+    return FunctionModel(respond, model_name="bench-complete")
+
+
+def setup(db_path: str, args: argparse.Namespace):
+    """Fresh SQLite DB with a catalogue; returns the library and patched modules."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from pydantic_ai import Tool  # noqa: PLC0415
+    from sqlmodel import Session, SQLModel  # noqa: PLC0415
+
+    from app import agent, db, enrichment, usage  # noqa: PLC0415
+    from shared.scores import IMSLP, Score  # noqa: PLC0415
+
+    SQLModel.metadata.create_all(db.engine)
+    rng = random.Random(args.seed)
+    library = []
+    with Session(db.engine) as session:
+        for i in range(args.catalogue):
+            session.add(
+                IMSLP(
+                    id=i + 1,
+                    title=f"{FORMS[i % len(FORMS)]} No.{i}",
+                    composer=COMPOSERS[i % len(COMPOSERS)],
+                    permlink=f"p{i}",
+                    year=str(1700 + i % 200),
+                    period="Romantic",
+                    style="Romantic",
+                    key="C major",
+                    instrumentation="Piano",
+                    genre=FORMS[i % len(FORMS)],
+                    form="Ternary",
+                )
+            )
+        session.commit()
+    for i in range(args.library):
+        known = rng.random() < args.in_catalogue
+        n = rng.randrange(args.catalogue) if known else args.catalogue + i
+        composer = COMPOSERS[n % len(COMPOSERS)].split(", ")[0] if known else "Anonymous"
+        fields = {}
+        if rng.random() < args.described:
+            fields = {
+                name: sample_value(name)
+                for name in enrichment.ENRICHED_FIELDS
+                if name not in enrichment.CATALOGUE_FIELDS
+            }
+        library.append(
+            Score.model_validate(
+                {
+                    "title": f"{FORMS[n % len(FORMS)].lower()} no. {n}",
+                    "composer": composer,
+                    "user_id": None,
+                    **fields,
+                }
+            )
+        )
+
+    async def search(query: str) -> str:
+        """Stand-in web search."""
+        await asyncio.sleep(args.search_latency)
+        return f"results for {query}"
+
+    model = stand_in_model(args.model_latency)
+    original = agent.get_complete_agent, agent.get_fields_agent
+    search_tool = Tool(search, name="duckduckgo_search")
+    agent.duckduckgo_search_tool = lambda: search_tool  # type: ignore[assignment, misc]
+    agent.get_complete_agent = lambda _m: original[0](model)  # type: ignore[assignment]
+    agent.get_fields_agent = lambda _m, fields: original[1](model, fields)  # type: ignore[assignment]
+    usage.recorder = usage.UsageRecorder(capacity=10**6, flush_size=10**9)
+    return library, agent, enrichment, usage
+
+
+async def run(mode: str, library, args, agent, enrichment, usage) -> dict:
+    """Complete ``library`` in ``mode``; totals of the agent calls it made."""
+    from sqlmodel.ext.asyncio.session import AsyncSession  # noqa: PLC0415
+
+    from app.db import async_engine  # noqa: PLC0415
+
+    usage.recorder.buffer.clear()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    prefilled = 0
+
+    async def one(score) -> None:
+        nonlocal prefilled
+        async with semaphore:
+            if mode == "agent":
+                await agent.run_complete_agent(score, "bench", strict=True)
+                return
+            async with AsyncSession(async_engine) as session:
+                filled, missing = await enrichment.prefill(session, score)
+            prefilled += missing is not None
+            if missing != []:
+                await agent.run_complete_agent(filled, "bench", strict=True, fields=missing)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(score) for score in library))
+    calls = list(usage.recorder.buffer)
+    return {
+        "agent calls": len(calls),
+        "model requests": sum(c.requests for c in calls),
+        "searches": sum(c.tool_calls for c in calls),
+        "input tokens": sum(c.input_tokens for c in calls),
+        "output tokens": sum(c.output_tokens for c in calls),
+        "agent seconds": sum(c.latency_ms for c in calls) / 1000,
+        "wall seconds": time.perf_counter() - start,
+        "catalogue matches": prefilled,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--library", type=int, default=200)
+    parser.add_argument("--catalogue", type=int, default=5000)
+    parser.add_argument("--in-catalogue", type=float, default=0.7)
+    parser.add_argument("--described", type=float, default=0.2)
+    parser.add_argument("--model-latency", type=float, default=1.0)
+    parser.add_argument("--search-latency", type=float, default=1.5)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library, agent, enrichment, usage = setup(os.path.join(tmp, "bench.db"), args)
+        results = {
+            mode: asyncio.run(run(mode, library, args, agent, enrichment, usage))
+            for mode in ("agent", "catalogue")
+        }
+
+    print(f"{'':<20}{'agent':>12}{'catalogue':>12}{'saved':>10}")
+    for metric, before in results["agent"].items():
+        after = results["catalogue"][metric]
+        saved = f"{1 - after / before:.0%}" if before and metric != "catalogue matches" else ""
+        print(f"{metric:<20}{before:>12.1f}{after:>12.1f}{saved:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Cost and throughput of the IMSLP completion, per entry and batched.
+
+Completes ``--works`` IMSLP entries (the rows ``imslp_parser.work_fields``
+makes of the saved pages of ``tests/data/imslp``) with a stand-in model, a
+pydantic-ai ``FunctionModel`` that answers after ``--latency-ms`` plus
+``--ms-per-token`` per output token, ``IMSLP_ENRICH_CONCURRENCY`` requests at
+a time as in the crawl:
+
+* ``entry``: ``imslp.complete_entry``, one request per work, which is how the
+  crawl completed works before ``imslp.complete_entries``;
+* ``batch``: ``imslp.complete_entries`` on batches of
+  ``IMSLP_ENRICH_BATCH_SIZE`` works, packed under
+  ``IMSLP_ENRICH_BATCH_TOKENS``.
+
+Requests and tokens are those ``app.usage`` records for the runs (the
+stand-in model estimates tokens from the words of the messages), priced at
+``--input-price`` / ``--output-price`` dollars per million tokens.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_imslp_enrich.py --works 200
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import time
+import warnings
+from pathlib import Path
+from typing import Any
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart, UserPromptPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from app import agent, config, imslp, usage
+from app.imslp_parser import work_fields
+from shared.scores import IMSLP
+
+PAGES = Path(__file__).parents[1] / "tests" / "data" / "imslp"
+ITEM = {"permlink": "https://imslp.org/wiki/Work", "intvals": {"worktitle": "T", "composer": "C"}}
+ANSWER = {
+    "year": 1808,
+    "period": "Classical",
+    "genre": "Symphony",
+    "form": "Symphony",
+    "style": "Classical",
+    "key": "C minor",
+    "instrumentation": "Orchestra",
+}
+
+
+def stand_in(latency: float, per_token: float, batched: bool) -> FunctionModel:
+    """A model completing every piece of its prompt after a simulated delay."""
+
+    async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        part = messages[0].parts[-1]
+        assert isinstance(part, UserPromptPart)
+        prompt = str(part.content)
+        answer: Any
+        if batched:
+            lines = [line.split(": ", 1) for line in prompt.splitlines()[1:-1]]
+            pieces = {i: json.loads(entry) for i, entry in lines if entry}
+            # pieces hold only the fields found (see agent.ImslpFix)
+            answer = {"response": dict.fromkeys(pieces, ANSWER)}
+        else:
+            answer = {"title": "Work", "composer": "Composer", **ANSWER}
+        await asyncio.sleep(latency + per_token * len(json.dumps(answer).split()))
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, answer)])
+
+    return FunctionModel(respond)
+
+
+def entries(n: int) -> list[IMSLP]:
+    """``n`` IMSLP rows made of the saved work pages."""
+    saved = [path.read_text(encoding="utf-8") for path in sorted(PAGES.glob("*.html"))]
+    pages = itertools.islice(itertools.cycle(saved), n)
+    return [IMSLP(**work_fields(i, ITEM, html)) for i, html in enumerate(pages)]
+
+
+async def run_entry(works: list[IMSLP]) -> None:
+    semaphore = asyncio.Semaphore(config.IMSLP_ENRICH_CONCURRENCY)
+
+    async def complete(entry: IMSLP) -> None:
+        async with semaphore:
+            await imslp.complete_entry(entry, "stand-in", [])
+
+    await asyncio.gather(*(complete(entry) for entry in works))
+
+
+async def run_batch(works: list[IMSLP]) -> None:
+    size = config.IMSLP_ENRICH_BATCH_SIZE
+    batches = iter(range(0, len(works), size))
+
+    async def worker() -> None:
+        for offset in batches:
+            await imslp.complete_entries(works[offset : offset + size], "stand-in", [])
+
+    await asyncio.gather(*(worker() for _ in range(config.IMSLP_ENRICH_CONCURRENCY)))
+
+
+async def measure(name: str, run, works: list[IMSLP], prices: tuple[float, float]) -> None:
+    usage.recorder.buffer.clear()
+    start = time.perf_counter()
+    await run(works)
+    elapsed = time.perf_counter() - start
+    calls = list(usage.recorder.buffer)
+    scale = 1000 / len(works)
+    input_tokens = sum(call.input_tokens for call in calls) * scale
+    output_tokens = sum(call.output_tokens for call in calls) * scale
+    cost = (input_tokens * prices[0] + output_tokens * prices[1]) / 1e6
+    print(
+        f"{name:>5}: {len(works) / elapsed:7.1f} works/s, per 1000 works: {len(calls) * scale:6.0f}"
+        f" requests, {input_tokens:9.0f} in + {output_tokens:8.0f} out tokens, ${cost:.3f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--works", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--ms-per-token", type=float, default=2)
+    parser.add_argument("--input-price", type=float, default=0.15, help="$ per million tokens")
+    parser.add_argument("--output-price", type=float, default=0.6, help="$ per million tokens")
+    args = parser.parse_args()
+    latency, per_token = args.latency_ms / 1000, args.ms_per_token / 1000
+    prices = (args.input_price, args.output_price)
+    usage.recorder.flush_size = 10**9  # keep the calls in memory to count them
+    # the saved pages' years ("1830–32") aren't ints, as on IMSLP
+    warnings.filterwarnings("ignore", message="Pydantic serializer warnings")
+
+    for name, batched in (
+        ("get_imslp_complete_agent", False),
+        ("get_imslp_batch_complete_agent", True),
+    ):
+        model = stand_in(latency, per_token, batched)
+        setattr(agent, name, functools.partial(lambda b, m, _: b(m), getattr(agent, name), model))
+
+    print(
+        f"{args.works} works, {config.IMSLP_ENRICH_CONCURRENCY} requests at a time,"
+        f" batches of {config.IMSLP_ENRICH_BATCH_SIZE} / {config.IMSLP_ENRICH_BATCH_TOKENS} tokens"
+    )
+    await measure("entry", run_entry, entries(args.works), prices)
+    await measure("batch", run_batch, entries(args.works), prices)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""Completion-agent calls the IMSLP metadata normalizer saves.
+
+Normalizes the metadata blocks of ``tests/data/imslp/metadata_corpus.json``
+(or of ``--corpus``, a JSON list of them) with ``app.imslp_normalize`` and
+reports how often each of ``COMPLETENESS_FIELDS`` is read, how many works
+would still go to the completion agent at a few values of
+``IMSLP_COMPLETENESS_THRESHOLD``, and how long normalizing a work takes.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_imslp_normalize.py
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from app.imslp_normalize import COMPLETENESS_FIELDS, completeness, normalize
+
+CORPUS = Path(__file__).parents[1] / "tests" / "data" / "imslp" / "metadata_corpus.json"
+# none, one or two of the fields missing
+THRESHOLDS = tuple(1 - missing / len(COMPLETENESS_FIELDS) for missing in range(3))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=1000, help="timed passes over the corpus")
+    args = parser.parse_args()
+    corpus = json.loads(args.corpus.read_text(encoding="utf-8"))
+
+    normalized = [normalize(metadata) for metadata in corpus]
+    print(f"{len(corpus)} works")
+    for name in COMPLETENESS_FIELDS:
+        read = sum(name in fields for fields in normalized)
+        print(f"  {name:>15}: read for {read:3} ({read / len(corpus):4.0%})")
+
+    scores = [completeness(fields) for fields in normalized]
+    for threshold in THRESHOLDS:
+        asked = sum(score < threshold for score in scores)
+        print(
+            f"threshold {threshold:.3f}: {asked:3} works to the agent,"
+            f" {len(corpus) - asked:3} calls saved ({1 - asked / len(corpus):4.0%})"
+        )
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for metadata in corpus:
+            normalize(metadata)
+    elapsed = time.perf_counter() - start
+    print(f"normalize: {elapsed / (args.repeat * len(corpus)) * 1e6:.1f} µs per work")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Pages per second of IMSLP work page parsing.
+
+Parses the saved work pages of ``tests/data/imslp``, each padded to about
+``--size-kb`` kB with the file listings and navigation that make up most of
+a real page, ``--pages`` times in total:
+
+* ``bs4``: the extraction before ``app.imslp_parser``, BeautifulSoup's
+  ``html.parser`` run once for the metadata and once more for the PDF
+  landing links;
+* ``lxml``: ``imslp_parser.parse_work_page``, one lxml parse for both.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_imslp_parse.py --pages 2000
+"""
+
+import argparse
+import itertools
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from app.imslp_parser import LANDING_PAGE_MARKER, parse_work_page
+
+PAGES = Path(__file__).parents[1] / "tests" / "data" / "imslp"
+FILE_BLOCK = """
+<div class="we_file_first we_fileblock_{i}">
+<div class="we_file_download plainlinks">
+<p><a rel="nofollow" class="external text" href="https://imslp.org/wiki/Special:ImagefromIndex/{i}/torat">
+<span title="Download this file"><span class="we_file_info2">Part {i}</span></span></a></p>
+</div>
+<div class="we_file_info"><span class="we_file_dlcnt">*#{i} - 1.2MB, 12 pp. - 10.0/10</span></div>
+<table class="we_edition_info">
+<tr><th>Editor</th><td><a href="/wiki/Category:Editor_{i}">Editor {i}</a></td></tr>
+<tr><th>Publisher. Info.</th><td>Leipzig: Breitkopf &amp; H&auml;rtel<br/>Plate {i}</td></tr>
+</table>
+</div>
+"""
+
+
+def legacy_parse(html: str) -> tuple[dict[str, str], list[str]]:
+    """The BeautifulSoup extraction ``app.imslp`` used before."""
+    data = {}
+    soup = BeautifulSoup(html, "html.parser")
+    gen_info = soup.find("span", id="General_Information")
+    table = gen_info.find_next("table") if gen_info is not None else None
+    for row in table.find_all("tr") if table is not None else ():
+        header = row.find("th")
+        value = row.find("td")
+        if header and value:
+            data[header.get_text(" ", strip=True)] = value.get_text(" ", strip=True)
+    soup = BeautifulSoup(html, "html.parser")
+    links = soup.find_all("a", href=True)
+    return data, [str(link["href"]) for link in links if LANDING_PAGE_MARKER in link["href"]]
+
+
+def padded(html: str, size: int) -> str:
+    """``html`` with file blocks added before ``</body>`` up to ``size`` bytes."""
+    blocks: list[str] = []
+    length = len(html)
+    for i in itertools.count(100000):
+        if length >= size:
+            break
+        blocks.append(FILE_BLOCK.format(i=i))
+        length += len(blocks[-1])
+    return html.replace("</body>", "".join(blocks) + "</body>", 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--size-kb", type=int, default=120)
+    args = parser.parse_args()
+    corpus = [
+        padded(path.read_text(encoding="utf-8"), args.size_kb * 1024)
+        for path in sorted(PAGES.glob("*.html"))
+    ]
+    for html in corpus:
+        page = parse_work_page(html)
+        assert legacy_parse(html) == (page.metadata, page.pdf_landing_pages)
+
+    print(f"{args.pages} pages of ~{args.size_kb} kB")
+    for name, parse in (("bs4", legacy_parse), ("lxml", parse_work_page)):
+        start = time.perf_counter()
+        for html in itertools.islice(itertools.cycle(corpus), args.pages):
+            parse(html)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>5}: {args.pages / elapsed:.0f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
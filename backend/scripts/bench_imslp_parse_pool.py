@@ -0,0 +1,106 @@
+"""Event loop latency while the IMSLP crawl parses work pages.
+
+Parses ``--pages`` saved work pages of ``tests/data/imslp``, padded to about
+``--size-kb`` kB as in ``bench_imslp_parse.py``, while a probe on the same
+event loop wakes up every millisecond, as an API request would be served,
+and records how late it wakes up:
+
+* ``thread``: one ``asyncio.to_thread`` call per page, ``IMSLP_PARSE_PROCESSES``
+  at a time, which is how the crawl parsed before the process pool (the
+  thread holds the GIL the loop needs for most of the parse);
+* ``pool``: ``imslp.parse_entries`` on chunks of ``IMSLP_PARSE_CHUNK`` pages,
+  one chunk in flight per worker of the ``ParsePool``, as the crawl does.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_imslp_parse_pool.py --pages 1000
+"""
+
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+from types import SimpleNamespace
+
+from bench_imslp_parse import PAGES, padded
+
+ITEM = {"permlink": "https://imslp.org/wiki/Work", "intvals": {"worktitle": "T", "composer": "C"}}
+
+
+async def probe(lags: list[float], stop: asyncio.Event) -> None:
+    """Record by how much each 1 ms sleep overshoots until ``stop``."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def parse_in_threads(corpus: list[str], concurrency: int) -> None:
+    from app.imslp_parser import work_fields  # noqa: PLC0415
+
+    pages = iter(enumerate(corpus))
+
+    async def worker() -> None:
+        for i, html in pages:
+            await asyncio.to_thread(work_fields, i, ITEM, html)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def parse_in_pool(corpus: list[str], concurrency: int, chunk: int) -> None:
+    from app import imslp  # noqa: PLC0415
+
+    fetched = [(i, ITEM, SimpleNamespace(text=html)) for i, html in enumerate(corpus)]
+    chunks = iter(range(0, len(fetched), chunk))
+
+    async def worker() -> None:
+        for offset in chunks:
+            await imslp.parse_entries(fetched[offset : offset + chunk])
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def measure(name: str, parse) -> None:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probing = asyncio.create_task(probe(lags, stop))
+    start = time.perf_counter()
+    await parse
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probing
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)]
+    print(
+        f"{name:>6}: {elapsed:6.2f} s, loop lag median {statistics.median(lags) * 1000:6.2f} ms,"
+        f" p99 {p99 * 1000:6.2f} ms, max {lags[-1] * 1000:6.2f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--size-kb", type=int, default=120)
+    args = parser.parse_args()
+
+    from app import config, imslp  # noqa: PLC0415
+
+    saved = [
+        padded(path.read_text(encoding="utf-8"), args.size_kb * 1024)
+        for path in sorted(PAGES.glob("*.html"))
+    ]
+    corpus = list(itertools.islice(itertools.cycle(saved), args.pages))
+    processes = config.IMSLP_PARSE_PROCESSES
+    await imslp.parse_entries([])  # start the workers before timing
+
+    print(f"{args.pages} pages of ~{args.size_kb} kB, {processes} workers")
+    try:
+        await measure("thread", parse_in_threads(corpus, processes))
+        await measure("pool", parse_in_pool(corpus, processes, config.IMSLP_PARSE_CHUNK))
+    finally:
+        imslp.close_parse_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""Rows per second of the IMSLP crawl's writer for several batch sizes.
+
+Writes ``--rows`` synthetic works with ``imslp.write_entries``, one commit
+per batch of ``--batches`` rows each, as the crawl's writer does: a first
+pass inserts them, a second one updates them all (the upsert's conflict
+path, as when the catalogue is re-crawled). A batch size of 1 is the
+write pattern from before the batched writer (one statement and one commit
+per work).
+
+``--url`` is a SQLAlchemy async URL, e.g. the Postgres of docker compose
+(``postgresql+asyncpg://...``); the rows get ids from 10**9 up so they
+don't meet real ones, and are deleted afterwards. By default a temporary
+SQLite file is used.
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_imslp_writes.py --url postgresql+asyncpg://... --rows 20000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+FIRST_ID = 10**9
+
+
+def synthetic_entry(i: int, generation: int):
+    from shared.scores import IMSLP, Period  # noqa: PLC0415
+
+    return IMSLP(
+        id=FIRST_ID + i,
+        title=f"Sonata No.{i} ({generation})",
+        composer=f"Composer{i % 300}",
+        permlink=f"https://imslp.org/wiki/Sonata_No.{i}",
+        instrumentation="Piano",
+        style="Romantic",
+        period=Period.Romantic,
+        year=1840,
+        key="C major",
+        score_metadata='{"Work Title": "Sonata"}',
+    )
+
+
+async def write_pass(engine, rows: int, batch: int, generation: int) -> float:
+    """Write every row in batches of ``batch``; rows per second."""
+    from sqlmodel.ext.asyncio.session import AsyncSession  # noqa: PLC0415
+
+    from app import imslp  # noqa: PLC0415
+
+    entries = [synthetic_entry(i, generation) for i in range(rows)]
+    start = time.perf_counter()
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        for offset in range(0, rows, batch):
+            await imslp.write_entries(entries[offset : offset + batch], session)
+    return rows / (time.perf_counter() - start)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batches", default="1,100,1000")
+    args = parser.parse_args()
+
+    from sqlalchemy import delete  # noqa: PLC0415
+    from sqlalchemy.ext.asyncio import create_async_engine  # noqa: PLC0415
+    from sqlmodel import SQLModel, col  # noqa: PLC0415
+
+    from shared.scores import IMSLP  # noqa: PLC0415
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_async_engine(url)
+        table = SQLModel.metadata.tables["imslp"]
+        async with engine.begin() as conn:
+            await conn.run_sync(table.create, checkfirst=True)
+
+        print(f"{engine.dialect.name}, {args.rows} rows")
+        print(f"{'batch':>6} {'insert rows/s':>14} {'update rows/s':>14}")
+        try:
+            for batch in (int(b) for b in args.batches.split(",")):
+                async with engine.begin() as conn:
+                    await conn.execute(delete(IMSLP).where(col(IMSLP.id) >= FIRST_ID))
+                inserted = await write_pass(engine, args.rows, batch, 0)
+                updated = await write_pass(engine, args.rows, batch, 1)
+                print(f"{batch:>6} {inserted:>14.0f} {updated:>14.0f}")
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(delete(IMSLP).where(col(IMSLP.id) >= FIRST_ID))
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+"""Throughput of the IMSLP crawl against a local stand-in IMSLP.
+
+Serves a fake worklist API and work pages with uvicorn on localhost, each
+request answered after ``--fetch-latency`` seconds, and replaces the
+completion agent by a stand-in sleeping ``--agent-latency`` seconds per
+request, be it for one work or a batch (no web search). Then
+crawls ``--works`` works twice into a fresh SQLite DB:
+
+* ``sequential``: one worker per stage, a queue of one and one work per
+  completion and write, which is how the crawl ran before the pipeline (one
+  work fetched, parsed, completed and committed after the other);
+* ``pipeline``: the stage concurrencies, parse processes, queue size and
+  write batch of ``app.config`` (``IMSLP_*`` environment variables).
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_ingest.py --works 2000 --agent-latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import time
+
+
+def stand_in_imslp(works: int, latency: float, port: int):
+    """FastAPI app answering like the IMSLP worklist API and work pages."""
+    from fastapi import FastAPI, Request  # noqa: PLC0415
+    from fastapi.responses import HTMLResponse  # noqa: PLC0415
+
+    app = FastAPI()
+
+    @app.get("/api")
+    async def worklist(request: Request) -> dict:
+        await asyncio.sleep(latency)
+        start = int(str(request.url.query).rsplit("start=", 1)[1])
+        page: dict = {"metadata": {"start": start}}
+        for i in range(start, min(start + 1000, works)):
+            page[str(i - start)] = {
+                "permlink": f"http://127.0.0.1:{port}/wiki/{i}",
+                "intvals": {"worktitle": f"Sonata No.{i}", "composer": f"Composer{i % 300}"},
+            }
+        return page
+
+    @app.get("/wiki/{work_id}", response_class=HTMLResponse)
+    async def work_page(work_id: int) -> str:
+        await asyncio.sleep(latency)
+        rows = {
+            "Work Title": f"Sonata No.{work_id}",
+            "Composer": f"Composer{work_id % 300}",
+            "Key": "C major",
+            "Instrumentation": "Piano",
+            "Piece Style": "Romantic",
+        }
+        table = "".join(f"<tr><th>{k}</th><td>{v}</td></tr>" for k, v in rows.items())
+        filler = "<p>Lorem ipsum dolor sit amet.</p>" * 200  # real pages are ~100 kB
+        return f'<html><span id="General_Information"></span><table>{table}</table>{filler}</html>'
+
+    return app
+
+
+async def crawl(mode: str, args: argparse.Namespace, imslp, similarity, tmp: str) -> float:
+    """Run ``get_works`` in ``mode`` on an empty catalogue; works per second."""
+    from sqlmodel import Session, delete, select  # noqa: PLC0415
+
+    from app import config, db  # noqa: PLC0415
+    from shared.scores import IMSLP  # noqa: PLC0415
+
+    if mode == "sequential":
+        for name in ("FETCH", "ENRICH"):
+            setattr(config, f"IMSLP_{name}_CONCURRENCY", 1)
+        config.IMSLP_PARSE_PROCESSES = 1
+        config.IMSLP_PARSE_CHUNK = 1
+        config.IMSLP_QUEUE_SIZE = 1
+        config.IMSLP_WRITE_BATCH = 1
+        config.IMSLP_ENRICH_BATCH_SIZE = 1
+    imslp.close_parse_pool()  # the next crawl's pool has the mode's size
+    with Session(db.engine) as session:
+        session.exec(delete(IMSLP))  # type: ignore[call-overload]
+        session.commit()
+    similarity.index = similarity.SimilarityIndex(os.path.join(tmp, mode))
+    imslp.progress_tracker.update(total=args.works // 1000 + 1, cancel_requested=False)
+    start = time.perf_counter()
+    await imslp.get_works()
+    elapsed = time.perf_counter() - start
+    with Session(db.engine) as session:
+        assert len(session.exec(select(IMSLP.id)).all()) == args.works
+    return args.works / elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--works", type=int, default=500)
+    parser.add_argument("--fetch-latency", type=float, default=0.05)
+    parser.add_argument("--agent-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["IMSLP_API_URL"] = f"http://127.0.0.1:{port}/api"
+        os.environ["IMSLP_RATE_BURST"] = str(10**6)  # don't pace the local server
+        import uvicorn  # noqa: PLC0415
+        from sqlmodel import SQLModel  # noqa: PLC0415
+
+        from app import db, imslp, similarity  # noqa: PLC0415
+        from shared.scores import ScoreBase  # noqa: PLC0415
+
+        SQLModel.metadata.create_all(db.engine)
+
+        def fixed(entry_json: str) -> ScoreBase:
+            entry = json.loads(entry_json)
+            return ScoreBase(title=entry["title"], composer=entry["composer"])
+
+        async def complete(entry_json: str, *_args) -> ScoreBase:
+            await asyncio.sleep(args.agent_latency)
+            return fixed(entry_json)
+
+        async def complete_batch(entries: dict[int, str], *_args) -> dict[int, ScoreBase]:
+            await asyncio.sleep(args.agent_latency)
+            return {i: fixed(entry_json) for i, entry_json in entries.items()}
+
+        imslp.run_imslp_complete_agent = complete  # type: ignore[assignment]
+        imslp.run_imslp_batch_complete_agent = complete_batch  # type: ignore[assignment]
+        app = stand_in_imslp(args.works, args.fetch_latency, port)
+        server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        print(f"works {args.works}, fetch {args.fetch_latency}s, agent {args.agent_latency}s")
+        for mode in ("pipeline", "sequential"):
+            rate = await crawl(mode, args, imslp, similarity, tmp)
+            print(f"{mode:>10}: {rate:.1f} works/s")
+        server.should_exit = True
+        await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
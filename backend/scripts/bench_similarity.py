@@ -0,0 +1,91 @@
+"""Build and query times of the "pieces like this one" similarity index.
+
+Indexes a synthetic catalogue of ``--works`` IMSLP-like works the way the
+ingest does (one segment per page of ``--page`` works, merged as it goes),
+then times ``--queries`` top-``--k`` lookups of random works and their
+recall against an exhaustive scan (no postings budget).
+
+Usage (from ``backend/``)::
+
+    uv run python scripts/bench_similarity.py --works 300000
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from app import similarity
+
+COMPOSERS = [f"Composer{i}, Firstname{i % 97}" for i in range(20000)]
+# Zipf-distributed: the most prolific composer has ~10% of the catalogue.
+COMPOSER_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(COMPOSERS))))
+FORMS = ("Sonata", "Nocturne", "Prelude", "Etude", "Fugue", "Waltz", "Mass", "Symphony", "Suite")
+INSTRUMENTS = ("Piano", "Violin, Piano", "Orchestra", "Voice, Piano", "Organ", "String Quartet")
+KEYS = [
+    f"{n}{a} {m}" for n in "ABCDEFG" for a in ("", "-flat", "-sharp") for m in ("major", "minor")
+]
+PERIODS = ("Baroque", "Classical", "Romantic", "Modernist")
+
+
+def synthetic_work(i: int, rng: random.Random) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=i,
+        title=f"{rng.choice(FORMS)} No.{rng.randint(1, 40)}, Op.{rng.randint(1, 200)}",
+        composer=rng.choices(COMPOSERS, cum_weights=COMPOSER_WEIGHTS)[0],
+        instrumentation=rng.choice(INSTRUMENTS),
+        style=rng.choice(PERIODS),
+        key=rng.choice(KEYS),
+        period=rng.choice(PERIODS),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--works", type=int, default=300000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    works = [synthetic_work(i, rng) for i in range(args.works)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = similarity.SimilarityIndex(tmp)
+        start = time.perf_counter()
+        for offset in range(0, len(works), args.page):
+            index.add(works[offset : offset + args.page])
+        build = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(tmp) for f in fs)
+
+        # a fresh reader, as another worker would open it
+        reader = similarity.SimilarityIndex(tmp)
+        reader.refresh()
+        latencies, exhaustive, recall = [], [], []
+        for work in rng.sample(works, args.queries):
+            start = time.perf_counter()
+            found = reader.similar(work, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            exact = reader.similar(work, args.k, budget=10**12)
+            exhaustive.append((time.perf_counter() - start) * 1000)
+            # ties at the k-th score make several answers equally right
+            threshold = exact[-1][1] - 1e-6 if exact else 0
+            hits = sum(score >= threshold for _, score in found)
+            recall.append(hits / len(exact) if exact else 1)
+
+    q = statistics.quantiles(latencies, n=100)
+    print(f"works {args.works}, segments {len(reader.segments)}, index {size / 2**20:.0f} MiB")
+    print(f"build {build:.1f} s ({args.works / build:.0f} works/s)")
+    print(f"query p50 {q[49]:.2f} ms, p95 {q[94]:.2f} ms, p99 {q[98]:.2f} ms")
+    print(f"exhaustive p50 {statistics.median(exhaustive):.2f} ms")
+    print(f"recall@{args.k} vs exhaustive {statistics.mean(recall):.3f}")
+
+
+if __name__ == "__main__":
+    main()
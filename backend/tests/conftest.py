@@ -13,7 +13,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app import db
+from app import config, db, http_cache, politeness, resilience, similarity, usage
 from app.main import app, get_pdf_user
 from app.users import get_current_user
 from shared.scores import Score, Scores
@@ -34,6 +34,43 @@ def cleanup_test_pdfs():
                 os.remove(file)
 
 
+@pytest.fixture(autouse=True)
+def reset_resilience(monkeypatch):
+    """Zero retry delays and start every test with closed circuit breakers."""
+    monkeypatch.setattr(config, "AGENT_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(config, "INGEST_RETRY_BASE_DELAY", 0)
+    resilience.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_politeness(monkeypatch):
+    """Don't pace the requests to IMSLP, and start every test with fresh limiters."""
+    monkeypatch.setattr(config, "IMSLP_RATE_BURST", 10**6)
+    politeness.reset()
+
+
+@pytest.fixture(autouse=True)
+def fresh_usage_recorder(monkeypatch):
+    """Give each test an empty usage recorder that never flushes on its own."""
+    monkeypatch.setattr(usage, "recorder", usage.UsageRecorder(capacity=100, flush_size=10**6))
+
+
+@pytest.fixture(autouse=True)
+def similarity_index(monkeypatch, tmp_path):
+    """Keep the similarity index of each test in its own directory."""
+    index = similarity.SimilarityIndex(str(tmp_path / "similarity"))
+    monkeypatch.setattr(similarity, "index", index)
+    return index
+
+
+@pytest.fixture(autouse=True)
+def imslp_cache(monkeypatch, tmp_path):
+    """Keep the IMSLP response cache of each test in its own directory."""
+    cache = http_cache.HttpCache(str(tmp_path / "imslp_cache"))
+    monkeypatch.setattr(http_cache, "cache", cache)
+    return cache
+
+
 @pytest.fixture(name="db_file")
 def db_file_fixture():
     """Temp sqlite file visible to both the sync TestClient and async session fixtures."""
@@ -1,9 +1,12 @@
 """Tests for the agent module."""
 
+import json
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
 
 from app import agent
 from shared.responses import FullResponse, ImslpResponse, Response
@@ -30,6 +33,21 @@ async def test_get_score_info():
     assert result == f"The scores infos are {scores.model_dump_json()}."
 
 
+@pytest.mark.asyncio
+async def test_recommend_scores():
+    """Test recommend_scores tool: compact top picks, not the whole library."""
+    ctx = MagicMock()
+    scores = [
+        Score(id=1, title="played", composer="Bach", number_of_plays=3),
+        Score(id=2, title="new", composer="Ravel"),
+    ]
+    ctx.deps = agent.Deps(user=User(username="test"), scores=Scores(scores=scores))
+    result = json.loads(await agent.recommend_scores(ctx, k=1))
+    assert [pick["id"] for pick in result] == [2]
+    assert "rarely played" in result[0]["reasons"]
+    assert "long_description" not in result[0]
+
+
 @pytest.mark.asyncio
 async def test_get_user_name():
     """Test get_user_name tool."""
@@ -294,7 +312,6 @@ async def test_run_imslp_complete_agent_http_error_retry(monkeypatch):
     mock_agent_instance.run = mock_agent_run
     mock_agent_class = MagicMock(return_value=mock_agent_instance)
     monkeypatch.setattr("app.agent.Agent", mock_agent_class)
-    monkeypatch.setattr("app.agent.time.sleep", lambda x: None)
 
     result = await agent.run_imslp_complete_agent('{"title": "test"}')
     assert result == score_base
@@ -323,8 +340,39 @@ async def test_run_imslp_complete_agent_generic_exception(monkeypatch):
     mock_agent_instance.run = mock_agent_run
     mock_agent_class = MagicMock(return_value=mock_agent_instance)
     monkeypatch.setattr("app.agent.Agent", mock_agent_class)
-    monkeypatch.setattr("app.agent.time.sleep", lambda x: None)
 
     with pytest.raises(Exception):
         await agent.run_imslp_complete_agent('{"title": "test"}')
     assert mock_agent_run.call_count == 5
+
+
+@pytest.mark.asyncio
+async def test_run_imslp_batch_complete_agent_typed_pieces(monkeypatch):
+    """Pieces hold only the fields the model gave; invalid ones are sent back, unasked dropped."""
+    prompts = []
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        prompts.append(messages[-1].parts[-1].content)
+        year = "unknown" if len(prompts) == 1 else 1835
+        pieces = {
+            1: {"composer": "Haydn", "year": 1780},
+            2: {"title": "Nocturne", "year": year},
+            9: {"title": "Extra"},
+        }
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": pieces})])
+
+    real = agent.get_imslp_batch_complete_agent
+    monkeypatch.setattr(
+        agent, "get_imslp_batch_complete_agent", lambda _m: real(FunctionModel(respond))
+    )
+
+    result = await agent.run_imslp_batch_complete_agent(
+        {1: '{"title": "Sonata"}', 2: '{"title": "Nocturne"}'}, model="test"
+    )
+
+    assert {i: fix.model_dump(exclude_unset=True) for i, fix in result.items()} == {
+        1: {"composer": "Haydn", "year": 1780},
+        2: {"title": "Nocturne", "year": 1835},
+    }
+    assert '1: {"title": "Sonata"}' in prompts[0]
+    assert len(prompts) == 2
@@ -0,0 +1,63 @@
+"""Tests for the shared crawl state and its lease."""
+
+import pytest
+
+from app import config, crawl_state
+
+
+@pytest.fixture(autouse=True)
+def state_sessions(session, async_session_factory, monkeypatch):
+    """The crawl state is read and written in the test DB."""
+    monkeypatch.setattr(crawl_state, "AsyncSession", lambda *_a, **_k: async_session_factory())
+
+
+@pytest.mark.asyncio
+async def test_one_worker_holds_the_lease(monkeypatch):
+    """A live lease keeps other workers from running or updating the crawl."""
+    assert await crawl_state.acquire("crawl", status="processing", page=3)
+    assert await crawl_state.acquire("crawl")  # already ours
+
+    monkeypatch.setattr(crawl_state, "WORKER_ID", "elsewhere:1")
+    assert not await crawl_state.acquire("crawl", status="starting")
+    assert await crawl_state.renew("crawl", page=7) is None
+    await crawl_state.release("crawl", status="completed")
+
+    state = await crawl_state.read("crawl")
+    assert (state.status, state.page) == ("processing", 3)
+    assert state.lease_owner != "elsewhere:1"
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_reads_interrupted_and_is_taken_over(monkeypatch):
+    """A worker that stopped renewing its lease loses the crawl to the next one."""
+    monkeypatch.setattr(config, "IMSLP_LEASE_SECONDS", -1)
+    assert await crawl_state.acquire("crawl", status="processing", checkpoint=4)
+    assert (await crawl_state.read("crawl")).status == "interrupted"
+
+    monkeypatch.setattr(crawl_state, "WORKER_ID", "elsewhere:1")
+    assert await crawl_state.acquire("crawl", status="starting")
+    state = await crawl_state.read("crawl")
+    assert (state.lease_owner, state.checkpoint) == ("elsewhere:1", 4)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_cancel_and_release():
+    """Renewals carry the checkpoint back and the cancel flag out."""
+    assert await crawl_state.acquire("crawl", status="processing")
+    assert await crawl_state.renew("crawl", page=2, checkpoint=1, written=10) is False
+    await crawl_state.request_cancel("crawl")
+    assert await crawl_state.renew("crawl", status="cancelling") is True
+    await crawl_state.release("crawl", status="cancelled", last_id=1500)
+
+    state = await crawl_state.read("crawl")
+    assert (state.status, state.page, state.checkpoint, state.written) == ("cancelled", 2, 1, 10)
+    assert (state.last_id, state.lease_owner, state.cancel_requested) == (1500, None, True)
+    await crawl_state.request_cancel("crawl")  # nothing running
+    assert (await crawl_state.read("crawl")).status == "cancelled"
+
+
+@pytest.mark.asyncio
+async def test_unknown_crawl_is_idle():
+    """A crawl never started has the default state."""
+    state = await crawl_state.read("never")
+    assert (state.status, state.checkpoint, state.lease_owner) == ("idle", 0, None)
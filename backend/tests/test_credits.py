@@ -1,21 +1,32 @@
 """Tests for app.credits.consume_credit."""
 
 import asyncio
+from datetime import UTC, datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
-from fastapi import HTTPException
+from fastapi import HTTPException, Response
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from sqlmodel import SQLModel
+from sqlmodel import SQLModel, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.credits import consume_credit
+from app import config, credits
+from app.credits import CREDITS_HEADER, consume_credit, release, reserve
+from shared.credits import CreditLedger
 from shared.user import User
 
 
 @pytest.fixture(name="async_session_factory")
-async def async_session_factory_fixture():
-    """Fresh in-memory async SQLite engine shared across sessions for one test."""
-    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+async def async_session_factory_fixture(db_file):
+    """Fresh SQLite file DB; sessions get their own connections, as in production.
+
+    An in-memory database would hand every session the same connection, so
+    one session's rollback could undo another's uncommitted debit. Writers
+    wait up to 30 s for SQLite's lock rather than failing with "database is
+    locked" when many debit at once.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}", connect_args={"timeout": 30})
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
     factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -97,3 +108,184 @@ async def test_consume_credit_no_double_spend_under_concurrency(async_session_fa
     assert ok_count == 1
     assert http_403_count == 1
     assert await _read_credits(async_session_factory, user_id) == 0
+
+
+async def _ledger(factory, user_id: int) -> list[CreditLedger]:
+    async with factory() as session:
+        rows = await session.exec(select(CreditLedger).where(CreditLedger.user_id == user_id))
+        return list(rows.all())
+
+
+async def test_ledger_records_settled_and_released_reservations(async_session_factory, seed_user):
+    """Each call leaves one ledger row: settled on success, released on failure."""
+    user_id = await seed_user(3)
+    response = Response()
+    async with async_session_factory() as session:
+        async with consume_credit(user_id, session, response, "/agent"):
+            pass
+    assert response.headers[CREDITS_HEADER] == "2"
+    with pytest.raises(RuntimeError):
+        async with async_session_factory() as session:
+            async with consume_credit(user_id, session, endpoint="/imslp_agent"):
+                raise RuntimeError("agent failed")
+
+    ledger = await _ledger(async_session_factory, user_id)
+    assert [(e.endpoint, e.delta, e.balance, e.reason, e.status) for e in ledger] == [
+        ("/agent", -1, 2, "agent", "settled"),
+        ("/imslp_agent", -1, 1, "agent", "released"),
+    ]
+    # a reservation is released at most once
+    async with async_session_factory() as session:
+        assert await release(session, ledger[1].id) is None  # type: ignore[arg-type]
+    assert await _read_credits(async_session_factory, user_id) == 2
+
+
+async def test_out_of_credits_header(async_session_factory, seed_user):
+    """The 403 tells the frontend there are no credits left."""
+    user_id = await seed_user(0)
+    with pytest.raises(HTTPException) as exc:
+        async with async_session_factory() as session:
+            async with consume_credit(user_id, session):
+                pass  # pragma: no cover
+    assert exc.value.headers == {CREDITS_HEADER: "0"}
+    assert await _ledger(async_session_factory, user_id) == []
+
+
+async def test_refund_failure_is_logged(async_session_factory, seed_user, monkeypatch, caplog):
+    """A failing release doesn't hide the agent error."""
+    user_id = await seed_user(1)
+
+    async def broken_release(*_args):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(credits, "release", broken_release)
+    with pytest.raises(ValueError):
+        async with async_session_factory() as session:
+            async with consume_credit(user_id, session):
+                raise ValueError("agent failed")
+    assert "failed to refund credit" in caplog.text
+
+
+def _postgres_session(first=None, scalar=None) -> MagicMock:
+    """Session on a PostgreSQL bind whose statements answer ``first`` / ``scalar``."""
+    result = MagicMock()
+    result.first.return_value = first
+    result.scalar.return_value = scalar
+    session = MagicMock()
+    session.bind.dialect.name = "postgresql"
+    session.exec = AsyncMock(return_value=result)
+    session.commit = AsyncMock()
+    return session
+
+
+def _sql(session: MagicMock) -> str:
+    (statement,) = session.exec.await_args.args
+    return " ".join(str(statement.compile(dialect=postgresql.dialect())).split())
+
+
+async def test_postgres_reserve_is_one_statement():
+    """On PostgreSQL the debit and its ledger row are one CTE statement."""
+    session = _postgres_session(first=(7, 2))
+
+    assert await reserve(session, 1, "/agent") == (7, 2)
+
+    session.exec.assert_awaited_once()
+    sql = _sql(session)
+    assert sql.startswith(
+        'WITH debit AS (UPDATE "user" SET credits=("user".credits - %(credits_1)s)'
+        ' WHERE "user".id = %(id_1)s AND "user".credits > %(credits_2)s'
+        ' RETURNING "user".id, "user".credits)'
+        " INSERT INTO credit_ledger (user_id, delta, balance, reason, endpoint, status,"
+        " created_at) SELECT debit.id,"
+    )
+    assert sql.endswith("FROM debit RETURNING credit_ledger.id, credit_ledger.balance")
+    session.commit.assert_awaited_once()
+
+    assert await reserve(_postgres_session(first=None), 1, "/agent") is None
+
+
+async def test_postgres_release_is_one_statement():
+    """On PostgreSQL marking the row released and the refund are one CTE statement."""
+    session = _postgres_session(scalar=3)
+
+    assert await release(session, 7) == 3
+
+    session.exec.assert_awaited_once()
+    assert _sql(session) == (
+        "WITH released AS (UPDATE credit_ledger SET status=%(param_1)s"
+        " WHERE credit_ledger.id = %(id_1)s AND credit_ledger.status = %(status_1)s"
+        " RETURNING credit_ledger.user_id, credit_ledger.delta)"
+        ' UPDATE "user" SET credits=("user".credits - released.delta) FROM released'
+        ' WHERE "user".id = released.user_id RETURNING "user".credits'
+    )
+    session.commit.assert_awaited_once()
+
+
+async def test_settle_failure_is_logged(async_session_factory, seed_user, monkeypatch, caplog):
+    """A failing settle doesn't fail the call; the credit stays spent, the row reserved."""
+    user_id = await seed_user(1)
+
+    async def broken_settle(*_args):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(credits, "settle", broken_settle)
+    async with async_session_factory() as session:
+        async with consume_credit(user_id, session):
+            pass
+    assert "failed to settle credit reservation" in caplog.text
+    assert await _read_credits(async_session_factory, user_id) == 0
+    assert [e.status for e in await _ledger(async_session_factory, user_id)] == ["reserved"]
+
+
+async def test_sweep_settles_stale_reservations(async_session_factory, seed_user):
+    """Reservations past the TTL are settled, younger ones left to their call."""
+    user_id = await seed_user(0)
+    old = datetime.now(UTC) - timedelta(seconds=config.CREDIT_RESERVATION_TTL + 60)
+    async with async_session_factory() as session:
+        for created_at, status in ((old, "reserved"), (datetime.now(UTC), "reserved")):
+            session.add(
+                CreditLedger(
+                    user_id=user_id, delta=-1, balance=0, status=status, created_at=created_at
+                )
+            )
+        session.add(CreditLedger(user_id=user_id, delta=-1, status="released", created_at=old))
+        await session.commit()
+        assert await credits.sweep(session) == 1
+    ledger = await _ledger(async_session_factory, user_id)
+    assert [e.status for e in ledger] == ["settled", "reserved", "released"]
+
+
+async def test_sweep_forever(async_session_factory, monkeypatch, caplog):
+    """The sweep loop goes on after a failure."""
+    monkeypatch.setattr(config, "CREDIT_SWEEP_INTERVAL", 0)
+    monkeypatch.setattr(credits, "AsyncSession", lambda *_a, **_k: async_session_factory())
+    sweep = AsyncMock(side_effect=[RuntimeError("db down"), 0, 2, asyncio.CancelledError()])
+    monkeypatch.setattr(credits, "sweep", sweep)
+
+    with pytest.raises(asyncio.CancelledError):
+        await credits.sweep_forever()
+
+    assert sweep.await_count == 4
+    assert "sweeping stale credit reservations failed" in caplog.text
+    assert "settled 2 stale credit reservations" in caplog.text
+
+
+async def test_500_parallel_debits(async_session_factory, seed_user):
+    """500 concurrent calls on 300 credits: exactly 300 pass, each with a ledger row."""
+    user_id = await seed_user(300)
+
+    async def run():
+        async with async_session_factory() as session:
+            async with consume_credit(user_id, session):
+                return "ok"
+
+    results = await asyncio.gather(*(run() for _ in range(500)), return_exceptions=True)
+
+    assert results.count("ok") == 300
+    refused = [r for r in results if isinstance(r, HTTPException) and r.status_code == 403]
+    assert len(refused) == 200
+    assert await _read_credits(async_session_factory, user_id) == 0
+    ledger = await _ledger(async_session_factory, user_id)
+    assert len(ledger) == 300
+    assert {e.status for e in ledger} == {"settled"}
+    assert sorted(e.balance for e in ledger) == list(range(300))
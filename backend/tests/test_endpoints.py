@@ -34,7 +34,7 @@ def test_complete_score_debits_credit_and_returns_score(
     """Happy path — agent returns; credit is debited once."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_complete_agent(score, _model):
+    async def fake_run_complete_agent(score, _model, _fallbacks, **_kwargs):
         return score
 
     monkeypatch.setattr(main, "run_complete_agent", fake_run_complete_agent)
@@ -55,7 +55,7 @@ def test_complete_score_refunds_credit_on_agent_error(
     """Agent error → endpoint returns 500 and ``consume_credit`` refunds."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_complete_agent(_score, _model):
+    async def fake_run_complete_agent(_score, _model, _fallbacks, **_kwargs):
         raise RuntimeError("model exploded")
 
     monkeypatch.setattr(main, "run_complete_agent", fake_run_complete_agent)
@@ -75,7 +75,7 @@ def test_imslp_agent_debits_credit_and_returns_response(
     """Happy path for the IMSLP SQL agent endpoint."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_imslp_agent(_prompt, message_history=None, model=None):
+    async def fake_run_imslp_agent(_prompt, message_history=None, model=None, fallbacks=None):
         return ImslpFullResponse(
             response=ImslpResponse(response="found 3 scores", score_ids=[1, 2, 3]),
             message_history=[],
@@ -88,6 +88,7 @@ def test_imslp_agent_debits_credit_and_returns_response(
     assert resp.status_code == 200
     assert resp.json()["response"]["score_ids"] == [1, 2, 3]
     assert _credits(session, test_user.id) == start - 1
+    assert resp.headers["X-Credits-Remaining"] == str(start - 1)
 
 
 def test_imslp_agent_refunds_credit_on_error(
@@ -96,7 +97,7 @@ def test_imslp_agent_refunds_credit_on_error(
     """IMSLP agent raises → refund path executes."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_imslp_agent(_prompt, message_history=None, model=None):
+    async def fake_run_imslp_agent(_prompt, message_history=None, model=None, fallbacks=None):
         raise RuntimeError("db down")
 
     monkeypatch.setattr(main, "run_imslp_agent", fake_run_imslp_agent)
@@ -113,7 +114,7 @@ def test_main_agent_debits_credit_and_returns_response(
     """Happy path for the main chat agent endpoint."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_agent(_prompt, deps, message_history=None, model=None):
+    async def fake_run_agent(_prompt, deps, message_history=None, model=None, fallbacks=None):
         assert deps.user.id == test_user.id
         return FullResponse(response=Response(response="play this one"), message_history=[])
 
@@ -135,7 +136,7 @@ def test_main_agent_refunds_credit_on_error(
     """Main agent raises → refund path executes."""
     start = _credits(session, test_user.id)
 
-    async def fake_run_agent(_prompt, deps, message_history=None, model=None):
+    async def fake_run_agent(_prompt, deps, message_history=None, model=None, fallbacks=None):
         raise RuntimeError("llm timeout")
 
     monkeypatch.setattr(main, "run_agent", fake_run_agent)
@@ -175,3 +176,25 @@ def test_agent_endpoint_blocks_when_out_of_credits(
     assert resp.status_code == 403
     assert "credits" in resp.json()["detail"].lower()
     assert called is False
+
+
+def test_agent_endpoint_passes_fallback_chain(
+    client: TestClient, session, monkeypatch: pytest.MonkeyPatch
+):
+    """Fallback chains stored via /admin/model reach the agent runner."""
+    from shared.settings import Setting  # noqa: PLC0415
+
+    session.add(Setting(key="model_imslp", value="primary"))
+    session.add(Setting(key="fallback_imslp", value='["backup-1", "backup-2"]'))
+    session.commit()
+    seen: dict = {}
+
+    async def fake_run_imslp_agent(_prompt, message_history=None, model=None, fallbacks=None):
+        seen.update(model=model, fallbacks=fallbacks)
+        return ImslpFullResponse(
+            response=ImslpResponse(response="ok", score_ids=[]), message_history=[]
+        )
+
+    monkeypatch.setattr(main, "run_imslp_agent", fake_run_imslp_agent)
+    assert client.post("/imslp_agent", json={"prompt": "hi"}).status_code == 200
+    assert seen == {"model": "primary", "fallbacks": ["backup-1", "backup-2"]}
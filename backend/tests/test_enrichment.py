@@ -0,0 +1,488 @@
+"""Tests for batch score enrichment and the shared enrichment cache."""
+
+import json
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import agent, config, db, enrichment, main
+from app.rate_limit import limiter
+from app.users import get_admin_user
+from shared.enrichment import EnrichmentCache
+from shared.scores import IMSLP, Period, Score
+from shared.user import User
+
+
+@pytest.fixture(autouse=True)
+def batch_env(monkeypatch, async_session_factory):
+    """No rate limit, job sessions on the test DB, empty job store."""
+    limiter.enabled = False
+    monkeypatch.setattr(enrichment, "AsyncSession", lambda *_a, **_k: async_session_factory())
+    monkeypatch.setattr(enrichment, "jobs", enrichment.OrderedDict())
+    yield
+    limiter.enabled = True
+
+
+def _score_ids(session, user: User) -> list[int]:
+    return [s.id for s in session.exec(select(Score).where(Score.user_id == user.id))]
+
+
+def _credits(session, user: User) -> int:
+    session.expire_all()
+    return session.get(User, user.id).credits
+
+
+def test_batch_enriches_scores_and_refunds_failures(
+    client: TestClient, session, test_user: User, monkeypatch
+):
+    """Scores are written back; failed and missing ones cost nothing."""
+    ids = _score_ids(session, test_user)
+    start = _credits(session, test_user)
+
+    async def fake_complete(score, _model, _fallbacks, strict=False, fields=None):
+        assert strict
+        if score.title == "title_2":
+            raise RuntimeError("model exploded")
+        return Score(
+            title="ignored", composer="ignored", year=1830, long_description="long", user_id=None
+        )
+
+    monkeypatch.setattr(enrichment, "run_complete_agent", fake_complete)
+    response = client.post("/complete_score/batch", json={"score_ids": [*ids, ids[0], 9999]})
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+    assert response.json()["total"] == len(ids) + 1
+
+    report = client.get(f"/complete_score/batch/{job_id}").json()
+    assert report["status"] == "completed"
+    assert report["counts"] == {"done": 3, "failed": 1, "not_found": 1}
+    assert [r["score_id"] for r in report["results"]] == [*ids, 9999]
+    assert report["results"][0]["score"]["year"] == 1830
+    assert report["results"][1]["error"] == "model exploded"
+    assert _credits(session, test_user) == start - 3
+
+    session.expire_all()
+    first = session.get(Score, ids[0])
+    assert (first.title, first.year, first.long_description) == ("title_1", 1830, "long")
+    assert first.user_id == test_user.id
+    assert session.get(Score, ids[1]).year == 1750
+
+
+def test_batch_stops_when_out_of_credits(client: TestClient, session, test_user: User, monkeypatch):
+    """Once credits run out the remaining scores are skipped."""
+    monkeypatch.setattr(config, "ENRICH_BATCH_CONCURRENCY", 1)
+    test_user.credits = 1
+    session.add(test_user)
+    session.commit()
+
+    async def fake_complete(score, *_args, **_kwargs):
+        return score
+
+    monkeypatch.setattr(enrichment, "run_complete_agent", fake_complete)
+    ids = _score_ids(session, test_user)
+    job_id = client.post("/complete_score/batch", json={"score_ids": ids}).json()["job_id"]
+
+    report = client.get(f"/complete_score/batch/{job_id}").json()
+    assert report["status"] == "out_of_credits"
+    statuses = [r["status"] for r in report["results"]]
+    assert statuses == ["done", "no_credits", "cancelled", "cancelled"]
+    assert _credits(session, test_user) == 0
+
+
+def test_batch_validation_and_ownership(client: TestClient, monkeypatch):
+    """Empty or oversized batches are rejected; other users' jobs are invisible."""
+    monkeypatch.setattr(config, "ENRICH_BATCH_MAX_ITEMS", 2)
+    assert client.post("/complete_score/batch", json={"score_ids": []}).status_code == 400
+    assert client.post("/complete_score/batch", json={"score_ids": [1, 2, 3]}).status_code == 400
+
+    enrichment.jobs["other"] = enrichment.BatchJob(id="other", user_id=-1, score_ids=[1])
+    assert client.get("/complete_score/batch/other").status_code == 404
+    assert client.post("/complete_score/batch/missing/cancel").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_cancel_skips_remaining_scores(client: TestClient, test_user: User):
+    """Cancelling marks not-yet-started scores as cancelled; finished jobs stay as they are."""
+    job = enrichment.BatchJob(id="j", user_id=test_user.id, score_ids=[1, 2], status="running")
+    enrichment.jobs["j"] = job
+    assert client.post("/complete_score/batch/j/cancel").json()["status"] == "running"
+    await enrichment.run_job(job, "test", [])
+    assert job.status == "cancelled"
+    assert job.snapshot()["counts"] == {"cancelled": 2}
+
+    job.cancel_requested = False
+    client.post("/complete_score/batch/j/cancel")
+    assert not job.cancel_requested
+
+
+def test_finished_jobs_are_pruned(monkeypatch):
+    """Only the newest finished jobs are kept; running ones never are dropped."""
+    monkeypatch.setattr(config, "ENRICH_BATCH_KEEP_JOBS", 2)
+    for job_id, status in (("a", "completed"), ("b", "running"), ("c", "cancelled")):
+        enrichment.jobs[job_id] = enrichment.BatchJob(
+            id=job_id, user_id=1, score_ids=[], status=status
+        )
+    enrichment._prune_jobs()
+    assert list(enrichment.jobs) == ["b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_complete_agent_strict_raises(monkeypatch):
+    """strict=True surfaces agent failures instead of returning the input score."""
+
+    def broken(_model):
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(agent, "get_complete_agent", broken)
+    score = Score(title="t", composer="c")
+    assert await agent.run_complete_agent(score, "test") is score
+    with pytest.raises(RuntimeError):
+        await agent.run_complete_agent(score, "test", strict=True)
+
+    def rejected(model):
+        raise ModelHTTPError(400, model)
+
+    monkeypatch.setattr(agent, "get_complete_agent", rejected)
+    with pytest.raises(ModelHTTPError):
+        await agent.run_complete_agent(score, "test", strict=True)
+
+
+def test_work_keys():
+    """Keys ignore case, accents, punctuation and composer word order."""
+    assert enrichment.title_key("Nocturne Op.9, No. 2") == "nocturne op 9 no 2"
+    assert enrichment.composer_key("Chopin, Frédéric") == enrichment.composer_key("frederic CHOPIN")
+
+
+def _nocturne(**fields) -> Score:
+    return Score(
+        title="Nocturne Op. 9 No. 2",
+        composer="Chopin",
+        year=1832,
+        period=Period.Romantic,
+        long_description="A nocturne.",
+        long_description_fr="Un nocturne.",
+        user_id=None,
+        **fields,
+    )
+
+
+def test_complete_score_uses_shared_cache(
+    client: TestClient, session, test_user: User, monkeypatch
+):
+    """The first completion is cached; similar requests are served from it for free."""
+    calls = []
+
+    async def fake_complete(score, _model, _fallbacks, **_kwargs):
+        calls.append(score.title)
+        return _nocturne()
+
+    monkeypatch.setattr(main, "run_complete_agent", fake_complete)
+    start = _credits(session, test_user)
+
+    first = client.post(
+        "/complete_score", json={"title": "Nocturne Op. 9 No. 2", "composer": "Chopin"}
+    )
+    assert first.json()["year"] == 1832
+    assert _credits(session, test_user) == start - 1
+
+    second = client.post(
+        "/complete_score",
+        json={"title": "Nocturne, op.9 no.2", "composer": "chopin", "key": "E-flat"},
+    )
+    assert second.status_code == 200
+    assert second.json()["long_description_fr"] == "Un nocturne."
+    assert second.json()["key"] == "E-flat"
+    assert second.json()["title"] == "Nocturne, op.9 no.2"
+    assert _credits(session, test_user) == start - 1
+    assert calls == ["Nocturne Op. 9 No. 2"]
+
+    # another number of the same opus is a different work
+    client.post("/complete_score", json={"title": "Nocturne Op. 9 No. 1", "composer": "Chopin"})
+    assert len(calls) == 2
+    entry = session.exec(
+        select(EnrichmentCache).where(EnrichmentCache.title_key == "nocturne op 9 no 2")
+    ).one()
+    assert entry.hits == 1
+
+
+def test_cache_hit_with_production_sessions(client: TestClient, session, async_session_factory):
+    """A cache hit also works with sessions that expire their objects on commit."""
+    session.add(
+        EnrichmentCache(
+            work_key="chopin|nocturne op 9 no 2",
+            composer_key="chopin",
+            title_key="nocturne op 9 no 2",
+            fields='{"year": 1832}',
+        )
+    )
+    session.commit()
+
+    async def get_async_session():
+        # as app.db.get_async_session: expire_on_commit left at its default
+        async with AsyncSession(async_session_factory.kw["bind"]) as async_session:
+            yield async_session
+
+    main.app.dependency_overrides[db.get_async_session] = get_async_session
+    response = client.post(
+        "/complete_score", json={"title": "Nocturne Op. 9 No. 2", "composer": "Chopin"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["year"] == 1832
+
+
+def test_stale_entries_are_refreshed(client: TestClient, session, monkeypatch):
+    """Entries past the TTL are re-run through the agent and updated in place."""
+    old = datetime.now(UTC) - timedelta(days=config.ENRICH_CACHE_TTL_DAYS + 1)
+    session.add(
+        EnrichmentCache(
+            work_key="chopin|nocturne op 9 no 2",
+            composer_key="chopin",
+            title_key="nocturne op 9 no 2",
+            fields='{"year": 1900}',
+            updated_at=old,
+        )
+    )
+    session.commit()
+
+    async def fake_complete(*_args, **_kwargs):
+        return _nocturne()
+
+    monkeypatch.setattr(main, "run_complete_agent", fake_complete)
+    response = client.post(
+        "/complete_score", json={"title": "Nocturne Op. 9 No. 2", "composer": "Chopin"}
+    )
+    assert response.json()["year"] == 1832
+    session.expire_all()
+    (entry,) = session.exec(select(EnrichmentCache)).all()
+    assert json.loads(entry.fields)["year"] == 1832
+    assert enrichment.is_fresh(entry)
+
+
+@pytest.mark.asyncio
+async def test_remember_tolerates_concurrent_insert(async_session_factory, session):
+    """Two requests caching the same work at once keep the first entry."""
+    score = _nocturne()
+    async with async_session_factory() as first, async_session_factory() as second:
+        assert await enrichment.find_entry(second, score.title, score.composer) is None
+        await enrichment.remember(first, score, score, "m1")
+        await enrichment.remember(second, score, score, "m2")
+    assert [e.model for e in session.exec(select(EnrichmentCache))] == ["m1"]
+
+
+def test_batch_serves_cached_scores_for_free(
+    client: TestClient, session, test_user: User, monkeypatch
+):
+    """Batch items hitting the cache are filled in without an agent call or a credit."""
+    ids = _score_ids(session, test_user)
+    session.add(
+        EnrichmentCache(
+            work_key="composer|title 1",
+            composer_key="composer",
+            title_key="title 1",
+            fields='{"year": 1801, "genre": "Etude"}',
+        )
+    )
+    session.commit()
+    start = _credits(session, test_user)
+
+    async def fake_complete(score, *_args, **_kwargs):
+        return score
+
+    monkeypatch.setattr(enrichment, "run_complete_agent", fake_complete)
+    job_id = client.post("/complete_score/batch", json={"score_ids": ids[:2]}).json()["job_id"]
+    report = client.get(f"/complete_score/batch/{job_id}").json()
+    assert [r["status"] for r in report["results"]] == ["cached", "done"]
+    assert report["results"][0]["score"]["genre"] == "Etude"
+    assert _credits(session, test_user) == start - 1
+    session.expire_all()
+    assert session.get(Score, ids[0]).year == 1801
+
+
+def test_admin_cache_endpoints(client: TestClient, session):
+    """Admins can list, search and purge cache entries."""
+    main.app.dependency_overrides[get_admin_user] = lambda: True
+    old = datetime.now(UTC) - timedelta(days=config.ENRICH_CACHE_TTL_DAYS + 1)
+    for key, updated_at in (("chopin|nocturne", datetime.now(UTC)), ("bach|fugue", old)):
+        composer, title = key.split("|")
+        session.add(
+            EnrichmentCache(
+                work_key=key, composer_key=composer, title_key=title, updated_at=updated_at
+            )
+        )
+    session.commit()
+
+    listing = client.get("/admin/enrichment_cache").json()
+    assert [(e["work_key"], e["stale"]) for e in listing] == [
+        ("chopin|nocturne", False),
+        ("bach|fugue", True),
+    ]
+    assert listing[0]["fields"] == {}
+    assert [e["work_key"] for e in client.get("/admin/enrichment_cache?q=Fugue").json()] == [
+        "bach|fugue"
+    ]
+
+    assert client.delete("/admin/enrichment_cache", params={"stale_only": True}).json() == {
+        "deleted": 1
+    }
+    entry_id = listing[0]["id"]
+    assert client.delete(f"/admin/enrichment_cache/{entry_id}").json() == {"deleted": 1}
+    assert client.delete(f"/admin/enrichment_cache/{entry_id}").status_code == 404
+    assert client.delete("/admin/enrichment_cache").json() == {"deleted": 0}
+
+
+def _catalogue(session) -> None:
+    session.add(
+        IMSLP(
+            id=42,
+            title="Nocturnes Op.9 No.2",
+            composer="Chopin, Frédéric",
+            permlink="https://imslp.org/wiki/Nocturnes,_Op.9_(Chopin,_Frédéric)",
+            year="1832",  # scraped as text
+            period="Romantic",
+            key="E-flat major",
+            instrumentation="Piano",
+            style="",
+        )
+    )
+    session.add(
+        IMSLP(
+            id=43, title="Nocturnes Op.9 No.1", composer="Chopin, Frédéric", permlink="", year="?"
+        )
+    )
+    session.commit()
+
+
+@pytest.mark.asyncio
+async def test_find_work(async_session_factory, session):
+    """Works are found by imslp_id, else by normalized composer and title."""
+    _catalogue(session)
+    async with async_session_factory() as db:
+        by_id = await enrichment.find_work(db, Score(title="x", composer="y", imslp_id=43))
+        assert by_id.id == 43
+        by_name = await enrichment.find_work(
+            db, Score(title="Nocturne, op. 9 no. 2", composer="frédéric chopin", imslp_id=7)
+        )
+        assert by_name.id == 42
+        assert (
+            await enrichment.find_work(db, Score(title="Nocturne Op.9 No.3", composer="Chopin"))
+            is None
+        )
+        assert (
+            await enrichment.find_work(db, Score(title="Nocturne Op.9 No.2", composer="Field"))
+            is None
+        )
+        assert await enrichment.find_work(db, Score(title="9", composer="Chopin")) is None
+
+
+def test_complete_score_fills_from_catalogue(
+    client: TestClient, session, test_user: User, monkeypatch
+):
+    """Catalogue facts are copied for free; the agent is only asked for the rest."""
+    _catalogue(session)
+    asked = []
+
+    async def fake_complete(score, _model, _fallbacks, fields=None):
+        asked.append(fields)
+        return Score(**{**score.model_dump(), "long_description": "A nocturne."})
+
+    monkeypatch.setattr(main, "run_complete_agent", fake_complete)
+    start = _credits(session, test_user)
+    response = client.post(
+        "/complete_score",
+        json={
+            "title": "Nocturne Op. 9 No. 2",
+            "composer": "Chopin",
+            "key": "E-flat",
+            "short_description": "Mine",
+        },
+    ).json()
+    assert (response["year"], response["period"], response["imslp_id"]) == (1832, "Romantic", 42)
+    assert response["key"] == "E-flat"
+    assert response["instrumentation"] == "Piano"
+    assert response["long_description"] == "A nocturne."
+    (fields,) = asked
+    assert "long_description" in fields and "style" in fields
+    assert not {"year", "period", "key", "instrumentation"} & set(fields)
+    assert _credits(session, test_user) == start - 1
+
+    # what the catalogue and the agent found is shared, what the user typed is not
+    cached = json.loads(session.exec(select(EnrichmentCache)).one().fields)
+    assert (cached["year"], cached["long_description"]) == (1832, "A nocturne.")
+    assert "key" not in cached and "short_description" not in cached
+
+    # unparsable catalogue values are left to the agent
+    client.post("/complete_score", json={"title": "Nocturne Op. 9 No. 1", "composer": "Chopin"})
+    assert "year" in asked[-1]
+
+
+def test_batch_completes_from_catalogue_alone_for_free(
+    client: TestClient, session, test_user: User, monkeypatch
+):
+    """Scores whose only gaps the catalogue fills never reach the agent."""
+    _catalogue(session)
+    known = {
+        "genre": "Nocturne",
+        "form": "Ternary",
+        "style": "Romantic",
+        "short_description": "d",
+        "short_description_fr": "d",
+        "long_description": "d",
+        "long_description_fr": "d",
+        "youtube_url": "https://youtu.be/x",
+        "difficulty": "advanced",
+        "notable_interpreters": "Rubinstein",
+    }
+    score = Score.model_validate(
+        {"title": "Nocturne Op. 9 No. 2", "composer": "Chopin", "user_id": test_user.id, **known}
+    )
+    session.add(score)
+    session.commit()
+    start = _credits(session, test_user)
+
+    async def fake_complete(*_args, **_kwargs):
+        raise AssertionError("agent called")  # pragma: no cover
+
+    monkeypatch.setattr(enrichment, "run_complete_agent", fake_complete)
+    job_id = client.post("/complete_score/batch", json={"score_ids": [score.id]}).json()["job_id"]
+    (result,) = client.get(f"/complete_score/batch/{job_id}").json()["results"]
+    assert result["status"] == "catalogue"
+    assert (result["score"]["year"], result["score"]["imslp_id"]) == (1832, 42)
+    assert _credits(session, test_user) == start
+
+
+@pytest.mark.asyncio
+async def test_run_complete_agent_asks_only_for_missing_fields(monkeypatch):
+    """With ``fields`` the agent sees the known facts and answers only the gaps."""
+    prompts = []
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        prompts.append(messages[0].parts[-1].content)
+        properties = info.output_tools[0].parameters_json_schema["properties"]
+        assert set(properties) == {"long_description", "difficulty"}
+        return ModelResponse(
+            parts=[
+                ToolCallPart(
+                    info.output_tools[0].name,
+                    {"long_description": "A nocturne.", "difficulty": "advanced"},
+                )
+            ]
+        )
+
+    real = agent.get_fields_agent
+    monkeypatch.setattr(agent, "get_fields_agent", lambda _m, f: real(FunctionModel(respond), f))
+    score = _nocturne(key="E-flat major")
+    out = await agent.run_complete_agent(score, "test", fields=["long_description", "difficulty"])
+    assert (out.long_description, out.difficulty, out.key) == (
+        "A nocturne.",
+        "advanced",
+        "E-flat major",
+    )
+    assert '"key":"E-flat major"' in prompts[0]
+    assert "long_description_fr" not in prompts[0]
@@ -0,0 +1,164 @@
+"""Tests for the IMSLP response cache."""
+
+import hashlib
+import os
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import config, http_cache
+from app.main import app
+from app.users import get_admin_user
+
+URL = "https://imslp.org/wiki/Symphony_No.5"
+
+
+class Server:
+    """Handler of an httpx mock transport serving ``bodies`` with validators."""
+
+    def __init__(self, **bodies: bytes):
+        self.bodies = bodies
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        body = self.bodies.get(request.url.path.rsplit("/", 1)[-1])
+        if body is None:
+            return httpx.Response(404)
+        etag = f'"{len(body)}-{body[:4].hex()}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        headers = {
+            "etag": etag,
+            "last-modified": "Wed, 01 Jan 2025 00:00:00 GMT",
+            "content-type": "text/html; charset=utf-8",
+        }
+        return httpx.Response(200, content=body, headers=headers)
+
+
+@pytest.fixture(name="server")
+def server_fixture():
+    """Stand-in IMSLP with one work page."""
+    return Server(**{"Symphony_No.5": "<html>Sinfonie Nr. 5 – c-moll</html>".encode()})
+
+
+@pytest.fixture(name="client")
+async def client_fixture(server):
+    """HTTP client talking to the stand-in IMSLP."""
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_revalidates_with_conditional_requests(client, server, imslp_cache):
+    """A cached URL is asked for again with its validators and a 304 serves the body."""
+    first = await http_cache.get(client, URL)
+    second = await http_cache.get(client, URL)
+
+    assert first.text == second.text == "<html>Sinfonie Nr. 5 – c-moll</html>"
+    assert "if-none-match" not in server.requests[0].headers
+    assert server.requests[1].headers["if-none-match"] == first.headers["etag"]
+    assert server.requests[1].headers["if-modified-since"] == "Wed, 01 Jan 2025 00:00:00 GMT"
+    stats = imslp_cache.stats()
+    assert (stats["entries"], stats["downloaded"], stats["revalidated"]) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_changed_page_replaces_its_body(client, server, imslp_cache):
+    """A page that changed is downloaded again and its old body removed."""
+    await http_cache.get(client, URL)
+    server.bodies["Symphony_No.5"] = b"<html>revised</html>"
+
+    assert (await http_cache.get(client, URL)).text == "<html>revised</html>"
+
+    bodies = [f for _, _, files in os.walk(imslp_cache.path + "/bodies") for f in files]
+    assert len(bodies) == 1
+    assert imslp_cache.stats()["bytes"] == len(b"<html>revised</html>")
+
+
+@pytest.mark.asyncio
+async def test_cache_only(client, server):
+    """From the cache only, no request is sent and an uncached URL is a miss."""
+    await http_cache.get(client, URL)
+
+    cached = await http_cache.get(client, URL, cache_only=True)
+
+    assert cached.text == "<html>Sinfonie Nr. 5 – c-moll</html>"
+    assert len(server.requests) == 1
+    with pytest.raises(http_cache.CacheMissError):
+        await http_cache.get(client, "https://imslp.org/wiki/Other", cache_only=True)
+
+
+@pytest.mark.asyncio
+async def test_errors_and_disabled_cache_are_not_stored(client, server, imslp_cache, monkeypatch):
+    """Only successful responses are cached, and nothing when the cache is off."""
+    assert (await http_cache.get(client, "https://imslp.org/wiki/Missing")).status_code == 404
+    monkeypatch.setattr(config, "IMSLP_CACHE", False)
+    await http_cache.get(client, URL)
+    await http_cache.get(client, URL)
+
+    assert imslp_cache.stats()["entries"] == 0
+    assert "if-none-match" not in server.requests[-1].headers
+
+
+def _response(body: bytes) -> httpx.Response:
+    return httpx.Response(200, content=body, headers={"etag": '"x"'})
+
+
+def test_least_recently_used_urls_are_evicted(tmp_path):
+    """Past its size the cache drops the URLs used longest ago."""
+    cache = http_cache.HttpCache(str(tmp_path), max_bytes=250)
+    cache.put("a", _response(b"a" * 100))
+    cache.put("b", _response(b"b" * 100))
+    assert cache.get("a") is not None  # now more recent than b
+    cache.put("c", _response(b"c" * 100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["bytes"] == 200
+
+    cache.put("d", _response(b"d" * 300))  # larger than the whole cache
+    assert cache.stats()["entries"] == cache.stats()["bytes"] == 0
+
+
+def test_identical_bodies_are_stored_once(tmp_path):
+    """Bodies are content-addressed: URLs with the same body share it."""
+    cache = http_cache.HttpCache(str(tmp_path))
+    cache.put("a", _response(b"same" * 25))
+    cache.put("b", _response(b"same" * 25))
+    assert cache.stats()["bytes"] == 100
+
+    cache.put("a", _response(b"a" * 10))  # b still uses the old body
+
+    assert cache.get("b").content == b"same" * 25
+    assert cache.stats()["bytes"] == 110
+
+
+def test_reopened_cache_and_lost_bodies(tmp_path):
+    """A cache reopened on its directory has its entries; a body deleted by hand is a miss."""
+    cache = http_cache.HttpCache(str(tmp_path))
+    cache.put("a", _response(b"a" * 10))
+    cache.put("b", _response(b"b" * 20))
+
+    reopened = http_cache.HttpCache(str(tmp_path))
+    assert reopened.stats()["bytes"] == 30
+    assert reopened.get("b") is not None
+    os.remove(reopened._body_path(hashlib.sha256(b"b" * 20).hexdigest()))
+    assert reopened.get("b") is None
+    assert reopened.stats()["entries"] == 1
+    os.remove(reopened._body_path(hashlib.sha256(b"a" * 10).hexdigest()))
+    reopened.put("a", _response(b"a" * 5))
+    assert reopened.get("a").content == b"a" * 5
+
+
+def test_cache_stats_endpoint(imslp_cache):
+    """Admins can see how full the cache is."""
+    imslp_cache.put("a", _response(b"a" * 10))
+    app.dependency_overrides[get_admin_user] = lambda: True
+    try:
+        stats = TestClient(app).get("/imslp/cache/stats").json()
+    finally:
+        app.dependency_overrides.clear()
+    assert (stats["entries"], stats["bytes"]) == (1, 10)
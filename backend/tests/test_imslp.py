@@ -1,12 +1,19 @@
 """Tests for IMSLP integration."""
 
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+from datetime import UTC, datetime
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from sqlmodel import Session, select
+from sqlmodel import Session, delete, select, update
 
-from app import db
+from app import config, crawl_state, db, imslp
+from app.agent import ImslpFix
 from app.imslp import (
     add_entry,
     fix_entry,
@@ -16,9 +23,11 @@ from app.imslp import (
     get_works,
     progress_tracker,
 )
+from app.imslp_parser import metadata_hash
 from app.main import app
 from app.users import get_admin_user
-from shared.scores import IMSLP, ScoreBase
+from shared.crawl import CrawlState
+from shared.scores import IMSLP, Period, ScoreBase
 
 client = TestClient(app)
 
@@ -45,11 +54,24 @@ def apply_test_db_override(session):
     app.dependency_overrides.clear()
 
 
-@pytest.fixture
-def mock_requests_get():
-    """Mock requests.get."""
-    with patch("app.imslp.requests.get") as mock:
-        yield mock
+@pytest.fixture(autouse=True)
+def crawl_sessions(session, async_session_factory, monkeypatch):
+    """The crawl's own sessions, and its shared state's, use the test DB."""
+    for module in (imslp, crawl_state):
+        monkeypatch.setattr(module, "AsyncSession", lambda *_a, **_k: async_session_factory())
+
+
+@pytest.fixture(autouse=True)
+def idle_crawl():
+    """No crawl is running on this worker at the start of a test."""
+    progress_tracker.update(status="idle", cancel_requested=False)
+
+
+@pytest.fixture(name="async_session")
+async def async_session_fixture(async_session_factory):
+    """Async session on the test DB."""
+    async with async_session_factory() as async_session:
+        yield async_session
 
 
 @pytest.fixture
@@ -60,16 +82,23 @@ def mock_httpx_get():
 
 
 @pytest.fixture
-def mock_requests_session():
-    """Mock requests.Session."""
-    with patch("app.imslp.requests.Session") as mock:
+def mock_httpx_head():
+    """Mock httpx.AsyncClient.head."""
+    with patch("app.imslp.httpx.AsyncClient.head", new_callable=AsyncMock) as mock:
         yield mock
 
 
 @pytest.fixture(name="mock_agent")
 def mock_agent_fixture():
-    """Mock run_imslp_complete_agent."""
-    with patch("app.imslp.run_imslp_complete_agent", new_callable=AsyncMock) as mock:
+    """Mock run_imslp_complete_agent, which the batched completion asks for each entry."""
+
+    async def complete_each(entries, *args):
+        return {i: await mock(entry, *args) for i, entry in entries.items()}
+
+    with (
+        patch("app.imslp.run_imslp_complete_agent", new_callable=AsyncMock) as mock,
+        patch("app.imslp.run_imslp_batch_complete_agent", side_effect=complete_each),
+    ):
         yield mock
 
 
@@ -112,7 +141,8 @@ def test_get_metadata():
     assert not get_metadata(mock_response)
 
 
-def test_get_pdfs(mock_requests_session):
+@pytest.mark.asyncio
+async def test_get_pdfs(mock_httpx_get, mock_httpx_head):
     """Test get_pdfs extraction."""
     html_landing = """
     <html>
@@ -129,15 +159,15 @@ def test_get_pdfs(mock_requests_session):
     mock_response_landing = MagicMock()
     mock_response_landing.text = html_landing
 
-    mock_session_instance = mock_requests_session.return_value
     mock_response_page = MagicMock()
     mock_response_page.text = html_page
 
-    mock_session_instance.get.return_value = mock_response_page
+    mock_httpx_get.return_value = mock_response_page
 
     # Test with direct link found
-    pdfs = get_pdfs(mock_response_landing)
+    pdfs = await get_pdfs(mock_response_landing)
     assert pdfs == ["http://example.com/score.pdf"]
+    mock_httpx_get.assert_awaited_once_with("Special:ImagefromIndex/12345")
 
     # Test with redirect (no sm_dl_wait)
     html_page_redirect = "<html></html>"
@@ -145,17 +175,76 @@ def test_get_pdfs(mock_requests_session):
 
     mock_head_response = MagicMock()
     mock_head_response.url = "http://example.com/redirected.pdf"
-    mock_session_instance.head.return_value = mock_head_response
+    mock_httpx_head.return_value = mock_head_response
 
-    pdfs = get_pdfs(mock_response_landing)
+    pdfs = await get_pdfs(mock_response_landing)
     assert pdfs == ["http://example.com/redirected.pdf"]
 
     # Test with redirect not PDF
     mock_head_response.url = "http://example.com/redirected.html"
-    pdfs = get_pdfs(mock_response_landing)
+    pdfs = await get_pdfs(mock_response_landing)
     assert not pdfs
 
 
+@pytest.mark.asyncio
+async def test_get_pdfs_resolves_landing_pages_concurrently(mock_httpx_get, monkeypatch):
+    """Landing pages are fetched at once, up to IMSLP_PDF_CONCURRENCY, in order."""
+    monkeypatch.setattr(config, "IMSLP_PDF_CONCURRENCY", 2)
+    links = "".join(f'<a href="Special:ImagefromIndex/{i}">{i}</a>' for i in range(5))
+    running, peak = 0, 0
+
+    async def get(url, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        i = url.rsplit("/", 1)[1]
+        return MagicMock(text=f'<span id="sm_dl_wait" data-id="{i}.pdf"></span>')
+
+    mock_httpx_get.side_effect = get
+    pdfs = await get_pdfs(MagicMock(text=links))
+    assert pdfs == [f"{i}.pdf" for i in range(5)]
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_http_client_is_shared():
+    """Every IMSLP request goes through one client, recreated once closed."""
+    await imslp.close_http_client()
+    client = imslp.http_client()
+    assert imslp.http_client() is client
+    assert client.cookies["imslpdisclaimeraccepted"] == "yes"
+    assert client.follow_redirects
+    await imslp.close_http_client()
+    assert client.is_closed
+    assert imslp.http_client() is not client
+    await imslp.close_http_client()
+    await imslp.close_http_client()  # nothing to close
+
+
+@pytest.mark.asyncio
+async def test_parse_pool(monkeypatch):
+    """Pages are parsed by one shared pool, which outlives a dead worker."""
+    monkeypatch.setattr(imslp, "_pool", None)
+    monkeypatch.setattr(config, "IMSLP_PARSE_PROCESSES", 1)
+    pool = imslp.parse_pool()
+    assert imslp.parse_pool() is pool
+    try:
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(os._exit, 1)
+        assert await pool.run(abs, -2) == 2
+        stats = pool.stats()
+        assert stats["processes"] == 1
+        assert stats["tasks"] == 2
+        assert stats["busy"] == 0
+        assert 0 < stats["utilisation"] <= 1
+    finally:
+        imslp.close_parse_pool()
+    assert imslp._pool is None
+    imslp.close_parse_pool()  # nothing to close
+
+
 @pytest.mark.asyncio
 async def test_get_page(mock_httpx_get):
     """Test get_page API call."""
@@ -169,34 +258,108 @@ async def test_get_page(mock_httpx_get):
     data = await get_page(0)
     assert "metadata" not in data
     assert "1" in data
+    assert await get_page(0, cache_only=True) == {}  # the mock's response isn't cached
 
 
 @pytest.mark.asyncio
-async def test_fix_entry(mock_agent, session):
+async def test_fix_entry(mock_agent, async_session):
     """Test fixing entry with agent."""
     mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
 
     entry = IMSLP(title="Old Title", permlink="http://example.com", composer="Old Composer")
-    await fix_entry(entry, session)
+    await fix_entry(entry, async_session)
 
     assert entry.title == "Fixed Title"
     assert entry.composer == "Fixed Composer"
 
 
 @pytest.mark.asyncio
-async def test_fix_entry_exception(mock_agent, session):
+async def test_fix_entry_exception(mock_agent, async_session):
     """Test fixing entry handles exceptions gracefully."""
     mock_agent.side_effect = Exception("Agent error")
 
     entry = IMSLP(title="Old Title", permlink="http://example.com", composer="Old Composer")
-    await fix_entry(entry, session)
+    await fix_entry(entry, async_session)
 
     assert entry.title == "Old Title"
     assert mock_agent.call_count == 1
 
 
+def test_pack():
+    """Requests hold at most ``size`` works and ``budget`` tokens; a big work goes alone."""
+    prompts = [(1, "x" * 36), (2, "x" * 36), (3, "x" * 400), (4, "x"), (5, "x"), (6, "x")]
+    assert imslp.pack(prompts, budget=20, size=2) == [
+        {1: "x" * 36, 2: "x" * 36},
+        {3: "x" * 400},
+        {4: "x", 5: "x"},
+        {6: "x"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_complete_entries_asks_again_for_failed_works(monkeypatch, caplog):
+    """Only the works a request failed for, or its answer left out, are asked again."""
+    monkeypatch.setattr(config, "IMSLP_ENRICH_BATCH_SIZE", 2)
+    monkeypatch.setattr(config, "IMSLP_ENRICH_RETRIES", 1)
+    entries = [IMSLP(id=i, title=f"T{i}", composer="C", permlink=f"url{i}") for i in range(5)]
+    requests = []
+
+    async def complete(request, model, fallbacks):
+        requests.append(sorted(request))
+        if len(requests) == 2:
+            raise RuntimeError("overloaded")
+        # work 4 is never answered
+        return {i: ScoreBase(title=f"Fixed {i}", composer="C") for i in request if i != 4}
+
+    monkeypatch.setattr(imslp, "run_imslp_batch_complete_agent", complete)
+
+    assert await imslp.complete_entries(entries, "m", []) is entries
+
+    assert requests == [[0, 1], [2, 3], [4], [2, 3], [4]]
+    assert [entry.title for entry in entries] == ["Fixed 0", "Fixed 1", "Fixed 2", "Fixed 3", "T4"]
+    assert "Failed to fix 2 entries: overloaded" in caplog.text
+    assert "Gave up fixing IMSLP works [4]" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_completion_keeps_the_fields_left_out(monkeypatch):
+    """Fields the agent's answer leaves out keep their parsed values, not ScoreBase's defaults."""
+
+    def parsed():
+        return IMSLP(
+            id=0,
+            title="Symphony No.5",
+            composer="Beethoven",
+            permlink="url",
+            year=1808,
+            period=Period.Romantic,
+            form="Symphony",
+            key="C minor",
+        )
+
+    async def complete(request, model, fallbacks):
+        return {0: ImslpFix(instrumentation="Orchestra", genre=None)}
+
+    async def complete_one(entry_json, model, fallbacks):
+        return ScoreBase.model_validate_json('{"title": "Symphony No.5", "composer": "Beethoven"}')
+
+    monkeypatch.setattr(imslp, "run_imslp_batch_complete_agent", complete)
+    monkeypatch.setattr(imslp, "run_imslp_complete_agent", complete_one)
+    (batched,) = await imslp.complete_entries([parsed()], "m", [])
+    single = await imslp.complete_entry(parsed(), "m", [])
+
+    for entry in (batched, single):
+        assert (entry.year, entry.period, entry.form, entry.key) == (
+            1808,
+            Period.Romantic,
+            "Symphony",
+            "C minor",
+        )
+    assert (batched.instrumentation, batched.genre) == ("Orchestra", "Classical")
+
+
 @pytest.mark.asyncio
-async def test_add_entry(session, mock_httpx_get, mock_agent):
+async def test_add_entry(session, async_session, mock_httpx_get, mock_agent):
     """Test adding entry."""
     # Mock fix_entry dependencies
     mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
@@ -219,7 +382,7 @@ async def test_add_entry(session, mock_httpx_get, mock_agent):
         "intvals": {"worktitle": "Sym 5", "composer": "Beethoven"},
     }
 
-    await add_entry(1, item, session)
+    await add_entry(1, item, async_session)
 
     # Check DB
     result = session.exec(select(IMSLP).where(IMSLP.id == 1)).one()
@@ -228,7 +391,18 @@ async def test_add_entry(session, mock_httpx_get, mock_agent):
 
 
 @pytest.mark.asyncio
-async def test_add_entry_exists(session, mock_httpx_get):
+async def test_add_entry_unparsable(session, async_session, mock_httpx_get, caplog):
+    """A work whose page can't be turned into a row is logged and not written."""
+    mock_httpx_get.return_value = MagicMock(text="<html></html>")
+
+    assert not await add_entry(1, {"permlink": "http://imslp.org/wiki/..."}, async_session)
+
+    assert "IMSLP parse failed for work 1" in caplog.text
+    assert not session.exec(select(IMSLP)).all()
+
+
+@pytest.mark.asyncio
+async def test_add_entry_exists(session, async_session, mock_httpx_get):
     """Test add_entry when entry already exists."""
     # Add an entry to the DB first
     existing_entry = IMSLP(
@@ -245,12 +419,78 @@ async def test_add_entry_exists(session, mock_httpx_get):
         "permlink": "http://imslp.org/wiki/...",
         "intvals": {"worktitle": "Sym 5", "composer": "Beethoven"},
     }
-    await add_entry(1, item, session)
+    await add_entry(1, item, async_session)
     mock_httpx_get.assert_not_called()
 
 
+COMPLETE_PAGE = """
+<html>
+    <span id="General_Information"></span>
+    <table>
+        <tr><th>Work Title</th><td>Symphony No.5</td></tr>
+        <tr><th>Composer</th><td>Beethoven, Ludwig van</td></tr>
+        <tr><th>Key</th><td>C minor</td></tr>
+        <tr><th>Year/Date of Composition Y/D of Comp.</th><td>1804–08</td></tr>
+        <tr><th>Composer Time Period Comp. Period</th><td>Romantic</td></tr>
+        <tr><th>Piece Style</th><td>Romantic</td></tr>
+        <tr><th>Instrumentation</th><td>orchestra</td></tr>
+        <tr><th>Genre Categories</th><td>Symphonies; For orchestra</td></tr>
+    </table>
+</html>
+"""
+
+
+@pytest.mark.asyncio
+async def test_add_entry_complete(session, async_session, mock_httpx_get, mock_agent):
+    """A work the rules read completely is written without asking the agent."""
+    mock_httpx_get.return_value = MagicMock(text=COMPLETE_PAGE)
+    item = {
+        "permlink": "http://imslp.org/wiki/...",
+        "intvals": {"worktitle": "Symphony No.5", "composer": "Beethoven, Ludwig van"},
+    }
+
+    await add_entry(1, item, async_session)
+
+    mock_agent.assert_not_called()
+    result = session.exec(
+        select(IMSLP.title, IMSLP.year, IMSLP.period, IMSLP.genre, IMSLP.key)
+    ).one()
+    assert tuple(result) == ("Symphony No.5", 1804, "Romantic", "Symphony", "C minor")
+
+
 @pytest.mark.asyncio
-async def test_get_works(session, mock_httpx_get, mock_agent):
+async def test_get_works_completes_only_incomplete_works(
+    session, async_session, mock_httpx_get, mock_agent, caplog
+):
+    """Only the works the rules couldn't complete go to the agent."""
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+    works = {
+        str(i): {
+            "permlink": f"https://imslp.org/wiki/W{i}",
+            "intvals": {"worktitle": f"T{i}", "composer": f"C{i}"},
+        }
+        for i in range(3)
+    }
+
+    def side_effect(url, **kwargs):
+        if "API.ISCR.php" in url:
+            return MagicMock(json=lambda: {"metadata": {}, **(works if "start=0" in url else {})})
+        return MagicMock(text=COMPLETE_PAGE if url.endswith(("W0", "W2")) else "<html></html>")
+
+    mock_httpx_get.side_effect = side_effect
+    progress_tracker["total"] = 2
+
+    with caplog.at_level("INFO", logger="app.imslp"):
+        await get_works()
+
+    assert mock_agent.call_count == 1
+    assert session.exec(select(IMSLP.title).where(IMSLP.id == 1)).one() == "Fixed Title"
+    assert session.exec(select(IMSLP.genre).where(IMSLP.id == 2)).one() == "Symphony"
+    assert "3 works written, 0 unchanged, 2 complete without the agent" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_get_works(session, async_session, mock_httpx_get, mock_agent):
     """Test getting works."""
     # Mock fix_entry dependencies
     mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
@@ -282,8 +522,7 @@ async def test_get_works(session, mock_httpx_get, mock_agent):
     progress_tracker["total"] = 2
     progress_tracker["cancel_requested"] = False
 
-    with patch("app.imslp.Session", return_value=session):
-        await get_works()
+    await get_works()
 
     assert progress_tracker["status"] == "completed"
 
@@ -293,7 +532,7 @@ async def test_get_works(session, mock_httpx_get, mock_agent):
 
 
 @pytest.mark.asyncio
-async def test_get_works_cancel(session, mock_httpx_get):
+async def test_get_works_cancel(session, async_session, mock_httpx_get):
     """Test cancelling get_works."""
     progress_tracker["total"] = 10
     progress_tracker["cancel_requested"] = True
@@ -308,10 +547,299 @@ async def test_get_works_cancel(session, mock_httpx_get):
 
     # Mock add_entry to do nothing or pass
     with patch("app.imslp.add_entry", new_callable=AsyncMock):
-        with patch("app.imslp.Session", return_value=session):
-            await get_works()
+        await get_works()
+
+    assert progress_tracker["status"] == "cancelled"
+
+
+@pytest.mark.asyncio
+async def test_get_works_pipeline(session, async_session, mock_httpx_get, mock_agent, monkeypatch):
+    """Works flow through concurrent stages into batched writes."""
+    monkeypatch.setattr(config, "IMSLP_WRITE_BATCH", 3)
+    monkeypatch.setattr(config, "IMSLP_QUEUE_SIZE", 2)
+    monkeypatch.setattr(config, "IMSLP_FETCH_CONCURRENCY", 3)
+    session.add(IMSLP(id=1, title="T", composer="C", score_metadata="{}", permlink="url1"))
+    session.commit()
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+    fetches = []
+
+    async def get(url, **kwargs):
+        if "API.ISCR.php" in url:
+            start = int(url.rsplit("=", 1)[1])
+            items = {
+                str(i): {
+                    "permlink": f"url{start + i}",
+                    "intvals": {"worktitle": "T", "composer": "C"},
+                }
+                for i in range(5)
+            }
+            return MagicMock(
+                json=lambda: {"metadata": {}, **items} if start < 2000 else {"metadata": {}}
+            )
+        fetches.append(url)
+        if url == "url3":
+            raise httpx.ConnectError("down")
+        await asyncio.sleep(0)
+        return MagicMock(text="<html></html>")
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 5
+    progress_tracker["cancel_requested"] = False
+
+    await get_works()
+
+    assert progress_tracker["status"] == "completed"
+    assert progress_tracker["page"] == 2
+    assert "url1" not in fetches  # already in the catalogue
+    ids = sorted(session.exec(select(IMSLP.id)).all())
+    assert ids == [0, 1, 2, 4, 1000, 1001, 1002, 1003, 1004]
+    assert progress_tracker["written"] == 8
+    state = await crawl_state.read("imslp")
+    assert (state.status, state.page, state.checkpoint) == ("completed", 2, 2)
+    assert (state.written, state.last_id, state.lease_owner) == (8, 1004, None)
+
+
+@pytest.mark.asyncio
+async def test_get_works_cancel_midway(session, async_session, mock_httpx_get, mock_agent):
+    """A cancel drops the queued works but writes those already completed."""
+
+    def complete(*_):
+        if mock_agent.call_count == 3:
+            progress_tracker["cancel_requested"] = True
+        return ScoreBase(title="Fixed Title", composer="Fixed Composer")
+
+    mock_agent.side_effect = complete
+    intvals = {"worktitle": "T", "composer": "C"}
+    page = {str(i): {"permlink": f"url{i}", "intvals": intvals} for i in range(20)}
+
+    def get(url, **kwargs):
+        if "API.ISCR.php" in url:
+            return MagicMock(json=lambda: {"metadata": {}, **page})
+        return MagicMock(text="<html></html>")
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 3
+    progress_tracker["cancel_requested"] = False
+
+    await get_works()
+
+    assert progress_tracker["status"] == "cancelled"
+    written = session.exec(select(IMSLP.id)).all()
+    assert 3 <= len(written) < 20
+    assert progress_tracker["written"] == len(written)
+    state = await crawl_state.read("imslp")
+    assert (state.status, state.checkpoint) == ("cancelled", 0)  # dropped works are on page 0
+
+
+def test_checkpoint():
+    """The checkpoint is the first page with works still in the pipeline."""
+    checkpoint = imslp.Checkpoint(3)
+    assert checkpoint.page == 3
+    checkpoint.add(3001, 3)
+    checkpoint.add(3002, 3)
+    checkpoint.add(4000, 4)
+    checkpoint.read = 5
+    checkpoint.settle([3001])
+    assert checkpoint.page == 3
+    checkpoint.settle([3002])
+    assert checkpoint.page == 4
+    checkpoint.settle([4000])
+    assert checkpoint.page == 5
+
+
+def _slow_worklist(mock_httpx_get, on_fetch):
+    """Serve one worklist page of 20 works, calling ``on_fetch(url)`` on each work page."""
+    intvals = {"worktitle": "T", "composer": "C"}
+    page = {str(i): {"permlink": f"url{i}", "intvals": intvals} for i in range(20)}
+
+    async def get(url, **kwargs):
+        if "API.ISCR.php" in url:
+            return MagicMock(json=lambda: {"metadata": {}, **page})
+        await on_fetch(url)
+        await asyncio.sleep(0.02)
+        return MagicMock(text="<html></html>")
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 3
+
+
+@pytest.mark.asyncio
+async def test_get_works_cancelled_from_another_worker(
+    session, async_session, mock_httpx_get, mock_agent, monkeypatch
+):
+    """A cancel stored by another worker stops the crawl at its next checkpoint."""
+    monkeypatch.setattr(config, "IMSLP_CHECKPOINT_INTERVAL", 0.01)
+    monkeypatch.setattr(config, "IMSLP_QUEUE_SIZE", 1)
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+
+    async def on_fetch(url):
+        if url == "url2":
+            await crawl_state.request_cancel("imslp")
+
+    _slow_worklist(mock_httpx_get, on_fetch)
+    await get_works()
+
+    assert progress_tracker["status"] == "cancelled"
+    state = await crawl_state.read("imslp")
+    assert (state.status, state.checkpoint, state.lease_owner) == ("cancelled", 0, None)
+    assert state.written == progress_tracker["written"] < 20
+
+
+@pytest.mark.asyncio
+async def test_get_works_stops_when_lease_is_lost(
+    session, async_session, mock_httpx_get, mock_agent, monkeypatch, caplog
+):
+    """A worker whose lease was taken over stops and leaves the state to the new holder."""
+    monkeypatch.setattr(config, "IMSLP_CHECKPOINT_INTERVAL", 0.01)
+    monkeypatch.setattr(config, "IMSLP_QUEUE_SIZE", 1)
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+
+    async def on_fetch(url):
+        if url == "url2":
+            await async_session.exec(update(CrawlState).values(lease_owner="elsewhere:1"))
+            await async_session.commit()
+
+    _slow_worklist(mock_httpx_get, on_fetch)
+    await get_works()
 
     assert progress_tracker["status"] == "cancelled"
+    assert "lease was taken over" in caplog.text
+    state = await crawl_state.read("imslp")
+    assert (state.status, state.lease_owner) == ("processing", "elsewhere:1")
+
+
+@pytest.mark.asyncio
+async def test_get_works_survives_failed_checkpoint(session, async_session, mock_httpx_get, caplog):
+    """A checkpoint that can't be written is logged and the crawl goes on."""
+    mock_httpx_get.return_value = MagicMock(json=lambda: {"metadata": {}, "0": {}})
+    progress_tracker["total"] = 1
+
+    with (
+        patch("app.imslp.existing_ids", AsyncMock(return_value={0})),
+        patch("app.crawl_state.renew", AsyncMock(side_effect=RuntimeError("db down"))),
+    ):
+        await get_works()
+
+    assert progress_tracker["status"] == "completed"
+    assert "IMSLP checkpoint failed" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_get_works_leaves_crawl_to_lease_holder(
+    session, async_session, mock_httpx_get, caplog
+):
+    """A crawl already running on another worker isn't run a second time."""
+    session.add(
+        CrawlState(name="imslp", status="processing", lease_owner="elsewhere:1", lease_expires=1e12)
+    )
+    session.commit()
+    progress_tracker["total"] = 1
+
+    await get_works()
+
+    mock_httpx_get.assert_not_called()
+    assert "running on another worker" in caplog.text
+    assert progress_tracker["status"] == "idle"
+
+
+@pytest.mark.asyncio
+async def test_get_works_interrupted(session, async_session, mock_httpx_get):
+    """A crawl stopped with its server is recorded as interrupted."""
+    started = asyncio.Event()
+
+    async def get(url, **kwargs):
+        started.set()
+        await asyncio.Event().wait()
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 2
+    crawl = asyncio.create_task(get_works())
+    await started.wait()
+    crawl.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await crawl
+
+    state = await crawl_state.read("imslp")
+    assert (state.status, state.lease_owner) == ("interrupted", None)
+
+
+@pytest.mark.asyncio
+async def test_write_entries_batches_upserts(session, async_session, monkeypatch):
+    """Entries are upserted a few rows per statement, the last copy of an id winning."""
+    monkeypatch.setattr(imslp, "MAX_BIND_PARAMS", 30)  # two rows per statement
+    session.add(IMSLP(id=1, title="Old", composer="C", score_metadata="{}", permlink="p1"))
+    session.commit()
+    entries = [
+        IMSLP(id=i, title=f"T{i}", composer="C", score_metadata="{}", permlink=f"p{i}")
+        for i in range(5)
+    ]
+    entries.append(IMSLP(id=4, title="T4 again", composer="C", permlink="p4"))
+    statements = []
+    execute = async_session.exec
+
+    async def counted(stmt, *args, **kwargs):
+        statements.append(stmt)
+        return await execute(stmt, *args, **kwargs)
+
+    monkeypatch.setattr(async_session, "exec", counted)
+    await imslp.write_entries(entries, async_session)
+
+    assert len(statements) == 3
+    session.expire_all()
+    rows = {row.id: row.title for row in session.exec(select(IMSLP))}
+    assert rows == {0: "T0", 1: "T1", 2: "T2", 3: "T3", 4: "T4 again"}
+    assert await imslp.existing_ids([3, 4, 5], async_session) == {3, 4}
+
+
+@pytest.mark.asyncio
+async def test_get_works_survives_failed_write(session, async_session, mock_httpx_get, mock_agent):
+    """A batch that can't be written is logged and the crawl goes on."""
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+    intvals = {"worktitle": "T", "composer": "C"}
+    page = {str(i): {"permlink": f"url{i}", "intvals": intvals} for i in range(3)}
+
+    def get(url, **kwargs):
+        if "start=0" in url:
+            return MagicMock(json=lambda: {"metadata": {}, **page})
+        if "API.ISCR.php" in url:
+            return MagicMock(json=lambda: {"metadata": {}})
+        return MagicMock(text="<html></html>")
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 2
+    progress_tracker["cancel_requested"] = False
+
+    with patch("app.imslp.write_entries", AsyncMock(side_effect=RuntimeError("db down"))):
+        await get_works()
+
+    assert progress_tracker["status"] == "completed"
+    assert progress_tracker["written"] == 0
+    assert not session.exec(select(IMSLP)).all()
+
+
+@pytest.mark.asyncio
+async def test_get_works_survives_failed_parse(session, async_session, mock_httpx_get, caplog):
+    """A chunk that can't be parsed is logged and the crawl goes on."""
+    intvals = {"worktitle": "T", "composer": "C"}
+    page = {str(i): {"permlink": f"url{i}", "intvals": intvals} for i in range(3)}
+
+    def get(url, **kwargs):
+        if "start=0" in url:
+            return MagicMock(json=lambda: {"metadata": {}, **page})
+        if "API.ISCR.php" in url:
+            return MagicMock(json=lambda: {"metadata": {}})
+        return MagicMock(text="<html></html>")
+
+    mock_httpx_get.side_effect = get
+    progress_tracker["total"] = 2
+    progress_tracker["cancel_requested"] = False
+
+    with patch("app.imslp.parse_entries", AsyncMock(side_effect=RuntimeError("pool down"))):
+        await get_works()
+
+    assert progress_tracker["status"] == "completed"
+    assert progress_tracker["written"] == 0
+    assert "IMSLP parse of" in caplog.text
 
 
 # --- Tests for Endpoints ---
@@ -325,23 +853,180 @@ def test_start_endpoint(mock_httpx_get):
 
     response = client.post("/imslp/start/10")
     assert response.status_code == 200
-    assert response.json() == {"message": "Task started successfully!"}
+    assert response.json() == {"message": "Task started successfully!", "page": 0}
     assert progress_tracker["total"] == 10
     assert progress_tracker["status"] == "completed"
 
 
+def test_start_resumes_from_checkpoint(session, mock_httpx_get):
+    """A crawl interrupted by a restart resumes from its checkpoint."""
+    session.add(
+        CrawlState(
+            name="imslp",
+            status="processing",
+            page=3,
+            total=9,
+            checkpoint=2,
+            written=5,
+            last_id=1999,
+        )
+    )
+    session.commit()
+    assert client.post("/imslp/progress").json()["status"] == "interrupted"
+    mock_httpx_get.return_value = MagicMock(json=lambda: {"metadata": {}})
+
+    response = client.post("/imslp/start/9", params={"resume": True})
+
+    assert response.json()["page"] == 2
+    assert "start=2000" in mock_httpx_get.call_args_list[0].args[0]
+    progress = client.post("/imslp/progress").json()
+    assert progress["status"] == "completed"
+    assert (progress["checkpoint"], progress["written"], progress["last_id"]) == (2, 5, 1999)
+
+
+def test_start_refused_while_running(session, monkeypatch):
+    """A crawl running here or on another live worker can't be started twice."""
+    session.add(
+        CrawlState(name="imslp", status="processing", lease_owner="elsewhere:1", lease_expires=1e12)
+    )
+    session.commit()
+    assert client.post("/imslp/start/10").status_code == 409
+
+    session.exec(delete(CrawlState))
+    session.commit()
+    progress_tracker["status"] = "processing"
+    assert client.post("/imslp/start/10").status_code == 409
+
+
+def test_start_rebuilds_from_cache(session, mock_httpx_get, mock_agent):
+    """A cache-only update writes the cached works again without any download."""
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+    intvals = {"worktitle": "A", "composer": "C"}
+    page = {"metadata": {}, "0": {"permlink": "https://imslp.org/wiki/A", "intvals": intvals}}
+    work = '<span id="General_Information"></span><table><tr><th>Key</th><td>C major</td></tr>'
+
+    def get(url, **kwargs):
+        request = httpx.Request("GET", url)
+        if "start=0" in url:
+            return httpx.Response(200, json=page, request=request)
+        if "API.ISCR.php" in url:
+            return httpx.Response(200, json={"metadata": {}}, request=request)
+        return httpx.Response(200, text=work, request=request)
+
+    mock_httpx_get.side_effect = get
+    client.post("/imslp/start/5")
+    session.exec(update(IMSLP).values(key="", title="Edited"))
+    session.commit()
+    mock_httpx_get.reset_mock()
+    mock_agent.reset_mock()
+
+    response = client.post("/imslp/start/5", params={"cache_only": True, "enrich": False})
+
+    assert response.status_code == 200
+    mock_httpx_get.assert_not_called()
+    mock_agent.assert_not_called()
+    session.expire_all()
+    assert session.exec(select(IMSLP.title, IMSLP.key)).one() == ("A", "C major")
+    assert progress_tracker["status"] == "completed"
+
+
+def test_sync_writes_new_and_edited_works(session, mock_httpx_get, mock_agent, caplog):
+    """A sync starts at the page of the highest known id and skips unedited works."""
+    mock_agent.return_value = ScoreBase(title="Fixed Title", composer="Fixed Composer")
+    work = '<span id="General_Information"></span><table><tr><th>Key</th><td>C major</td></tr>'
+    current = metadata_hash({"Key": "C major"})
+    for i, digest in ((5, "old"), (1000, current), (1001, "old")):
+        session.add(IMSLP(id=i, title="Kept", composer="C", permlink=f"w{i}", metadata_hash=digest))
+    session.commit()
+    intvals = {"worktitle": "A", "composer": "C"}
+    items = {str(i): {"permlink": f"w{1000 + i}", "intvals": intvals} for i in range(3)}
+    page = {"metadata": {}, **items}
+
+    def get(url, **kwargs):
+        request = httpx.Request("GET", url)
+        if "start=1000" in url:
+            return httpx.Response(200, json=page, request=request)
+        if "API.ISCR.php" in url:
+            return httpx.Response(200, json={"metadata": {}}, request=request)
+        return httpx.Response(200, text=work, request=request)
+
+    mock_httpx_get.side_effect = get
+    caplog.set_level("INFO", logger="app.imslp")
+
+    response = client.post("/imslp/sync")
+
+    assert response.json()["page"] == 1
+    assert not any("start=0" in call.args[0] for call in mock_httpx_get.call_args_list)
+    assert mock_agent.call_count == 2  # 1001 was edited, 1002 is new
+    session.expire_all()
+    rows = session.exec(select(IMSLP.id, IMSLP.title, IMSLP.metadata_hash)).all()
+    assert sorted(rows) == [
+        (5, "Kept", "old"),
+        (1000, "Kept", current),
+        (1001, "Fixed Title", current),
+        (1002, "Fixed Title", current),
+    ]
+    assert progress_tracker["total"] == 1 + config.IMSLP_SYNC_PAGES
+    assert "2 works written, 1 unchanged" in caplog.text
+
+
+def test_sync_from_page(mock_httpx_get):
+    """A sync can start from any page, e.g. to look for edits everywhere."""
+    mock_httpx_get.return_value = MagicMock(json=lambda: {"metadata": {}})
+    response = client.post("/imslp/sync", params={"from_page": 0, "pages": 3})
+    assert response.json()["page"] == 0
+    assert progress_tracker["total"] == 3
+    assert progress_tracker["status"] == "completed"
+
+
+def test_seconds_until():
+    """The nightly sync waits for the next occurrence of its time."""
+    now = datetime(2026, 1, 1, 2, 30, tzinfo=UTC)
+    assert imslp.seconds_until("03:00", now) == 1800
+    assert imslp.seconds_until("02:30", now) == 86400
+
+
+@pytest.mark.asyncio
+async def test_sync_nightly(monkeypatch, caplog):
+    """The nightly loop syncs when it can and goes on after a failure."""
+    monkeypatch.setattr(config, "IMSLP_SYNC_AT", "03:00")
+    monkeypatch.setattr(imslp, "seconds_until", lambda *_: 0)
+    busy = HTTPException(status_code=409)
+    start = AsyncMock(side_effect=[busy, 4, 4])
+    works = AsyncMock(side_effect=[RuntimeError("down"), asyncio.CancelledError()])
+    monkeypatch.setattr(imslp, "start_sync", start)
+    monkeypatch.setattr(imslp, "get_works", works)
+    caplog.set_level("INFO", logger="app.imslp")
+
+    with pytest.raises(asyncio.CancelledError):
+        await imslp.sync_nightly()
+
+    start.assert_awaited_with(config.IMSLP_SYNC_PAGES)
+    works.assert_awaited_with(sync_from=4)
+    assert "IMSLP sync skipped" in caplog.text
+    assert "IMSLP sync failed" in caplog.text
+
+
 def test_progress_endpoint():
     """Test progress endpoint."""
     response = client.post("/imslp/progress")
     assert response.status_code == 200
-    assert "status" in response.json()
+    assert response.json()["status"] == "idle"
+    assert response.json()["parse_pool"] is None  # not crawling on this worker
+    assert response.json()["politeness"] == {}  # no request to IMSLP yet
 
 
 def test_cancel_endpoint():
     """Test cancel endpoint."""
     response = client.post("/imslp/cancel")
     assert response.status_code == 200
+    assert progress_tracker["cancel_requested"] is False  # nothing running
+
+    progress_tracker["status"] = "processing"
+    response = client.post("/imslp/cancel")
+    assert response.status_code == 200
     assert progress_tracker["cancel_requested"] is True
+    assert progress_tracker["status"] == "cancelling"
 
 
 def test_stats_endpoint(session):
@@ -374,12 +1059,18 @@ def test_empty_endpoint(session):
     session.add(entry)
     session.commit()
 
+    session.add(CrawlState(name="imslp", status="completed", checkpoint=4, last_id=3999))
+    session.commit()
+
     response = client.post("/imslp/empty")
     assert response.status_code == 200
 
     # Verify empty
     results = session.exec(select(IMSLP)).all()
     assert not results
+    state = session.exec(select(CrawlState)).one()
+    session.refresh(state)
+    assert (state.checkpoint, state.last_id) == (0, None)
 
 
 def test_get_by_ids(session):
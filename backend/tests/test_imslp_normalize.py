@@ -0,0 +1,187 @@
+"""Tests for the rule-based normalization of IMSLP metadata."""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from app import config
+from app.imslp_normalize import (
+    COMPLETENESS_FIELDS,
+    canonical_instrumentation,
+    canonical_key,
+    completeness,
+    form_of,
+    genre_of,
+    normalize,
+    parse_period,
+    parse_year,
+    period_of_year,
+)
+from shared.scores import Period
+
+# Metadata blocks of IMSLP work pages, complete and not.
+CORPUS = json.loads(
+    (Path(__file__).parent / "data" / "imslp" / "metadata_corpus.json").read_text(encoding="utf-8")
+)
+
+
+@pytest.mark.parametrize(
+    "text, year",
+    [
+        ("1804–08", 1804),
+        ("ca.1720", 1720),
+        ("1783 (?)", 1783),
+        ("ca.1890, rev.1905", 1890),
+        ("1630s", 1630),
+        ("late 17th century", 1650),
+        ("No.5 (1824)", 1824),
+        ("9999", None),
+        ("unknown", None),
+        (None, None),
+    ],
+)
+def test_parse_year(text, year):
+    """The first plausible year of a date, or the middle of its century."""
+    assert parse_year(text) == year
+
+
+@pytest.mark.parametrize(
+    "label, period",
+    [
+        ("Romantic", Period.Romantic),
+        ("Early 20th century", Period.Modernist),
+        ("Neoclassical", Period.Modernist),
+        ("Classical", Period.Classical),
+        ("Contemporary", Period.Postmodernist),
+        ("21st century", Period.Postmodernist),
+        ("Baroque ", Period.Baroque),
+        ("Folk", None),
+        (None, None),
+    ],
+)
+def test_parse_period(label, period):
+    """IMSLP's period labels map to a period."""
+    assert parse_period(label) == period
+
+
+def test_period_of_year():
+    """Works without a period label get the one of their year."""
+    assert period_of_year(1350) == Period.Medieval
+    assert period_of_year(1720) == Period.Baroque
+    assert period_of_year(1790) == Period.Classical
+    assert period_of_year(1990) == Period.Postmodernist
+
+
+@pytest.mark.parametrize(
+    "text, key",
+    [
+        ("C minor", "C minor"),
+        ("e minor", "E minor"),
+        ("B♭ major", "B-flat major"),
+        ("Bb major", "B-flat major"),
+        ("f# minor", "F-sharp minor"),
+        ("D dorian", "D dorian"),
+        ("B-flat minor E-flat major B major", "B-flat minor, E-flat major, B major"),
+        ("G major, G major", "G major"),
+        ("Various", None),
+        (None, None),
+    ],
+)
+def test_canonical_key(text, key):
+    """Keys are spelled one way, several keys comma-separated."""
+    assert canonical_key(text) == key
+
+
+def test_canonical_instrumentation():
+    """Abbreviations are spelled out and the whitespace collapsed."""
+    assert canonical_instrumentation("voice,  pf") == "Voice, piano"
+    assert canonical_instrumentation("Vc.") == "Cello"
+    assert canonical_instrumentation("2 violins, viola, cello") == "2 violins, viola, cello"
+    assert canonical_instrumentation("") is None
+
+
+@pytest.mark.parametrize(
+    "categories, genre",
+    [
+        ("Symphonies; For orchestra; Scores featuring the orchestra", "Symphony"),
+        ("For piano; Nocturnes", "Nocturne"),
+        ("Masses; Sacred works", "Mass"),
+        ("Waltzes", "Waltz"),
+        ("Studies", "Study"),
+        ("Requiem; For chorus, orchestra", "Requiem"),
+        ("Songs without words; For piano", "Song without words"),
+        ("Arrangements; For orchestra", None),
+        (None, None),
+    ],
+)
+def test_genre_of(categories, genre):
+    """The first category naming what a work is, singular."""
+    assert genre_of(categories) == genre
+
+
+@pytest.mark.parametrize(
+    "title, form",
+    [
+        ("Piano Sonata No.11", "Sonata"),
+        ("Etudes, Op.10", "Etude"),
+        ("Gymnopédies", "Gymnopedie"),
+        ("Trio Sonata", "Sonata"),
+        ("Canon and Gigue", "Canon"),
+        ("Lieder ohne Worte, Op.19b", "Lied"),
+        ("Clair de lune", None),
+        (None, None),
+    ],
+)
+def test_form_of(title, form):
+    """The form word of a title, singular; the last of adjacent ones."""
+    assert form_of(title) == form
+
+
+def test_normalize():
+    """A complete metadata block fills every column."""
+    fields = normalize(CORPUS[0])
+
+    assert fields == {
+        "title": "Symphony No.5",
+        "composer": "Beethoven, Ludwig van",
+        "year": 1804,
+        "period": Period.Romantic,
+        "genre": "Symphony",
+        "form": "Symphony",
+        "key": "C minor",
+        "instrumentation": fields["instrumentation"],
+        "style": "Romantic",
+    }
+    assert fields["instrumentation"].startswith("Orchestra 2 flutes")
+    assert completeness(fields) == 1
+
+
+def test_normalize_leaves_out_what_it_cannot_read():
+    """Unreadable values are left out; the period falls back on the year."""
+    fields = normalize(
+        {
+            "Work Title": "Clair de lune",
+            "Genre Categories": "Pieces; For piano",
+            "Key": "Various",
+            "Year/Date of Composition Y/D of Comp.": "1701",
+        }
+    )
+
+    # the genre says nothing of the form
+    assert fields == {
+        "title": "Clair de lune",
+        "year": 1701,
+        "period": Period.Baroque,
+        "genre": "Piece",
+    }
+    assert completeness(fields) == 4 / len(COMPLETENESS_FIELDS)
+
+
+def test_corpus_completeness():
+    """Most of the corpus goes without the completion agent at the default threshold."""
+    scores = [completeness(normalize(metadata)) for metadata in CORPUS]
+
+    assert len(CORPUS) == 30
+    assert sum(score == 1 for score in scores) == 11
+    assert sum(score >= config.IMSLP_COMPLETENESS_THRESHOLD for score in scores) == 23
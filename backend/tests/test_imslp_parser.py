@@ -0,0 +1,69 @@
+"""Tests for the IMSLP page parser."""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from app.imslp_parser import (
+    WorkPage,
+    metadata_hash,
+    parse_download_ids,
+    parse_work_page,
+    parse_works,
+)
+
+PAGES = Path(__file__).parent / "data" / "imslp"
+# What the BeautifulSoup (html.parser) extraction returned for each saved page.
+EXPECTED = json.loads((PAGES / "expected.json").read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_saved_pages_parse_as_before(name):
+    """Metadata, landing pages and download ids match the previous parser's."""
+    html = (PAGES / name).read_text(encoding="utf-8")
+    page = parse_work_page(html)
+    assert page.metadata == EXPECTED[name]["metadata"]
+    assert page.pdf_landing_pages == EXPECTED[name]["pdf_landing_pages"]
+    assert parse_download_ids(html) == EXPECTED[name]["download_ids"]
+
+
+def test_corpus_is_complete():
+    """Every saved page has its expected output."""
+    assert sorted(path.name for path in PAGES.glob("*.html")) == sorted(EXPECTED)
+
+
+@pytest.mark.parametrize("html", ["", "   \n", "<!-- nothing -->"])
+def test_empty_documents(html):
+    """Pages without any element parse to nothing."""
+    assert parse_work_page(html) == WorkPage()
+    assert parse_download_ids(html) == []
+
+
+def test_encoding_declaration_and_entities():
+    """An XML declaration doesn't stop the parse; entities are decoded."""
+    html = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<html><body><span id="General_Information"></span>'
+        "<table><tr><th>Composer</th><td>Dvo&#345;&aacute;k, Anton&iacute;n</td></tr></table>"
+        "</body></html>"
+    )
+    assert parse_work_page(html).metadata == {"Composer": "Dvořák, Antonín"}
+
+
+def test_parse_works_keeps_errors_per_page():
+    """A page that fails yields its error, the others of the chunk their row."""
+    html = (PAGES / "beethoven_symphony_5.html").read_text(encoding="utf-8")
+    item = {"permlink": "p", "intvals": {"worktitle": "T", "composer": "C"}}
+    good, bad = parse_works([(5, item, html), (6, {"permlink": "p"}, "<html></html>")])
+    assert isinstance(good, dict)
+    assert good["id"] == 5
+    assert json.loads(good["score_metadata"]) == EXPECTED["beethoven_symphony_5.html"]["metadata"]
+    assert isinstance(bad, KeyError)
+
+
+def test_metadata_hash_follows_the_metadata_block():
+    """The hash ignores the order of the rows but not their content."""
+    metadata = {"Key": "C minor", "Composer": "Beethoven, Ludwig van"}
+    assert metadata_hash(metadata) == metadata_hash(dict(reversed(metadata.items())))
+    assert metadata_hash(metadata) != metadata_hash({**metadata, "Key": "C major"})
@@ -1,6 +1,7 @@
 """Tests for IMSLP parsing logic in imslp.py."""
 
-import requests
+import httpx
+import pytest
 
 from app import imslp
 
@@ -35,7 +36,8 @@ def test_get_metadata_returns_empty_when_none_found():
     assert not imslp.get_metadata(DummyResponse())
 
 
-def test_get_pdfs_extracts_pdf_urls(monkeypatch):
+@pytest.mark.asyncio
+async def test_get_pdfs_extracts_pdf_urls(monkeypatch):
     """Test that PDF URLs are extracted correctly."""
 
     class DummyResponse:
@@ -43,30 +45,18 @@ def test_get_pdfs_extracts_pdf_urls(monkeypatch):
 
         text = '<a href="Special:ImagefromIndex/123">Download</a>'
 
-    # Patch requests.Session.get and .head for test isolation
-    with monkeypatch.context() as m:
+    async def get(self, url, **kwargs):
+        """Mock get request."""
+        text = '<span id="sm_dl_wait" data-id="url.pdf"></span>'
+        return type("Resp", (), {"status_code": 200, "text": text})()
 
-        class MockSession:
-            """Mock requests session."""
+    monkeypatch.setattr(httpx.AsyncClient, "get", get)
+    urls = await imslp.get_pdfs(DummyResponse())
+    assert "url.pdf" in urls
 
-            def get(self, url, **kwargs):
-                """Mock get request."""
-                return type(
-                    "Resp",
-                    (),
-                    {"text": '<span id="sm_dl_wait" data-id="url.pdf"></span>'},
-                )()
 
-            def head(self, url, **kwargs):
-                """Mock head request."""
-                return type("Resp", (), {"url": "url.pdf"})()
-
-        m.setattr(requests, "Session", MockSession)
-        urls = imslp.get_pdfs(DummyResponse())
-        assert "url.pdf" in urls
-
-
-def test_get_pdfs_handles_non_pdf_redirect(monkeypatch):
+@pytest.mark.asyncio
+async def test_get_pdfs_handles_non_pdf_redirect(monkeypatch, caplog):
     """Test handling of redirects that do not result in a PDF."""
 
     class DummyResponse:
@@ -74,30 +64,19 @@ def test_get_pdfs_handles_non_pdf_redirect(monkeypatch):
 
         text = '<a href="Special:ImagefromIndex/456">Download</a>'
 
-    with monkeypatch.context() as m:
-
-        class MockSession:
-            """Mock requests session."""
-
-            def get(self, url, **kwargs):
-                """Mock get request."""
-                # No 'sm_dl_wait', so it goes to else block
-                return type("Resp", (), {"text": "<html></html>"})()
-
-            def head(self, url, **kwargs):
-                """Mock head request."""
-                # Redirects to non-pdf
-                return type("Resp", (), {"url": "http://example.com/not_a_pdf.html"})()
+    async def get(self, url, **kwargs):
+        """Mock get request."""
+        # No 'sm_dl_wait', so it goes to the redirect
+        return type("Resp", (), {"status_code": 200, "text": "<html></html>"})()
 
-        m.setattr(requests, "Session", MockSession)
-        # Capture print output
-        import io
-        import sys
+    async def head(self, url, **kwargs):
+        """Mock head request."""
+        # Redirects to non-pdf
+        return type("Resp", (), {"status_code": 200, "url": "http://example.com/not_a_pdf.html"})()
 
-        captured_output = io.StringIO()
-        sys.stdout = captured_output
-        urls = imslp.get_pdfs(DummyResponse())
-        sys.stdout = sys.__stdout__
+    monkeypatch.setattr(httpx.AsyncClient, "get", get)
+    monkeypatch.setattr(httpx.AsyncClient, "head", head)
+    urls = await imslp.get_pdfs(DummyResponse())
 
-        assert "http://example.com/not_a_pdf.html" in captured_output.getvalue()
-        assert urls == []
+    assert "http://example.com/not_a_pdf.html" in caplog.text
+    assert urls == []
@@ -33,7 +33,8 @@ def test_get_metadata_no_table():
     assert not imslp.get_metadata(DummyResp())
 
 
-def test_get_pdfs_no_pdf_found():
+@pytest.mark.asyncio
+async def test_get_pdfs_no_pdf_found():
     """Test get_pdfs no pdf found."""
 
     class DummyResp:
@@ -41,7 +42,7 @@ def test_get_pdfs_no_pdf_found():
 
         text = "<html></html>"
 
-    result = imslp.get_pdfs(DummyResp())
+    result = await imslp.get_pdfs(DummyResp())
     assert not result
 
 
@@ -0,0 +1,137 @@
+"""Tests for the adaptive pace of the requests to IMSLP."""
+
+import time
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from app import config, politeness
+from app.politeness import HostLimiter, retry_after, send
+
+URL = "https://imslp.org/wiki/Symphony_No.5"
+
+
+@pytest.fixture(autouse=True)
+def pace(monkeypatch):
+    """A limiter starting at 10 requests/s, one token at a time."""
+    monkeypatch.setattr(config, "IMSLP_RATE", 10)
+    monkeypatch.setattr(config, "IMSLP_RATE_BURST", 1)
+    monkeypatch.setattr(config, "IMSLP_RATE_MIN", 1)
+    monkeypatch.setattr(config, "IMSLP_RATE_MAX", 100)
+    monkeypatch.setattr(config, "IMSLP_RATE_INCREASE", 1)
+
+
+def answers(*responses):
+    """Client whose requests get ``responses`` in turn (an exception is raised)."""
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        response = responses[min(len(sent), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), sent
+
+
+def test_retry_after():
+    """Retry-After is read as seconds or as an HTTP date."""
+    in_a_minute = format_datetime(datetime.now(UTC) + timedelta(seconds=60), usegmt=True)
+
+    assert retry_after(httpx.Response(429, headers={"retry-after": "5"})) == 5
+    assert 55 < retry_after(httpx.Response(429, headers={"retry-after": in_a_minute})) <= 60
+    assert retry_after(httpx.Response(429, headers={"retry-after": "soon"})) is None
+    assert retry_after(httpx.Response(429)) is None
+
+
+def test_fast_responses_ramp_up():
+    """Fast successes add to the rate, slow ones leave it, up to the maximum."""
+    limiter = HostLimiter("imslp.org")
+
+    assert not limiter.record(httpx.Response(200), 0.1)
+    assert limiter.rate == 11
+    limiter.record(httpx.Response(304), config.IMSLP_RATE_SLOW_SECONDS)
+    assert limiter.rate == 11
+    for _ in range(200):
+        limiter.record(httpx.Response(200), 0.1)
+    assert limiter.rate == config.IMSLP_RATE_MAX
+
+
+def test_backoff_halves_once_per_burst(monkeypatch):
+    """429/5xx/timeouts halve the rate, once for failures seen together."""
+    limiter = HostLimiter("imslp.org")
+
+    assert limiter.record(httpx.Response(429), 0.1)
+    assert limiter.record(None, 0.1)  # in flight along with the 429
+    assert limiter.rate == 5
+    assert limiter.tokens == 0
+    monkeypatch.setattr(limiter, "_decreased_at", time.monotonic() - 1)
+    limiter.record(httpx.Response(503), 0.1)
+    assert limiter.rate == 2.5
+    for _ in range(5):
+        monkeypatch.setattr(limiter, "_decreased_at", time.monotonic() - 10)
+        limiter.record(httpx.Response(500), 0.1)
+    assert limiter.rate == config.IMSLP_RATE_MIN
+    assert limiter.stats()["backoffs"] == 8
+    assert limiter.stats()["last_status"] == 500
+
+
+def test_retry_after_holds_the_host(monkeypatch):
+    """A Retry-After holds every request to the host, capped."""
+    monkeypatch.setattr(config, "IMSLP_RETRY_AFTER_MAX", 30)
+    limiter = HostLimiter("imslp.org")
+
+    limiter.record(httpx.Response(429, headers={"retry-after": "3600"}), 0.1)
+
+    assert 29 < limiter.stats()["backoff_seconds"] <= 30
+
+
+@pytest.mark.asyncio
+async def test_acquire_paces_requests():
+    """Past the burst, requests are spaced by the rate."""
+    limiter = HostLimiter("imslp.org")
+
+    start = time.monotonic()
+    for _ in range(3):
+        await limiter.acquire()
+
+    assert time.monotonic() - start >= 0.18  # 2 waits at 10 requests/s
+
+
+@pytest.mark.asyncio
+async def test_send_retries_after_backoff():
+    """A 429 is sent again once its Retry-After has passed."""
+    client, sent = answers(
+        httpx.Response(429, headers={"retry-after": "0.1"}), httpx.Response(200, text="ok")
+    )
+
+    start = time.monotonic()
+    async with client:
+        response = await send(client.get, URL)
+
+    assert response.text == "ok"
+    assert len(sent) == 2
+    assert time.monotonic() - start >= 0.1
+    stats = politeness.stats()["imslp.org"]
+    assert stats["backoffs"] == 1
+    assert stats["last_status"] == 200
+
+
+@pytest.mark.asyncio
+async def test_send_gives_up(monkeypatch):
+    """After ``IMSLP_HTTP_RETRIES`` the last response is returned, or its timeout raised."""
+    monkeypatch.setattr(config, "IMSLP_RATE_MIN", 1000)  # no waits between the attempts
+    monkeypatch.setattr(config, "IMSLP_HTTP_RETRIES", 2)
+    client, sent = answers(httpx.ReadTimeout("slow"), httpx.Response(503))
+    async with client:
+        assert (await send(client.get, URL)).status_code == 503
+    assert len(sent) == 3
+
+    client, sent = answers(httpx.ReadTimeout("slow"))
+    async with client:
+        with pytest.raises(httpx.ReadTimeout):
+            await send(client.get, URL)
+    assert len(sent) == 3
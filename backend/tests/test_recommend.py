@@ -0,0 +1,94 @@
+"""Tests for the "what to play next" recommender."""
+
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app import recommend
+from shared.scores import Difficulty, Period, Score
+
+NOW = datetime(2026, 10, 19, tzinfo=UTC)
+
+
+def _score(
+    id, composer, plays=0, days=None, difficulty=Difficulty.moderate, period=Period.Romantic
+):
+    return Score(
+        id=id,
+        title=f"piece {id}",
+        composer=composer,
+        number_of_plays=plays,
+        last_played=None if days is None else NOW - timedelta(days=days),
+        difficulty=difficulty,
+        period=period,
+        user_id=0,
+    )
+
+
+def test_terms():
+    """Rest, plays, level and variety each favour the expected score."""
+    scores = [
+        _score(1, "Chopin", plays=10, days=1, difficulty=Difficulty.intermediate),
+        _score(2, "Chopin", plays=2, days=30, difficulty=Difficulty.intermediate),
+        _score(3, "Bach", difficulty=Difficulty.expert, period=Period.Baroque),
+        _score(4, "Ravel", difficulty=Difficulty.easy, period=Period.Modernist),
+    ]
+    rest, plays, level, variety = recommend.terms(scores, NOW).T
+    assert rest[0] == pytest.approx(1 - 0.5 ** (1 / 7))
+    assert rest[2] == 1 and rest[0] < rest[1] < rest[2]
+    assert plays[2] == 1 and plays[0] < plays[1] < plays[2]
+    # the user plays intermediate pieces: advanced is the stretch, expert and easy are far
+    assert level[0] > level[2] and level[0] > level[3]
+    # only score 1 was played in the last two weeks
+    assert variety.tolist() == [0, 0, 1, 1]
+
+
+def test_terms_without_history():
+    """Naive dates count as UTC and an unplayed library aims at its median level."""
+    scores = [_score(1, "Bach", difficulty=Difficulty.easy), _score(2, "Bach"), _score(3, "Bach")]
+    scores[0].last_played = (NOW - timedelta(days=7)).replace(tzinfo=None)
+    rest, _, level, _ = recommend.terms(scores, NOW).T
+    assert rest[0] == pytest.approx(0.5)
+    assert level.tolist()[1:] == [1, 1]
+
+
+def test_recommend_ranks_and_spreads_composers():
+    """Rested, varied scores come first; a composer's next scores are discounted."""
+    scores = [
+        _score(1, "Chopin", plays=5, days=0),
+        _score(2, "Chopin", plays=1, days=60),
+        _score(3, "Chopin", plays=1, days=60),
+        _score(4, " bach", plays=1, days=50, period=Period.Baroque),
+    ]
+    picks = recommend.recommend(scores, k=3, now=NOW)
+    # Chopin was just played, so Bach leads; 3 ties with 2 before the discount
+    assert [score.id for score, _, _ in picks] == [4, 2, 3]
+    values = [value for _, value, _ in picks]
+    assert values[2] == pytest.approx(values[1] * recommend.COMPOSER_DECAY, abs=1e-4)
+    assert set(picks[0][2]) == set(recommend.TERMS)
+    assert recommend.recommend([], k=3) == []
+
+
+def test_reasons():
+    """Only the high terms are explained."""
+    assert recommend.reasons({"rest": 1, "plays": 0.1, "level": 0.7, "variety": 0.2}) == [
+        "not played recently",
+        "matches your level",
+    ]
+
+
+def test_recommendations_endpoint(client: TestClient, session: Session):
+    """GET /scores/recommendations ranks the user's library; plays are remembered."""
+    assert client.post("/scores/1/play").status_code == 200
+    played = session.exec(select(Score).where(Score.id == 1)).one()
+    assert played.last_played is not None
+
+    response = client.get("/scores/recommendations", params={"k": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body) == 2
+    assert 1 not in [score["id"] for score in body]
+    assert {"recommendation", "terms", "reasons", "title"} <= set(body[0])
+    assert len(client.get("/scores/recommendations", params={"k": 0}).json()) == 1
@@ -0,0 +1,66 @@
+"""Tests for the buffered database recorder."""
+
+import pytest
+from sqlmodel import select
+
+from app.recorder import BufferedRecorder
+from shared.workload import AgentQuery
+
+
+class FlakyRecorder(BufferedRecorder[AgentQuery]):
+    """Fails its next write after the INSERT, recording ``meanwhile`` during it."""
+
+    fail = False
+    meanwhile: tuple[str, ...] = ()
+
+    async def _write(self, session, batch):
+        if not self.fail:
+            return await super()._write(session, batch)
+        self.fail = False
+        session.add_all(batch)
+        await session.flush()
+        for name in self.meanwhile:
+            self._append(AgentQuery(fingerprint=name))
+        raise RuntimeError("db down")
+
+
+def _fingerprints(rows) -> list[str]:
+    return [row.fingerprint for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_puts_the_batch_back(monkeypatch, async_session_factory, session):
+    """A batch whose commit fails is written by the next flush, ahead of newer rows."""
+    monkeypatch.setattr("app.recorder.AsyncSession", lambda _engine: async_session_factory())
+    recorder = FlakyRecorder(capacity=3, flush_size=10)
+    for name in ("a", "b"):
+        recorder._append(AgentQuery(fingerprint=name))
+
+    recorder.fail = True
+    with pytest.raises(RuntimeError):
+        await recorder.flush()
+    recorder._append(AgentQuery(fingerprint="c"))
+    assert _fingerprints(recorder.buffer) == ["a", "b", "c"]
+
+    assert await recorder.flush() == 3
+    assert _fingerprints(session.exec(select(AgentQuery).order_by(AgentQuery.id)).all()) == [
+        "a",
+        "b",
+        "c",
+    ]
+    assert recorder.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_requeued_rows_past_capacity_are_counted(monkeypatch, async_session_factory, session):
+    """Rows recorded during a failed flush keep their place; the oldest overflow is dropped."""
+    monkeypatch.setattr("app.recorder.AsyncSession", lambda _engine: async_session_factory())
+    recorder = FlakyRecorder(capacity=3, flush_size=10)
+    for name in ("a", "b"):
+        recorder._append(AgentQuery(fingerprint=name))
+
+    recorder.fail, recorder.meanwhile = True, ("c", "d")
+    with pytest.raises(RuntimeError):
+        await recorder.flush()
+    assert _fingerprints(recorder.buffer) == ["b", "c", "d"]
+    assert recorder.dropped == 1
@@ -0,0 +1,319 @@
+"""Tests for async retries, retry budgets and circuit breakers."""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pydantic_ai.exceptions import ModelAPIError, ModelHTTPError
+
+from app import agent, config, resilience
+from app.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy
+from shared.scores import Score
+
+
+def test_backoff_delay_is_jittered_and_capped(monkeypatch):
+    """Delay is uniform in [0, min(max_delay, base * 2**attempt)]."""
+    policy = RetryPolicy(attempts=5, base_delay=1.0, max_delay=5.0)
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: high)
+    assert [resilience.backoff_delay(i, policy) for i in range(4)] == [1.0, 2.0, 4.0, 5.0]
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: low)
+    assert resilience.backoff_delay(3, policy) == 0
+
+
+def test_is_retryable():
+    """Overload/5xx and transport errors retry; 4xx and open circuits don't."""
+    interactive = RetryPolicy(attempts=3, base_delay=0, max_delay=0)
+    ingest = RetryPolicy(attempts=3, base_delay=0, max_delay=0, retry_unknown=True)
+    assert resilience.is_retryable(ModelHTTPError(503, "m"), interactive)
+    assert resilience.is_retryable(ModelHTTPError(429, "m"), interactive)
+    assert not resilience.is_retryable(ModelHTTPError(400, "m"), ingest)
+    assert not resilience.is_retryable(CircuitOpenError(503, "m", 1.0), ingest)
+    assert resilience.is_retryable(ModelAPIError("m", "connection reset"), interactive)
+    assert not resilience.is_retryable(ValueError("bad output"), interactive)
+    assert resilience.is_retryable(ValueError("bad output"), ingest)
+
+
+def test_retry_budget():
+    """Retries are limited to the bucket; first attempts slowly refill it."""
+    budget = RetryBudget(ratio=0.5, capacity=2)
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.on_request()
+    budget.on_request()
+    assert budget.try_spend()
+    for _ in range(10):
+        budget.on_request()
+    assert budget.tokens == 2
+
+
+def test_circuit_breaker_lifecycle(monkeypatch):
+    """Consecutive 429/503s open the breaker; after the cooldown one probe is let through."""
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("m", failure_threshold=2, cooldown=10)
+
+    breaker.record_failure(ModelHTTPError(500, "m"))
+    breaker.record_failure(ModelHTTPError(429, "m"))
+    assert breaker.state == "closed"
+    breaker.record_failure(ModelHTTPError(429, "m"))
+    assert breaker.state == "open"
+
+    now[0] = 104.0
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after == 6.0
+
+    now[0] = 111.0
+    breaker.before_call()  # the probe
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # others wait for the probe
+    breaker.record_failure(ValueError("bad output"))
+    assert breaker.state == "open"
+
+    now[0] = 122.0
+    breaker.before_call()
+    breaker.record_failure(ModelHTTPError(503, "m"))
+    assert breaker.state == "open"
+
+    now[0] = 133.0
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_other_outcomes_break_the_failure_streak():
+    """Only 429/503s with nothing else in between count as consecutive."""
+    breaker = CircuitBreaker("m", failure_threshold=2, cooldown=10)
+
+    for outcome in (ModelHTTPError(400, "m"), ModelHTTPError(500, "m"), ValueError("bad")):
+        breaker.record_failure(ModelHTTPError(429, "m"))
+        breaker.record_failure(outcome)
+        assert breaker.failures == 0
+    breaker.record_failure(ModelHTTPError(503, "m"))
+    breaker.record_success()
+    breaker.record_failure(ModelHTTPError(503, "m"))
+    assert breaker.state == "closed"
+    breaker.record_failure(ModelHTTPError(429, "m"))
+    assert breaker.state == "open"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_reopens_the_breaker(monkeypatch):
+    """A half-open probe cancelled mid-call re-opens the breaker instead of wedging it."""
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(config, "BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(config, "BREAKER_COOLDOWN", 10)
+    breaker = resilience.get_breaker("m")
+    breaker.record_failure(ModelHTTPError(503, "m"))
+    now[0] = 111.0
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(10)
+
+    probe = asyncio.create_task(resilience.call_with_retries("main", "m", hang))
+    await started.wait()
+    assert breaker.state == "half_open"
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as exc:
+        await resilience.call_with_retries("main", "m", AsyncMock())
+    assert exc.value.retry_after == 10
+    now[0] = 122.0
+    assert await resilience.call_with_retries("main", "m", AsyncMock(return_value="ok")) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_circuit_open_error_pickles():
+    """CircuitOpenError round-trips through pickle like ModelHTTPError."""
+    import pickle  # noqa: PLC0415
+
+    err = pickle.loads(pickle.dumps(CircuitOpenError(503, "m", 2.5)))
+    assert (err.status_code, err.model_name, err.retry_after) == (503, "m", 2.5)
+
+
+@pytest.mark.asyncio
+async def test_call_with_retries_uses_asyncio_sleep(monkeypatch):
+    """Retries back off with asyncio.sleep and succeed once the provider recovers."""
+    sleep = AsyncMock()
+    monkeypatch.setattr(resilience.asyncio, "sleep", sleep)
+    call = AsyncMock(side_effect=[ModelHTTPError(503, "m"), ModelHTTPError(502, "m"), "ok"])
+
+    assert await resilience.call_with_retries("main", "m", call) == "ok"
+    assert call.await_count == 3
+    assert sleep.await_count == 2
+    assert resilience.get_breaker("m").state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_call_with_retries_stops_on_budget_and_attempts(monkeypatch):
+    """No retry without budget; attempts are capped by the policy."""
+    call = AsyncMock(side_effect=ModelHTTPError(500, "m"))
+    resilience.get_budget("main").tokens = 0
+    resilience.get_budget("main").ratio = 0
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_retries("main", "m", call)
+    assert call.await_count == 1
+
+    call.reset_mock()
+    policy = RetryPolicy(attempts=4, base_delay=0, max_delay=0)
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_retries("other", "m", call, policy)
+    assert call.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_short_circuits(monkeypatch):
+    """Once the breaker is open, calls fail immediately without hitting the provider."""
+    monkeypatch.setattr(config, "BREAKER_FAILURE_THRESHOLD", 2)
+    call = AsyncMock(side_effect=ModelHTTPError(503, "m"))
+    with pytest.raises(ModelHTTPError) as first:
+        await resilience.call_with_retries("main", "m", call)
+    assert not isinstance(first.value, CircuitOpenError)
+    assert call.await_count == 2
+
+    with pytest.raises(CircuitOpenError):
+        await resilience.call_with_retries("main", "m", call)
+    assert call.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_agents_answer_immediately_when_breaker_open(monkeypatch, test_user):
+    """Open breakers surface as an immediate user-facing message from every agent."""
+    monkeypatch.setattr(config, "BREAKER_FAILURE_THRESHOLD", 1)
+    resilience.get_breaker("test").record_failure(ModelHTTPError(503, "test"))
+    mock_agent = MagicMock()
+    mock_agent.run = AsyncMock()
+    monkeypatch.setattr("app.agent.Agent", MagicMock(return_value=mock_agent))
+    monkeypatch.setattr("app.agent.get_main_agent", lambda *args, **kwargs: mock_agent)
+
+    result = await agent.run_imslp_agent("prompt", model="test")
+    assert "temporarily unavailable" in result.response.response
+    result = await agent.run_agent(
+        "prompt", agent.Deps(user=test_user, scores=agent.Scores(scores=[])), model="test"
+    )
+    assert "try again in 30 seconds" in result.response.response
+    score = Score(title="t", composer="c")
+    assert await agent.run_complete_agent(score, model="test") == score
+    with pytest.raises(CircuitOpenError):
+        await agent.run_imslp_complete_agent("{}", model="test")
+    mock_agent.run.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_call_with_fallback_walks_chain():
+    """An overloaded model is abandoned after one attempt; the next one answers."""
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        if model == "primary":
+            raise ModelHTTPError(503, model)
+        return f"answer from {model}"
+
+    out = await resilience.call_with_fallback("main", ["primary", "primary", "backup"], call)
+    assert out == "answer from backup"
+    assert calls == ["primary", "backup"]
+
+
+@pytest.mark.asyncio
+async def test_call_with_fallback_does_not_mask_client_errors():
+    """4xx errors and exhausted chains are raised to the caller."""
+    call = AsyncMock(side_effect=ModelHTTPError(400, "m"))
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_fallback("main", ["a", "b"], call)
+    assert call.await_count == 1
+
+    call = AsyncMock(side_effect=ModelHTTPError(503, "m"))
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_fallback("main", ["a", "b"], call)
+    assert [c.args[0] for c in call.await_args_list] == ["a", "b", "b", "b"]
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_secondary_wins_and_primary_is_cancelled(monkeypatch):
+    """A slow primary is raced by the fallback; the loser is cancelled."""
+    monkeypatch.setattr(config, "AGENT_HEDGE_DELAY", 0.01)
+    cancelled = []
+
+    async def call(model):
+        if model == "slow":
+            try:
+                await resilience.asyncio.sleep(10)
+            except resilience.asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+        return model
+
+    assert await resilience.call_with_fallback("main", ["slow", "fast"], call) == "fast"
+    await resilience.asyncio.sleep(0)
+    assert cancelled == ["slow"]
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_primary_fast_paths(monkeypatch):
+    """Fast primaries never trigger a hedge; fast failures fall back or raise."""
+    monkeypatch.setattr(config, "AGENT_HEDGE_DELAY", 1)
+    call = AsyncMock(return_value="primary")
+    assert await resilience.call_with_fallback("main", ["a", "b"], call) == "primary"
+    assert call.await_count == 1
+
+    async def fail_a(model):
+        if model == "a":
+            raise ModelHTTPError(503, model)
+        return model
+
+    assert await resilience.call_with_fallback("main", ["a", "b", "c"], fail_a) == "b"
+
+    call = AsyncMock(side_effect=ModelHTTPError(401, "a"))
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_fallback("main", ["a", "b", "c"], call)
+    assert call.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_pair_failure_continues_down_the_chain(monkeypatch):
+    """If both hedged models fail, the rest of the chain is tried in order."""
+    monkeypatch.setattr(config, "AGENT_HEDGE_DELAY", 0.01)
+
+    async def call(model):
+        if model == "c":
+            return model
+        if model == "a":
+            await resilience.asyncio.sleep(0.02)
+        raise ModelHTTPError(503, model)
+
+    assert await resilience.call_with_fallback("main", ["a", "b", "c"], call) == "c"
+
+    with pytest.raises(ModelHTTPError):
+        await resilience.call_with_fallback("main", ["a", "b"], call)
+
+
+@pytest.mark.asyncio
+async def test_agents_use_fallback_models(monkeypatch):
+    """run_imslp_agent answers from the fallback when the configured model is down."""
+    from shared.responses import ImslpResponse  # noqa: PLC0415
+
+    def build(model):
+        instance = MagicMock()
+        if model == "down":
+            instance.run = AsyncMock(side_effect=ModelHTTPError(503, model))
+        else:
+            result = MagicMock()
+            result.output = ImslpResponse(response=f"from {model}", score_ids=[])
+            result.all_messages.return_value = []
+            instance.run = AsyncMock(return_value=result)
+        return instance
+
+    monkeypatch.setattr("app.agent.get_imslp_agent", build)
+    result = await agent.run_imslp_agent("prompt", model="down", fallbacks=["up"])
+    assert result.response.response == "from up"
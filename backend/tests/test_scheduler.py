@@ -0,0 +1,205 @@
+"""Tests for the fair agent scheduler."""
+
+import asyncio
+
+import pytest
+from fastapi import BackgroundTasks
+from fastapi.testclient import TestClient
+
+from app import config, main, scheduler
+from app.rate_limit import limiter
+from app.users import get_admin_user
+from shared.responses import FullResponse, Response
+from shared.user import User
+
+
+@pytest.fixture(autouse=True)
+def _fresh_scheduler(monkeypatch):
+    """Empty lanes and jobs, one slot per model."""
+    monkeypatch.setattr(scheduler, "lanes", {})
+    monkeypatch.setattr(scheduler, "jobs", scheduler.OrderedDict())
+    monkeypatch.setattr(config, "SCHEDULER_MODEL_CONCURRENCY", 1)
+
+
+async def _take(model, user_id, order, release=None):
+    async with scheduler.slot(model, user_id, bounded=False):
+        order.append(user_id)
+        if release is not None:
+            await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_slots_go_round_robin_across_users():
+    """A user with many queued calls doesn't hold the others back."""
+    order = []
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(_take("m", 0, order, release))
+    await asyncio.sleep(0)
+    waiting = [asyncio.ensure_future(_take("m", user, order)) for user in (1, 1, 1, 2)]
+    await asyncio.sleep(0)
+    assert scheduler.lanes["m"].stats()["queued"] == 4
+    assert scheduler.lanes["m"].stats()["users_waiting"] == 2
+    release.set()
+    await asyncio.gather(holder, *waiting)
+    assert order == [0, 1, 2, 1, 1]
+    stats = scheduler.lanes["m"].stats()
+    assert [stats[name] for name in ("running", "queued", "admitted", "max_depth")] == [0, 0, 5, 4]
+    assert stats["wait_max"] >= stats["wait_p95"] >= stats["wait_p50"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_full_queues_are_rejected(monkeypatch):
+    """Past the per-user (or lane) bound, calls fail at once with a retry hint."""
+    monkeypatch.setattr(config, "SCHEDULER_MAX_USER_QUEUE", 1)
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(_take("m", 0, [], release))
+    await asyncio.sleep(0)
+    queued = asyncio.ensure_future(_take("m", 1, []))
+    await asyncio.sleep(0)
+    with pytest.raises(scheduler.QueueFullError) as error:
+        async with scheduler.slot("m", 1):
+            pass  # pragma: no cover
+    assert error.value.retry_after == 20  # two calls of DEFAULT_RUN_SECONDS
+    scheduler.check("m", 2)  # other users still get in
+    release.set()
+    await asyncio.gather(holder, queued)
+    assert scheduler.lanes["m"].stats()["rejected"] == 1
+    assert scheduler.lanes["m"].retry_after() == 1  # runs were instant
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_leave_the_queue():
+    """A caller giving up frees its place, or its slot if it had just got one."""
+    order = []
+    holder = scheduler.slot("m", 0)
+    await holder.__aenter__()
+    leaver = asyncio.ensure_future(_take("m", 1, order))
+    granted = asyncio.ensure_future(_take("m", 2, order))
+    await asyncio.sleep(0)
+    leaver.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.lanes["m"].depth == 1
+    await holder.__aexit__(None, None, None)  # hands the slot over...
+    granted.cancel()  # ...to a caller that leaves before running
+    await asyncio.gather(granted, return_exceptions=True)
+    assert order == []
+    assert scheduler.lanes["m"].running == 0
+
+
+@pytest.mark.asyncio
+async def test_admitted_jobs_count_in_the_queue(monkeypatch, async_session_factory):
+    """Background jobs take their place in the queue on submission, not when they run."""
+    monkeypatch.setattr(scheduler, "AsyncSession", lambda *_a, **_k: async_session_factory())
+    monkeypatch.setattr(config, "SCHEDULER_MAX_USER_QUEUE", 2)
+    tasks = BackgroundTasks()
+
+    async def submit(user_id):
+        return await scheduler.dispatch(
+            _run_in_slot, None, "/agent", user_id, "m", tasks, background=True
+        )
+
+    await submit(1)
+    await submit(1)
+    with pytest.raises(scheduler.QueueFullError):
+        await submit(1)
+    await submit(2)
+    lane = scheduler.lanes["m"]
+    assert (lane.depth, lane.user_depth(1)) == (3, 2)
+
+    await tasks()
+    assert [job.status for job in scheduler.jobs.values()] == ["done"] * 3
+    assert (lane.depth, lane.reserved, lane.admitted) == (0, {}, 3)
+
+    # a job ending without an agent call gives its place back too
+    async def cached(_session):
+        return "cached"
+
+    tasks = BackgroundTasks()
+    await scheduler.dispatch(cached, None, "/agent", 1, "m", tasks, background=True)
+    assert lane.depth == 1
+    await tasks()
+    assert lane.depth == 0
+
+
+async def _run_in_slot(_session):
+    async with scheduler.slot("m", 1):
+        return "ok"
+
+
+@pytest.fixture(name="api")
+def api_fixture(client: TestClient, monkeypatch, async_session_factory):
+    """Client without rate limit; background jobs use the test DB."""
+    monkeypatch.setattr(scheduler, "AsyncSession", lambda *_a, **_k: async_session_factory())
+    main.app.dependency_overrides[get_admin_user] = lambda: True
+    limiter.enabled = False
+    yield client
+    limiter.enabled = True
+
+
+def _credits(session, user_id: int) -> int:
+    session.expire_all()
+    return session.get(User, user_id).credits
+
+
+def test_full_queue_is_a_503_and_refunds(api, session, test_user, monkeypatch):
+    """No room left: 503 with Retry-After, and the credit comes back."""
+    monkeypatch.setattr(config, "SCHEDULER_MODEL_CONCURRENCY", 0)
+    monkeypatch.setattr(config, "SCHEDULER_MAX_QUEUE", 0)
+    start = _credits(session, test_user.id)
+    for path in ("/agent", "/imslp_agent", "/complete_score"):
+        body = {"prompt": "hi", "deps": '{"scores": []}'}
+        if path == "/complete_score":
+            body = {"title": "Unknown piece", "composer": "Nobody", "user_id": None}
+        response = api.post(path, json=body)
+        assert response.status_code == 503, path
+        assert response.headers["Retry-After"] == "10"
+        assert api.post(path, json=body, params={"background": True}).status_code == 503
+    assert _credits(session, test_user.id) == start
+    assert api.get("/admin/scheduler").json()["test"]["rejected"] == 6
+
+
+def test_background_jobs_are_polled(api, session, test_user, monkeypatch):
+    """?background=true returns a job id; the owner polls the response."""
+    start = _credits(session, test_user.id)
+
+    async def fake_run_agent(prompt, **_kwargs):
+        if prompt == "fail":
+            raise RuntimeError("model down")
+        return FullResponse(response=Response(response=prompt), message_history=[])
+
+    monkeypatch.setattr(main, "run_agent", fake_run_agent)
+    body = {"prompt": "what now?", "deps": '{"scores": []}'}
+    job = api.post("/agent", json=body, params={"background": True}).json()
+    assert job["status"] == "queued"
+    done = api.get(f"/agent/jobs/{job['job_id']}").json()
+    assert done["status"] == "done"
+    assert done["result"]["response"]["response"] == "what now?"
+    assert _credits(session, test_user.id) == start - 1
+
+    job = api.post("/agent", json={**body, "prompt": "fail"}, params={"background": True})
+    failed = api.get(f"/agent/jobs/{job.json()['job_id']}").json()
+    assert (failed["status"], failed["error"]) == (
+        "failed",
+        {"status_code": 500, "detail": "model down"},
+    )
+    assert _credits(session, test_user.id) == start - 1
+    assert api.get("/agent/jobs/unknown").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_job_errors_are_recorded(monkeypatch, async_session_factory):
+    """Unexpected errors fail the job; old finished jobs are forgotten."""
+    monkeypatch.setattr(scheduler, "AsyncSession", lambda *_a, **_k: async_session_factory())
+    monkeypatch.setattr(config, "AGENT_JOBS_KEEP", 1)
+
+    async def broken(_session):
+        raise ValueError("bad")
+
+    first = scheduler.AgentJob(id="a", user_id=1, endpoint="/agent", status="done")
+    scheduler.jobs["a"] = first
+    job = scheduler.AgentJob(id="b", user_id=1, endpoint="/agent")
+    scheduler.jobs["b"] = job
+    await scheduler.run_job(job, broken)
+    assert job.error == {"status_code": 500, "detail": "bad"}
+    scheduler._prune_jobs()
+    assert list(scheduler.jobs) == ["b"]
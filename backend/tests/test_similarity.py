@@ -0,0 +1,193 @@
+"""Tests for the IMSLP similarity index."""
+
+import os
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app import config, imslp, similarity
+from app.db import get_session
+from app.main import app
+from app.users import get_admin_user
+from shared.scores import IMSLP
+
+
+def _work(id, title, composer, instrumentation="Piano", key="", period="Romantic"):
+    return SimpleNamespace(
+        id=id,
+        title=title,
+        composer=composer,
+        instrumentation=instrumentation,
+        style="",
+        key=key,
+        period=period,
+    )
+
+
+CATALOGUE = [
+    _work(1, "Nocturne Op.9 No.1", "Chopin, Frédéric", key="B-flat minor"),
+    _work(2, "Nocturne Op.9 No.2", "Chopin, Frédéric", key="E-flat major"),
+    _work(3, "Nocturnes, Op.15", "Chopin, Frédéric"),
+    _work(4, "Ballade No.1", "Chopin, Frédéric", key="G minor"),
+    _work(5, "Nocturne No.5", "Field, John"),
+    _work(6, "Mass in B minor", "Bach, Johann Sebastian", "Voices, Orchestra", period="Baroque"),
+    _work(7, "Fugue in G minor", "Bach, Johann Sebastian", "Organ", period="Baroque"),
+]
+
+
+def test_features_are_normalized_and_fold_accents():
+    """Vectors are unit length; accents and case don't matter."""
+    a = similarity.features(_work(1, "Étude", "Dvořák"))
+    b = similarity.features(_work(1, "etude", "DVORAK"))
+    assert a == b
+    assert sum(w * w for w in a.values()) == pytest.approx(1)
+    assert similarity.features(_work(1, "", "", "", period="")) == {}
+
+
+def test_similar_ranks_neighbours(similarity_index):
+    """Same composer or form rank first; the work itself is excluded."""
+    assert similarity_index.similar(CATALOGUE[0]) == []
+    assert similarity_index.add(CATALOGUE) == 7
+    similarity_index.add([_work(8, "", "", "", period="")])  # a segment without features
+    neighbours = similarity_index.similar(CATALOGUE[1], k=3)
+    assert [i for i, _ in neighbours] == [1, 3, 5]
+    assert all(0 < score < 1 for _, score in neighbours)
+    assert neighbours == sorted(neighbours, key=lambda n: -n[1])
+    # a tiny postings budget only changes how candidates are gathered
+    assert [i for i, _ in similarity_index.similar(CATALOGUE[1], k=3, budget=1)] == [1, 3, 5]
+    assert similarity_index.similar(_work(99, "Zzz", "Nobody", "", period="")) == []
+
+
+def test_segments_are_shared_merged_and_superseded(similarity_index, monkeypatch):
+    """Other readers see new segments; re-indexed works mask their old copy."""
+    monkeypatch.setattr(config, "SIMILARITY_MAX_SEGMENTS", 3)
+    reader = similarity.SimilarityIndex(similarity_index.path)
+    for work in CATALOGUE[:4]:
+        similarity_index.add([work])
+    # sizes 1+1 merge, then 2 and 1+1 -> 2+2 merge: one segment of 4
+    assert [len(s.ids) for s in similarity_index.segments] == [4]
+    assert similarity_index.add([]) == 0
+
+    similarity_index.add(CATALOGUE[4:6])
+    similarity_index.add([_work(2, "Ballade No.2", "Chopin, Frédéric")])
+    reader.refresh()
+    assert reader.docs == 6
+    assert isinstance(reader.segments[0].ids, np.memmap)
+    assert [i for i, _ in reader.similar(CATALOGUE[3], k=1)] == [2]
+
+    reader.compact()
+    similarity_index.refresh()
+    assert len(similarity_index.segments) == 1
+    assert similarity_index.docs == 6
+    assert sorted(similarity_index.segments[0].ids.tolist()) == [1, 2, 3, 4, 5, 6]
+    assert [i for i, _ in similarity_index.similar(CATALOGUE[3], k=1)] == [2]
+    names = {name for name in os.listdir(similarity_index.path) if name.startswith("seg-")}
+    assert names == {similarity_index.segments[0].name}
+
+    similarity_index.reset()
+    reader.refresh()
+    assert (reader.docs, reader.segments) == (0, [])
+    similarity_index.reset()  # nothing to drop
+
+
+def test_adding_writes_only_the_new_segment(similarity_index, monkeypatch):
+    """Document frequencies come from the segments' postings; nothing else is rewritten."""
+    monkeypatch.setattr(config, "SIMILARITY_MAX_SEGMENTS", 10)
+    similarity_index.add(CATALOGUE[:4])
+    before = set(os.listdir(similarity_index.path))
+    similarity_index.add(CATALOGUE[4:5])  # too small to merge
+    assert set(os.listdir(similarity_index.path)) - before == {similarity_index.segments[1].name}
+
+    similarity_index.add([_work(2, "Ballade No.2", "Chopin, Frédéric")])
+    similarity_index.compact()
+    (segment,) = similarity_index.segments
+    expected = np.zeros(config.SIMILARITY_FEATURES, dtype=np.int32)
+    expected[segment.features] = np.diff(segment.offsets)
+    np.testing.assert_array_equal(similarity_index.df, expected)
+    reader = similarity.SimilarityIndex(similarity_index.path)
+    reader.refresh()
+    np.testing.assert_array_equal(reader.df, expected)
+
+
+def test_refresh_retries_when_a_merge_removes_segments(similarity_index):
+    """A reader racing a merge reopens from the new manifest."""
+    similarity_index.add(CATALOGUE)
+    reader = similarity.SimilarityIndex(similarity_index.path)
+    real_open = reader._open
+    calls = []
+
+    def flaky_open(manifest):
+        calls.append(manifest)
+        if len(calls) == 1:
+            raise FileNotFoundError
+        real_open(manifest)
+
+    reader._open = flaky_open  # type: ignore[method-assign]
+    reader.refresh()
+    assert len(calls) == 2
+    assert reader.docs == 7
+
+
+@pytest.fixture(name="api")
+def api_fixture(session):
+    """Client on the test DB with the catalogue stored and indexed."""
+    session.add_all(IMSLP(permlink=f"p{w.id}", **vars(w)) for w in CATALOGUE)
+    session.commit()
+    app.dependency_overrides[get_admin_user] = lambda: True
+    app.dependency_overrides[get_session] = lambda: session
+    with patch("app.similarity.Session", return_value=session):
+        yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_similar_endpoint(api, similarity_index):
+    """GET /imslp/{id}/similar returns the neighbours' rows with their scores."""
+    similarity_index.add(CATALOGUE)
+    response = api.get("/imslp/2/similar", params={"k": 2})
+    assert response.status_code == 200
+    assert [(w["id"], w["title"]) for w in response.json()] == [
+        (1, "Nocturne Op.9 No.1"),
+        (3, "Nocturnes, Op.15"),
+    ]
+    assert 0 < response.json()[0]["similarity"] <= 1
+    assert api.get("/imslp/999/similar").status_code == 404
+
+
+def test_rebuild_and_stats(api, similarity_index):
+    """The admin rebuild indexes the whole table in one segment."""
+    assert api.get("/imslp/similarity/stats").json() == {
+        "indexed_works": 0,
+        "segments": 0,
+        "catalogue_works": 7,
+    }
+    assert api.post("/imslp/similarity/rebuild").status_code == 200
+    assert api.get("/imslp/similarity/stats").json()["indexed_works"] == 7
+    assert similarity.rebuild(batch_size=3) == 7
+    assert len(similarity_index.segments) == 1
+
+
+def test_large_catalogue_shortlists_and_merges_tails(similarity_index):
+    """Only the newest segments are merged; shortlisted answers match a full scan."""
+    works = [
+        _work(i, f"Sonata No.{i % 40}", f"Composer{i % 30}", key=("C major", "A minor")[i % 2])
+        for i in range(600)
+    ]
+    for start, end in ((0, 200), (200, 400), (400, 500), (500, 600)):
+        similarity_index.add(works[start:end])
+    assert [len(s.ids) for s in similarity_index.segments] == [400, 200]
+    assert similarity_index.docs == 600
+    shortlisted = similarity_index.similar(works[7], k=5, budget=0)
+    assert shortlisted == similarity_index.similar(works[7], k=5, budget=10**9)
+    assert all(i % 30 == 7 or i % 40 == 7 for i, _ in shortlisted)
+
+
+@pytest.mark.asyncio
+async def test_ingest_indexes_written_entries(similarity_index):
+    """Entries written by the IMSLP ingest are added to the index."""
+    await imslp.index_entries([])
+    assert similarity_index.docs == 0
+    await imslp.index_entries(CATALOGUE[:3])
+    assert similarity_index.docs == 3
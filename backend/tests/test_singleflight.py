@@ -0,0 +1,184 @@
+"""Tests for the single-flight call coalescing."""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+from app import config, imslp, main, singleflight
+from app.rate_limit import limiter
+from app.users import get_admin_user
+from shared.responses import ImslpFullResponse, ImslpResponse
+from shared.scores import IMSLP
+from shared.user import User
+
+
+@pytest.fixture(autouse=True)
+def _fresh_groups():
+    """Every test starts from empty counters."""
+    for flight in singleflight.groups.values():
+        flight.calls = flight.executions = flight.timeouts = 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    """Same key: one execution, one result; other keys run on their own."""
+    flight = singleflight.SingleFlight("test")
+    runs = []
+
+    async def call(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        *(flight.do("a", lambda: call(1)) for _ in range(5)), flight.do("b", lambda: call(2))
+    )
+    assert results == [1, 1, 1, 1, 1, 2]
+    assert runs == [1, 2]
+    assert flight.stats() == {
+        "calls": 6,
+        "executions": 2,
+        "collapsed": 4,
+        "timeouts": 0,
+        "in_flight": 0,
+    }
+    # finished calls are not cached
+    assert await flight.do("a", lambda: call(3)) == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_and_timeouts_reach_every_waiter():
+    """Waiters share the failure; a timed-out key is free again."""
+    flight = singleflight.SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(
+        flight.do("k", fail), flight.do("k", fail), return_exceptions=True
+    )
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
+
+    results = await asyncio.gather(
+        flight.do("k", lambda: asyncio.sleep(10), timeout=0.01),
+        flight.do("k", lambda: asyncio.sleep(10), timeout=5),
+        return_exceptions=True,
+    )
+    assert [type(r) for r in results] == [TimeoutError, TimeoutError]
+    assert flight.stats()["timeouts"] == 1
+    assert flight.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_leaving_caller_does_not_cancel_the_others():
+    """A cancelled caller only stops waiting."""
+    flight = singleflight.SingleFlight("test")
+    leaver = asyncio.ensure_future(flight.do("k", lambda: asyncio.sleep(0.02, "done")))
+    stayer = asyncio.ensure_future(flight.do("k", lambda: asyncio.sleep(0.02, "other")))
+    await asyncio.sleep(0)
+    leaver.cancel()
+    assert await stayer == "done"
+    assert leaver.cancelled()
+
+
+@pytest.fixture(name="admin_client")
+def admin_client_fixture(client: TestClient):
+    """Client with admin rights and no rate limit."""
+    main.app.dependency_overrides[get_admin_user] = lambda: True
+    limiter.enabled = False
+    yield client
+    limiter.enabled = True
+
+
+def _credits(session, user_id: int) -> int:
+    session.expire_all()
+    return session.get(User, user_id).credits
+
+
+@pytest.mark.asyncio
+async def test_imslp_agent_prompts_are_collapsed_but_each_caller_pays(
+    admin_client, session, test_user, monkeypatch
+):
+    """Identical concurrent prompts run the agent once; every caller is debited."""
+    start = _credits(session, test_user.id)
+    runs = []
+
+    async def fake_run_imslp_agent(prompt, message_history=None, model=None, fallbacks=None):
+        runs.append(prompt)
+        # hold the runs until every request has joined its flight
+        async with asyncio.timeout(5):
+            while main.imslp_agent_flight.calls < 4:
+                await asyncio.sleep(0.01)
+        return ImslpFullResponse(
+            response=ImslpResponse(response=prompt, score_ids=[1]), message_history=[]
+        )
+
+    monkeypatch.setattr(main, "run_imslp_agent", fake_run_imslp_agent)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *(client.post("/imslp_agent", json={"prompt": "sonatas"}) for _ in range(3)),
+            client.post("/imslp_agent", json={"prompt": "fugues"}),
+        )
+    assert [r.json()["response"]["response"] for r in responses] == ["sonatas"] * 3 + ["fugues"]
+    assert sorted(runs) == ["fugues", "sonatas"]
+    assert _credits(session, test_user.id) == start - 4
+
+    report = admin_client.get("/admin/singleflight").json()
+    assert report["imslp_agent"]["collapsed"] == 2
+
+
+def test_imslp_agent_timeout_refunds(admin_client, session, test_user, monkeypatch):
+    """An agent run past its timeout is a 504 and the credit comes back."""
+    start = _credits(session, test_user.id)
+    monkeypatch.setattr(config, "SINGLEFLIGHT_AGENT_TIMEOUT", 0.01)
+
+    async def slow_run_imslp_agent(*_args, **_kwargs):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(main, "run_imslp_agent", slow_run_imslp_agent)
+    assert admin_client.post("/imslp_agent", json={"prompt": "x"}).status_code == 504
+    assert _credits(session, test_user.id) == start
+
+
+@pytest.fixture(name="catalogue_sessions")
+def catalogue_sessions_fixture(monkeypatch, async_session_factory):
+    """The catalogue queries' own sessions use the test DB."""
+    monkeypatch.setattr(imslp, "AsyncSession", lambda *_a, **_k: async_session_factory())
+
+
+@pytest.mark.asyncio
+async def test_catalogue_queries_time_out(monkeypatch, catalogue_sessions):
+    """A catalogue query past its timeout is a 504."""
+    monkeypatch.setattr(config, "SINGLEFLIGHT_QUERY_TIMEOUT", 0.01)
+    with pytest.raises(HTTPException) as error:
+        await imslp._coalesced(imslp.by_ids_flight, (1,), lambda _session: asyncio.sleep(0.1))
+    assert error.value.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_catalogue_rows_belong_to_no_caller(session, catalogue_sessions):
+    """Coalesced queries run on a session of their own; every caller gets detached rows."""
+    session.add(IMSLP(id=1, title="T", composer="C", permlink=""))
+    session.commit()
+
+    rows = await asyncio.gather(*(imslp.get_by_ids("[1]") for _ in range(3)))
+
+    assert singleflight.groups["imslp_scores_by_ids"].executions == 1
+    assert all(result is rows[0] for result in rows)
+    (work,) = rows[0]
+    assert (work.title, inspect(work).detached) == ("T", True)
+
+
+def test_catalogue_endpoints_are_reported(admin_client, catalogue_sessions):
+    """The catalogue endpoints go through their groups."""
+    assert admin_client.get("/imslp/scores_by_ids", params={"score_ids": "[2, 1, 2]"}).json() == []
+    assert admin_client.get("/imslp/stats").json() == {"total_works": 0, "total_composers": 0}
+    report = admin_client.get("/admin/singleflight").json()
+    assert report["imslp_scores_by_ids"]["calls"] == 1
+    assert report["imslp_stats"]["executions"] == 1
@@ -0,0 +1,147 @@
+"""Tests for the EXPLAIN-based SQL cost guard."""
+
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pydantic_ai.exceptions import ModelRetry
+
+from app import config, sql_guard
+from app.sql_guard import PlanEstimate
+
+
+def _plan(cost: float, rows: float, node: str = "Seq Scan"):
+    return [{"Plan": {"Node Type": node, "Total Cost": cost, "Plan Rows": rows}}]
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    """Pin thresholds so tests don't depend on the environment."""
+    monkeypatch.setattr(config, "SQL_GUARD_MAX_COST", 1000.0)
+    monkeypatch.setattr(config, "SQL_GUARD_MAX_ROWS", 500.0)
+    monkeypatch.setattr(config, "SQL_GUARD_ROW_LIMIT", 100)
+
+
+def test_parse_plan_accepts_str_and_list():
+    """EXPLAIN output may come back as a JSON string or already decoded."""
+    expected = PlanEstimate(total_cost=12.5, plan_rows=3.0, node_type="Index Scan")
+    assert sql_guard.parse_plan(_plan(12.5, 3, "Index Scan")) == expected
+    assert sql_guard.parse_plan(json.dumps(_plan(12.5, 3, "Index Scan"))) == expected
+
+
+def test_decide_thresholds():
+    """Cheap plans pass, expensive ones are rejected, wide ones get a LIMIT."""
+    sql = "SELECT * FROM imslp"
+    assert sql_guard.decide(sql, None).action == "allow"
+    assert sql_guard.decide(sql, PlanEstimate(10, 10, "Seq Scan")).action == "allow"
+
+    rejected = sql_guard.decide(sql, PlanEstimate(5000, 10, "Nested Loop"))
+    assert rejected.action == "reject"
+    payload = json.loads(rejected.error_payload())
+    assert payload["error"] == "query_too_expensive"
+    assert payload["estimated_cost"] == 5000
+    assert payload["max_cost"] == 1000.0
+
+    rewritten = sql_guard.decide(sql, PlanEstimate(100, 50000, "Seq Scan"))
+    assert rewritten.action == "rewrite"
+    assert rewritten.sql == "SELECT * FROM (\nSELECT * FROM imslp\n) AS guarded LIMIT 100"
+
+
+@pytest.mark.parametrize(
+    "sql, action",
+    [
+        ("SELECT * FROM imslp -- all of them", "rewrite"),
+        ("(select id from imslp) union (select id from score)", "rewrite"),
+        ("WITH gone AS (DELETE FROM imslp RETURNING *) SELECT * FROM gone", "reject"),
+        ("SELECT 1; SELECT * FROM imslp", "reject"),
+        ("UPDATE imslp SET year = 1800", "reject"),
+    ],
+)
+def test_decide_wraps_only_plain_selects(sql, action):
+    """Only a single SELECT is wrapped; a trailing comment can't swallow the parenthesis."""
+    decision = sql_guard.decide(sql, PlanEstimate(100, 50000, "Seq Scan"))
+
+    assert decision.action == action
+    if action == "rewrite":
+        assert decision.sql.endswith(f"\n{sql}\n) AS guarded LIMIT 100")
+
+
+@pytest.mark.asyncio
+async def test_explain_skipped_on_sqlite():
+    """The test database is SQLite, where EXPLAIN (FORMAT JSON) doesn't exist."""
+    assert await sql_guard.explain("SELECT 1") is None
+
+
+def _fake_pg_engine(conn):
+    engine = MagicMock()
+    engine.dialect.name = "postgresql"
+    engine.connect.return_value.__aenter__ = AsyncMock(return_value=conn)
+    engine.connect.return_value.__aexit__ = AsyncMock(return_value=False)
+    return engine
+
+
+@pytest.mark.asyncio
+async def test_explain_postgres_read_only(monkeypatch):
+    """On Postgres the EXPLAIN runs in a read-only transaction that is rolled back."""
+    conn = MagicMock()
+    result = MagicMock()
+    result.scalar_one.return_value = json.dumps(_plan(42.0, 7))
+    conn.exec_driver_sql = AsyncMock(return_value=result)
+    conn.rollback = AsyncMock()
+    monkeypatch.setattr(sql_guard, "async_engine", _fake_pg_engine(conn))
+
+    estimate = await sql_guard.explain("SELECT * FROM imslp")
+
+    assert estimate == PlanEstimate(42.0, 7.0, "Seq Scan")
+    statements = [c.args[0] for c in conn.exec_driver_sql.call_args_list]
+    assert statements[0] == "SET TRANSACTION READ ONLY"
+    assert statements[-1] == "EXPLAIN (FORMAT JSON) SELECT * FROM imslp"
+    conn.rollback.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_explain_failure_lets_query_through(monkeypatch, caplog):
+    """A failing EXPLAIN (syntax error, timeout) yields no estimate; failing open is a warning."""
+    conn = MagicMock()
+    conn.exec_driver_sql = AsyncMock(side_effect=RuntimeError("syntax error"))
+    monkeypatch.setattr(sql_guard, "async_engine", _fake_pg_engine(conn))
+
+    assert await sql_guard.explain("SELEC nonsense") is None
+    with caplog.at_level("INFO", logger="app.sql_guard"):
+        assert (await sql_guard.check_query("SELEC nonsense")).action == "allow"
+    assert [r.levelname for r in caplog.records if "decision=allow" in r.message] == ["WARNING"]
+
+
+@pytest.mark.asyncio
+async def test_guard_tool_call_passthrough_for_other_tools():
+    """Tools that don't run SQL are forwarded untouched."""
+    call_tool = AsyncMock(return_value="tables")
+    out = await sql_guard.guard_tool_call(MagicMock(), call_tool, "list_objects", {"schema": "x"})
+    assert out == "tables"
+    call_tool.assert_awaited_once_with("list_objects", {"schema": "x"}, None)
+
+
+@pytest.mark.asyncio
+async def test_guard_tool_call_rewrites_and_rejects(monkeypatch, caplog):
+    """Wide queries are forwarded with a LIMIT, expensive ones raise ModelRetry."""
+    call_tool = AsyncMock(return_value="[]")
+    monkeypatch.setattr(sql_guard, "explain", AsyncMock(return_value=PlanEstimate(1, 9999, "X")))
+
+    with caplog.at_level("INFO", logger="app.sql_guard"):
+        result = await sql_guard.guard_tool_call(
+            MagicMock(), call_tool, "execute_sql", {"sql": "SELECT * FROM imslp;"}
+        )
+    forwarded = call_tool.call_args.args[1]["sql"]
+    assert forwarded == "SELECT * FROM (\nSELECT * FROM imslp\n) AS guarded LIMIT 100"
+    assert "decision=rewrite" in caplog.text
+    assert result["rows"] == "[]"
+    assert "first 100 rows" in result["note"] and "9999 rows" in result["note"]
+
+    monkeypatch.setattr(sql_guard, "explain", AsyncMock(return_value=PlanEstimate(1e9, 1, "X")))
+    call_tool.reset_mock()
+    with pytest.raises(ModelRetry) as exc:
+        await sql_guard.guard_tool_call(
+            MagicMock(), call_tool, "execute_sql", {"sql": "SELECT * FROM imslp a, imslp b"}
+        )
+    assert json.loads(exc.value.message)["error"] == "query_too_expensive"
+    call_tool.assert_not_called()
@@ -0,0 +1,198 @@
+"""Tests for per-call LLM usage accounting."""
+
+import asyncio
+import json
+from datetime import UTC, datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic_ai import Agent
+from pydantic_ai.models.test import TestModel
+from pydantic_ai.usage import RunUsage
+from sqlmodel import Session, select
+
+from app import agent, usage
+from app.main import app
+from app.users import get_admin_user
+from shared.scores import ScoreBase
+from shared.usage import AgentUsage, AgentUsageDaily
+
+
+def test_histogram_percentiles():
+    """Percentiles interpolate inside buckets; the open last bucket reports its lower bound."""
+    assert usage.bucket_index(10) == 0
+    assert usage.bucket_index(50) == 0
+    assert usage.bucket_index(51) == 1
+    assert usage.bucket_index(10**6) == len(usage.LATENCY_BUCKETS_MS)
+
+    histogram = [0] * (len(usage.LATENCY_BUCKETS_MS) + 1)
+    assert usage.percentile(histogram, 0.5) is None
+    histogram[0] = 10
+    assert usage.percentile(histogram, 0.5) == 25.0
+    histogram[-1] = 90
+    assert usage.percentile(histogram, 0.95) == usage.LATENCY_BUCKETS_MS[-1]
+
+
+@pytest.mark.asyncio
+async def test_track_records_usage_and_errors():
+    """Successful calls record tokens; failures are recorded as errors and re-raised."""
+    result = MagicMock()
+    result.usage.return_value = RunUsage(requests=2, input_tokens=30, output_tokens=7, tool_calls=1)
+    assert await usage.track("main", "m", AsyncMock(return_value=result)) is result
+
+    with pytest.raises(ValueError):
+        await usage.track("main", "m", AsyncMock(side_effect=ValueError("boom")))
+
+    # results without a usage() (e.g. mocks in other tests) record zeros
+    await usage.track("main", "m", AsyncMock(return_value="plain"))
+
+    ok, error, plain = usage.recorder.buffer
+    assert (ok.input_tokens, ok.output_tokens, ok.tool_calls, ok.requests) == (30, 7, 1, 2)
+    assert (ok.endpoint, ok.user_id, ok.status) == ("main", None, "ok")
+    assert error.status == "error"
+    assert plain.input_tokens == 0
+
+
+@pytest.mark.asyncio
+async def test_bind_attributes_calls_to_request():
+    """Calls made after bind() carry the endpoint and user id."""
+
+    async def request():
+        usage.bind("/agent", 42)
+        await usage.track("main", "m", AsyncMock(return_value=None))
+
+    await asyncio.create_task(request())
+    await usage.track("main", "m", AsyncMock(return_value=None))
+    bound, unbound = usage.recorder.buffer
+    assert (bound.endpoint, bound.user_id) == ("/agent", 42)
+    assert (unbound.endpoint, unbound.user_id) == ("main", None)
+
+
+@pytest.mark.asyncio
+async def test_agent_runs_are_tracked(monkeypatch):
+    """A real pydantic-ai run reports its token usage under the model name."""
+    monkeypatch.setattr(
+        agent,
+        "get_imslp_complete_agent",
+        lambda _m: Agent(TestModel(call_tools=[]), output_type=ScoreBase),
+    )
+    await agent.run_imslp_complete_agent("{}", model="test-model")
+    (call,) = usage.recorder.buffer
+    assert call.kind == call.endpoint == "imslp_complete"
+    assert call.model == "test-model"
+    assert call.requests == 1
+    assert call.input_tokens > 0
+    assert call.output_tokens > 0
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_rows_and_merges_rollups(monkeypatch, async_session_factory, session):
+    """Each flush inserts raw rows and folds them into the daily rollups."""
+    monkeypatch.setattr("app.recorder.AsyncSession", lambda _engine: async_session_factory())
+    recorder = usage.UsageRecorder(capacity=10, flush_size=10)
+    assert await recorder.flush() == 0
+
+    recorder.record("main", "m", 40.0, RunUsage(input_tokens=10, output_tokens=2))
+    recorder.record("main", "m", 400.0, status="error")
+    recorder.record("imslp", "other", 1.0)
+    assert await recorder.flush() == 3
+    recorder.record("main", "m", 3000.0, RunUsage(input_tokens=5, tool_calls=3))
+    assert await recorder.flush() == 1
+
+    assert len(session.exec(select(AgentUsage)).all()) == 4
+    rollup = session.exec(select(AgentUsageDaily).where(AgentUsageDaily.model == "m")).one()
+    assert (rollup.calls, rollup.errors) == (3, 1)
+    assert (rollup.input_tokens, rollup.output_tokens, rollup.tool_calls) == (15, 2, 3)
+    assert rollup.total_ms == 3440.0
+    histogram = json.loads(rollup.latency_histogram)
+    assert sum(histogram) == 3
+    assert histogram[usage.bucket_index(3000.0)] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_flushes_add_up(monkeypatch, async_session_factory, session):
+    """Flushes racing on the same rollup, e.g. from two workers, lose no calls."""
+    monkeypatch.setattr("app.recorder.AsyncSession", lambda _engine: async_session_factory())
+    recorders = [usage.UsageRecorder(capacity=100, flush_size=100) for _ in range(4)]
+    for i, recorder in enumerate(recorders):
+        for _ in range(10):
+            recorder.record("main", "m", 40.0 * (i + 1), RunUsage(input_tokens=1))
+
+    assert await asyncio.gather(*(recorder.flush() for recorder in recorders)) == [10] * 4
+
+    rollup = session.exec(select(AgentUsageDaily)).one()
+    assert (rollup.calls, rollup.input_tokens, rollup.total_ms) == (40, 40, 4000.0)
+    assert sum(json.loads(rollup.latency_histogram)) == 40
+
+
+@pytest.mark.asyncio
+async def test_recorder_ring_buffer_and_background_flush():
+    """The buffer drops the oldest calls when full and flushes once flush_size is hit."""
+    recorder = usage.UsageRecorder(capacity=2, flush_size=10)
+    for i in range(3):
+        recorder.record("main", f"m{i}", 1.0)
+    assert recorder.dropped == 1
+    assert [c.model for c in recorder.buffer] == ["m1", "m2"]
+
+    recorder.flush_size = 1
+    recorder.flush = AsyncMock(side_effect=RuntimeError("db down"))  # type: ignore[method-assign]
+    recorder.record("main", "m3", 1.0)
+    await asyncio.sleep(0)
+    recorder.flush.assert_awaited_once()
+    assert recorder._flush_task is None
+
+
+def test_usage_report(client: TestClient, session: Session, monkeypatch):
+    """The admin report serves percentiles and totals from the rollups."""
+    app.dependency_overrides[get_admin_user] = lambda: True
+    today = datetime.now(UTC).date()
+    histogram = [0] * (len(usage.LATENCY_BUCKETS_MS) + 1)
+    histogram[usage.bucket_index(80)] = 10
+    session.add(
+        AgentUsageDaily(
+            day=today - timedelta(days=30),
+            model="old",
+            endpoint="/agent",
+            calls=1,
+            latency_histogram=json.dumps(histogram),
+        )
+    )
+    session.add(
+        AgentUsageDaily(
+            day=today,
+            model="m",
+            endpoint="/agent",
+            calls=10,
+            input_tokens=100,
+            total_ms=800.0,
+            latency_histogram=json.dumps(histogram),
+        )
+    )
+    session.commit()
+    usage.recorder.record("imslp", "m", 10.0)
+
+    data = client.get("/admin/usage").json()
+    assert data["buffered"] == 0
+    assert [(r["model"], r["endpoint"]) for r in data["rows"]] == [("m", "/agent"), ("m", "imslp")]
+    row = data["rows"][0]
+    assert row["input_tokens"] == 100
+    assert row["mean_ms"] == 80.0
+    assert row["p50_ms"] == 75.0
+    assert 50 < row["p95_ms"] <= 100
+
+    data = client.get("/admin/usage", params={"days": 60, "model": "old"}).json()
+    assert [r["model"] for r in data["rows"]] == ["old"]
+    data = client.get("/admin/usage", params={"endpoint": "imslp"}).json()
+    assert [r["calls"] for r in data["rows"]] == [1]
+
+
+def test_agent_endpoint_binds_user(client: TestClient, test_user, monkeypatch):
+    """Agent calls made by an endpoint are attributed to it and to the current user."""
+
+    async def fake_run(*_args, **_kwargs):
+        return {"context": usage._call_context.get()}
+
+    monkeypatch.setattr("app.main.run_imslp_agent", fake_run)
+    response = client.post("/imslp_agent", json={"prompt": "hi"})
+    assert response.json()["context"] == ["/imslp_agent", test_user.id]
@@ -337,6 +337,8 @@ def test_refill_user_credits(user_in_db: User, client: TestClient, session: Sess
     )
     assert resp.status_code == 200
     assert resp.json()["credits"] == 50
+    ledger = client.get(f"/users/{user_in_db.id}/credit_ledger", headers=admin_headers).json()
+    assert [(e["delta"], e["balance"], e["reason"]) for e in ledger] == [(40, 50, "refill")]
 
     # 2. User not found
     resp_not_found = client.post(
@@ -353,3 +355,24 @@ def test_refill_user_credits(user_in_db: User, client: TestClient, session: Sess
         headers=user_headers,
     )
     assert resp_forbidden.status_code == 403
+    resp_forbidden = client.get(f"/users/{user_in_db.id}/credit_ledger", headers=user_headers)
+    assert resp_forbidden.status_code == 403
+
+
+def test_admin_model_fallbacks(client: TestClient, session: Session):
+    """POST /admin/model stores per-kind fallback chains, GET returns them."""
+    app.dependency_overrides[users.get_admin_user] = lambda: True
+
+    resp = client.post(
+        "/admin/model",
+        json={"fallbacks": {"main": ["google-gla:gemini-2.5-flash", "openai:gpt-4o-mini"]}},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["models"] == {}
+
+    fallbacks = client.get("/admin/model").json()["fallbacks"]
+    assert fallbacks["main"] == ["google-gla:gemini-2.5-flash", "openai:gpt-4o-mini"]
+    assert fallbacks["imslp"] == []
+
+    client.post("/admin/model", json={"fallbacks": {"main": []}})
+    assert client.get("/admin/model").json()["fallbacks"]["main"] == []
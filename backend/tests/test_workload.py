@@ -0,0 +1,176 @@
+"""Tests for the agent SQL workload recorder and index advisor."""
+
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import workload
+from app.main import app
+from app.sql_guard import PlanEstimate
+from app.users import get_admin_user
+from shared.workload import AgentQuery
+
+
+@pytest.fixture(autouse=True)
+def fresh_recorder(monkeypatch):
+    """Give each test an empty recorder."""
+    monkeypatch.setattr(workload, "recorder", workload.WorkloadRecorder(capacity=3, flush_size=2))
+
+
+def test_normalize_and_fingerprint():
+    """Literals and IN lists are collapsed so equivalent queries share a fingerprint."""
+    a = "SELECT * FROM imslp WHERE composer = 'Bach' AND year > 1700 AND id IN (1, 2, 3);"
+    b = "select *  from imslp where composer = 'Chopin' and year > 1810 and id in (4,5)"
+    assert workload.normalize(a) == (
+        "select * from imslp where composer = ? and year > ? and id in (?)"
+    )
+    assert workload.fingerprint(a) == workload.fingerprint(b)
+    assert workload.fingerprint(a) != workload.fingerprint("SELECT 1")
+
+
+def test_row_count():
+    """Row counts are parsed from JSON, Python reprs or lists; anything else is None."""
+    assert workload.row_count([{"id": 1}]) == 1
+    assert workload.row_count('[{"id": 1}, {"id": 2}]') == 2
+    assert workload.row_count("[{'id': 1, 'title': 'x'}]") == 1
+    assert workload.row_count("No results") is None
+    assert workload.row_count('{"id": 1}') is None
+    assert workload.row_count({"rows": []}) is None
+
+
+def test_predicate_columns():
+    """Predicates resolve through aliases; leading wildcards need a trigram index."""
+    sql = (
+        "SELECT i.title FROM public.imslp AS i JOIN score s ON s.imslp_id = i.id "
+        "WHERE lower(i.instrumentation) LIKE '%piano%' AND i.year >= 1800 AND s.title = 'x'"
+    )
+    assert workload.predicate_columns(sql) == {
+        ("score", "imslp_id", "btree"),
+        ("imslp", "instrumentation", "trgm"),
+        ("imslp", "year", "btree"),
+        ("score", "title", "btree"),
+    }
+    assert workload.predicate_columns("SELECT 1") == set()
+    assert workload.predicate_columns("SELECT * FROM imslp WHERE composer LIKE 'Ba%'") == {
+        ("imslp", "composer", "btree")
+    }
+
+
+def test_suggest_indexes_skips_indexed_and_unknown_columns():
+    """Already-indexed columns and columns outside our schema get no suggestion."""
+    samples = [
+        "SELECT * FROM imslp WHERE id = 3 AND composer = 'Bach'",
+        "SELECT * FROM imslp WHERE composer = 'Liszt' AND title ILIKE '%etude%'",
+        "SELECT * FROM imslp WHERE nonexistent = 1",
+        "SELECT * FROM pg_class WHERE relname = 'x'",
+    ]
+    suggestions = workload.suggest_indexes(samples, {"imslp": {"id"}})
+    assert [(s["column"], s["kind"], s["queries"]) for s in suggestions] == [
+        ("composer", "btree", 2),
+        ("title", "trgm", 1),
+    ]
+    assert suggestions[1]["statement"] == (
+        "CREATE INDEX CONCURRENTLY ix_imslp_title_trgm ON imslp USING gin (title gin_trgm_ops)"
+    )
+
+
+@pytest.mark.asyncio
+async def test_recorder_ring_buffer_and_background_flush(monkeypatch):
+    """The buffer drops the oldest entries when full and flushes once flush_size is hit."""
+    recorder = workload.WorkloadRecorder(capacity=2, flush_size=10)
+    for i in range(3):
+        recorder.record(f"SELECT {i}", 1.0, 1)
+    assert recorder.dropped == 1
+    assert [q.sql for q in recorder.buffer] == ["SELECT 1", "SELECT 2"]
+
+    recorder.flush_size = 1
+    recorder.flush = AsyncMock(side_effect=RuntimeError("db down"))  # type: ignore[method-assign]
+    recorder.record("SELECT 3", 1.0, None, "rewrite", PlanEstimate(5.0, 2.0, "Seq Scan"))
+    assert recorder.buffer[-1].plan_node == "Seq Scan"
+    await asyncio.sleep(0)
+    recorder.flush.assert_awaited_once()
+    assert recorder._flush_task is None
+
+
+@pytest.mark.asyncio
+async def test_recorder_flush_with_own_session(monkeypatch, async_session_factory, session):
+    """Without a session, flush opens one on the app's async engine."""
+    monkeypatch.setattr("app.recorder.AsyncSession", lambda _engine: async_session_factory())
+    recorder = workload.WorkloadRecorder(capacity=10, flush_size=10)
+    assert await recorder.flush() == 0
+    recorder.record("SELECT * FROM imslp WHERE id = 1", 2.0, 1)
+    assert await recorder.flush() == 1
+    assert session.exec(select(AgentQuery)).one().fingerprint
+
+
+@pytest.mark.asyncio
+async def test_guard_records_queries(monkeypatch):
+    """Queries going through the SQL guard end up in the recorder."""
+    from app import sql_guard  # noqa: PLC0415
+
+    monkeypatch.setattr(sql_guard, "explain", AsyncMock(return_value=None))
+    call_tool = AsyncMock(return_value='[{"id": 1}, {"id": 2}]')
+    await sql_guard.guard_tool_call(MagicMock(), call_tool, "execute_sql", {"sql": "SELECT 1"})
+    recorded = workload.recorder.buffer[-1]
+    assert recorded.sql == "SELECT 1"
+    assert recorded.row_count == 2
+
+
+def test_workload_report(client: TestClient, session: Session):
+    """The admin report ranks fingerprints by total time and suggests indexes."""
+    app.dependency_overrides[get_admin_user] = lambda: True
+    session.add(
+        AgentQuery(
+            fingerprint="slow",
+            normalized="select * from imslp where composer = ?",
+            sql="SELECT * FROM imslp WHERE composer = 'Bach'",
+            latency_ms=900.0,
+            row_count=10,
+        )
+    )
+    session.commit()
+    workload.recorder.record("SELECT * FROM score WHERE id = 1", 5.0, 1)
+
+    response = client.get("/admin/workload")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [t["fingerprint"] for t in data["top"]][0] == "slow"
+    assert data["top"][0]["total_ms"] == 900.0
+    assert len(data["top"]) == 2
+    assert data["buffered"] == 0
+    assert [s["statement"] for s in data["suggested_indexes"]] == [
+        "CREATE INDEX CONCURRENTLY ix_imslp_composer ON imslp (composer)"
+    ]
+
+
+def test_replay_and_compare_cli(tmp_path, capsys):
+    """The CLI replays recorded queries against a target DB and diffs two runs."""
+    source_url = f"sqlite:///{tmp_path / 'source.db'}"
+    target_url = f"sqlite:///{tmp_path / 'target.db'}"
+    for url in (source_url, target_url):
+        SQLModel.metadata.create_all(create_engine(url))
+    with Session(create_engine(source_url)) as source:
+        source.add(AgentQuery(fingerprint="a", sql="SELECT count(*) FROM imslp", latency_ms=3))
+        source.add(AgentQuery(fingerprint="b", sql="SELECT * FROM missing", latency_ms=2))
+        source.add(AgentQuery(fingerprint="c", sql="SELECT 1", decision="reject"))
+        source.commit()
+
+    before = tmp_path / "before.json"
+    args = ["replay", "--source-url", source_url, "--target-url", target_url, "--repeat", "2"]
+    assert workload.main([*args, "-o", str(before)]) == 0
+    timings = json.loads(before.read_text())
+    assert set(timings) == {"a", "b"}
+    assert "median_ms" in timings["a"]
+    assert "error" in timings["b"]
+
+    after = tmp_path / "after.json"
+    after.write_text(json.dumps({"a": {"sql": "SELECT count(*) FROM imslp", "median_ms": 0.0}}))
+    assert workload.main(["compare", str(before), str(after)]) == 0
+    out = capsys.readouterr().out
+    assert "replayed 2 fingerprints" in out
+    assert out.strip().splitlines()[-1].startswith("a  ")
@@ -0,0 +1,26 @@
+"""Crawl state models."""
+
+from sqlmodel import Field, SQLModel
+
+
+class CrawlState(SQLModel, table=True):
+    """Progress of a crawl, shared by every backend worker.
+
+    The worker running the crawl holds its lease (``lease_owner`` until
+    ``lease_expires``, a Unix time) and renews it as it checkpoints.
+    ``page`` is the worklist page being read, ``checkpoint`` the first one
+    with works not yet through the crawl, where a resumed crawl starts.
+    """
+
+    __tablename__ = "crawl_state"  # type: ignore[reportAssignmentType]
+
+    name: str = Field(primary_key=True)
+    status: str = Field(default="idle")
+    page: int = Field(default=0)
+    total: int = Field(default=0)
+    checkpoint: int = Field(default=0)
+    last_id: int | None = Field(default=None)
+    written: int = Field(default=0)
+    cancel_requested: bool = Field(default=False)
+    lease_owner: str | None = Field(default=None)
+    lease_expires: float = Field(default=0.0)
@@ -0,0 +1,29 @@
+"""Credit ledger models."""
+
+from datetime import UTC, datetime
+
+from sqlalchemy import Column, DateTime
+from sqlmodel import Field, SQLModel
+
+
+class CreditLedger(SQLModel, table=True):
+    """One movement of a user's credits, and why.
+
+    Agent calls first write a ``reserved`` debit, then mark it ``settled``
+    when the call succeeded or ``released`` (credit given back) when it
+    failed. ``balance`` is the user's credits right after the movement.
+    """
+
+    __tablename__ = "credit_ledger"  # type: ignore[reportAssignmentType]
+
+    id: int | None = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    delta: int = Field(default=0)
+    balance: int = Field(default=0)
+    reason: str = Field(default="")
+    endpoint: str = Field(default="")
+    status: str = Field(default="settled")
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
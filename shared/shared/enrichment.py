@@ -0,0 +1,30 @@
+"""Shared enrichment cache models."""
+
+from datetime import UTC, datetime
+
+from sqlalchemy import Column, DateTime
+from sqlmodel import Field, SQLModel
+
+
+class EnrichmentCache(SQLModel, table=True):
+    """Complete-agent output for one work, shared across users.
+
+    Keyed by normalized title and composer; ``fields`` is the JSON of the
+    enriched score fields (year, period, descriptions, translations, ...).
+    """
+
+    __tablename__ = "enrichment_cache"  # type: ignore[reportAssignmentType]
+
+    id: int | None = Field(default=None, primary_key=True)
+    work_key: str = Field(unique=True)
+    composer_key: str = Field(index=True)
+    title_key: str = Field(default="")
+    title: str = Field(default="")
+    composer: str = Field(default="")
+    fields: str = Field(default="{}")
+    model: str = Field(default="")
+    hits: int = Field(default=0)
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
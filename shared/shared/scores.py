@@ -1,9 +1,11 @@
 """Score models."""
 
+from datetime import datetime
 from enum import Enum
 from typing import TYPE_CHECKING, Optional
 
 from pydantic import BaseModel
+from sqlalchemy import Column, DateTime
 from sqlmodel import Field, Relationship, SQLModel
 
 if TYPE_CHECKING:
@@ -54,6 +56,9 @@ class Score(ScoreBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
     pdf_path: str = Field(default="")
     number_of_plays: int = 0
+    last_played: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
     source: str = Field(default="IMSLP")
     imslp_id: int | None = Field(default=None)
     user_id: int | None = Field(foreign_key="user.id")
@@ -80,9 +85,9 @@ class Scores(BaseModel):
 class ScoreCreate(ScoreBase):
     """Request body for creating a score.
 
-    Excludes server-owned fields (``id``, ``user_id``, ``number_of_plays``) so
-    clients cannot set them. Extra fields from the client are silently dropped
-    by pydantic's default behavior.
+    Excludes server-owned fields (``id``, ``user_id``, ``number_of_plays``,
+    ``last_played``) so clients cannot set them. Extra fields from the client
+    are silently dropped by pydantic's default behavior.
     """
 
     pdf_path: str = Field(default="")
@@ -127,6 +132,7 @@ class IMSLP(ScoreBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
     permlink: str = Field()
     score_metadata: str = Field(default="")
+    metadata_hash: str = Field(default="")  # of score_metadata, to spot edited works
     pdf_urls: str = Field(default="")
 
 
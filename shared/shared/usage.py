@@ -0,0 +1,50 @@
+"""LLM usage accounting models."""
+
+from datetime import UTC, date, datetime
+
+from sqlalchemy import Column, DateTime
+from sqlmodel import Field, SQLModel
+
+
+class AgentUsage(SQLModel, table=True):
+    """One model call made by an agent: tokens, tool calls and wall time."""
+
+    __tablename__ = "agent_usage"  # type: ignore[reportAssignmentType]
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str = Field(default="")
+    endpoint: str = Field(default="")
+    model: str = Field(default="")
+    user_id: int | None = Field(default=None, index=True)
+    status: str = Field(default="ok")
+    latency_ms: float = Field(default=0.0)
+    requests: int = Field(default=0)
+    input_tokens: int = Field(default=0)
+    output_tokens: int = Field(default=0)
+    tool_calls: int = Field(default=0)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False, index=True),
+    )
+
+
+class AgentUsageDaily(SQLModel, table=True):
+    """Daily rollup of ``AgentUsage`` per model and endpoint.
+
+    ``latency_histogram`` is a JSON list of call counts per latency bucket
+    (bounds in ``app.usage.LATENCY_BUCKETS_MS``), so percentiles can be read
+    without scanning the raw table.
+    """
+
+    __tablename__ = "agent_usage_daily"  # type: ignore[reportAssignmentType]
+
+    day: date = Field(primary_key=True)
+    model: str = Field(primary_key=True)
+    endpoint: str = Field(primary_key=True)
+    calls: int = Field(default=0)
+    errors: int = Field(default=0)
+    input_tokens: int = Field(default=0)
+    output_tokens: int = Field(default=0)
+    tool_calls: int = Field(default=0)
+    total_ms: float = Field(default=0.0)
+    latency_histogram: str = Field(default="[]")
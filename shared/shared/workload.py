@@ -0,0 +1,27 @@
+"""Agent SQL workload models."""
+
+from datetime import UTC, datetime
+
+from sqlalchemy import Column, DateTime
+from sqlmodel import Field, SQLModel
+
+
+class AgentQuery(SQLModel, table=True):
+    """One SQL statement issued by an agent through the postgres MCP server."""
+
+    __tablename__ = "agent_query"  # type: ignore[reportAssignmentType]
+
+    id: int | None = Field(default=None, primary_key=True)
+    fingerprint: str = Field(index=True)
+    normalized: str = Field(default="")
+    sql: str = Field(default="")
+    decision: str = Field(default="allow")
+    latency_ms: float = Field(default=0.0)
+    row_count: int | None = Field(default=None)
+    plan_node: str = Field(default="")
+    plan_cost: float | None = Field(default=None)
+    plan_rows: float | None = Field(default=None)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
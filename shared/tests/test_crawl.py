@@ -0,0 +1,13 @@
+"""test crawl"""
+
+from shared.crawl import CrawlState
+
+
+def test_crawl_state():
+    """test crawl state defaults"""
+    state = CrawlState(name="imslp")
+    assert state.status == "idle"
+    assert state.checkpoint == 0
+    assert state.last_id is None
+    assert state.lease_owner is None
+    assert not state.cancel_requested
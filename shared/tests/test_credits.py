@@ -0,0 +1,11 @@
+"""test credits"""
+
+from shared.credits import CreditLedger
+
+
+def test_credit_ledger():
+    """test credit ledger defaults"""
+    entry = CreditLedger(user_id=1, delta=-1, balance=4, reason="agent")
+    assert entry.status == "settled"
+    assert entry.endpoint == ""
+    assert entry.created_at is not None
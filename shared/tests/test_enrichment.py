@@ -0,0 +1,11 @@
+"""test enrichment"""
+
+from shared.enrichment import EnrichmentCache
+
+
+def test_enrichment_cache():
+    """test enrichment cache defaults"""
+    entry = EnrichmentCache(work_key="chopin|nocturne", composer_key="chopin")
+    assert entry.fields == "{}"
+    assert entry.hits == 0
+    assert entry.updated_at is not None
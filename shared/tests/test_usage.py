@@ -0,0 +1,20 @@
+"""test usage"""
+
+from datetime import date
+
+from shared.usage import AgentUsage, AgentUsageDaily
+
+
+def test_agent_usage():
+    """test agent usage defaults"""
+    usage = AgentUsage(model="m", endpoint="/agent", input_tokens=10)
+    assert usage.status == "ok"
+    assert usage.user_id is None
+    assert usage.created_at is not None
+
+
+def test_agent_usage_daily():
+    """test daily rollup defaults"""
+    rollup = AgentUsageDaily(day=date(2026, 1, 1), model="m", endpoint="/agent")
+    assert rollup.calls == 0
+    assert rollup.latency_histogram == "[]"
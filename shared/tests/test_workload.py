@@ -0,0 +1,12 @@
+"""test workload"""
+
+from shared.workload import AgentQuery
+
+
+def test_agent_query():
+    """test agent query defaults"""
+    query = AgentQuery(fingerprint="abc", sql="SELECT 1")
+    assert query.fingerprint == "abc"
+    assert query.decision == "allow"
+    assert query.row_count is None
+    assert query.created_at is not None